@@ -17,16 +17,51 @@ class Settings:
     # Slack設定
     SLACK_BOT_TOKEN = os.getenv('SLACK_BOT_TOKEN')
     SLACK_NOTIFICATION_CHANNEL = os.getenv('SLACK_NOTIFICATION_CHANNEL', '#lesson-alerts')
+    SLACK_API_URL = os.getenv('SLACK_API_URL') or None  # 省略時は https://slack.com/api/
     
     # OpenAI設定
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None  # 省略時は https://api.openai.com/v1
+    OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+    
+    # 振り返り以外の話題の一括分析（前日分を Batch API でまとめて分析する。確認の間隔は分）
+    OPENAI_BATCH_ENABLED = os.getenv('OPENAI_BATCH_ENABLED', 'false').lower() == 'true'
+    OPENAI_BATCH_DIR = os.getenv('OPENAI_BATCH_DIR', 'batches')
+    OPENAI_BATCH_POLL_MINUTES = float(os.getenv('OPENAI_BATCH_POLL_MINUTES', '30'))
     
     # データベース設定
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///lesson_logs.db')
     DATABASE_PATH = os.getenv('DATABASE_PATH', 'lesson_logs.db')
     
+    # ストレージのシャーディング（1 なら DATABASE_PATH のみ。2 以上でギルドまたはチャンネルごとにファイルを分ける）
+    SHARD_COUNT = int(os.getenv('SHARD_COUNT', '1'))
+    SHARD_MODE = os.getenv('SHARD_MODE', 'guild')  # guild or channel
+    SHARD_GUILD_MAP = os.getenv('SHARD_GUILD_MAP', '')  # "ギルドID:シャード番号,..." の固定割り当て
+    
+    # ゲートウェイのマルチプロセス化（0 なら同じプロセスで受信する。1 以上で Discord のシャードごとにプロセスを分ける）
+    GATEWAY_PROCESSES = int(os.getenv('GATEWAY_PROCESSES', '0'))
+    GATEWAY_QUEUE_SIZE = int(os.getenv('GATEWAY_QUEUE_SIZE', '256'))  # プロセス間キューに積めるバッチ数
+    
+    # 取り込みキュー設定
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '4'))
+    INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '1000'))
+    INGEST_OVERFLOW_POLICY = os.getenv('INGEST_OVERFLOW_POLICY', 'block')  # block, spill or drop
+    INGEST_SPILL_DIR = os.getenv('INGEST_SPILL_DIR', os.path.join(os.path.dirname(DATABASE_PATH), 'spill'))
+    INGEST_DRAIN_TIMEOUT = float(os.getenv('INGEST_DRAIN_TIMEOUT', '30'))
+    
+    # 名簿の同期（起動時にギルドのメンバーをまとめて登録）
+    ROSTER_SYNC_ENABLED = os.getenv('ROSTER_SYNC_ENABLED', 'true').lower() == 'true'
+    ROSTER_SYNC_BATCH_SIZE = int(os.getenv('ROSTER_SYNC_BATCH_SIZE', '1000'))  # 1トランザクションで登録する人数
+    
     # ログ設定
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FILE = os.getenv('LOG_FILE', 'logs/lesson_bot.log')  # JSON 形式で出力（空なら出力しない）
+    LOG_JSON = os.getenv('LOG_JSON', 'false').lower() == 'true'  # コンソールも JSON 形式にする
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    # 同じ箇所からの INFO 以下のログを1秒あたりこの件数に間引く（0 なら間引かない）
+    LOG_SAMPLE_PER_SECOND = float(os.getenv('LOG_SAMPLE_PER_SECOND', '20'))
+    LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', '100'))
     
     # デバッグモード
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
@@ -34,12 +69,92 @@ class Settings:
     # アラート設定
     UNANSWERED_QUESTION_ALERT_HOURS = int(os.getenv('UNANSWERED_QUESTION_ALERT_HOURS', '2'))
     
+    # 検出器の設定（定期分析で1回の走査にまとめて実行する）
+    # 未回答の質問は会話セッションで判定するため、既定では含めない
+    DETECTORS = [
+        name.strip() for name in
+        os.getenv('DETECTORS', 'mentor_silence,message_flood,student_only_run').split(',')
+        if name.strip()
+    ]
+    DETECTOR_CONFIG = {
+        'unanswered_question': {
+            'alert_after_hours': UNANSWERED_QUESTION_ALERT_HOURS
+        },
+        'mentor_silence': {
+            'silence_hours': int(os.getenv('MENTOR_SILENCE_HOURS', '6')),
+            'min_student_messages': int(os.getenv('MENTOR_SILENCE_MIN_MESSAGES', '3'))
+        },
+        'message_flood': {
+            'max_messages': int(os.getenv('FLOOD_MAX_MESSAGES', '10')),
+            'window_seconds': int(os.getenv('FLOOD_WINDOW_SECONDS', '60'))
+        },
+        'student_only_run': {
+            'max_run': int(os.getenv('STUDENT_ONLY_RUN_MAX', '15'))
+        }
+    }
+    ANALYSIS_WINDOW_HOURS = int(os.getenv('ANALYSIS_WINDOW_HOURS', '24'))
+    ANALYSIS_CONCURRENCY = int(os.getenv('ANALYSIS_CONCURRENCY', '8'))
+    
+    # メッセージキャッシュ設定（直近 ANALYSIS_WINDOW_HOURS 時間分をメモリに保持）
+    MESSAGE_CACHE_ENABLED = os.getenv('MESSAGE_CACHE_ENABLED', 'true').lower() == 'true'
+    MESSAGE_CACHE_MAX_MESSAGES = int(os.getenv('MESSAGE_CACHE_MAX_MESSAGES', '200000'))
+    
+    # 会話セッション設定
+    SESSION_GAP_MINUTES = int(os.getenv('SESSION_GAP_MINUTES', '30'))
+    SESSION_RESOLVED_GAP_MINUTES = int(os.getenv('SESSION_RESOLVED_GAP_MINUTES', '10'))
+    
+    # 活動集計の設定（この日数より古い時間単位の集計は日単位にまとめる）
+    ROLLUP_HOURLY_RETENTION_DAYS = int(os.getenv('ROLLUP_HOURLY_RETENTION_DAYS', '14'))
+    
+    # 発言が途絶えた生徒のアラート（INACTIVE_STUDENT_DAYS 日以上発言がなければ通知。0 で無効）
+    # INACTIVE_STUDENT_MAX_DAYS 日以上発言がない生徒は退会・修了とみなして通知しない
+    INACTIVE_STUDENT_DAYS = float(os.getenv('INACTIVE_STUDENT_DAYS', '7'))
+    INACTIVE_STUDENT_MAX_DAYS = float(os.getenv('INACTIVE_STUDENT_MAX_DAYS', '30'))
+    INACTIVE_STUDENT_CHECK_HOURS = float(os.getenv('INACTIVE_STUDENT_CHECK_HOURS', '6'))
+    
+    # アーカイブ設定（この日数より古いメッセージを messages から削除し、チャンネル・月ごとの圧縮ファイルに移す）
+    # DB の行を移す操作なので既定は 0（無効）。有効にするときは .env で明示的に指定する
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '0'))
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+    ARCHIVE_COMPRESSION = os.getenv('ARCHIVE_COMPRESSION', 'gzip')  # gzip or zstd（zstandard が必要）
+    
+    # DBメンテナンス設定（間隔は時間、0 で無効。空き領域の解放は REPORT_TIMEZONE の静かな時間帯のみ）
+    MAINTENANCE_ENABLED = os.getenv('MAINTENANCE_ENABLED', 'true').lower() == 'true'
+    BACKUP_DIR = os.getenv('BACKUP_DIR', os.path.join(os.path.dirname(DATABASE_PATH), 'backups'))
+    BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '24'))
+    BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+    OPTIMIZE_INTERVAL_HOURS = float(os.getenv('OPTIMIZE_INTERVAL_HOURS', '6'))
+    VACUUM_INTERVAL_HOURS = float(os.getenv('VACUUM_INTERVAL_HOURS', '24'))
+    MAINTENANCE_QUIET_HOURS = os.getenv('MAINTENANCE_QUIET_HOURS', '2-5')
+    MAINTENANCE_PAGES_PER_STEP = int(os.getenv('MAINTENANCE_PAGES_PER_STEP', '256'))
+    MAINTENANCE_STEP_SLEEP_MS = float(os.getenv('MAINTENANCE_STEP_SLEEP_MS', '20'))
+    
     # 出力設定
     OUTPUT_DIR = os.getenv('OUTPUT_DIR', 'output')
     
+    # 集計・出力の実行方法（duckdb なら DB とアーカイブを DuckDB で列単位に集計する。duckdb が必要）
+    REPORTING_BACKEND = os.getenv('REPORTING_BACKEND', 'sqlite')  # sqlite or duckdb
+    REPORTING_THREADS = int(os.getenv('REPORTING_THREADS', '0'))  # 0 なら DuckDB の既定（CPU数）
+    REPORTING_MEMORY_LIMIT = os.getenv('REPORTING_MEMORY_LIMIT') or None  # 例: 1GB
+    
+    # 集計レポートのタイムゾーン（時間帯別集計に使用）
+    REPORT_TIMEZONE = os.getenv('REPORT_TIMEZONE', 'Asia/Tokyo')
+    
     # スプレッドシート形式
     SPREADSHEET_FORMAT = os.getenv('SPREADSHEET_FORMAT', 'xlsx')  # xlsx or csv
     
+    # イベントループ監視設定
+    LOOP_LAG_THRESHOLD_MS = float(os.getenv('LOOP_LAG_THRESHOLD_MS', '250'))
+    LOOP_LAG_INTERVAL_MS = float(os.getenv('LOOP_LAG_INTERVAL_MS', '100'))
+    PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', '5'))
+    
+    # メモリ監視設定（RSS を MEMORY_SAMPLE_SECONDS 秒ごとに採取し、MEMORY_RSS_ALERT_MB を超えたら通知。0 で通知しない）
+    MEMORY_SAMPLE_SECONDS = float(os.getenv('MEMORY_SAMPLE_SECONDS', '60'))
+    MEMORY_RSS_ALERT_MB = float(os.getenv('MEMORY_RSS_ALERT_MB', '0'))
+    MEMORY_ALERT_COOLDOWN_MINUTES = float(os.getenv('MEMORY_ALERT_COOLDOWN_MINUTES', '60'))
+    # !memsnap で tracemalloc が記録する呼び出し元の段数（多いほど追跡中の負荷が大きい）
+    TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '10'))
+    
     @classmethod
     def validate(cls):
         """設定値をバリデーション"""
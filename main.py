@@ -1,40 +1,207 @@
 """
 アプリケーションのエントリポイント
 """
+import time
+
+# 起動時間には import の時間も含める
+PROCESS_STARTED = time.perf_counter()
+
 import asyncio
+import importlib
+import itertools
 import logging
+import multiprocessing
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import List, Optional
 
 from config.settings import Settings, LOG_FORMAT
 
+# pandas / openpyxl / slack_sdk / discord は使うときに読み込まれる（起動を遅くしないため）
 from src.infrastructure.database import (
-    DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository, SQLiteAlertRepository
+    DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository, SQLiteAlertRepository,
+    SQLiteSessionRepository, SQLiteRollupRepository, SQLiteStudentActivityRepository
 )
-from src.infrastructure.discord_client import DiscordClient, DiscordCommands, DiscordChannelRepository
 from src.infrastructure.slack_client import SlackNotificationService
 from src.infrastructure.spreadsheet import ExcelSpreadsheetService, CSVSpreadsheetService
+from src.infrastructure.loop_monitor import LoopLagWatchdog
+from src.infrastructure.memory_monitor import MemoryMonitor
+from src.infrastructure.message_cache import CachedMessageRepository
+from src.infrastructure.archive import ArchiveStore, ArchiveAwareMessageRepository, ArchiveResult, MessageArchiver
+from src.infrastructure.sharding import (
+    ShardDirectory, ShardedMessageRepository, ShardedAlertRepository, ShardedSessionRepository,
+    ShardedRollupRepository, ShardedStudentActivityRepository, ReplicatedUserRepository, shard_paths, parse_guild_shards, sync_users
+)
+from src.infrastructure.maintenance import MaintenanceScheduler
+from src.infrastructure.analytics import ResponseTimeAnalytics
+from src.infrastructure.reporting import DuckDBReporting, duckdb_available
+from src.infrastructure.gateway import (
+    ForwardedChannelRepository, GatewayEventReceiver, GatewaySupervisor, run_gateway_shard
+)
+from src.infrastructure.startup import StartupTimer
+from src.infrastructure.log_pipeline import LogPipeline
 from src.application.services import LogCollectionService
+from src.domain.services import Sessionizer
+from src.domain.detectors import DetectorPipeline
+from src.application.ingest import IngestQueue
+
+
+@dataclass
+class Application:
+    """起動済みのサービス一式（Discord への接続前）"""
+    log_service: LogCollectionService
+    ingest_queue: IngestQueue
+    slack_service: SlackNotificationService
+    loop_monitor: LoopLagWatchdog
+    memory_monitor: MemoryMonitor
+    db_paths: List[str]
+    timer: StartupTimer
+    shard_directory: Optional[ShardDirectory] = None
+    maintenance: Optional[MaintenanceScheduler] = None
+    reporting: Optional[DuckDBReporting] = None
+    background: List[asyncio.Task] = field(default_factory=list)
 
 
 async def main():
-    # ログ設定
-    logging.basicConfig(level=getattr(logging, Settings.LOG_LEVEL), format=LOG_FORMAT)
+    # ログ設定（整形と書き込みは別スレッドで行う。終了時に残りを書き出す）
+    LogPipeline(
+        level=Settings.LOG_LEVEL,
+        text_format=LOG_FORMAT,
+        json_console=Settings.LOG_JSON,
+        log_file=Settings.LOG_FILE or None,
+        max_bytes=Settings.LOG_MAX_BYTES,
+        backup_count=Settings.LOG_BACKUP_COUNT,
+        sample_per_second=Settings.LOG_SAMPLE_PER_SECOND,
+        sample_burst=Settings.LOG_SAMPLE_BURST
+    ).start()
     logger = logging.getLogger("main")
     
     # 設定のバリデーション
     try:
         Settings.validate()
     except ValueError as e:
-        logger.warning(f"設定警告: {e}")
+        logger.warning("設定警告: %s", e)
         logger.warning(".env ファイルを設定してください。Slack/Discord/OpenAI のキーは後日差し替え可能です。")
     
-    # データベース初期化
-    db_manager = DatabaseManager(db_path=Settings.DATABASE_PATH)
-    await db_manager.initialize_database()
+    timer = StartupTimer(started=PROCESS_STARTED)
+    timer.mark('imports')
+    app = await start_application(timer)
+    
+    # ゲートウェイを別プロセスにする場合はここから受信を始める
+    if Settings.GATEWAY_PROCESSES > 0:
+        await run_multiprocess_gateway(app, logger)
+        return
+    
+    from src.infrastructure.discord_client import DiscordClient, DiscordCommands
+    
+    # Discordクライアントの初期化
+    discord_client = DiscordClient(
+        log_collection_service=app.log_service, ingest_queue=app.ingest_queue, startup_timer=timer
+    )
+    if app.shard_directory:
+        app.shard_directory.guild_resolver = discord_client.guild_id_for_channel
+    app.memory_monitor.register(
+        "discord_messages", lambda: (len(discord_client.cached_messages), iter(discord_client.cached_messages))
+    )
+    
+    # DiscordCommands を登録
+    analytics = app.reporting or ResponseTimeAnalytics(
+        db_path=Settings.DATABASE_PATH, timezone=Settings.REPORT_TIMEZONE, db_paths=app.db_paths
+    )
+    await discord_client.add_cog(DiscordCommands(
+        discord_client, app.log_service, loop_monitor=app.loop_monitor, analytics=analytics,
+        maintenance=app.maintenance, memory_monitor=app.memory_monitor
+    ))
+    
+    # DiscordChannelRepository にクライアントをセット
+    app.log_service.channel_repo.client = discord_client
+    
+    # Discordに接続（Slack接続テストなどの起動時処理は並行して進める）
+    try:
+        if Settings.DISCORD_BOT_TOKEN:
+            timer.mark('connecting')
+            await discord_client.start(Settings.DISCORD_BOT_TOKEN)
+        else:
+            logger.error("DISCORD_BOT_TOKEN が未設定のため、Discord接続をスキップします。")
+    finally:
+        await stop_application(app)
+
+
+async def start_application(timer: StartupTimer) -> Application:
+    """DB・リポジトリ・サービス・取り込みキューを準備する（互いに依存しない処理は並行して実行）"""
+    logger = logging.getLogger("main")
+    multiprocess_gateway = Settings.GATEWAY_PROCESSES > 0
+    
+    # discord.py の読み込みはDBの初期化（ファイルI/O）と重ねる
+    discord_import = None
+    if not multiprocess_gateway:
+        discord_import = asyncio.create_task(timer.timed(
+            'import_discord', asyncio.to_thread(importlib.import_module, 'src.infrastructure.discord_client')
+        ))
+    
+    # イベントループ監視を開始
+    loop_monitor = LoopLagWatchdog(
+        threshold_ms=Settings.LOOP_LAG_THRESHOLD_MS,
+        interval_ms=Settings.LOOP_LAG_INTERVAL_MS,
+        profiler_interval_ms=Settings.PROFILER_INTERVAL_MS,
+        output_dir=Settings.OUTPUT_DIR
+    )
+    await loop_monitor.start()
+    
+    # データベース初期化（シャーディング時は全シャードのファイルを並行して）
+    db_paths = shard_paths(Settings.DATABASE_PATH, Settings.SHARD_COUNT)
+    await timer.timed('database', asyncio.gather(*(
+        DatabaseManager(db_path=db_path).initialize_database() for db_path in db_paths
+    )))
     
     # リポジトリとサービスの初期化
-    message_repo = SQLiteMessageRepository(db_path=Settings.DATABASE_PATH)
-    user_repo = SQLiteUserRepository(db_path=Settings.DATABASE_PATH)
-    alert_repo = SQLiteAlertRepository(db_path=Settings.DATABASE_PATH)
+    # アーカイブ済みの範囲に及ぶ読み込みはアーカイブも参照する（キャッシュはその外側に置く）
+    archive_stores = [
+        ArchiveStore(db_path=db_path, archive_dir=Settings.ARCHIVE_DIR, compression=Settings.ARCHIVE_COMPRESSION)
+        for db_path in db_paths
+    ]
+    message_repos = [
+        ArchiveAwareMessageRepository(SQLiteMessageRepository(db_path=db_path), store)
+        for db_path, store in zip(db_paths, archive_stores)
+    ]
+    shard_directory = None
+    if Settings.SHARD_COUNT > 1:
+        # ギルドはDiscordクライアントの作成後に引けるようにする
+        shard_directory = ShardDirectory(
+            Settings.DATABASE_PATH,
+            Settings.SHARD_COUNT,
+            mode=Settings.SHARD_MODE,
+            guild_shards=parse_guild_shards(Settings.SHARD_GUILD_MAP)
+        )
+        await timer.timed('shards', asyncio.gather(
+            asyncio.to_thread(shard_directory.load), asyncio.to_thread(sync_users, db_paths)
+        ))
+        message_repo = ShardedMessageRepository(message_repos, shard_directory)
+        user_repo = ReplicatedUserRepository([SQLiteUserRepository(db_path=path) for path in db_paths])
+        alert_repo = ShardedAlertRepository([SQLiteAlertRepository(db_path=path) for path in db_paths], shard_directory)
+        session_repo = ShardedSessionRepository(
+            [SQLiteSessionRepository(db_path=path) for path in db_paths], shard_directory
+        )
+        rollup_repo = ShardedRollupRepository(
+            [SQLiteRollupRepository(db_path=path) for path in db_paths], shard_directory
+        )
+        student_activity_repo = ShardedStudentActivityRepository(
+            [SQLiteStudentActivityRepository(db_path=path) for path in db_paths], shard_directory
+        )
+        logger.info("ストレージを %d シャードに分割しています（%s 単位）", Settings.SHARD_COUNT, Settings.SHARD_MODE)
+    else:
+        message_repo = message_repos[0]
+        user_repo = SQLiteUserRepository(db_path=Settings.DATABASE_PATH)
+        alert_repo = SQLiteAlertRepository(db_path=Settings.DATABASE_PATH)
+        session_repo = SQLiteSessionRepository(db_path=Settings.DATABASE_PATH)
+        rollup_repo = SQLiteRollupRepository(db_path=Settings.DATABASE_PATH)
+        student_activity_repo = SQLiteStudentActivityRepository(db_path=Settings.DATABASE_PATH)
+    if Settings.MESSAGE_CACHE_ENABLED:
+        message_repo = CachedMessageRepository(
+            message_repo,
+            window_hours=Settings.ANALYSIS_WINDOW_HOURS,
+            max_messages=Settings.MESSAGE_CACHE_MAX_MESSAGES
+        )
     
     if Settings.SPREADSHEET_FORMAT == 'csv':
         spreadsheet_service = CSVSpreadsheetService(output_dir=Settings.OUTPUT_DIR)
@@ -43,36 +210,225 @@ async def main():
     
     slack_service = SlackNotificationService(
         token=Settings.SLACK_BOT_TOKEN or "",
-        channel=Settings.SLACK_NOTIFICATION_CHANNEL
+        channel=Settings.SLACK_NOTIFICATION_CHANNEL,
+        base_url=Settings.SLACK_API_URL
     )
     
+    # 集計・出力を DuckDB で行う場合（duckdb がなければ従来の方法のまま）
+    reporting = None
+    if Settings.REPORTING_BACKEND == 'duckdb':
+        if duckdb_available():
+            reporting = DuckDBReporting(
+                db_paths,
+                archive_dir=Settings.ARCHIVE_DIR,
+                timezone=Settings.REPORT_TIMEZONE,
+                threads=Settings.REPORTING_THREADS or None,
+                memory_limit=Settings.REPORTING_MEMORY_LIMIT
+            )
+        else:
+            logger.warning("duckdb がインストールされていないため、集計・出力は従来の方法で行います")
+    
     # ログ収集サービスを初期化
+    # ゲートウェイを別プロセスにする場合、チャンネル一覧はゲートウェイプロセスから送られてくる
+    if multiprocess_gateway:
+        channel_repo = ForwardedChannelRepository()
+    else:
+        discord_client_module = await discord_import
+        channel_repo = discord_client_module.DiscordChannelRepository(None)  # 後でDiscordClientでセット
     log_service = LogCollectionService(
         message_repo=message_repo,
-        channel_repo=DiscordChannelRepository(None),  # 後でDiscordClientでセット
+        channel_repo=channel_repo,
         user_repo=user_repo,
         alert_repo=alert_repo,
         notification_service=slack_service,
-        spreadsheet_service=spreadsheet_service
+        spreadsheet_service=spreadsheet_service,
+        session_repo=session_repo,
+        sessionizer=Sessionizer(
+            gap_minutes=Settings.SESSION_GAP_MINUTES,
+            resolved_gap_minutes=Settings.SESSION_RESOLVED_GAP_MINUTES
+        ),
+        rollup_repo=rollup_repo,
+        detector_pipeline=DetectorPipeline.from_config(Settings.DETECTORS, Settings.DETECTOR_CONFIG),
+        analysis_window_hours=Settings.ANALYSIS_WINDOW_HOURS,
+        analysis_concurrency=Settings.ANALYSIS_CONCURRENCY,
+        log_table_source=reporting,
+        student_activity_repo=student_activity_repo
     )
+    # 登録済みユーザーを読み込む（メッセージの処理ではユーザーを DB から引かない）
+    user_count = await timer.timed('users', log_service.load_users())
+    logger.info("登録済みユーザー: %d 人", user_count)
     
-    # Discordクライアントの初期化
-    discord_client = DiscordClient(log_collection_service=log_service)
+    # Slack接続テスト（任意）は結果を待たずに進める
+    background = [asyncio.create_task(timer.timed('slack', slack_service.test_connection()), name="slack-test")]
     
-    # DiscordCommands を登録
-    discord_client.add_cog(DiscordCommands(discord_client, log_service))
+    # 定期メンテナンス（バックアップ・統計の更新・空き領域の解放・集計のまとめ・アーカイブ）
+    async def compact_rollups():
+        return await log_service.compact_rollups(Settings.ROLLUP_HOURLY_RETENTION_DAYS)
     
-    # DiscordChannelRepository にクライアントをセット
-    log_service.channel_repo.client = discord_client
+    async def check_inactive_students():
+        return await log_service.check_inactive_students(
+            Settings.INACTIVE_STUDENT_DAYS, Settings.INACTIVE_STUDENT_MAX_DAYS
+        )
     
-    # Slack接続テスト（任意）
-    await slack_service.test_connection()
+    async def archive_messages():
+        results = [
+            await MessageArchiver(store).archive_older_than(Settings.ARCHIVE_AFTER_DAYS) for store in archive_stores
+        ]
+        return ArchiveResult(
+            files=sum(result.files for result in results),
+            messages=sum(result.messages for result in results),
+            seconds=sum(result.seconds for result in results)
+        )
     
-    # Discordに接続
-    if Settings.DISCORD_BOT_TOKEN:
-        await discord_client.start(Settings.DISCORD_BOT_TOKEN)
+    maintenance = None
+    if Settings.MAINTENANCE_ENABLED:
+        maintenance = MaintenanceScheduler(
+            db_path=Settings.DATABASE_PATH,
+            backup_dir=Settings.BACKUP_DIR,
+            backup_interval_hours=Settings.BACKUP_INTERVAL_HOURS,
+            backup_keep=Settings.BACKUP_KEEP,
+            optimize_interval_hours=Settings.OPTIMIZE_INTERVAL_HOURS,
+            vacuum_interval_hours=Settings.VACUUM_INTERVAL_HOURS,
+            quiet_hours=Settings.MAINTENANCE_QUIET_HOURS,
+            timezone=Settings.REPORT_TIMEZONE,
+            pages_per_step=Settings.MAINTENANCE_PAGES_PER_STEP,
+            step_sleep_ms=Settings.MAINTENANCE_STEP_SLEEP_MS,
+            db_paths=db_paths
+        )
+        maintenance.add_job("compact_rollups", timedelta(days=1), compact_rollups)
+        if Settings.ARCHIVE_AFTER_DAYS > 0:
+            maintenance.add_job("archive_messages", timedelta(days=1), archive_messages, quiet_hours_only=True)
+        if Settings.INACTIVE_STUDENT_DAYS > 0:
+            maintenance.add_job(
+                "inactive_students", timedelta(hours=Settings.INACTIVE_STUDENT_CHECK_HOURS), check_inactive_students
+            )
+        if Settings.OPENAI_BATCH_ENABLED and Settings.OPENAI_API_KEY:
+            # openai の読み込みは一括分析を使う場合だけ
+            from src.infrastructure.openai_batch import OffTopicBatchRunner
+            from src.infrastructure.openai_client import OpenAIAnalyzer
+            batch_runner = OffTopicBatchRunner(
+                analyzer=OpenAIAnalyzer(
+                    Settings.OPENAI_API_KEY, base_url=Settings.OPENAI_BASE_URL, model=Settings.OPENAI_MODEL
+                ),
+                message_repo=message_repo,
+                alert_repo=alert_repo,
+                notification_service=slack_service,
+                channel_repo=channel_repo,
+                db_path=Settings.DATABASE_PATH,
+                work_dir=Settings.OPENAI_BATCH_DIR,
+                sessionizer=log_service.sessionizer,
+                timezone=Settings.REPORT_TIMEZONE
+            )
+            maintenance.add_job(
+                "off_topic_batch", timedelta(minutes=Settings.OPENAI_BATCH_POLL_MINUTES), batch_runner.run_pending
+            )
+        await maintenance.start()
     else:
-        logger.error("DISCORD_BOT_TOKEN が未設定のため、Discord接続をスキップします。")
+        # スケジューラを使わない場合は起動時に1回だけ、接続と並行して実行する
+        async def run_once():
+            compacted = await compact_rollups()
+            if compacted:
+                logger.info("活動集計を日単位にまとめました: %d 行", compacted)
+            if Settings.ARCHIVE_AFTER_DAYS > 0:
+                archived = await archive_messages()
+                if archived.messages:
+                    logger.info("メッセージをアーカイブしました: %d 件 (%.1f 秒)", archived.messages, archived.seconds)
+        
+        background.append(asyncio.create_task(timer.timed('startup_maintenance', run_once()), name="startup-maintenance"))
+    
+    # 取り込みキューを開始
+    ingest_queue = IngestQueue(
+        handler=log_service.handle_event,
+        workers=Settings.INGEST_WORKERS,
+        max_size=Settings.INGEST_QUEUE_SIZE,
+        overflow_policy=Settings.INGEST_OVERFLOW_POLICY,
+        spill_dir=Settings.INGEST_SPILL_DIR,
+        partitions=Settings.SHARD_COUNT,
+        partition_of=shard_directory.shard_of if shard_directory else None
+    )
+    await ingest_queue.start()
+    timer.mark('services')
+    
+    # メモリ監視（サブシステムごとの使用量は !perf memory、RSS が閾値を超えたら Slack に通知）
+    memory_monitor = MemoryMonitor(
+        notification_service=slack_service,
+        interval_seconds=Settings.MEMORY_SAMPLE_SECONDS,
+        rss_alert_mb=Settings.MEMORY_RSS_ALERT_MB,
+        alert_cooldown_minutes=Settings.MEMORY_ALERT_COOLDOWN_MINUTES,
+        output_dir=Settings.OUTPUT_DIR,
+        trace_frames=Settings.TRACEMALLOC_FRAMES
+    )
+    if isinstance(message_repo, CachedMessageRepository):
+        memory_monitor.register("message_cache", message_repo.memory_items)
+    memory_monitor.register("ingest_queue", ingest_queue.memory_items)
+    memory_monitor.register("users", log_service.memory_items)
+    memory_monitor.register("archive_files", lambda: _archive_memory_items(archive_stores))
+    await memory_monitor.start()
+    
+    return Application(
+        log_service=log_service,
+        ingest_queue=ingest_queue,
+        slack_service=slack_service,
+        loop_monitor=loop_monitor,
+        memory_monitor=memory_monitor,
+        db_paths=db_paths,
+        timer=timer,
+        shard_directory=shard_directory,
+        maintenance=maintenance,
+        reporting=reporting,
+        background=background
+    )
+
+
+def _archive_memory_items(archive_stores: List[ArchiveStore]):
+    """全シャードのアーカイブのうちメモリに残しているレコード"""
+    counts, records = zip(*(store.memory_items() for store in archive_stores))
+    return sum(counts), itertools.chain.from_iterable(records)
+
+
+async def stop_application(app: Application) -> None:
+    """起動時の処理の完了を待ち、メンテナンスと監視を止めて取り込みキューを処理しきる"""
+    await asyncio.gather(*app.background, return_exceptions=True)
+    if app.maintenance:
+        await app.maintenance.stop()
+    await app.memory_monitor.stop()
+    await app.ingest_queue.drain(timeout=Settings.INGEST_DRAIN_TIMEOUT)
+    await app.loop_monitor.stop()
+
+
+async def run_multiprocess_gateway(app: Application, logger):
+    """Discord のシャードごとのゲートウェイプロセスからイベントを受け取り、このプロセスで保存・分析する
+
+    SQLite に書き込むのはこのプロセスだけ。管理コマンド（!stats など）は使えない。
+    """
+    channel_repo = app.log_service.channel_repo
+    if app.shard_directory:
+        app.shard_directory.guild_resolver = channel_repo.guild_id_for_channel
+    
+    event_queue = multiprocessing.get_context('spawn').Queue(maxsize=Settings.GATEWAY_QUEUE_SIZE)
+    
+    async def on_channels():
+        await app.log_service.warm_up()
+        if 'ready' not in app.timer.marks:
+            app.timer.mark('ready')
+            logger.info("起動時間: %s", app.timer.summary())
+    
+    receiver = GatewayEventReceiver(event_queue, app.ingest_queue, channel_repo, on_channels=on_channels)
+    supervisor = GatewaySupervisor(
+        run_gateway_shard, Settings.GATEWAY_PROCESSES, event_queue, kwargs={'token': Settings.DISCORD_BOT_TOKEN}
+    )
+    try:
+        if not Settings.DISCORD_BOT_TOKEN:
+            logger.error("DISCORD_BOT_TOKEN が未設定のため、Discord接続をスキップします。")
+            return
+        await receiver.start()
+        await supervisor.start()
+        await supervisor.wait()
+    finally:
+        # ゲートウェイプロセスが送り終えてから、プロセス間キューが空になるまで受け取り、最後に取り込みキューを処理する
+        await supervisor.stop()
+        await receiver.stop()
+        await stop_application(app)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,263 @@
+"""
+アプリケーションサービス: Discordイベントの取り込みキュー
+"""
+import asyncio
+import glob
+import itertools
+import json
+import logging
+import os
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .log_context import bind_log_context
+
+
+EventHandler = Callable[[str, dict], Awaitable[None]]
+
+
+class IngestQueue:
+    """イベント受信とストレージ処理の間に置く有界キュー
+
+    チャンネルIDでワーカーを固定するため、同一チャンネル内の処理順序は保たれる。
+    キューが満杯になった場合の挙動は overflow_policy で指定する。
+      - block: 空きが出るまで投入側を待たせる
+      - spill: ディスクに退避し、キューが空いた後に順序を保って処理する
+      - drop : 破棄して件数を記録する
+    partition_of を指定すると、チャンネルIDからパーティション（ストレージのシャード）を求め、
+    パーティションごとに workers 個の専用ワーカーを割り当てる（あるシャードの書き込み待ちが他のシャードの取り込みを止めない）。
+    """
+
+    OVERFLOW_POLICIES = ('block', 'spill', 'drop')
+
+    def __init__(
+        self,
+        handler: EventHandler,
+        workers: int = 4,
+        max_size: int = 1000,
+        overflow_policy: str = 'block',
+        spill_dir: str = 'spill',
+        partitions: int = 1,
+        partition_of: Optional[Callable[[str], int]] = None
+    ):
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"未対応のオーバーフローポリシーです: {overflow_policy}")
+
+        self.handler = handler
+        self.partitions = max(1, partitions)
+        self.partition_of = partition_of
+        self.workers_per_partition = max(1, workers)
+        self.workers = self.workers_per_partition * self.partitions
+        self.max_size = max(self.workers, max_size)
+        self.overflow_policy = overflow_policy
+        self.spill_dir = spill_dir
+        self.logger = logging.getLogger(__name__)
+
+        self._queues: List[asyncio.Queue] = []
+        self._spilling: List[bool] = [False] * self.workers
+        # ワーカーがキューから取り出して処理中のイベント（停止がタイムアウトしたときに退避する）
+        self._in_flight: List[Optional[Tuple[str, dict]]] = [None] * self.workers
+        self._tasks: List[asyncio.Task] = []
+        self._closing = False
+        self.counters: Dict[str, int] = {
+            'submitted': 0, 'processed': 0, 'failed': 0, 'dropped': 0, 'spilled': 0
+        }
+        self.max_depth = 0
+
+    async def start(self) -> None:
+        """ワーカーを起動"""
+        if self._tasks:
+            return
+
+        # 前回の退避分を新しいイベントより先に処理
+        await self._recover_spill_files()
+
+        per_worker = self.max_size // self.workers
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._closing = False
+        self._tasks = [
+            asyncio.create_task(self._worker(index), name=f"ingest-worker-{index}")
+            for index in range(self.workers)
+        ]
+        self.logger.info(
+            "取り込みキューを開始しました（ワーカー %d、容量 %d、ポリシー %s）",
+            self.workers, self.max_size, self.overflow_policy
+        )
+
+    async def submit(self, event_type: str, data: dict) -> bool:
+        """イベントを投入。破棄された場合は False を返す"""
+        if self._closing or not self._tasks:
+            self.counters['dropped'] += 1
+            self.logger.warning("停止中のためイベントを破棄しました: %s %s", event_type, data.get('id'))
+            return False
+
+        self.counters['submitted'] += 1
+        index = self._worker_index(data)
+        queue = self._queues[index]
+        item = (event_type, data)
+
+        # 退避中のワーカーには順序を保つため後続もすべて退避する
+        if self._spilling[index]:
+            self._spill(index, item)
+            return True
+
+        if not queue.full():
+            queue.put_nowait(item)
+            self.max_depth = max(self.max_depth, self.depth())
+            return True
+
+        if self.overflow_policy == 'block':
+            await queue.put(item)
+        elif self.overflow_policy == 'spill':
+            self._spilling[index] = True
+            self._spill(index, item)
+        else:
+            self.counters['dropped'] += 1
+            return False
+        return True
+
+    async def drain(self, timeout: float = 30.0) -> None:
+        """新規投入を止め、残りのイベントを処理してからワーカーを停止"""
+        if not self._tasks:
+            return
+        self._closing = True
+
+        try:
+            await asyncio.wait_for(self._wait_idle(), timeout=timeout)
+            self.logger.info("取り込みキューの処理が完了しました")
+        except asyncio.TimeoutError:
+            # 残りは退避ファイルに書き出し、次回の起動時に処理する
+            spilled = self._spill_remaining()
+            self.logger.warning("取り込みキューの停止がタイムアウトしました（残り %d 件を退避しました）", spilled)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def depth(self) -> int:
+        """メモリ上に滞留しているイベント数"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> Dict[str, Any]:
+        """キューの統計を取得"""
+        return {
+            **self.counters,
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'spilling_workers': sum(self._spilling)
+        }
+
+    def memory_items(self) -> Tuple[int, Iterator[Any]]:
+        """メモリ上に滞留しているイベント数と、その要素（メモリ使用量の概算用）"""
+        return self.depth(), itertools.chain.from_iterable(queue._queue for queue in self._queues)
+
+    def _worker_index(self, data: dict) -> int:
+        """チャンネルIDから担当ワーカーを決定"""
+        key = str(data.get('channel_id', ''))
+        index = zlib.crc32(key.encode('utf-8')) % self.workers_per_partition
+        if self.partition_of is None:
+            return index
+        return self.partition_of(key) * self.workers_per_partition + index
+
+    async def _worker(self, index: int) -> None:
+        queue = self._queues[index]
+        while True:
+            if queue.empty() and self._spilling[index]:
+                await self._drain_spill(index)
+                continue
+
+            event_type, data = await queue.get()
+            self._in_flight[index] = (event_type, data)
+            try:
+                await self._process(event_type, data)
+            finally:
+                self._in_flight[index] = None
+                queue.task_done()
+
+    async def _process(self, event_type: str, data: dict) -> None:
+        # 処理中に出たログにイベントの相関IDを付ける
+        with bind_log_context(
+            event=event_type,
+            message_id=data.get('id') or data.get('message_id'),
+            channel_id=data.get('channel_id'),
+            thread_id=data.get('thread_id')
+        ):
+            try:
+                await self.handler(event_type, data)
+                self.counters['processed'] += 1
+            except Exception as e:
+                self.counters['failed'] += 1
+                self.logger.error("イベント処理中にエラー (%s %s): %s", event_type, data.get('id'), e)
+
+    async def _wait_idle(self) -> None:
+        while True:
+            await asyncio.gather(*(queue.join() for queue in self._queues))
+            if not any(self._spilling):
+                return
+            await asyncio.sleep(0.05)
+
+    def _spill_path(self, index: int) -> str:
+        return os.path.join(self.spill_dir, f"ingest_spill_{index}.jsonl")
+
+    def _spill(self, index: int, item: Tuple[str, dict]) -> None:
+        """イベントをディスクに退避"""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with open(self._spill_path(index), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'type': item[0], 'data': item[1]}, ensure_ascii=False) + "\n")
+        self.counters['spilled'] += 1
+
+    def _spill_remaining(self) -> int:
+        """処理中・キューに残っているイベントを、既存の退避分より前に退避（退避した件数を返す）"""
+        total = 0
+        for index, queue in enumerate(self._queues):
+            items = [self._in_flight[index]] if self._in_flight[index] else []
+            while not queue.empty():
+                items.append(queue.get_nowait())
+                queue.task_done()
+            if not items:
+                continue
+
+            # 退避ファイルにはキューの後に届いたイベントが入っているので、その前に書く
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = self._spill_path(index)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                for event_type, data in items:
+                    f.write(json.dumps({'type': event_type, 'data': data}, ensure_ascii=False) + "\n")
+                if os.path.exists(path):
+                    with open(path, encoding='utf-8') as spilled:
+                        for line in spilled:
+                            f.write(line)
+            os.replace(path + '.tmp', path)
+            self.counters['spilled'] += len(items)
+            total += len(items)
+        return total
+
+    async def _drain_spill(self, index: int) -> None:
+        """退避ファイルを順に処理し、追いついたら通常処理に戻す"""
+        path = self._spill_path(index)
+        draining_path = path + '.draining'
+
+        while os.path.exists(path):
+            os.replace(path, draining_path)
+            await self._process_spill_file(draining_path)
+
+        self._spilling[index] = False
+
+    async def _process_spill_file(self, path: str) -> None:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                await self._process(record['type'], record['data'])
+        os.remove(path)
+
+    async def _recover_spill_files(self) -> None:
+        """前回停止時に残った退避ファイルを処理"""
+        paths = sorted(glob.glob(os.path.join(self.spill_dir, "ingest_spill_*.jsonl*")))
+        # 処理途中だったファイルを先に処理
+        paths.sort(key=lambda p: not p.endswith('.draining'))
+        for path in paths:
+            self.logger.info("退避ファイルを処理します: %s", path)
+            await self._process_spill_file(path)
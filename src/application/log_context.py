@@ -0,0 +1,26 @@
+"""
+ログの相関ID: 処理中のイベント（メッセージID・チャンネルなど）をログに付けるためのコンテキスト
+
+asyncio のタスクごと（to_thread で実行するスレッドにも引き継がれる）に保持されるので、
+イベントを処理するワーカーで bind_log_context() しておけば、その中で出力されたログすべてに付く。
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator
+
+_log_context: ContextVar[Dict[str, Any]] = ContextVar('log_context', default={})
+
+
+def current_log_context() -> Dict[str, Any]:
+    """現在の相関IDを取得"""
+    return _log_context.get()
+
+
+@contextmanager
+def bind_log_context(**fields: Any) -> Iterator[None]:
+    """ブロック内のログに相関IDを付ける（値が None の項目は付けない）"""
+    token = _log_context.set({**_log_context.get(), **{key: value for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
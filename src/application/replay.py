@@ -0,0 +1,162 @@
+"""
+アプリケーションサービス: イベントダンプのオフラインリプレイ
+"""
+import asyncio
+import gzip
+import json
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional
+
+from ..domain import clock
+from ..domain.clock import ReplayClock
+
+
+@dataclass
+class ReplayEvent:
+    """リプレイ対象のイベント"""
+    event_type: str
+    data: dict
+    timestamp: Optional[datetime]
+
+
+@dataclass
+class ReplayStats:
+    """リプレイ結果の統計"""
+    events: int = 0
+    processed: int = 0
+    failed: int = 0
+    invalid_lines: int = 0
+    by_type: Counter = field(default_factory=Counter)
+    elapsed_seconds: float = 0.0
+
+    @property
+    def events_per_second(self) -> float:
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return self.events / self.elapsed_seconds
+
+    def summary(self) -> str:
+        types = ', '.join(f"{event_type}={count}" for event_type, count in self.by_type.most_common())
+        return (
+            f"{self.events} 件 ({self.events_per_second:.0f} 件/秒, {self.elapsed_seconds:.1f} 秒) "
+            f"成功 {self.processed} / 失敗 {self.failed} / 不正行 {self.invalid_lines} [{types}]"
+        )
+
+
+class ReplayEngine:
+    """JSONL のイベントダンプを LogCollectionService に流し込む
+
+    ファイルは1行ずつ読み、ジェネレータで処理するためメモリ使用量は件数に依存しない。
+    speed は 1.0 で実時間、N で N 倍速、0 以下で待ち時間なし。
+    再生中は ReplayClock をイベント時刻に進めるので、アラート判定はリプレイ時刻基準になる。
+    """
+
+    def __init__(
+        self,
+        log_service,
+        speed: float = 0.0,
+        observers: Optional[List[Callable[[ReplayEvent], None]]] = None,
+        report_every: int = 10000
+    ):
+        self.log_service = log_service
+        self.speed = speed
+        self.observers = observers or []
+        self.report_every = report_every
+        self.logger = logging.getLogger(__name__)
+
+    async def replay(self, path: str) -> ReplayStats:
+        """ファイルを再生"""
+        stats = ReplayStats()
+        replay_clock = ReplayClock()
+        previous_clock = clock.get_clock()
+        clock.set_clock(replay_clock)
+
+        started = time.perf_counter()
+        try:
+            events = self._parse(read_lines(path), stats)
+            async for event in self._pace(events):
+                if event.timestamp:
+                    replay_clock.advance_to(event.timestamp)
+                await self._dispatch(event, stats)
+
+                if self.report_every and stats.events % self.report_every == 0:
+                    stats.elapsed_seconds = time.perf_counter() - started
+                    self.logger.info("リプレイ進捗: %s", stats.summary())
+        finally:
+            clock.set_clock(previous_clock)
+            stats.elapsed_seconds = time.perf_counter() - started
+
+        self.logger.info("リプレイ完了: %s", stats.summary())
+        return stats
+
+    def _parse(self, lines: Iterable[str], stats: ReplayStats) -> Iterator[ReplayEvent]:
+        """JSON 行をイベントに変換"""
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                stats.invalid_lines += 1
+                continue
+
+            # {"type": ..., "data": {...}} 形式、またはメッセージデータそのもの
+            if 'data' in record and 'type' in record:
+                event_type, data = record['type'], record['data']
+            else:
+                event_type, data = 'message', record
+
+            yield ReplayEvent(event_type=event_type, data=data, timestamp=self._event_time(data))
+
+    async def _pace(self, events: Iterator[ReplayEvent]) -> AsyncIterator[ReplayEvent]:
+        """イベント時刻の間隔に合わせて待機"""
+        first_event_time: Optional[datetime] = None
+        first_wall_time = 0.0
+
+        for event in events:
+            if self.speed > 0 and event.timestamp:
+                if first_event_time is None:
+                    first_event_time = event.timestamp
+                    first_wall_time = time.perf_counter()
+                offset = (event.timestamp - first_event_time).total_seconds() / self.speed
+                delay = first_wall_time + offset - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield event
+
+    async def _dispatch(self, event: ReplayEvent, stats: ReplayStats) -> None:
+        stats.events += 1
+        stats.by_type[event.event_type] += 1
+
+        for observer in self.observers:
+            observer(event)
+
+        try:
+            await self.log_service.handle_event(event.event_type, event.data)
+            stats.processed += 1
+        except Exception as e:
+            stats.failed += 1
+            self.logger.error("リプレイ中にエラー (%s %s): %s", event.event_type, event.data.get('id'), e)
+
+    @staticmethod
+    def _event_time(data: dict) -> Optional[datetime]:
+        value = data.get('timestamp') or data.get('edited_at') or data.get('deleted_at')
+        if not value:
+            return None
+        try:
+            return clock.as_utc(datetime.fromisoformat(value))
+        except ValueError:
+            return None
+
+
+def read_lines(path: str) -> Iterator[str]:
+    """ファイルを1行ずつ読む（.gz にも対応）"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield line
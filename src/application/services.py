@@ -1,13 +1,18 @@
 """
 アプリケーションサービス: メッセージログ収集ユースケース
 """
-from typing import List
-from datetime import datetime
-from ..domain.entities import Message, Channel, Alert, User, UserRole
-from ..domain.services import MessageAnalyzer, UserRoleClassifier
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+from ..domain import clock
+from ..domain.entities import Message, Channel, Alert, User, UserRole, Session, ActivityBucket, StudentActivity
+from ..domain.services import MessageAnalyzer, UserRoleClassifier, Sessionizer
+from ..domain.detectors import Detector, DetectorPipeline
+from ..domain.features import FeatureExtractor
 from ..domain.repositories import (
     MessageRepository, ChannelRepository, UserRepository, 
-    AlertRepository, NotificationService, SpreadsheetService
+    AlertRepository, NotificationService, SpreadsheetService, SessionRepository,
+    RollupRepository, LogTableSource, StudentActivityRepository
 )
 
 
@@ -21,7 +26,16 @@ class LogCollectionService:
         user_repo: UserRepository,
         alert_repo: AlertRepository,
         notification_service: NotificationService,
-        spreadsheet_service: SpreadsheetService
+        spreadsheet_service: SpreadsheetService,
+        session_repo: Optional[SessionRepository] = None,
+        sessionizer: Optional[Sessionizer] = None,
+        rollup_repo: Optional[RollupRepository] = None,
+        detector_pipeline: Optional[DetectorPipeline] = None,
+        analysis_window_hours: int = 24,
+        analysis_concurrency: int = 8,
+        feature_extractor: Optional[FeatureExtractor] = None,
+        log_table_source: Optional[LogTableSource] = None,
+        student_activity_repo: Optional[StudentActivityRepository] = None
     ):
         self.message_repo = message_repo
         self.channel_repo = channel_repo
@@ -29,33 +43,101 @@ class LogCollectionService:
         self.alert_repo = alert_repo
         self.notification_service = notification_service
         self.spreadsheet_service = spreadsheet_service
+        self.session_repo = session_repo
+        self.sessionizer = sessionizer or Sessionizer()
+        self.rollup_repo = rollup_repo
+        self.detector_pipeline = detector_pipeline
+        self.analysis_window_hours = analysis_window_hours
+        self.analysis_concurrency = analysis_concurrency
+        self.feature_extractor = feature_extractor or FeatureExtractor()
+        # 設定されていれば、チャンネルログの出力と活動の集計は表のまま読み込んで行う
+        self.log_table_source = log_table_source
+        self.student_activity_repo = student_activity_repo
+        # 登録済みユーザー（名簿の同期・メンバーの更新で最新に保つ。メッセージの処理では DB を引かない）
+        self._users: Dict[str, User] = {}
     
     async def collect_and_analyze_messages(self) -> None:
-        """メッセージを収集・分析してアラートを生成"""
+        """レッスンチャンネルをまとめて分析してアラートを生成
+        
+        未回答のセッションと最近のメッセージは全チャンネル分をまとめて取得し、
+        チャンネルごとの分析は analysis_concurrency 件までスレッドで並行して行う。
+        """
         # 1. レッスンチャンネル一覧を取得
         channels = await self.channel_repo.get_lesson_channels()
+        if not channels:
+            return
+        channel_ids = [channel.id for channel in channels]
         
-        for channel in channels:
-            # 2. 各チャンネルの最近のメッセージを取得
-            messages = await self.message_repo.get_recent_messages(channel.id, hours=24)
-            
-            if not messages:
-                continue
-            
-            # 3. メッセージを分析してアラートを生成
-            alerts = MessageAnalyzer.detect_unanswered_questions(channel, messages)
-            
-            # 4. アラートを保存・通知
-            for alert in alerts:
-                await self.alert_repo.save_alert(alert)
-                await self.notification_service.send_alert(alert)
+        # 2. 会話セッションがあれば未回答のセッションと質問をまとめて取得
+        pending_sessions: Dict[str, List[Session]] = {}
+        questions: Dict[str, Message] = {}
+        if self.session_repo:
+            pending_sessions = await self.session_repo.get_pending_sessions_for_channels(
+                channel_ids, asked_before=clock.hours_ago(2)
+            )
+            question_ids = [
+                session.pending_question_id
+                for sessions in pending_sessions.values() for session in sessions
+            ]
+            if question_ids:
+                questions = await self.message_repo.get_messages(question_ids)
+        
+        # 3. 検出器で走査する場合は最近のメッセージをまとめて取得
+        recent_messages: Dict[str, List[Message]] = {}
+        if self.detector_pipeline or not self.session_repo:
+            recent_messages = await self.message_repo.get_recent_messages_for_channels(
+                channel_ids, hours=self.analysis_window_hours
+            )
+        
+        # 範囲より前の状態が必要な検出器には、範囲の直前のメッセージも渡す
+        context_messages: Dict[str, List[Message]] = {}
+        if self.detector_pipeline and self.detector_pipeline.context_messages:
+            context_messages = await self.message_repo.get_messages_before_for_channels(
+                channel_ids, clock.hours_ago(self.analysis_window_hours), self.detector_pipeline.context_messages
+            )
+        
+        # 4. チャンネルごとに並行して分析（イベントループを塞がないようスレッドで実行）
+        semaphore = asyncio.Semaphore(self.analysis_concurrency)
+        
+        async def analyze(channel: Channel) -> List[Alert]:
+            async with semaphore:
+                return await asyncio.to_thread(
+                    self._analyze_channel,
+                    channel,
+                    recent_messages.get(channel.id, []),
+                    pending_sessions.get(channel.id, []),
+                    questions,
+                    context_messages.get(channel.id, [])
+                )
+        
+        results = await asyncio.gather(*(analyze(channel) for channel in channels))
+        
+        # 5. アラートをまとめて保存・通知
+        await self._save_and_notify([alert for alerts in results for alert in alerts])
+    
+    async def handle_event(self, event_type: str, data: dict) -> None:
+        """イベント種別に応じて処理を振り分け"""
+        handlers = {
+            'message': self.process_new_message,
+            'message_edit': self.process_message_edit,
+            'message_delete': self.process_message_delete,
+            'reaction_add': self.process_reaction_add,
+            'reaction_remove': self.process_reaction_remove,
+            'members': self.process_members,
+        }
+        
+        handler = handlers.get(event_type)
+        if handler is None:
+            raise ValueError(f"未対応のイベント種別です: {event_type}")
+        await handler(data)
     
     async def process_new_message(self, discord_message_data: dict) -> None:
         """新しいメッセージを処理"""
         # 1. ユーザー情報を取得・分類
         user = await self._get_or_create_user(discord_message_data['author'])
         
-        # 2. メッセージエンティティを作成
+        # 2. 本文の特徴を求めてメッセージエンティティを作成
+        features = self.feature_extractor.extract(discord_message_data['content'])
         message = Message(
             id=discord_message_data['id'],
             channel_id=discord_message_data['channel_id'],
@@ -64,52 +146,417 @@ class LogCollectionService:
             content=discord_message_data['content'],
             timestamp=datetime.fromisoformat(discord_message_data['timestamp']),
             reactions=discord_message_data.get('reactions', []),
-            is_question=discord_message_data['content'].endswith('？') or discord_message_data['content'].endswith('?')
+            is_question=features.is_question,
+            thread_id=discord_message_data.get('thread_id'),
+            features=features
         )
         
-        # 3. メッセージを保存
-        await self.message_repo.save_message(message)
+        # 3. メッセージを保存し、新規なら会話セッションに反映
+        inserted = await self.message_repo.save_message(message)
+        if self.session_repo and not inserted:
+            return
+        session, answered = await self._record_session(message) if self.session_repo else (None, 0)
+        
+        # 新規のメッセージだけを活動集計に加算（再送・履歴の再取得で二重計上しない）
+        if self.rollup_repo and inserted:
+            await self.rollup_repo.record_message(
+                message.channel_id,
+                message.timestamp,
+                "staff" if user.is_staff() else "student",
+                message.is_question,
+                answered_questions=answered
+            )
+        if self.student_activity_repo and inserted:
+            await self._record_student_activity(message)
         
         # 4. 必要に応じて即座にアラート分析
         channel = await self.channel_repo.get_channel(message.channel_id)
         if channel and channel.is_lesson_channel:
-            recent_messages = await self.message_repo.get_recent_messages(channel.id, hours=6)
-            alerts = MessageAnalyzer.detect_unanswered_questions(channel, recent_messages)
+            if session is not None:
+                alerts = await self._detect_unanswered_in_session(channel, session, message)
+            else:
+                # スレッドの投稿はそのスレッドだけを見直す
+                if message.thread_id:
+                    recent_messages = await self.message_repo.get_recent_thread_messages(message.thread_id, hours=6)
+                else:
+                    recent_messages = await self.message_repo.get_recent_messages(channel.id, hours=6)
+                alerts = MessageAnalyzer.detect_unanswered_questions(channel, recent_messages)
             
-            for alert in alerts:
-                await self.alert_repo.save_alert(alert)
-                await self.notification_service.send_alert(alert)
+            await self._save_and_notify(alerts)
+    
+    async def process_members(self, data: dict) -> None:
+        """ギルドのメンバー（名簿の同期・参加・更新）を反映"""
+        await self.sync_members(data['members'])
+    
+    async def sync_members(self, members: List[dict]) -> int:
+        """メンバーをまとめて登録（ロールと名前が変わったユーザーだけ書き込み、その件数を返す）"""
+        changed = []
+        for member in members:
+            user = self._user_from_author(member)
+            cached = self._users.get(user.id)
+            if cached is None or cached.role_hash() != user.role_hash():
+                changed.append(user)
+        if not changed:
+            return 0
+        
+        written = await self.user_repo.save_users(changed)
+        for user in changed:
+            self._users[user.id] = user
+        return written
+    
+    async def load_users(self) -> int:
+        """登録済みのユーザーを読み込む（起動時）"""
+        self._users = {user.id: user for user in await self.user_repo.get_users()}
+        return len(self._users)
+    
+    def memory_items(self) -> Tuple[int, List[User]]:
+        """メモリに持っているユーザー数と、その要素（メモリ使用量の概算用）"""
+        return len(self._users), list(self._users.values())
+    
+    async def process_message_edit(self, data: dict) -> None:
+        """メッセージの編集を反映"""
+        edited_at = datetime.fromisoformat(data['edited_at']) if data.get('edited_at') else clock.now()
+        await self.message_repo.update_message_content(
+            data['channel_id'],
+            data['id'],
+            data['content'],
+            self.feature_extractor.extract(data['content']),
+            edited_at
+        )
+    
+    async def process_message_delete(self, data: dict) -> None:
+        """メッセージの削除を反映"""
+        deleted_at = datetime.fromisoformat(data['deleted_at']) if data.get('deleted_at') else clock.now()
+        await self.message_repo.mark_message_deleted(data['channel_id'], data['id'], deleted_at)
+    
+    async def process_reaction_add(self, data: dict) -> None:
+        """リアクションの追加を反映"""
+        is_staff = await self._is_staff(data['user_id'], data.get('roles'))
+        added = await self.message_repo.add_reaction(
+            data['channel_id'], data['message_id'], data['user_id'], data['emoji'], is_staff
+        )
+        
+        # 運営側のリアクションは質問の確認とみなす
+        if added and is_staff:
+            await self.alert_repo.resolve_alerts(data['message_id'], "unanswered_question")
+            if self.session_repo:
+                await self.session_repo.acknowledge_question(data['message_id'])
     
-    async def export_channel_logs(self, channel_id: str) -> str:
-        """チャンネルログをスプレッドシートにエクスポート"""
-        messages = await self.message_repo.get_channel_messages(channel_id, limit=1000)
+    async def process_reaction_remove(self, data: dict) -> None:
+        """リアクションの削除を反映"""
+        await self.message_repo.remove_reaction(
+            data['channel_id'], data['message_id'], data['user_id'], data['emoji']
+        )
+    
+    async def export_channel_logs(self, channel_id: str, days: Optional[int] = None) -> str:
+        """チャンネルログをスプレッドシートにエクスポート（古い順に読みながら書き出す）"""
+        since = clock.now() - timedelta(days=days) if days else None
+        if self.log_table_source:
+            table = await self.log_table_source.channel_log_table(channel_id, since=since)
+            return await self.spreadsheet_service.export_log_table(channel_id, table)
+        messages = self.message_repo.iter_channel_messages(channel_id, since=since)
         return await self.spreadsheet_service.export_channel_logs(channel_id, messages)
     
+    async def export_thread_logs(self, thread_id: str) -> str:
+        """スレッドのログをスプレッドシートにエクスポート（古い順に読みながら書き出す）"""
+        messages = self.message_repo.iter_thread_messages(thread_id)
+        return await self.spreadsheet_service.export_thread_logs(thread_id, messages)
+    
+    async def export_channel_sessions(self, channel_id: str, days: int = 30) -> str:
+        """チャンネルの会話セッション一覧をスプレッドシートにエクスポート"""
+        if not self.session_repo:
+            return ""
+        sessions = await self.session_repo.get_recent_sessions(channel_id, hours=days * 24)
+        return await self.spreadsheet_service.export_channel_sessions(channel_id, sessions)
+    
+    async def export_report(self, name: str, tables: Dict[str, Any]) -> str:
+        """集計結果をスプレッドシートにエクスポート"""
+        return await self.spreadsheet_service.export_report(name, tables)
+    
+    async def export_activity(self, days: int = 30) -> str:
+        """直近 days 日の活動の集計をスプレッドシートにエクスポート（表のまま読み込める場合のみ）"""
+        if not self.log_table_source:
+            return ""
+        tables = await self.log_table_source.activity_tables(days)
+        return await self.spreadsheet_service.export_report('activity', tables)
+    
+    async def warm_up(self) -> None:
+        """レッスンチャンネルの直近のメッセージを事前に読み込む"""
+        channels = await self.channel_repo.get_lesson_channels()
+        await self.message_repo.warm([channel.id for channel in channels], self.analysis_window_hours)
+    
+    def register_detector(self, detector: Detector) -> None:
+        """定期分析に検出器を追加"""
+        if self.detector_pipeline is None:
+            self.detector_pipeline = DetectorPipeline()
+        self.detector_pipeline.register(detector)
+    
+    async def rebuild_sessions(self, channel_id: str, since: Optional[datetime] = None) -> int:
+        """保存済みのメッセージからチャンネルの会話セッションを作り直す（作成したセッション数を返す）
+        
+        メッセージは古い順に読みながら処理し、会話ごとに進行中のセッションだけを保持する。
+        """
+        if not self.session_repo:
+            raise RuntimeError("会話セッションリポジトリが設定されていません")
+        
+        await self.session_repo.delete_sessions(channel_id, since)
+        
+        open_sessions: Dict[Optional[str], Session] = {}
+        # 閉じたが質問が未回答のまま残っているセッション（後の運営側の返信で解消する）
+        pending_sessions: Dict[Optional[str], List[Session]] = {}
+        created = 0
+        async for message in self.message_repo.iter_channel_messages(channel_id, since=since):
+            current = open_sessions.get(message.thread_id)
+            session = self.sessionizer.apply(current, message)
+            # 運営側のリアクションで確認済みの質問は未回答として残さない
+            if session.pending_question_id == message.id and message.acknowledged:
+                session.pending_question_id = None
+                session.pending_question_at = None
+            
+            if current is not None and session is not current:
+                await self.session_repo.save_session(current)
+                created += 1
+                if current.pending_question_id is not None:
+                    pending_sessions.setdefault(message.thread_id, []).append(current)
+            open_sessions[message.thread_id] = session
+            
+            if message.user.is_staff() and pending_sessions.get(message.thread_id):
+                for closed in pending_sessions.pop(message.thread_id):
+                    closed.pending_question_id = None
+                    closed.pending_question_at = None
+                    await self.session_repo.save_session(closed)
+        
+        for session in open_sessions.values():
+            await self.session_repo.save_session(session)
+            created += 1
+        return created
+    
+    async def get_activity(
+        self, since: datetime, until: Optional[datetime] = None,
+        channel_id: Optional[str] = None, granularity: str = "hour"
+    ) -> List[ActivityBucket]:
+        """活動集計を取得"""
+        if not self.rollup_repo:
+            raise RuntimeError("活動集計リポジトリが設定されていません")
+        return await self.rollup_repo.get_activity(since, until or clock.now(), channel_id, granularity)
+    
+    async def get_activity_summary(self, since: datetime, channel_id: Optional[str] = None) -> Dict[str, int]:
+        """期間内の発言数・質問数・回答済み数の合計"""
+        buckets = await self.get_activity(since, channel_id=channel_id)
+        summary = {'student_messages': 0, 'staff_messages': 0, 'questions': 0, 'answered': 0}
+        for bucket in buckets:
+            summary[f"{bucket.side}_messages"] += bucket.message_count
+            summary['questions'] += bucket.question_count
+            summary['answered'] += bucket.answered_count
+        return summary
+    
+    async def compact_rollups(self, hourly_retention_days: int) -> int:
+        """古い時間単位の活動集計を日単位にまとめる"""
+        if not self.rollup_repo:
+            return 0
+        return await self.rollup_repo.compact(clock.now() - timedelta(days=hourly_retention_days))
+    
+    async def get_student_activity(
+        self, channel_id: Optional[str] = None, user_id: Optional[str] = None
+    ) -> List[StudentActivity]:
+        """生徒ごとの最後の発言・運営側の最後の返信・発言数・未回答の質問数を取得"""
+        if not self.student_activity_repo:
+            raise RuntimeError("生徒の活動リポジトリが設定されていません")
+        return await self.student_activity_repo.get_student_activity(channel_id, user_id)
+    
+    async def get_inactive_students(
+        self, days: float, max_days: Optional[float] = None, channel_ids: Optional[List[str]] = None
+    ) -> List[StudentActivity]:
+        """最後の発言から days 日以上（max_days 日未満）経っている生徒を取得（いまは運営側のユーザーは除く）"""
+        if not self.student_activity_repo:
+            raise RuntimeError("生徒の活動リポジトリが設定されていません")
+        now = clock.now()
+        activities = await self.student_activity_repo.get_inactive_students(
+            before=now - timedelta(days=days),
+            since=now - timedelta(days=max_days) if max_days else None,
+            channel_ids=channel_ids
+        )
+        return [
+            activity for activity in activities
+            if not (activity.user_id in self._users and self._users[activity.user_id].is_staff())
+        ]
+    
+    async def check_inactive_students(self, days: float, max_days: Optional[float] = None) -> int:
+        """レッスンチャンネルで days 日以上発言していない生徒をアラートにする（通知した件数を返す）
+        
+        生徒の活動の表だけを引くので、メッセージの件数によらず生徒の人数分の処理で済む。
+        アラートは最後の発言に付けるため、同じ生徒には次に発言してまた間が空くまで通知しない。
+        """
+        if not self.student_activity_repo:
+            return 0
+        channels = {channel.id: channel for channel in await self.channel_repo.get_lesson_channels()}
+        if not channels:
+            return 0
+        
+        activities = await self.get_inactive_students(days, max_days, channel_ids=list(channels))
+        if not activities:
+            return 0
+        last_messages = await self.message_repo.get_messages([activity.last_message_id for activity in activities])
+        alerts = []
+        for activity in activities:
+            message = last_messages.get(activity.last_message_id)
+            if message:
+                alerts.extend(
+                    MessageAnalyzer.detect_inactive_student(channels[activity.channel_id], activity, message, days)
+                )
+        
+        new_alerts = await self.alert_repo.save_alerts(alerts) if alerts else []
+        if new_alerts:
+            await self.notification_service.send_alerts(new_alerts)
+        return len(new_alerts)
+    
+    async def rebuild_student_activity(self, channel_id: str) -> int:
+        """保存済みのメッセージからチャンネルの生徒の活動を作り直す（生徒の人数を返す）"""
+        if not self.student_activity_repo:
+            raise RuntimeError("生徒の活動リポジトリが設定されていません")
+        
+        activities: Dict[str, StudentActivity] = {}
+        last_staff_at: Optional[datetime] = None
+        
+        def settle(activity: StudentActivity) -> None:
+            # 最後の発言以降の運営側の発言は、最も新しいものだけを返信として反映すればよい
+            if last_staff_at is not None and last_staff_at >= activity.last_post_at:
+                activity.last_staff_reply_at = last_staff_at
+                activity.open_questions = 0
+        
+        async for message in self.message_repo.iter_channel_messages(channel_id):
+            if message.user.is_staff():
+                last_staff_at = message.timestamp
+                continue
+            activity = activities.get(message.user.id)
+            if activity is None:
+                activity = activities[message.user.id] = StudentActivity(
+                    user_id=message.user.id, channel_id=channel_id,
+                    last_post_at=message.timestamp, last_message_id=message.id
+                )
+            settle(activity)
+            activity.last_post_at = message.timestamp
+            activity.last_message_id = message.id
+            activity.message_count += 1
+            activity.open_questions += int(message.is_question)
+        for activity in activities.values():
+            settle(activity)
+        
+        await self.student_activity_repo.replace_channel(channel_id, list(activities.values()))
+        return len(activities)
+    
+    async def _record_student_activity(self, message: Message) -> None:
+        """生徒側の発言は本人の活動に、運営側の発言はチャンネルの生徒への返信として反映"""
+        if message.user.is_staff():
+            await self.student_activity_repo.record_staff_reply(message.channel_id, message.timestamp)
+        else:
+            await self.student_activity_repo.record_student_message(
+                message.user.id, message.channel_id, message.id, message.timestamp, message.is_question
+            )
+    
+    async def _record_session(self, message: Message) -> Tuple[Session, int]:
+        """メッセージを会話セッションに反映（このメッセージで解消した未回答の質問の数も返す）"""
+        session = await self.session_repo.get_active_session(
+            message.channel_id, message.thread_id, message.timestamp, self.sessionizer.gap
+        )
+        was_pending = session is not None and session.pending_question_id is not None
+        session = self.sessionizer.apply(session, message)
+        answered = int(was_pending and session.pending_question_id is None and message.user.is_staff())
+        session = await self.session_repo.save_session(session)
+        if message.user.is_staff():
+            # 間隔を空けた返信は新しいセッションになるので、以前のセッションに残った質問もここで解消する
+            answered += await self.session_repo.resolve_pending_questions(
+                message.channel_id, message.thread_id, message.timestamp, exclude_session_id=session.id
+            )
+        return session, answered
+    
+    async def _detect_unanswered_in_session(
+        self, channel: Channel, session: Session, latest_message: Optional[Message] = None
+    ) -> List[Alert]:
+        """セッションの未回答の質問を検出"""
+        if not session.pending_question_id:
+            return []
+        
+        if latest_message and latest_message.id == session.pending_question_id:
+            question = latest_message
+        else:
+            question = await self.message_repo.get_message(session.pending_question_id)
+        if not question:
+            return []
+        return MessageAnalyzer.detect_unanswered_session(channel, session, question)
+    
+    def _analyze_channel(
+        self,
+        channel: Channel,
+        messages: List[Message],
+        pending_sessions: List[Session],
+        questions: Dict[str, Message],
+        context: Optional[List[Message]] = None
+    ) -> List[Alert]:
+        """1チャンネル分の分析（I/O を行わない）"""
+        alerts = []
+        for session in pending_sessions:
+            question = questions.get(session.pending_question_id)
+            if question:
+                alerts.extend(MessageAnalyzer.detect_unanswered_session(channel, session, question))
+        
+        if self.detector_pipeline:
+            # 範囲の境界で両方に入ったメッセージは範囲の方だけで数える
+            window_ids = {message.id for message in messages}
+            context = [message for message in context or [] if message.id not in window_ids]
+            alerts.extend(self.detector_pipeline.run(channel, messages, context))
+        elif not self.session_repo and messages:
+            alerts.extend(MessageAnalyzer.detect_unanswered_questions(channel, messages))
+        return alerts
+    
+    async def _save_and_notify(self, alerts: List[Alert]) -> None:
+        """アラートをまとめて保存し、新しいものだけ通知"""
+        if not alerts:
+            return
+        new_alerts = await self.alert_repo.save_alerts(alerts)
+        if new_alerts:
+            await self.notification_service.send_alerts(new_alerts)
+    
     async def _get_or_create_user(self, author_data: dict) -> User:
-        """ユーザーを取得または作成"""
+        """ユーザーを取得または作成（通常は名簿の同期で登録済み）"""
         user_id = author_data['id']
-        existing_user = await self.user_repo.get_user(user_id)
+        existing_user = self._users.get(user_id) or await self.user_repo.get_user(user_id)
         
         if existing_user:
+            self._users[user_id] = existing_user
             return existing_user
         
-        # 新しいユーザーを作成
-        role_names = author_data.get('roles', [])
-        classified_roles = UserRoleClassifier.classify_user_roles(role_names)
-        
+        # 名簿にないユーザー（同期前の投稿や退出済みのメンバー）だけここで作成
+        user = self._user_from_author(author_data)
+        await self.user_repo.save_user(user)
+        self._users[user_id] = user
+        return user
+    
+    def _user_from_author(self, author_data: dict) -> User:
+        """Discordの投稿者・メンバー情報からユーザーを作成"""
+        return User(
+            id=author_data['id'],
+            username=author_data['username'],
+            display_name=author_data.get('display_name', author_data['username']),
+            roles=self._classify_roles(author_data.get('roles', []))
+        )
+    
+    async def _is_staff(self, user_id: str, role_names: Optional[List[str]] = None) -> bool:
+        """ユーザーが運営側かどうか（未登録ならイベントのロール名で判定）"""
+        user = self._users.get(user_id) or await self.user_repo.get_user(user_id)
+        if user:
+            return user.is_staff()
+        if role_names is None:
+            return False
+        return User(id=user_id, username='', display_name='', roles=self._classify_roles(role_names)).is_staff()
+    
+    @staticmethod
+    def _classify_roles(role_names: List[str]) -> List[UserRole]:
+        """Discordのロール名をユーザーロールに変換"""
         user_roles = []
-        for role_name in classified_roles:
+        for role_name in UserRoleClassifier.classify_user_roles(role_names):
             try:
                 user_roles.append(UserRole(role_name))
             except ValueError:
                 user_roles.append(UserRole.STUDENT)  # デフォルト
-        
-        user = User(
-            id=user_id,
-            username=author_data['username'],
-            display_name=author_data.get('display_name', author_data['username']),
-            roles=user_roles
-        )
-        
-        await self.user_repo.save_user(user)
-        return user
\ No newline at end of file
+        return user_roles
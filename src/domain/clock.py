@@ -0,0 +1,75 @@
+"""
+ドメインサービス: 現在時刻の取得
+
+分析ロジックは datetime.now() を直接呼ばずにこのモジュールを経由する。
+リプレイ時は ReplayClock に差し替えることで、再生中のイベント時刻を基準に判定できる。
+タイムゾーンを持たない日時は UTC として扱う（SQLite の datetime('now') と同じ基準）。
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+
+class Clock:
+    """システム時計"""
+
+    def now(self) -> datetime:
+        """現在時刻（UTC）"""
+        return datetime.now(timezone.utc)
+
+
+class ReplayClock(Clock):
+    """リプレイ中のイベント時刻を現在時刻として返す時計"""
+
+    def __init__(self, start: Optional[datetime] = None):
+        self._current = as_utc(start) if start else None
+
+    def now(self) -> datetime:
+        # 最初のイベントまではシステム時刻を返す
+        return self._current or datetime.now(timezone.utc)
+
+    def advance_to(self, moment: datetime) -> None:
+        """時刻を進める（巻き戻しはしない）"""
+        moment = as_utc(moment)
+        if self._current is None or moment > self._current:
+            self._current = moment
+
+
+_clock: Clock = Clock()
+
+
+def get_clock() -> Clock:
+    """現在の時計を取得"""
+    return _clock
+
+
+def set_clock(clock: Clock) -> None:
+    """時計を差し替え"""
+    global _clock
+    _clock = clock
+
+
+def now() -> datetime:
+    """現在時刻（UTC）"""
+    return _clock.now()
+
+
+def as_utc(moment: datetime) -> datetime:
+    """タイムゾーン付きのUTC日時に変換"""
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def elapsed_since(moment: datetime) -> timedelta:
+    """指定時刻からの経過時間"""
+    return now() - as_utc(moment)
+
+
+def hours_ago(hours: float) -> datetime:
+    """指定時間前の時刻（UTC）"""
+    return now() - timedelta(hours=hours)
+
+
+def to_db_timestamp(moment: datetime) -> str:
+    """SQLite の datetime('now') と比較可能な形式に変換"""
+    return as_utc(moment).strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,318 @@
+"""
+ドメインサービス: 検出器パイプライン
+
+チャンネルのメッセージ列を1回だけ走査し、登録された検出器すべてに1件ずつ渡す。
+検出器は走査ごとに new_state() で作った小さな状態だけを持ち、
+feed() で途中のアラートを、finish() で走査後のアラートを返す。
+分析の範囲より前の状態が必要な検出器は context_messages に件数を返し、その件数分の直前のメッセージを
+seed() で状態に反映する（アラートは出さない）。
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, replace
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+from . import clock
+from .entities import Alert, Channel, Message
+
+
+class Detector:
+    """検出器の基底クラス
+
+    name はアラート種別と設定のキーを兼ねる。
+    defaults に設定項目と既定値を定義し、コンストラクタの引数で上書きする。
+    """
+    name = ""
+    defaults: Dict[str, Any] = {}
+
+    def __init__(self, **config):
+        unknown = set(config) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"{self.name} に未対応の設定があります: {', '.join(sorted(unknown))}")
+        self.config = {**self.defaults, **config}
+
+    def new_state(self) -> Any:
+        """走査ごとの状態を作成"""
+        return None
+
+    @property
+    def context_messages(self) -> int:
+        """状態に反映する、分析の範囲より前のメッセージの件数（チャンネルごと）"""
+        return 0
+
+    def seed(self, state: Any, channel: Channel, message: Message) -> None:
+        """分析の範囲より前のメッセージを1件、状態に反映"""
+        pass
+
+    def feed(self, state: Any, channel: Channel, message: Message) -> List[Alert]:
+        """メッセージを1件処理"""
+        return []
+
+    def finish(self, state: Any, channel: Channel) -> List[Alert]:
+        """走査の最後に呼ばれる"""
+        return []
+
+    def _alert(self, channel: Channel, message: Message, description: str) -> Alert:
+        return Alert(
+            channel=channel,
+            message=message,
+            alert_type=self.name,
+            description=description,
+            created_at=clock.now()
+        )
+
+
+class UnansweredQuestionDetector(Detector):
+    """会話（チャンネル本体・スレッド）の最後が生徒側の質問のまま返信がない"""
+    name = "unanswered_question"
+    defaults = {'alert_after_hours': 2}
+
+    def new_state(self) -> Dict[Optional[str], Message]:
+        return {}
+
+    def feed(self, state, channel, message):
+        state[message.thread_id] = message
+        return []
+
+    def finish(self, state, channel):
+        threshold = timedelta(hours=self.config['alert_after_hours'])
+        alerts = []
+        for last_message in state.values():
+            elapsed = clock.elapsed_since(last_message.timestamp)
+            if (last_message.user.is_student_side() and
+                last_message.is_question and
+                not last_message.acknowledged and
+                elapsed > threshold):
+                hours = int(elapsed.total_seconds() / 3600)
+                alerts.append(self._alert(channel, last_message, f"生徒からの質問に {hours} 時間返信がありません"))
+        return alerts
+
+
+@dataclass
+class _SilenceState:
+    last_staff_message: Optional[Message] = None
+    first_student_after_staff: Optional[Message] = None
+    student_messages: int = 0
+
+
+class MentorSilenceDetector(Detector):
+    """運営側の最後の発言以降、生徒側だけが発言し続けている"""
+    name = "mentor_silence"
+    defaults = {'silence_hours': 6, 'min_student_messages': 3}
+
+    def new_state(self) -> _SilenceState:
+        return _SilenceState()
+
+    def feed(self, state, channel, message):
+        if message.user.is_staff():
+            state.last_staff_message = message
+            state.first_student_after_staff = None
+            state.student_messages = 0
+        else:
+            if state.first_student_after_staff is None:
+                state.first_student_after_staff = message
+            state.student_messages += 1
+        return []
+
+    def finish(self, state, channel):
+        first = state.first_student_after_staff
+        if first is None or state.student_messages < self.config['min_student_messages']:
+            return []
+
+        elapsed = clock.elapsed_since(first.timestamp)
+        if elapsed <= timedelta(hours=self.config['silence_hours']):
+            return []
+
+        hours = int(elapsed.total_seconds() / 3600)
+        return [self._alert(
+            channel, first,
+            f"運営側の発言が {hours} 時間ありません（その間の生徒側の発言 {state.student_messages} 件）"
+        )]
+
+
+class FloodDetector(Detector):
+    """短時間に同じユーザーが大量に発言している"""
+    name = "message_flood"
+    defaults = {'max_messages': 10, 'window_seconds': 60}
+
+    def new_state(self) -> Dict[str, Any]:
+        return {'recent': defaultdict(deque), 'alerted': set()}
+
+    def feed(self, state, channel, message):
+        user_id = message.user.id
+        if user_id in state['alerted']:
+            return []
+
+        recent = state['recent'][user_id]
+        timestamp = clock.as_utc(message.timestamp)
+        recent.append(timestamp)
+        window = timedelta(seconds=self.config['window_seconds'])
+        while recent and timestamp - recent[0] > window:
+            recent.popleft()
+
+        if len(recent) < self.config['max_messages']:
+            return []
+
+        # 1回の走査では同じユーザーに1回だけ出す
+        state['alerted'].add(user_id)
+        return [self._alert(
+            channel, message,
+            f"{message.user.display_name} さんが {self.config['window_seconds']} 秒間に "
+            f"{len(recent)} 件発言しています"
+        )]
+
+
+@dataclass
+class _RunState:
+    first_message: Optional[Message] = None
+    count: int = 0
+
+
+class StudentOnlyRunDetector(Detector):
+    """会話の中で生徒側の発言だけが長く続いている
+
+    アラートは連続の最初の発言に出す。分析の範囲が連続の途中から始まっても同じ発言になるよう、
+    範囲の直前の max_run 件で連続の始まりと件数を求めておく（範囲の前に max_run 件続いていれば出し済み）。
+    """
+    name = "student_only_run"
+    defaults = {'max_run': 15}
+
+    def new_state(self) -> Dict[Optional[str], _RunState]:
+        return defaultdict(_RunState)
+
+    @property
+    def context_messages(self) -> int:
+        return self.config['max_run']
+
+    def seed(self, state, channel, message):
+        self._count(state, message)
+
+    def feed(self, state, channel, message):
+        run = self._count(state, message)
+        # しきい値に達したときにだけ出す（同じ連続で何度も出さない）
+        if run is None or run.count != self.config['max_run']:
+            return []
+        return [self._alert(
+            channel, run.first_message,
+            f"運営側の返信なしに生徒側の発言が {self.config['max_run']} 件続いています"
+        )]
+
+    @staticmethod
+    def _count(state, message) -> Optional[_RunState]:
+        if message.user.is_staff():
+            state.pop(message.thread_id, None)
+            return None
+        run = state[message.thread_id]
+        if run.first_message is None:
+            run.first_message = message
+        run.count += 1
+        return run
+
+
+DETECTORS: Dict[str, Type[Detector]] = {
+    detector.name: detector
+    for detector in (UnansweredQuestionDetector, MentorSilenceDetector, FloodDetector, StudentOnlyRunDetector)
+}
+
+
+@dataclass
+class DetectorTiming:
+    """検出器ごとの処理時間の累計"""
+    runs: int = 0
+    messages: int = 0
+    alerts: int = 0
+    seconds: float = 0.0
+
+    @property
+    def microseconds_per_message(self) -> float:
+        if not self.messages:
+            return 0.0
+        return self.seconds / self.messages * 1_000_000
+
+
+class DetectorPipeline:
+    """登録された検出器にメッセージ列を1回の走査で渡す"""
+
+    def __init__(self, detectors: Optional[Iterable[Detector]] = None):
+        self.detectors: List[Detector] = []
+        self.timings: Dict[str, DetectorTiming] = {}
+        self._lock = threading.Lock()
+        for detector in detectors or []:
+            self.register(detector)
+
+    @classmethod
+    def from_config(cls, names: Iterable[str], config: Optional[Dict[str, Dict[str, Any]]] = None) -> "DetectorPipeline":
+        """検出器名と検出器ごとの設定からパイプラインを作成"""
+        config = config or {}
+        detectors = []
+        for name in names:
+            if name not in DETECTORS:
+                raise ValueError(f"未対応の検出器です: {name}")
+            detectors.append(DETECTORS[name](**config.get(name, {})))
+        return cls(detectors)
+
+    def register(self, detector: Detector) -> None:
+        """検出器を登録"""
+        if detector.name in self.timings:
+            raise ValueError(f"検出器が重複しています: {detector.name}")
+        self.detectors.append(detector)
+        self.timings[detector.name] = DetectorTiming()
+
+    @property
+    def context_messages(self) -> int:
+        """分析の範囲より前に読むメッセージの件数（チャンネルごと、検出器の最大）"""
+        return max((detector.context_messages for detector in self.detectors), default=0)
+
+    def run(
+        self, channel: Channel, messages: Iterable[Message], context: Iterable[Message] = ()
+    ) -> List[Alert]:
+        """メッセージ列（時刻順）を走査してアラートを返す
+
+        context は分析の範囲の直前のメッセージ（時刻順）で、必要な検出器の状態に反映するだけでアラートは出さない。
+        複数チャンネルをスレッドで並行して走査できるよう、状態は走査ごとに作り、
+        処理時間は走査の最後にまとめて加算する。
+        """
+        alerts: List[Alert] = []
+        stages = [(detector, detector.new_state(), DetectorTiming(runs=1)) for detector in self.detectors]
+        counter = time.perf_counter
+
+        seeding = [(detector, state) for detector, state, _ in stages if detector.context_messages]
+        for message in context:
+            for detector, state in seeding:
+                detector.seed(state, channel, message)
+
+        count = 0
+        for message in messages:
+            count += 1
+            for detector, state, timing in stages:
+                started = counter()
+                found = detector.feed(state, channel, message)
+                timing.seconds += counter() - started
+                if found:
+                    timing.alerts += len(found)
+                    alerts.extend(found)
+
+        for detector, state, timing in stages:
+            started = counter()
+            found = detector.finish(state, channel)
+            timing.seconds += counter() - started
+            timing.alerts += len(found)
+            timing.messages = count
+            alerts.extend(found)
+
+        with self._lock:
+            for detector, _, timing in stages:
+                total = self.timings[detector.name]
+                total.runs += timing.runs
+                total.messages += timing.messages
+                total.alerts += timing.alerts
+                total.seconds += timing.seconds
+
+        return alerts
+
+    def stats(self) -> Dict[str, DetectorTiming]:
+        """検出器ごとの処理時間"""
+        with self._lock:
+            return {name: replace(timing) for name, timing in self.timings.items()}
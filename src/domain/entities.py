@@ -1,7 +1,8 @@
 """
 ドメインモデル: メッセージエンティティ
 """
-from dataclasses import dataclass
+import hashlib
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import List, Optional
 from enum import Enum
@@ -17,6 +18,10 @@ class UserRole(Enum):
     PARENT = "parent"
 
 
+# 運営側とみなすロール
+STAFF_ROLES = frozenset({UserRole.ADMIN, UserRole.SUPPORT, UserRole.MENTOR, UserRole.AI_ASSISTANT})
+
+
 @dataclass
 class User:
     """ユーザーエンティティ"""
@@ -27,12 +32,34 @@ class User:
     
     def is_staff(self) -> bool:
         """運営側かどうかを判定"""
-        staff_roles = {UserRole.ADMIN, UserRole.SUPPORT, UserRole.MENTOR, UserRole.AI_ASSISTANT}
-        return any(role in staff_roles for role in self.roles)
+        return any(role in STAFF_ROLES for role in self.roles)
     
     def is_student_side(self) -> bool:
         """生徒側かどうかを判定"""
         return not self.is_staff()
+    
+    def role_hash(self) -> str:
+        """ロールと名前のハッシュ（名簿の同期で変更のないユーザーを判定する。ロールの順序は問わない）"""
+        parts = [self.username, self.display_name, *sorted(role.value for role in self.roles)]
+        return hashlib.blake2b("\x1f".join(parts).encode('utf-8'), digest_size=8).hexdigest()
+
+
+# この値以上の質問らしさのメッセージを質問とみなす
+QUESTION_SCORE_THRESHOLD = 0.5
+
+
+@dataclass(frozen=True)
+class MessageFeatures:
+    """取り込み時に本文から求める特徴（messages テーブルの列に保存する）"""
+    question_score: float = 0.0  # 質問らしさ（0〜1）
+    has_code_block: bool = False
+    mention_count: int = 0
+    url_count: int = 0
+    length: int = 0
+    
+    @property
+    def is_question(self) -> bool:
+        return self.question_score >= QUESTION_SCORE_THRESHOLD
 
 
 @dataclass
@@ -47,10 +74,9 @@ class Message:
     reactions: List[str]
     is_question: bool = False
     thread_id: Optional[str] = None
-    
-    def contains_question_mark(self) -> bool:
-        """質問マークを含むかどうか"""
-        return "？" in self.content or "?" in self.content
+    edited_at: Optional[datetime] = None
+    acknowledged: bool = False  # 運営側のリアクションで確認済み
+    features: Optional[MessageFeatures] = None  # 取り込み時に求める（未計算なら None）
 
 
 @dataclass
@@ -68,7 +94,7 @@ class Channel:
         
         # 最後のメッセージが生徒側からの質問の場合
         return (self.last_message.user.is_student_side() and 
-                self.last_message.contains_question_mark())
+                self.last_message.is_question)
 
 
 @dataclass
@@ -78,4 +104,59 @@ class Alert:
     message: Message
     alert_type: str
     description: str
-    created_at: datetime
\ No newline at end of file
+    created_at: datetime
+
+
+@dataclass
+class Session:
+    """会話セッションエンティティ（時間の空きで区切られた一連のやり取り）"""
+    channel_id: str
+    started_at: datetime
+    ended_at: datetime
+    thread_id: Optional[str] = None
+    id: Optional[int] = None
+    message_count: int = 0
+    participant_ids: List[str] = field(default_factory=list)
+    turns: int = 0  # 生徒側と運営側の発言が入れ替わった回数
+    last_speaker_side: Optional[str] = None  # "student" または "staff"
+    last_message_id: Optional[str] = None
+    first_student_message_id: Optional[str] = None
+    first_student_at: Optional[datetime] = None
+    first_staff_reply_id: Optional[str] = None
+    first_staff_reply_at: Optional[datetime] = None
+    first_staff_reply_user_id: Optional[str] = None
+    pending_question_id: Optional[str] = None  # 運営側の返信がまだない最初の質問
+    pending_question_at: Optional[datetime] = None
+    
+    def response_time_seconds(self) -> Optional[float]:
+        """最初の生徒側の発言から運営側の最初の返信までの秒数"""
+        if not self.first_student_at or not self.first_staff_reply_at:
+            return None
+        return (self.first_staff_reply_at - self.first_student_at).total_seconds()
+
+
+@dataclass
+class ActivityBucket:
+    """チャンネル・時間枠・発言者側ごとの活動集計"""
+    channel_id: str
+    bucket_start: datetime
+    granularity: str  # "hour" または "day"
+    side: str  # "student" または "staff"
+    message_count: int = 0
+    question_count: int = 0
+    answered_count: int = 0  # 運営側の発言で回答済みになった質問の数
+
+
+@dataclass
+class StudentActivity:
+    """生徒側のユーザー・チャンネルごとの活動（取り込み時に更新する）
+
+    運営側の返信は、生徒の発言より後にそのチャンネル（スレッドを含む）で運営側が発言した時刻とする。
+    """
+    user_id: str
+    channel_id: str
+    last_post_at: datetime
+    last_message_id: str
+    message_count: int = 0
+    open_questions: int = 0  # 最後の運営側の返信より後の質問の数
+    last_staff_reply_at: Optional[datetime] = None
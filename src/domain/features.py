@@ -0,0 +1,106 @@
+"""
+ドメインサービス: メッセージ本文の特徴抽出
+
+質問らしさ（日本語の文末の表現）・コードブロック・メンション・URL・文字数を取り込み時に1回だけ求め、
+messages テーブルの列に保存する。分析・出力は保存済みの列を読み、本文を解析し直さない。
+正規表現はモジュールの読み込み時にまとめてコンパイルしておく。
+"""
+import re
+from typing import Iterable, List, Pattern, Tuple
+
+from .entities import MessageFeatures
+
+# 抽出方法を変えたら上げる（保存済みの行のうち古い版のものを埋め直す）
+FEATURES_VERSION = 1
+
+CODE_BLOCK = re.compile(r"```.*?(?:```|\Z)", re.S)
+INLINE_CODE = re.compile(r"`[^`\n]+`")
+URL = re.compile(r"https?://[^\s<>\"'`]+")
+MENTION = re.compile(r"<@[!&]?\d+>|@(?:everyone|here)\b")
+CUSTOM_EMOJI = re.compile(r"<a?:\w+:\d+>|:\w+:")
+
+# 文の区切り（疑問符は文末の判定に使うので区切りに含めない）
+SENTENCE_BREAK = re.compile(r"[。．！!\n]+")
+# 文末の飾り（空白・伸ばし棒・笑い・記号・括弧など）
+TRAILING = re.compile(r"[\s　ー〜~…・.,、wｗ笑汗♪☆★)）」』】\]]+$")
+
+# 文ごとに当てはめる（文末の飾りを除いた後の文に対して）パターンと質問らしさ
+SENTENCE_RULES: Tuple[Tuple[Pattern[str], float], ...] = (
+    # 疑問符で終わる
+    (re.compile(r"[?？]$"), 1.0),
+    # 〜ですか / 〜ますか / 〜でしょうか / 〜のでしょうか / 〜かな / 〜っけ
+    (re.compile(
+        r"(?:ですか|ますか|でしょうか|ませんか|ましたか|でしたか|ましょうか|だろうか|のか|かな|かね|っけ)$"
+    ), 0.9),
+    # 〜教えてください / 〜教えていただけますか（文のどこにあってもよい）
+    (re.compile(
+        r"(?:教えて|おしえて)(?:ください|下さい|くださ|ほしい|欲しい|もらえ|いただけ|頂け|くれ)"
+    ), 0.85),
+    # 疑問符を含む（文末でなくても）
+    (re.compile(r"[?？]"), 0.7),
+    # 確認・手助けの依頼
+    (re.compile(
+        r"(?:見て|確認して|助けて|手伝って|アドバイス)(?:ください|下さい|もらえ|いただけ|頂け|ほしい|欲しい)"
+    ), 0.7),
+    # つまずいていることの表明
+    (re.compile(
+        r"(?:わかりません|分かりません|わからない|分からない|できません|動きません|うまくいきません|困って|詰まって)"
+    ), 0.6),
+    # 疑問詞だけ（これだけでは質問とみなさない）
+    (re.compile(r"(?:どうすれば|どうやって|どうしたら|なぜ|何故|なんで|どこ|いつ|どれ|どの|どんな|何を|何が)"), 0.4),
+)
+
+
+class FeatureExtractor:
+    """メッセージ本文から MessageFeatures を求める"""
+
+    version = FEATURES_VERSION
+
+    def extract(self, content: str) -> MessageFeatures:
+        """1件分の特徴を求める"""
+        has_code_block = '```' in content and CODE_BLOCK.search(content) is not None
+        prose = CODE_BLOCK.sub("\n", content) if has_code_block else content
+        url_count = len(URL.findall(content)) if '://' in content else 0
+        mention_count = len(MENTION.findall(content)) if '@' in content else 0
+
+        # 質問らしさはコード・URL・メンション・カスタム絵文字を除いた文章だけで判定する
+        if url_count:
+            prose = URL.sub(" ", prose)
+        if mention_count:
+            prose = MENTION.sub(" ", prose)
+        if '`' in prose:
+            prose = INLINE_CODE.sub(" ", prose)
+        if ':' in prose:
+            prose = CUSTOM_EMOJI.sub(" ", prose)
+
+        return MessageFeatures(
+            question_score=self.question_score(prose),
+            has_code_block=has_code_block,
+            mention_count=mention_count,
+            url_count=url_count,
+            length=len(content)
+        )
+
+    def extract_many(self, contents: Iterable[str]) -> List[MessageFeatures]:
+        """まとめて求める（保存済みの行の埋め直し用）"""
+        extract = self.extract
+        return [extract(content or "") for content in contents]
+
+    @staticmethod
+    def question_score(text: str) -> float:
+        """文ごとに最も強く当てはまる規則の値のうち、最大のもの（0〜1）"""
+        best = 0.0
+        for sentence in SENTENCE_BREAK.split(text):
+            sentence = TRAILING.sub("", sentence)
+            if not sentence:
+                continue
+            for pattern, score in SENTENCE_RULES:
+                if score <= best:
+                    # 規則は強い順に並んでいるので、これ以降で最大値は更新されない
+                    break
+                if pattern.search(sentence):
+                    best = score
+                    break
+            if best >= 1.0:
+                break
+        return best
@@ -2,16 +2,39 @@
 ドメインリポジトリインターフェース
 """
 from abc import ABC, abstractmethod
-from typing import List, Optional
-from .entities import Message, Channel, User, Alert
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional
+from .entities import Message, MessageFeatures, Channel, User, Alert, Session, ActivityBucket, StudentActivity
+
+
+@dataclass(frozen=True)
+class MessageCursor:
+    """キーセットページングの位置（直前のページの最後のメッセージ）"""
+    timestamp: datetime
+    message_id: str
+    
+    @classmethod
+    def after(cls, message: Message) -> "MessageCursor":
+        return cls(timestamp=message.timestamp, message_id=message.id)
 
 
 class MessageRepository(ABC):
     """メッセージリポジトリインターフェース"""
     
     @abstractmethod
-    async def save_message(self, message: Message) -> None:
-        """メッセージを保存"""
+    async def save_message(self, message: Message) -> bool:
+        """メッセージを保存（新規に保存された場合は True）"""
+        pass
+    
+    @abstractmethod
+    async def get_message(self, message_id: str) -> Optional[Message]:
+        """メッセージを1件取得"""
+        pass
+    
+    @abstractmethod
+    async def get_messages(self, message_ids: List[str]) -> Dict[str, Message]:
+        """複数のメッセージをまとめて取得（IDをキーにした辞書）"""
         pass
     
     @abstractmethod
@@ -19,10 +42,292 @@ class MessageRepository(ABC):
         """チャンネルのメッセージを取得"""
         pass
     
+    @abstractmethod
+    async def get_messages_page(
+        self,
+        channel_id: Optional[str] = None,
+        thread_id: Optional[str] = None,
+        after: Optional[MessageCursor] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 500
+    ) -> List[Message]:
+        """(時刻, ID) 順で after より後のメッセージを最大 limit 件取得"""
+        pass
+    
+    async def iter_channel_messages(
+        self,
+        channel_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        batch_size: int = 500
+    ) -> AsyncIterator[Message]:
+        """チャンネルのメッセージを古い順に batch_size 件ずつ読みながら返す"""
+        async for message in self._iter_pages(since, until, batch_size, channel_id=channel_id):
+            yield message
+    
+    async def iter_thread_messages(
+        self,
+        thread_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        batch_size: int = 500
+    ) -> AsyncIterator[Message]:
+        """スレッドのメッセージを古い順に batch_size 件ずつ読みながら返す"""
+        async for message in self._iter_pages(since, until, batch_size, thread_id=thread_id):
+            yield message
+    
+    async def _iter_pages(
+        self, since: Optional[datetime], until: Optional[datetime], batch_size: int, **scope
+    ) -> AsyncIterator[Message]:
+        cursor = None
+        while True:
+            page = await self.get_messages_page(after=cursor, since=since, until=until, limit=batch_size, **scope)
+            for message in page:
+                yield message
+            if len(page) < batch_size:
+                return
+            cursor = MessageCursor.after(page[-1])
+    
     @abstractmethod
     async def get_recent_messages(self, channel_id: str, hours: int = 24) -> List[Message]:
         """最近のメッセージを取得"""
         pass
+    
+    @abstractmethod
+    async def get_recent_messages_for_channels(
+        self, channel_ids: List[str], hours: int = 24
+    ) -> Dict[str, List[Message]]:
+        """複数チャンネルの最近のメッセージをまとめて取得（チャンネルIDごとに時刻順）"""
+        pass
+    
+    @abstractmethod
+    async def get_messages_before_for_channels(
+        self, channel_ids: List[str], before: datetime, limit: int
+    ) -> Dict[str, List[Message]]:
+        """複数チャンネルの指定時刻以前の直近 limit 件をまとめて取得（チャンネルIDごとに時刻順）"""
+        pass
+    
+    @abstractmethod
+    async def get_thread_messages(self, thread_id: str, limit: int = 100) -> List[Message]:
+        """スレッドのメッセージを取得"""
+        pass
+    
+    @abstractmethod
+    async def get_recent_thread_messages(self, thread_id: str, hours: int = 24) -> List[Message]:
+        """スレッドの最近のメッセージを取得"""
+        pass
+    
+    @abstractmethod
+    async def get_session_messages(self, session: Session) -> List[Message]:
+        """セッションに含まれるメッセージを取得"""
+        pass
+    
+    @abstractmethod
+    async def update_message_content(
+        self, channel_id: str, message_id: str, content: str, features: MessageFeatures, edited_at: datetime
+    ) -> bool:
+        """メッセージ本文と特徴を更新（対象がなければ False）"""
+        pass
+    
+    @abstractmethod
+    async def mark_message_deleted(self, channel_id: str, message_id: str, deleted_at: datetime) -> bool:
+        """メッセージを削除済みにする（対象がなければ False）"""
+        pass
+    
+    @abstractmethod
+    async def add_reaction(
+        self, channel_id: str, message_id: str, user_id: str, emoji: str, is_staff: bool
+    ) -> bool:
+        """リアクションを追加（新規に追加された場合のみ True）"""
+        pass
+    
+    @abstractmethod
+    async def remove_reaction(self, channel_id: str, message_id: str, user_id: str, emoji: str) -> bool:
+        """リアクションを削除（削除された場合のみ True）"""
+        pass
+    
+    async def warm(self, channel_ids: List[str], hours: Optional[int] = None) -> None:
+        """直近のメッセージを事前に読み込む（キャッシュを持つ実装のみ）"""
+        pass
+
+
+class DelegatingMessageRepository(MessageRepository):
+    """下位のリポジトリにそのまま委譲する MessageRepository（キャッシュなどの基底クラス）"""
+    
+    def __init__(self, backend: MessageRepository):
+        self.backend = backend
+    
+    async def save_message(self, message: Message) -> bool:
+        return await self.backend.save_message(message)
+    
+    async def get_message(self, message_id: str) -> Optional[Message]:
+        return await self.backend.get_message(message_id)
+    
+    async def get_messages(self, message_ids: List[str]) -> Dict[str, Message]:
+        return await self.backend.get_messages(message_ids)
+    
+    async def get_channel_messages(self, channel_id: str, limit: int = 100) -> List[Message]:
+        return await self.backend.get_channel_messages(channel_id, limit)
+    
+    async def get_messages_page(
+        self,
+        channel_id: Optional[str] = None,
+        thread_id: Optional[str] = None,
+        after: Optional[MessageCursor] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 500
+    ) -> List[Message]:
+        return await self.backend.get_messages_page(channel_id, thread_id, after, since, until, limit)
+    
+    async def get_recent_messages(self, channel_id: str, hours: int = 24) -> List[Message]:
+        return await self.backend.get_recent_messages(channel_id, hours)
+    
+    async def get_recent_messages_for_channels(
+        self, channel_ids: List[str], hours: int = 24
+    ) -> Dict[str, List[Message]]:
+        return await self.backend.get_recent_messages_for_channels(channel_ids, hours)
+    
+    async def get_messages_before_for_channels(
+        self, channel_ids: List[str], before: datetime, limit: int
+    ) -> Dict[str, List[Message]]:
+        return await self.backend.get_messages_before_for_channels(channel_ids, before, limit)
+    
+    async def get_thread_messages(self, thread_id: str, limit: int = 100) -> List[Message]:
+        return await self.backend.get_thread_messages(thread_id, limit)
+    
+    async def get_recent_thread_messages(self, thread_id: str, hours: int = 24) -> List[Message]:
+        return await self.backend.get_recent_thread_messages(thread_id, hours)
+    
+    async def get_session_messages(self, session: Session) -> List[Message]:
+        return await self.backend.get_session_messages(session)
+    
+    async def update_message_content(
+        self, channel_id: str, message_id: str, content: str, features: MessageFeatures, edited_at: datetime
+    ) -> bool:
+        return await self.backend.update_message_content(channel_id, message_id, content, features, edited_at)
+    
+    async def mark_message_deleted(self, channel_id: str, message_id: str, deleted_at: datetime) -> bool:
+        return await self.backend.mark_message_deleted(channel_id, message_id, deleted_at)
+    
+    async def add_reaction(
+        self, channel_id: str, message_id: str, user_id: str, emoji: str, is_staff: bool
+    ) -> bool:
+        return await self.backend.add_reaction(channel_id, message_id, user_id, emoji, is_staff)
+    
+    async def remove_reaction(self, channel_id: str, message_id: str, user_id: str, emoji: str) -> bool:
+        return await self.backend.remove_reaction(channel_id, message_id, user_id, emoji)
+    
+    async def warm(self, channel_ids: List[str], hours: Optional[int] = None) -> None:
+        await self.backend.warm(channel_ids, hours)
+
+
+class SessionRepository(ABC):
+    """会話セッションリポジトリインターフェース"""
+    
+    @abstractmethod
+    async def get_active_session(
+        self, channel_id: str, thread_id: Optional[str], timestamp: datetime, gap: timedelta
+    ) -> Optional[Session]:
+        """指定時刻の前後 gap 以内に続いているセッションを取得"""
+        pass
+    
+    @abstractmethod
+    async def save_session(self, session: Session) -> Session:
+        """セッションを保存（新規なら id を採番して返す）"""
+        pass
+    
+    @abstractmethod
+    async def get_recent_sessions(self, channel_id: str, hours: int = 24) -> List[Session]:
+        """最近のセッションを取得"""
+        pass
+    
+    @abstractmethod
+    async def get_pending_sessions(self, channel_id: str, asked_before: datetime) -> List[Session]:
+        """指定時刻より前の質問が未回答のままのセッションを取得"""
+        pass
+    
+    @abstractmethod
+    async def get_pending_sessions_for_channels(
+        self, channel_ids: List[str], asked_before: datetime
+    ) -> Dict[str, List[Session]]:
+        """複数チャンネルの未回答のセッションをまとめて取得"""
+        pass
+    
+    @abstractmethod
+    async def delete_sessions(self, channel_id: str, since: Optional[datetime] = None) -> int:
+        """チャンネルのセッションを削除（作り直し用、件数を返す）"""
+        pass
+    
+    @abstractmethod
+    async def acknowledge_question(self, message_id: str) -> None:
+        """質問を確認済みとして未回答状態を解除"""
+        pass
+    
+    @abstractmethod
+    async def resolve_pending_questions(
+        self, channel_id: str, thread_id: Optional[str], answered_at: datetime, exclude_session_id: Optional[int] = None
+    ) -> int:
+        """運営側の返信より前の未回答の質問を、同じ会話の以前のセッションも含めて解除（解除した件数を返す）"""
+        pass
+
+
+class RollupRepository(ABC):
+    """活動集計リポジトリインターフェース"""
+    
+    @abstractmethod
+    async def record_message(
+        self, channel_id: str, timestamp: datetime, side: str, is_question: bool, answered_questions: int = 0
+    ) -> None:
+        """メッセージ1件分を時間枠の集計に加算"""
+        pass
+    
+    @abstractmethod
+    async def get_activity(
+        self, since: datetime, until: datetime, channel_id: Optional[str] = None, granularity: str = "hour"
+    ) -> List[ActivityBucket]:
+        """期間内の集計を取得（day 指定時は時間単位の集計も日単位にまとめて返す）"""
+        pass
+    
+    @abstractmethod
+    async def compact(self, before: datetime) -> int:
+        """指定日時より前の時間単位の集計を日単位にまとめる（まとめた行数を返す）"""
+        pass
+
+
+class StudentActivityRepository(ABC):
+    """生徒ごとの活動リポジトリインターフェース"""
+    
+    @abstractmethod
+    async def record_student_message(self, user_id: str, channel_id: str, message_id: str,
+                                     timestamp: datetime, is_question: bool) -> None:
+        """生徒側の発言1件分を反映"""
+        pass
+    
+    @abstractmethod
+    async def record_staff_reply(self, channel_id: str, timestamp: datetime) -> None:
+        """運営側の発言を、それより前に発言したチャンネルの生徒への返信として反映"""
+        pass
+    
+    @abstractmethod
+    async def get_student_activity(
+        self, channel_id: Optional[str] = None, user_id: Optional[str] = None
+    ) -> List[StudentActivity]:
+        """チャンネル・ユーザーで絞り込んだ活動を取得"""
+        pass
+    
+    @abstractmethod
+    async def get_inactive_students(
+        self, before: datetime, since: Optional[datetime] = None, channel_ids: Optional[List[str]] = None
+    ) -> List[StudentActivity]:
+        """最後の発言が before より前（since 以降）の生徒を、最後の発言の古い順に取得"""
+        pass
+    
+    @abstractmethod
+    async def replace_channel(self, channel_id: str, activities: List[StudentActivity]) -> None:
+        """チャンネルの活動を作り直した内容で置き換える"""
+        pass
 
 
 class ChannelRepository(ABC):
@@ -51,20 +356,40 @@ class UserRepository(ABC):
     async def save_user(self, user: User) -> None:
         """ユーザー情報を保存"""
         pass
+    
+    @abstractmethod
+    async def save_users(self, users: List[User]) -> int:
+        """ユーザーをまとめて保存（1トランザクション、ロールと名前が変わったユーザーだけ書き込み、その件数を返す）"""
+        pass
+    
+    @abstractmethod
+    async def get_users(self) -> List[User]:
+        """登録済みのユーザーをすべて取得"""
+        pass
 
 
 class AlertRepository(ABC):
     """アラートリポジトリインターフェース"""
     
     @abstractmethod
-    async def save_alert(self, alert: Alert) -> None:
-        """アラートを保存"""
+    async def save_alert(self, alert: Alert) -> bool:
+        """アラートを保存（同じメッセージ・種別のアラートが既にあれば False）"""
+        pass
+    
+    @abstractmethod
+    async def save_alerts(self, alerts: List[Alert]) -> List[Alert]:
+        """アラートをまとめて保存（新規に保存されたものだけを返す）"""
         pass
     
     @abstractmethod
     async def get_unresolved_alerts(self) -> List[Alert]:
         """未解決のアラートを取得"""
         pass
+    
+    @abstractmethod
+    async def resolve_alerts(self, message_id: str, alert_type: str) -> int:
+        """メッセージに対するアラートを解決済みにする（件数を返す）"""
+        pass
 
 
 class NotificationService(ABC):
@@ -74,12 +399,67 @@ class NotificationService(ABC):
     async def send_alert(self, alert: Alert) -> None:
         """アラートを送信"""
         pass
+    
+    async def send_alerts(self, alerts: List[Alert]) -> None:
+        """複数のアラートを送信（まとめて送れる実装は上書きする）"""
+        for alert in alerts:
+            await self.send_alert(alert)
+
+    @abstractmethod
+    async def send_system_alert(self, title: str, description: str) -> None:
+        """メッセージに紐づかない運用上の通知（メモリ使用量など）を送信"""
+        pass
 
 
 class SpreadsheetService(ABC):
     """スプレッドシートサービスインターフェース"""
     
     @abstractmethod
-    async def export_channel_logs(self, channel_id: str, messages: List[Message]) -> str:
+    async def export_channel_logs(self, channel_id: str, messages: AsyncIterable[Message]) -> str:
         """チャンネルログをスプレッドシートに出力"""
-        pass
\ No newline at end of file
+        pass
+    
+    @abstractmethod
+    async def export_thread_logs(self, thread_id: str, messages: AsyncIterable[Message]) -> str:
+        """スレッドのログをスプレッドシートに出力"""
+        pass
+    
+    @abstractmethod
+    async def export_channel_sessions(self, channel_id: str, sessions: List[Session]) -> str:
+        """チャンネルの会話セッション一覧をスプレッドシートに出力"""
+        pass
+    
+    @abstractmethod
+    async def export_report(self, name: str, tables: Dict[str, Any]) -> str:
+        """集計表（表名 → 行のリストまたはデータフレーム）をスプレッドシートに出力"""
+        pass
+    
+    @abstractmethod
+    async def export_log_table(self, channel_id: str, table: Any) -> str:
+        """表（データフレーム）のまま読み込んだチャンネルログをスプレッドシートに出力"""
+        pass
+
+
+class LogTableSource(ABC):
+    """集計・出力用にメッセージを表（データフレーム）のまま読み込むインターフェース
+    
+    Message への変換を行わないので、件数の多い出力や長期間の集計に使う。
+    """
+    
+    @abstractmethod
+    async def channel_log_table(self, channel_id: str, since: Optional[datetime] = None) -> Any:
+        """チャンネルのメッセージログを古い順に表として読み込む（列は LOG_TABLE_COLUMNS）"""
+        pass
+    
+    @abstractmethod
+    async def activity_tables(self, days: int = 30) -> Dict[str, Any]:
+        """直近 days 日の活動の集計表（表名 → データフレーム）"""
+        pass
+
+
+# LogTableSource.channel_log_table が返す表の列
+LOG_TABLE_COLUMNS = (
+    'message_id', 'channel_name', 'display_name', 'username', 'is_staff', 'roles',
+    'content', 'timestamp', 'is_question', 'reactions', 'thread_id',
+    'question_score', 'has_code_block', 'mention_count', 'url_count', 'length'
+)
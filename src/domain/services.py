@@ -1,9 +1,10 @@
 """
 ドメインサービス: メッセージ分析ロジック
 """
-from typing import List
-from datetime import datetime, timedelta
-from .entities import Message, Channel, Alert, User
+from typing import Dict, List, Optional
+from datetime import timedelta
+from . import clock
+from .entities import Message, Channel, Alert, User, Session, StudentActivity
 
 
 class MessageAnalyzer:
@@ -11,29 +12,73 @@ class MessageAnalyzer:
     
     @staticmethod
     def detect_unanswered_questions(channel: Channel, messages: List[Message]) -> List[Alert]:
-        """未回答の質問を検出"""
+        """未回答の質問を検出（チャンネル本体と各スレッドを別々に判定）"""
         alerts = []
         
         if not messages:
             return alerts
         
-        # 最後のメッセージが生徒側からの質問で、その後返信がない場合
-        last_message = messages[-1]
-        if (last_message.user.is_student_side() and 
-            last_message.contains_question_mark() and
-            MessageAnalyzer._is_old_enough_for_alert(last_message)):
-            
-            alert = Alert(
-                channel=channel,
-                message=last_message,
-                alert_type="unanswered_question",
-                description=f"生徒からの質問に {MessageAnalyzer._hours_since(last_message)} 時間返信がありません",
-                created_at=datetime.now()
-            )
-            alerts.append(alert)
+        # 会話ごとの最後のメッセージ（thread_id が None はチャンネル本体）
+        last_messages: Dict[Optional[str], Message] = {}
+        for message in messages:
+            last_messages[message.thread_id] = message
+        
+        # 最後のメッセージが生徒側からの質問で、その後返信がない場合（運営側のリアクションで確認済みのものは除く）
+        for last_message in last_messages.values():
+            if (last_message.user.is_student_side() and 
+                last_message.is_question and
+                not last_message.acknowledged and
+                MessageAnalyzer._is_old_enough_for_alert(last_message)):
+                
+                alert = Alert(
+                    channel=channel,
+                    message=last_message,
+                    alert_type="unanswered_question",
+                    description=f"生徒からの質問に {MessageAnalyzer._hours_since(last_message)} 時間返信がありません",
+                    created_at=clock.now()
+                )
+                alerts.append(alert)
         
         return alerts
     
+    @staticmethod
+    def detect_unanswered_session(channel: Channel, session: Session, question: Message) -> List[Alert]:
+        """セッションの未回答の質問を検出（メッセージ履歴を走査しない）"""
+        if (session.pending_question_id != question.id or
+            question.acknowledged or
+            not MessageAnalyzer._is_old_enough_for_alert(question)):
+            return []
+        
+        return [Alert(
+            channel=channel,
+            message=question,
+            alert_type="unanswered_question",
+            description=f"生徒からの質問に {MessageAnalyzer._hours_since(question)} 時間返信がありません",
+            created_at=clock.now()
+        )]
+    
+    @staticmethod
+    def detect_inactive_student(
+        channel: Channel, activity: StudentActivity, last_message: Message, days: float
+    ) -> List[Alert]:
+        """最後の発言から days 日以上経った生徒を検出（アラートは最後の発言に付けるので、発言するまで1回だけ）"""
+        elapsed = clock.elapsed_since(activity.last_post_at)
+        if elapsed < timedelta(days=days):
+            return []
+        
+        description = f"{last_message.user.display_name} さんが {elapsed.days} 日間発言していません"
+        if activity.open_questions:
+            description += f"（運営側の返信がない質問が {activity.open_questions} 件あります）"
+        elif activity.last_staff_reply_at is None:
+            description += "（運営側の返信はまだありません）"
+        return [Alert(
+            channel=channel,
+            message=last_message,
+            alert_type="inactive_student",
+            description=description,
+            created_at=clock.now()
+        )]
+    
     @staticmethod
     def detect_off_topic_conversations(messages: List[Message]) -> List[Alert]:
         """振り返り以外の話題を検出（GPT-4.1で分析）"""
@@ -44,12 +89,83 @@ class MessageAnalyzer:
     def _is_old_enough_for_alert(message: Message) -> bool:
         """アラートを出すのに十分古いメッセージかどうか"""
         # 2時間以上経過していればアラート対象
-        return datetime.now() - message.timestamp > timedelta(hours=2)
+        return clock.elapsed_since(message.timestamp) > timedelta(hours=2)
     
     @staticmethod
     def _hours_since(message: Message) -> int:
         """メッセージから何時間経過したか"""
-        return int((datetime.now() - message.timestamp).total_seconds() / 3600)
+        return int(clock.elapsed_since(message.timestamp).total_seconds() / 3600)
+
+
+class Sessionizer:
+    """メッセージを会話セッションにまとめるサービス
+    
+    直前の発言から gap 以上空いたら新しいセッションとする。
+    運営側の返信で区切りがついた後は、resolved_gap 以上空いて生徒側が発言した時点で新しいセッションとする。
+    """
+    
+    def __init__(self, gap_minutes: int = 30, resolved_gap_minutes: int = 10):
+        self.gap = timedelta(minutes=gap_minutes)
+        self.resolved_gap = timedelta(minutes=resolved_gap_minutes)
+    
+    def starts_new_session(self, session: Optional[Session], message: Message) -> bool:
+        """メッセージが新しいセッションを始めるかどうか"""
+        if session is None:
+            return True
+        
+        idle = clock.as_utc(message.timestamp) - session.ended_at
+        if idle > self.gap:
+            return True
+        return (idle > self.resolved_gap and
+                session.last_speaker_side == "staff" and
+                message.user.is_student_side())
+    
+    def apply(self, session: Optional[Session], message: Message) -> Session:
+        """メッセージをセッションに反映（必要なら新しいセッションを作成）"""
+        timestamp = clock.as_utc(message.timestamp)
+        
+        if self.starts_new_session(session, message):
+            session = Session(
+                channel_id=message.channel_id,
+                thread_id=message.thread_id,
+                started_at=timestamp,
+                ended_at=timestamp
+            )
+        
+        side = "staff" if message.user.is_staff() else "student"
+        # 遅れて届いたメッセージは集計にだけ反映し、会話の流れは変えない
+        is_late = timestamp < session.ended_at
+        
+        session.message_count += 1
+        if message.user.id not in session.participant_ids:
+            session.participant_ids.append(message.user.id)
+        session.started_at = min(session.started_at, timestamp)
+        
+        if not is_late:
+            if session.last_speaker_side and session.last_speaker_side != side:
+                session.turns += 1
+            session.last_speaker_side = side
+            session.last_message_id = message.id
+            session.ended_at = timestamp
+        
+        if side == "student":
+            if session.first_student_at is None or timestamp < session.first_student_at:
+                session.first_student_message_id = message.id
+                session.first_student_at = timestamp
+            if message.is_question and session.pending_question_id is None and not is_late:
+                session.pending_question_id = message.id
+                session.pending_question_at = timestamp
+        else:
+            if (session.first_student_at and timestamp > session.first_student_at and
+                (session.first_staff_reply_at is None or timestamp < session.first_staff_reply_at)):
+                session.first_staff_reply_id = message.id
+                session.first_staff_reply_at = timestamp
+                session.first_staff_reply_user_id = message.user.id
+            if session.pending_question_at and timestamp >= session.pending_question_at:
+                session.pending_question_id = None
+                session.pending_question_at = None
+        
+        return session
 
 
 class UserRoleClassifier:
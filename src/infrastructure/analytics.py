@@ -0,0 +1,178 @@
+"""
+分析基盤: 運営側の返信時間の集計
+
+pandas / numpy は読み込みに時間がかかるので、集計を最初に実行するときに読み込む。
+"""
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, Dict, Optional, Sequence
+
+from ..domain import clock
+from ..domain.entities import STAFF_ROLES
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# ユーザーのロールJSONから運営側かどうかを判定するSQL式
+STAFF_FLAG_SQL = "EXISTS (SELECT 1 FROM json_each(u.roles) WHERE json_each.value IN ({}))".format(
+    ", ".join(f"'{role.value}'" for role in sorted(STAFF_ROLES, key=lambda r: r.value))
+)
+
+
+@dataclass
+class ResponseTimeReport:
+    """返信時間レポート（時間はすべて分単位）"""
+    days: int
+    overall: Dict[str, Any]
+    by_channel: pd.DataFrame
+    by_mentor: pd.DataFrame
+    by_hour: pd.DataFrame
+
+    def to_tables(self) -> Dict[str, pd.DataFrame]:
+        """出力用の表に変換"""
+        import pandas as pd
+
+        return {
+            '全体': pd.DataFrame([self.overall]),
+            'チャンネル別': self.by_channel,
+            'メンター別': self.by_mentor,
+            '時間帯別': self.by_hour
+        }
+
+
+class ResponseTimeAnalytics:
+    """生徒側の発言から運営側の最初の返信までの時間を集計
+
+    メッセージは列単位でまとめて読み込み、会話（チャンネル本体・スレッド）ごとの
+    シフトと後方補完で返信時刻を求めるため、メッセージ単位の Python ループは行わない。
+    生徒側の連続した発言は最初の1件を起点とする。
+    """
+
+    def __init__(
+        self, db_path: str = "lesson_logs.db", timezone: str = "Asia/Tokyo", db_paths: Optional[Sequence[str]] = None
+    ):
+        self.db_path = db_path
+        # シャーディング時は全シャードを読み込む（会話は1つのシャードに収まるので連結するだけでよい）
+        self.db_paths = list(db_paths or [db_path])
+        self.timezone = timezone
+
+    async def compute(self, days: int = 30, channel_id: Optional[str] = None) -> ResponseTimeReport:
+        """返信時間レポートを作成（イベントループを塞がないよう別スレッドで実行）"""
+        return await asyncio.to_thread(self._compute, days, channel_id)
+
+    def _compute(self, days: int, channel_id: Optional[str]) -> ResponseTimeReport:
+        starts = self._starts(days, channel_id)
+        return ResponseTimeReport(
+            days=days,
+            overall=self._overall(starts),
+            by_channel=self._summarize(starts, ['channel_id', 'channel_name']),
+            by_mentor=self._summarize(starts[starts['mentor_id'].notna()], ['mentor_id', 'mentor_name']),
+            by_hour=self._summarize(starts, ['hour']).sort_values('hour')
+        )
+
+    def _starts(self, days: int, channel_id: Optional[str]) -> pd.DataFrame:
+        """生徒側の発言の起点と返信までの分数（列は _response_times の戻り値と同じ）"""
+        return self._response_times(self._load_frame(days, channel_id))
+
+    def _load_frame(self, days: int, channel_id: Optional[str]) -> pd.DataFrame:
+        """対象期間のメッセージを列単位で読み込む"""
+        import pandas as pd
+
+        since = clock.to_db_timestamp(clock.now() - timedelta(days=days))
+        # 時刻はSQLite側でエポックミリ秒に変換し、文字列の解析を避ける
+        # （julianday からの浮動小数点の計算では、ちょうど HH:00:00 が前の時間帯に入ってしまうので整数で求める）
+        query = """
+            SELECT channel_id, COALESCE(thread_id, '') AS thread_id, user_id,
+                   CAST(strftime('%s', timestamp) AS INTEGER) * 1000
+                   + CAST(substr(strftime('%f', timestamp), 4) AS INTEGER) AS epoch_ms
+            FROM messages
+            WHERE timestamp >= ? AND deleted_at IS NULL
+        """
+        params = [since]
+        if channel_id:
+            query += " AND channel_id = ?"
+            params.append(channel_id)
+
+        frames, users, channels = [], [], []
+        for path in self.db_paths:
+            with sqlite3.connect(path) as conn:
+                frames.append(pd.read_sql_query(query, conn, params=params))
+                # ユーザーとチャンネルの属性は件数が少ないので別に読み込んで結合する
+                users.append(pd.read_sql_query(
+                    f"SELECT u.id AS user_id, u.display_name, {STAFF_FLAG_SQL} AS is_staff FROM users u", conn
+                ))
+                channels.append(pd.read_sql_query(
+                    "SELECT channel_id, MAX(channel_name) AS channel_name FROM messages GROUP BY channel_id", conn
+                ))
+        frame = pd.concat(frames, ignore_index=True)
+        users = pd.concat(users, ignore_index=True).drop_duplicates('user_id')
+        channels = pd.concat(channels, ignore_index=True).drop_duplicates('channel_id')
+
+        frame['timestamp'] = pd.to_datetime(frame.pop('epoch_ms'), unit='ms', utc=True)
+        users['is_staff'] = users['is_staff'].astype(bool)
+        frame = frame.merge(users, on='user_id', how='inner').merge(channels, on='channel_id', how='left')
+        return frame
+
+    def _response_times(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """生徒側の発言の起点ごとに、最初の運営側の返信までの時間を求める"""
+        import pandas as pd
+
+        columns = ['channel_id', 'channel_name', 'hour', 'mentor_id', 'mentor_name', 'minutes']
+        if frame.empty:
+            return pd.DataFrame(columns=columns)
+
+        frame = frame.sort_values(['channel_id', 'thread_id', 'timestamp'], kind='stable')
+        conversation = frame.groupby(['channel_id', 'thread_id'], sort=False)
+
+        is_student = ~frame['is_staff']
+        previous_is_student = conversation['is_staff'].shift(1).eq(False)
+        run_start = is_student & ~previous_is_student
+
+        # 各行以降で最初の運営側の発言（時刻・発言者）を後方補完で求める
+        staff_rows = frame[['timestamp', 'user_id', 'display_name']].where(frame['is_staff'])
+        staff_rows[['channel_id', 'thread_id']] = frame[['channel_id', 'thread_id']]
+        next_staff = staff_rows.groupby(['channel_id', 'thread_id'], sort=False)[
+            ['timestamp', 'user_id', 'display_name']
+        ].bfill()
+
+        starts = frame.loc[run_start, ['channel_id', 'channel_name', 'timestamp']].copy()
+        replies = next_staff.loc[run_start]
+        starts['mentor_id'] = replies['user_id']
+        starts['mentor_name'] = replies['display_name']
+        starts['minutes'] = (replies['timestamp'] - starts['timestamp']).dt.total_seconds() / 60
+        starts['hour'] = starts['timestamp'].dt.tz_convert(self.timezone).dt.hour
+        return starts[columns]
+
+    @staticmethod
+    def _overall(starts: pd.DataFrame) -> Dict[str, Any]:
+        import numpy as np
+
+        answered = starts['minutes'].dropna().to_numpy()
+        p50, p90 = np.percentile(answered, [50, 90]) if answered.size else (np.nan, np.nan)
+        return {
+            '質問数': int(len(starts)),
+            '返信あり': int(answered.size),
+            '未返信': int(len(starts) - answered.size),
+            'p50(分)': round(float(p50), 1),
+            'p90(分)': round(float(p90), 1)
+        }
+
+    @staticmethod
+    def _summarize(starts: pd.DataFrame, keys) -> pd.DataFrame:
+        """キーごとに件数とp50/p90を集計"""
+        import pandas as pd
+
+        grouped = starts.groupby(keys, dropna=False)['minutes']
+        summary = pd.DataFrame({
+            '質問数': grouped.size(),
+            '返信あり': grouped.count(),
+            'p50(分)': grouped.quantile(0.5),
+            'p90(分)': grouped.quantile(0.9)
+        }).reset_index()
+        summary['未返信'] = summary['質問数'] - summary['返信あり']
+        return summary.round(1).sort_values('p90(分)', ascending=False, na_position='last')
@@ -0,0 +1,510 @@
+"""
+メッセージのアーカイブ: 古いメッセージをチャンネル・月ごとの圧縮 JSONL に移す
+
+アーカイブは archive_dir/<チャンネルID>/<YYYY-MM>.jsonl.gz（zstandard があれば .jsonl.zst も可）に置き、
+各ファイルの内容（件数・時刻の範囲・スレッド）は DB の archive_manifest に記録する。
+ArchiveAwareMessageRepository は、読み込みがアーカイブ済みの範囲に及ぶときだけファイルを読んで結果に合わせる。
+アーカイブ済みのメッセージは読み取り専用で、編集・削除・リアクションは反映しない。
+"""
+import asyncio
+import bisect
+import gzip
+import heapq
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from ..domain import clock
+from ..domain.entities import Message, Session, User
+from ..domain.repositories import DelegatingMessageRepository, MessageCursor, MessageRepository
+from .database import FEATURE_COLUMN_NAMES, _parse_json_list, _parse_roles, _chunks, _row_to_features
+
+try:
+    import zstandard
+except ImportError:  # zstd は任意（なければ gzip のみ）
+    zstandard = None
+
+
+# Discord のスノーフレークIDの基準時刻（ミリ秒）
+DISCORD_EPOCH_MS = 1420070400000
+
+ARCHIVE_SELECT = """
+    SELECT m.*, u.username, u.display_name, u.roles,
+        (SELECT json_group_array(DISTINCT r.emoji)
+         FROM message_reactions r WHERE r.message_id = m.id) AS reaction_list,
+        EXISTS (SELECT 1 FROM message_reactions r
+                WHERE r.message_id = m.id AND r.is_staff) AS acknowledged
+    FROM messages m
+    LEFT JOIN users u ON m.user_id = u.id
+"""
+
+
+@dataclass
+class ArchiveEntry:
+    """アーカイブファイル1つ分のマニフェスト"""
+    channel_id: str
+    month: str
+    path: str
+    message_count: int
+    first_timestamp: str
+    last_timestamp: str
+    thread_ids: List[str] = field(default_factory=list)
+
+    def overlaps(self, since: Optional[str], until: Optional[str]) -> bool:
+        return ((since is None or self.last_timestamp >= since) and
+                (until is None or self.first_timestamp < until))
+
+
+@dataclass
+class ArchiveResult:
+    """アーカイブ処理の結果"""
+    files: int = 0
+    messages: int = 0
+    seconds: float = 0.0
+
+
+def sort_key(record: dict) -> Tuple[str, str]:
+    """DB の ORDER BY timestamp, id と同じ並び順のキー"""
+    return record['timestamp'], record['id']
+
+
+class ArchiveStore:
+    """アーカイブファイルとマニフェストの読み書き"""
+
+    def __init__(self, db_path: str, archive_dir: str, compression: str = "gzip", cache_files: int = 16):
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd で圧縮するには zstandard パッケージが必要です")
+        self.db_path = db_path
+        self.archive_dir = archive_dir
+        self.compression = compression
+        self.cache_files = cache_files
+        self._entries: Optional[List[ArchiveEntry]] = None
+        self._files: "OrderedDict[str, Tuple[List[Tuple[str, str]], List[dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    # --- マニフェスト ---
+
+    def entries(self) -> List[ArchiveEntry]:
+        """マニフェスト全体（小さいのでメモリに持つ）"""
+        with self._lock:
+            if self._entries is None:
+                with sqlite3.connect(self.db_path) as conn:
+                    rows = conn.execute("""
+                        SELECT channel_id, month, path, message_count, first_timestamp, last_timestamp, thread_ids
+                        FROM archive_manifest ORDER BY channel_id, month
+                    """).fetchall()
+                self._entries = [
+                    ArchiveEntry(*row[:6], thread_ids=json.loads(row[6] or '[]')) for row in rows
+                ]
+            return self._entries
+
+    def find_entries(
+        self,
+        channel_id: Optional[str] = None,
+        thread_id: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        month: Optional[str] = None
+    ) -> List[ArchiveEntry]:
+        """条件に合うアーカイブを古い順に返す"""
+        return [
+            entry for entry in self.entries()
+            if (channel_id is None or entry.channel_id == channel_id)
+            and (thread_id is None or thread_id in entry.thread_ids)
+            and (month is None or entry.month == month)
+            and entry.overlaps(since, until)
+        ]
+
+    def horizon(self, channel_id: str) -> Optional[str]:
+        """チャンネルのアーカイブ済みの最後の時刻"""
+        last = [entry.last_timestamp for entry in self.entries() if entry.channel_id == channel_id]
+        return max(last) if last else None
+
+    # --- 読み込み ---
+
+    def read(self, entry: ArchiveEntry) -> Tuple[List[Tuple[str, str]], List[dict]]:
+        """アーカイブを読み込む（並び順のキーとレコード、直近に読んだファイルはメモリに残す）"""
+        with self._lock:
+            cached = self._files.get(entry.path)
+            if cached is not None:
+                self._files.move_to_end(entry.path)
+                return cached
+
+        records = list(self._read_records(os.path.join(self.archive_dir, entry.path)))
+        loaded = ([sort_key(record) for record in records], records)
+        with self._lock:
+            self._files[entry.path] = loaded
+            while len(self._files) > self.cache_files:
+                self._files.popitem(last=False)
+        return loaded
+
+    def memory_items(self) -> Tuple[int, List[dict]]:
+        """メモリに残しているアーカイブのレコード数と、その要素（メモリ使用量の概算用）"""
+        with self._lock:
+            records = [record for _, file_records in self._files.values() for record in file_records]
+        return len(records), records
+
+    def scan(
+        self,
+        entries: List[ArchiveEntry],
+        predicate: Callable[[dict], bool],
+        after: Optional[Tuple[str, str]] = None,
+        limit: Optional[int] = None
+    ) -> List[dict]:
+        """アーカイブを古い順に走査し、after より後で条件に合うレコードを返す"""
+        result = []
+        for entry in entries:
+            keys, records = self.read(entry)
+            start = bisect.bisect_right(keys, after) if after else 0
+            for record in records[start:]:
+                if record.get('deleted_at') or not predicate(record):
+                    continue
+                result.append(record)
+                if limit is not None and len(result) >= limit:
+                    return result
+        return result
+
+    def scan_newest(self, entries: List[ArchiveEntry], predicate: Callable[[dict], bool], limit: int) -> List[dict]:
+        """アーカイブを新しい順に走査"""
+        result = []
+        for entry in reversed(entries):
+            _, records = self.read(entry)
+            for record in reversed(records):
+                if record.get('deleted_at') or not predicate(record):
+                    continue
+                result.append(record)
+                if len(result) >= limit:
+                    return result
+        return result
+
+    def find_message(self, message_id: str) -> Optional[dict]:
+        """IDからアーカイブ済みのメッセージを探す（Discord のスノーフレークIDのみ対応）"""
+        if not message_id.isdigit():
+            return None
+        created = datetime.utcfromtimestamp(((int(message_id) >> 22) + DISCORD_EPOCH_MS) / 1000)
+        for entry in self.find_entries(month=created.strftime('%Y-%m')):
+            for record in self.read(entry)[1]:
+                if record['id'] == message_id:
+                    return record
+        return None
+
+    def _read_records(self, path: str) -> Iterator[dict]:
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f"{path} を読むには zstandard パッケージが必要です")
+            with open(path, 'rb') as raw:
+                reader = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw), encoding='utf-8')
+                for line in reader:
+                    yield json.loads(line)
+        else:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)
+
+    # --- 書き込み ---
+
+    def write(self, channel_id: str, month: str, records: List[dict]) -> ArchiveEntry:
+        """チャンネル・月のアーカイブに追加（既存のファイルとIDで統合して書き直す）"""
+        extension = '.jsonl.zst' if self.compression == 'zstd' else '.jsonl.gz'
+        relative = os.path.join(channel_id, f"{month}{extension}")
+        path = os.path.join(self.archive_dir, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        existing = next((entry for entry in self.entries() if entry.channel_id == channel_id and entry.month == month), None)
+        merged: Dict[str, dict] = {}
+        if existing:
+            for record in self._read_records(os.path.join(self.archive_dir, existing.path)):
+                merged[record['id']] = record
+        for record in records:
+            merged[record['id']] = record
+        ordered = sorted(merged.values(), key=sort_key)
+
+        # 書き終えてから差し替える（途中で止まっても既存のアーカイブを壊さない）
+        temporary = path + '.tmp'
+        if self.compression == 'zstd':
+            with open(temporary, 'wb') as raw:
+                with zstandard.ZstdCompressor(level=10).stream_writer(raw) as compressed:
+                    for record in ordered:
+                        compressed.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        else:
+            with gzip.open(temporary, 'wt', encoding='utf-8', compresslevel=6) as f:
+                for record in ordered:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(temporary, path)
+        if existing and existing.path != relative:
+            os.remove(os.path.join(self.archive_dir, existing.path))
+
+        with self._lock:
+            self._files.pop(relative, None)
+            if existing:
+                self._files.pop(existing.path, None)
+
+        return ArchiveEntry(
+            channel_id=channel_id,
+            month=month,
+            path=relative,
+            message_count=len(ordered),
+            first_timestamp=ordered[0]['timestamp'],
+            last_timestamp=ordered[-1]['timestamp'],
+            thread_ids=sorted({record['thread_id'] for record in ordered if record.get('thread_id')})
+        )
+
+    def invalidate(self) -> None:
+        """マニフェストを読み直す"""
+        with self._lock:
+            self._entries = None
+
+
+def record_to_message(record: dict) -> Message:
+    """アーカイブのレコードを Message に変換"""
+    return Message(
+        id=record['id'],
+        channel_id=record['channel_id'],
+        channel_name=record['channel_name'],
+        user=User(
+            id=record['user_id'],
+            username=record.get('username') or '',
+            display_name=record.get('display_name') or '',
+            roles=list(_parse_roles(record.get('roles') or '[]'))
+        ),
+        content=record['content'],
+        timestamp=datetime.fromisoformat(record['timestamp']),
+        reactions=record.get('reactions') or [],
+        is_question=bool(record.get('is_question')),
+        thread_id=record.get('thread_id'),
+        edited_at=datetime.fromisoformat(record['edited_at']) if record.get('edited_at') else None,
+        acknowledged=bool(record.get('acknowledged')),
+        # 特徴の列を追加する前のアーカイブには特徴がない
+        features=_row_to_features({**dict.fromkeys(FEATURE_COLUMN_NAMES), **record})
+    )
+
+
+class MessageArchiver:
+    """指定日時より古いメッセージをアーカイブに移し、DB から削除する"""
+
+    def __init__(self, store: ArchiveStore):
+        self.store = store
+        self.logger = logging.getLogger(__name__)
+
+    async def archive_older_than(self, days: int) -> ArchiveResult:
+        """days 日より古いメッセージをアーカイブ（DB への書き込みはスレッドで実行）"""
+        cutoff = clock.to_db_timestamp(clock.now() - timedelta(days=days))
+        return await asyncio.to_thread(self._archive, cutoff)
+
+    def _archive(self, cutoff: str) -> ArchiveResult:
+        started = time.perf_counter()
+        result = ArchiveResult()
+
+        with sqlite3.connect(self.store.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            groups = conn.execute("""
+                SELECT channel_id, substr(timestamp, 1, 7) AS month
+                FROM messages WHERE timestamp < ?
+                GROUP BY channel_id, month
+                ORDER BY channel_id, month
+            """, (cutoff,)).fetchall()
+
+            for group in groups:
+                rows = conn.execute(ARCHIVE_SELECT + """
+                    WHERE m.channel_id = ? AND m.timestamp < ? AND substr(m.timestamp, 1, 7) = ?
+                    ORDER BY m.timestamp, m.id
+                """, (group['channel_id'], cutoff, group['month'])).fetchall()
+                if not rows:
+                    continue
+
+                records = [self._row_to_record(row) for row in rows]
+                entry = self.store.write(group['channel_id'], group['month'], records)
+
+                # ファイルを書き終えてから、マニフェストの更新と削除を1トランザクションで行う
+                message_ids = [record['id'] for record in records]
+                with conn:
+                    conn.execute("""
+                        INSERT INTO archive_manifest
+                        (channel_id, month, path, message_count, first_timestamp, last_timestamp, thread_ids, archived_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (channel_id, month) DO UPDATE SET
+                            path = excluded.path,
+                            message_count = excluded.message_count,
+                            first_timestamp = excluded.first_timestamp,
+                            last_timestamp = excluded.last_timestamp,
+                            thread_ids = excluded.thread_ids,
+                            archived_at = excluded.archived_at
+                    """, (
+                        entry.channel_id, entry.month, entry.path, entry.message_count,
+                        entry.first_timestamp, entry.last_timestamp, json.dumps(entry.thread_ids),
+                        clock.to_db_timestamp(clock.now())
+                    ))
+                    for chunk in _chunks(message_ids):
+                        placeholders = ", ".join("?" * len(chunk))
+                        conn.execute(f"DELETE FROM message_reactions WHERE message_id IN ({placeholders})", chunk)
+                        conn.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", chunk)
+                self.store.invalidate()
+
+                result.files += 1
+                result.messages += len(records)
+
+        result.seconds = time.perf_counter() - started
+        return result
+
+    @staticmethod
+    def _row_to_record(row) -> dict:
+        return {
+            'id': row['id'],
+            'channel_id': row['channel_id'],
+            'channel_name': row['channel_name'],
+            'user_id': row['user_id'],
+            'username': row['username'],
+            'display_name': row['display_name'],
+            'roles': row['roles'],
+            'content': row['content'],
+            'timestamp': row['timestamp'],
+            'reactions': _parse_json_list(row['reaction_list']) or _parse_json_list(row['reactions']),
+            'acknowledged': bool(row['acknowledged']),
+            'is_question': bool(row['is_question']),
+            **{column: row[column] for column in FEATURE_COLUMN_NAMES},
+            'thread_id': row['thread_id'],
+            'edited_at': row['edited_at'],
+            'deleted_at': row['deleted_at']
+        }
+
+
+class ArchiveAwareMessageRepository(DelegatingMessageRepository):
+    """読み込みがアーカイブ済みの範囲に及ぶときだけアーカイブも合わせて返す MessageRepository"""
+
+    def __init__(self, backend: MessageRepository, store: ArchiveStore):
+        super().__init__(backend)
+        self.store = store
+
+    async def get_message(self, message_id: str) -> Optional[Message]:
+        message = await self.backend.get_message(message_id)
+        if message is None:
+            record = await asyncio.to_thread(self.store.find_message, message_id)
+            if record and not record.get('deleted_at'):
+                message = record_to_message(record)
+        return message
+
+    async def get_messages(self, message_ids: List[str]) -> Dict[str, Message]:
+        messages = await self.backend.get_messages(message_ids)
+        for message_id in message_ids:
+            if message_id not in messages:
+                message = await self.get_message(message_id)
+                if message:
+                    messages[message_id] = message
+        return messages
+
+    async def get_channel_messages(self, channel_id: str, limit: int = 100) -> List[Message]:
+        messages = await self.backend.get_channel_messages(channel_id, limit)
+        return await self._fill_newest(messages, limit, self.store.find_entries(channel_id=channel_id),
+                                       lambda record: True)
+
+    async def get_thread_messages(self, thread_id: str, limit: int = 100) -> List[Message]:
+        messages = await self.backend.get_thread_messages(thread_id, limit)
+        return await self._fill_newest(messages, limit, self.store.find_entries(thread_id=thread_id),
+                                       lambda record: record.get('thread_id') == thread_id)
+
+    async def get_messages_page(
+        self,
+        channel_id: Optional[str] = None,
+        thread_id: Optional[str] = None,
+        after: Optional[MessageCursor] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 500
+    ) -> List[Message]:
+        """DB とアーカイブのページを (時刻, ID) 順に統合"""
+        hot = await self.backend.get_messages_page(channel_id, thread_id, after, since, until, limit)
+        since_key = clock.to_db_timestamp(since) if since else None
+        until_key = clock.to_db_timestamp(until) if until else None
+        after_key = (str(after.timestamp), after.message_id) if after else None
+
+        entries = self.store.find_entries(
+            channel_id=channel_id, thread_id=thread_id,
+            since=max(filter(None, [since_key, after_key and after_key[0]]), default=None), until=until_key
+        )
+        if not entries:
+            return hot
+
+        def matches(record: dict) -> bool:
+            return ((channel_id is None or record['channel_id'] == channel_id) and
+                    (thread_id is None or record.get('thread_id') == thread_id) and
+                    (since_key is None or record['timestamp'] >= since_key) and
+                    (until_key is None or record['timestamp'] < until_key))
+
+        records = await asyncio.to_thread(self.store.scan, entries, matches, after_key, limit)
+        archived = [record_to_message(record) for record in records]
+        merged = heapq.merge(archived, hot, key=lambda message: (str(message.timestamp), message.id))
+        return [message for _, message in zip(range(limit), merged)]
+
+    async def get_recent_messages(self, channel_id: str, hours: int = 24) -> List[Message]:
+        since = clock.hours_ago(hours)
+        if not self._reaches_archive(channel_id, since):
+            return await self.backend.get_recent_messages(channel_id, hours)
+        return [message async for message in self.iter_channel_messages(channel_id, since=since)]
+
+    async def get_recent_messages_for_channels(
+        self, channel_ids: List[str], hours: int = 24
+    ) -> Dict[str, List[Message]]:
+        grouped = await self.backend.get_recent_messages_for_channels(channel_ids, hours)
+        since = clock.hours_ago(hours)
+        for channel_id in channel_ids:
+            if self._reaches_archive(channel_id, since):
+                grouped[channel_id] = [
+                    message async for message in self.iter_channel_messages(channel_id, since=since)
+                ]
+        return grouped
+
+    async def get_recent_thread_messages(self, thread_id: str, hours: int = 24) -> List[Message]:
+        since = clock.hours_ago(hours)
+        if not self.store.find_entries(thread_id=thread_id, since=clock.to_db_timestamp(since)):
+            return await self.backend.get_recent_thread_messages(thread_id, hours)
+        return [message async for message in self.iter_thread_messages(thread_id, since=since)]
+
+    async def get_session_messages(self, session: Session) -> List[Message]:
+        messages = await self.backend.get_session_messages(session)
+        if not self._reaches_archive(session.channel_id, session.started_at):
+            return messages
+
+        started = clock.to_db_timestamp(session.started_at - timedelta(seconds=1))
+        ended = clock.to_db_timestamp(session.ended_at + timedelta(seconds=1))
+        entries = self.store.find_entries(channel_id=session.channel_id, since=started)
+        records = await asyncio.to_thread(
+            self.store.scan, entries,
+            lambda record: (record.get('thread_id') == session.thread_id and
+                            started <= record['timestamp'] <= ended)
+        )
+        archived = [
+            message for message in map(record_to_message, records)
+            if session.started_at <= clock.as_utc(message.timestamp) <= session.ended_at
+        ]
+        known = {message.id for message in messages}
+        return sorted(
+            [message for message in archived if message.id not in known] + messages,
+            key=lambda message: (str(message.timestamp), message.id)
+        )
+
+    def _reaches_archive(self, channel_id: str, since: datetime) -> bool:
+        horizon = self.store.horizon(channel_id)
+        return horizon is not None and horizon >= clock.to_db_timestamp(since)
+
+    async def _fill_newest(
+        self, messages: List[Message], limit: int, entries: List[ArchiveEntry], predicate
+    ) -> List[Message]:
+        """新しい順の結果が limit に足りなければアーカイブから補う"""
+        if len(messages) >= limit or not entries:
+            return messages
+        oldest = (str(messages[-1].timestamp), messages[-1].id) if messages else None
+        records = await asyncio.to_thread(
+            self.store.scan_newest, entries,
+            lambda record: predicate(record) and (oldest is None or sort_key(record) < oldest),
+            limit - len(messages)
+        )
+        return messages + [record_to_message(record) for record in records]
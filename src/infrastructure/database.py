@@ -1,15 +1,26 @@
 """
 データベース実装（SQLite）
 """
+import asyncio
 import sqlite3
+import threading
 import aiosqlite
-from typing import List, Optional
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
 import json
 import logging
 
-from ..domain.entities import Message, User, Alert, Channel, UserRole
-from ..domain.repositories import MessageRepository, UserRepository, AlertRepository
+from ..domain import clock
+from ..domain.entities import (
+    Message, MessageFeatures, User, Alert, Channel, UserRole, Session, ActivityBucket, StudentActivity
+)
+from ..domain.features import FEATURES_VERSION, FeatureExtractor
+from ..domain.repositories import (
+    MessageRepository, UserRepository, AlertRepository, SessionRepository, RollupRepository,
+    StudentActivityRepository, MessageCursor
+)
 
 
 class DatabaseManager:
@@ -22,6 +33,11 @@ class DatabaseManager:
     async def initialize_database(self):
         """データベースを初期化"""
         async with aiosqlite.connect(self.db_path) as db:
+            # 新規作成時のみ有効（既存のDBは VACUUM するまで切り替わらないので、他の設定より先に行う）
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            # 読み込み・バックアップ中も書き込めるよう WAL にする（設定はファイルに残る）
+            await db.execute("PRAGMA journal_mode = WAL")
+            
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     id TEXT PRIMARY KEY,
@@ -32,6 +48,11 @@ class DatabaseManager:
                 )
             """)
             
+            # 名簿の同期で変更のないユーザーの書き込みを省くためのハッシュ
+            await self._ensure_columns(db, "users", {
+                "role_hash": "TEXT"
+            })
+            
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS messages (
                     id TEXT PRIMARY KEY,
@@ -43,11 +64,38 @@ class DatabaseManager:
                     reactions TEXT,
                     is_question BOOLEAN DEFAULT FALSE,
                     thread_id TEXT,
+                    edited_at TIMESTAMP,
+                    deleted_at TIMESTAMP,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users (id)
                 )
             """)
             
+            # 既存DBへの列追加
+            await self._ensure_columns(db, "messages", {
+                "edited_at": "TIMESTAMP",
+                "deleted_at": "TIMESTAMP",
+                # 取り込み時に求める本文の特徴（features_version が古い・空の行は埋め直しの対象）
+                "question_score": "REAL",
+                "has_code_block": "BOOLEAN",
+                "mention_count": "INTEGER",
+                "url_count": "INTEGER",
+                "content_length": "INTEGER",
+                "features_version": "INTEGER"
+            })
+            
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS message_reactions (
+                    message_id TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    emoji TEXT NOT NULL,
+                    is_staff BOOLEAN DEFAULT FALSE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (message_id, user_id, emoji),
+                    FOREIGN KEY (message_id) REFERENCES messages (id)
+                )
+            """)
+            
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS alerts (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -61,9 +109,25 @@ class DatabaseManager:
                 )
             """)
             
+            # (時刻, ID) のキーセットページングで並べ替えが不要になるよう ID まで含める
+            await db.execute("DROP INDEX IF EXISTS idx_messages_channel_timestamp")
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_channel_timestamp_id
+                ON messages (channel_id, timestamp, id)
+            """)
+            
+            await db.execute("DROP INDEX IF EXISTS idx_messages_thread_timestamp")
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_thread_timestamp_id
+                ON messages (thread_id, timestamp, id)
+                WHERE thread_id IS NOT NULL
+            """)
+            
+            # チャンネルの質問だけを時刻順に引く
             await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_messages_channel_timestamp 
+                CREATE INDEX IF NOT EXISTS idx_messages_channel_questions
                 ON messages (channel_id, timestamp)
+                WHERE is_question
             """)
             
             await db.execute("""
@@ -71,8 +135,265 @@ class DatabaseManager:
                 ON alerts (created_at)
             """)
             
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel_id TEXT NOT NULL,
+                    thread_id TEXT,
+                    started_at TIMESTAMP NOT NULL,
+                    ended_at TIMESTAMP NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    participants TEXT NOT NULL DEFAULT '[]',
+                    turns INTEGER NOT NULL DEFAULT 0,
+                    last_speaker_side TEXT,
+                    last_message_id TEXT,
+                    first_student_message_id TEXT,
+                    first_student_at TIMESTAMP,
+                    first_staff_reply_id TEXT,
+                    first_staff_reply_at TIMESTAMP,
+                    first_staff_reply_user_id TEXT,
+                    pending_question_id TEXT,
+                    pending_question_at TIMESTAMP
+                )
+            """)
+            
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sessions_channel_ended 
+                ON sessions (channel_id, thread_id, ended_at)
+            """)
+            
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_sessions_pending 
+                ON sessions (channel_id, pending_question_at)
+                WHERE pending_question_id IS NOT NULL
+            """)
+            
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS activity_rollups (
+                    granularity TEXT NOT NULL,
+                    bucket_start TEXT NOT NULL,
+                    channel_id TEXT NOT NULL,
+                    side TEXT NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    question_count INTEGER NOT NULL DEFAULT 0,
+                    answered_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (granularity, bucket_start, channel_id, side)
+                ) WITHOUT ROWID
+            """)
+            
+            # 生徒側のユーザー・チャンネルごとの活動（取り込み時に更新し、メッセージを走査せずに引く）
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS student_activity (
+                    user_id TEXT NOT NULL,
+                    channel_id TEXT NOT NULL,
+                    last_post_at TEXT NOT NULL,
+                    last_message_id TEXT NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    open_questions INTEGER NOT NULL DEFAULT 0,
+                    last_staff_reply_at TEXT,
+                    PRIMARY KEY (user_id, channel_id)
+                ) WITHOUT ROWID
+            """)
+            
+            # 運営側の発言の反映（チャンネル内でその時刻より前に発言した生徒）とチャンネルごとの非活動の検索
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_student_activity_channel_last_post
+                ON student_activity (channel_id, last_post_at)
+            """)
+            
+            # 全チャンネルの非活動の検索
+            await db.execute("""
+                CREATE INDEX IF NOT EXISTS idx_student_activity_last_post
+                ON student_activity (last_post_at)
+            """)
+            
+            # アーカイブ済みのメッセージ（チャンネル・月ごとの圧縮ファイル）の索引
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS archive_manifest (
+                    channel_id TEXT NOT NULL,
+                    month TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    message_count INTEGER NOT NULL,
+                    first_timestamp TEXT NOT NULL,
+                    last_timestamp TEXT NOT NULL,
+                    thread_ids TEXT NOT NULL DEFAULT '[]',
+                    archived_at TEXT NOT NULL,
+                    PRIMARY KEY (channel_id, month)
+                )
+            """)
+            
+            # OpenAI Batch API で実行する一括分析のジョブ（途中から再開するための進み具合）
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_batches (
+                    job_key TEXT PRIMARY KEY,
+                    day TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    request_count INTEGER NOT NULL DEFAULT 0,
+                    input_path TEXT,
+                    input_file_id TEXT,
+                    batch_id TEXT,
+                    output_file_id TEXT,
+                    processed_lines INTEGER NOT NULL DEFAULT 0,
+                    alert_count INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            
+            # シャーディング時のチャンネル・スレッドとシャードの対応（シャード0のファイルだけで使う）
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS shard_directory (
+                    key TEXT PRIMARY KEY,
+                    shard INTEGER NOT NULL,
+                    guild_id TEXT
+                )
+            """)
+            
+            await self._ensure_unique_alerts(db)
+            
             await db.commit()
             self.logger.info("データベース初期化完了")
+    
+    async def _ensure_unique_alerts(self, db) -> None:
+        """同じメッセージ・種別のアラートを1件にまとめ、一意インデックスを作成"""
+        cursor = await db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_alerts_message_type'"
+        )
+        if await cursor.fetchone():
+            return
+        
+        await db.execute("""
+            DELETE FROM alerts WHERE id NOT IN (
+                SELECT MIN(id) FROM alerts GROUP BY message_id, alert_type
+            )
+        """)
+        await db.execute("""
+            CREATE UNIQUE INDEX idx_alerts_message_type 
+            ON alerts (message_id, alert_type)
+        """)
+    
+    async def _ensure_columns(self, db, table: str, columns: Dict[str, str]) -> None:
+        """不足している列を追加"""
+        cursor = await db.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in await cursor.fetchall()}
+        
+        for name, definition in columns.items():
+            if name not in existing:
+                await db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                self.logger.info("%s.%s 列を追加しました", table, name)
+
+
+class SQLiteWriter:
+    """DBファイルごとに1本だけ持つ書き込み用の接続
+
+    メッセージごとに発生する書き込みは、接続を毎回開くと接続の準備が処理時間の大半を占めるため、
+    ファイルごとの専用スレッドで開いたままの接続に順に流す（同じファイルへの書き込みどうしのロック待ちもなくなる）。
+    読み込みは従来どおり呼び出しごとの接続で行う（WAL なので書き込みを待たない）。
+    """
+    
+    _writers: Dict[str, "SQLiteWriter"] = {}
+    _writers_lock = threading.Lock()
+    
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._connection: Optional[sqlite3.Connection] = None
+    
+    @classmethod
+    def for_path(cls, db_path: str) -> "SQLiteWriter":
+        """ファイルの書き込み用接続を取得（同じファイルのリポジトリ間で共有する）"""
+        with cls._writers_lock:
+            writer = cls._writers.get(db_path)
+            if writer is None:
+                writer = cls._writers[db_path] = cls(db_path)
+            return writer
+    
+    async def run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """書き込み用スレッドで func(接続) を1トランザクションとして実行"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._run, func)
+    
+    async def execute(self, sql: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        """1文だけの書き込み"""
+        return await self.run(lambda conn: conn.execute(sql, parameters))
+    
+    def _run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        with self._connection:
+            return func(self._connection)
+
+
+# 本文の特徴の列（MessageFeatures と同じ順）
+FEATURE_COLUMN_NAMES = (
+    "question_score", "has_code_block", "mention_count", "url_count", "content_length", "features_version"
+)
+FEATURE_COLUMNS = ", ".join(FEATURE_COLUMN_NAMES)
+FEATURE_ASSIGNMENTS = ", ".join(f"{column} = ?" for column in FEATURE_COLUMN_NAMES)
+
+
+def _feature_values(features: MessageFeatures, version: int = FEATURES_VERSION) -> tuple:
+    return (
+        features.question_score, features.has_code_block, features.mention_count,
+        features.url_count, features.length, version
+    )
+
+
+def _row_to_features(row) -> MessageFeatures:
+    """保存済みの特徴（埋め直し前の行は質問フラグと本文の長さから補う）"""
+    if row['features_version'] is None:
+        return MessageFeatures(question_score=1.0 if row['is_question'] else 0.0, length=len(row['content']))
+    return MessageFeatures(
+        question_score=row['question_score'],
+        has_code_block=bool(row['has_code_block']),
+        mention_count=row['mention_count'],
+        url_count=row['url_count'],
+        length=row['content_length']
+    )
+
+
+# メッセージ取得用の共通SELECT（リアクションは正規化テーブルから集約）
+MESSAGE_SELECT = """
+    SELECT m.*, u.username, u.display_name, u.roles,
+        (SELECT json_group_array(DISTINCT r.emoji)
+         FROM message_reactions r WHERE r.message_id = m.id) AS reaction_list,
+        EXISTS (SELECT 1 FROM message_reactions r
+                WHERE r.message_id = m.id AND r.is_staff) AS acknowledged
+    FROM messages m
+    JOIN users u ON m.user_id = u.id
+"""
+
+
+ROLE_VALUES = frozenset(role.value for role in UserRole)
+
+
+@lru_cache(maxsize=256)
+def _parse_roles(roles_json: str) -> Tuple[UserRole, ...]:
+    """ロールのJSONをパース（同じ組み合わせが繰り返し現れるのでキャッシュする）"""
+    try:
+        return tuple(UserRole(role) for role in json.loads(roles_json) if role in ROLE_VALUES)
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return (UserRole.STUDENT,)
+
+
+def _parse_json_list(value: Optional[str]) -> list:
+    """JSON配列の列をパース（空・不正な値は空リスト）"""
+    if not value or value == '[]':
+        return []
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return []
+
+
+# IN 句に渡すパラメータ数の上限（SQLite の変数上限より十分小さくする）
+IN_CLAUSE_CHUNK_SIZE = 500
+
+
+def _chunks(items: List[str], size: int = IN_CLAUSE_CHUNK_SIZE):
+    """リストを指定件数ごとに分割"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 
 class SQLiteMessageRepository(MessageRepository):
@@ -81,36 +402,89 @@ class SQLiteMessageRepository(MessageRepository):
     def __init__(self, db_path: str = "lesson_logs.db"):
         self.db_path = db_path
     
-    async def save_message(self, message: Message) -> None:
-        """メッセージを保存"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT OR REPLACE INTO messages 
-                (id, channel_id, channel_name, user_id, content, timestamp, reactions, is_question, thread_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    async def save_message(self, message: Message) -> bool:
+        """メッセージを保存（新規に保存された場合は True）"""
+        return await SQLiteWriter.for_path(self.db_path).run(lambda db: self._save_message(db, message))
+    
+    @staticmethod
+    def _save_message(db: sqlite3.Connection, message: Message) -> bool:
+        # 特徴が未計算のメッセージは空のまま保存し、埋め直しの対象にする
+        features = _feature_values(message.features) if message.features else (None,) * len(FEATURE_COLUMN_NAMES)
+        cursor = db.execute(f"""
+            INSERT OR IGNORE INTO messages 
+            (id, channel_id, channel_name, user_id, content, timestamp, is_question, thread_id, {FEATURE_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            message.id,
+            message.channel_id,
+            message.channel_name,
+            message.user.id,
+            message.content,
+            message.timestamp,
+            message.is_question,
+            message.thread_id,
+            *features
+        ))
+        inserted = cursor.rowcount > 0
+        
+        # 編集・削除の記録を消さないよう、既存行は本文などのみ更新する
+        if not inserted:
+            db.execute(f"""
+                UPDATE messages SET channel_name = ?, content = ?, is_question = ?, thread_id = ?, {FEATURE_ASSIGNMENTS}
+                WHERE id = ?
             """, (
-                message.id,
-                message.channel_id,
                 message.channel_name,
-                message.user.id,
                 message.content,
-                message.timestamp,
-                json.dumps(message.reactions),
                 message.is_question,
-                message.thread_id
+                message.thread_id,
+                *features,
+                message.id
             ))
-            await db.commit()
+        
+        # 取得時点のリアクション（付けたユーザーは不明）
+        if message.reactions:
+            db.executemany("""
+                INSERT OR IGNORE INTO message_reactions (message_id, user_id, emoji)
+                VALUES (?, '', ?)
+            """, [(message.id, emoji) for emoji in message.reactions])
+        
+        return inserted
+    
+    async def get_message(self, message_id: str) -> Optional[Message]:
+        """メッセージを1件取得"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            
+            cursor = await db.execute(MESSAGE_SELECT + """
+                WHERE m.id = ?
+            """, (message_id,))
+            
+            row = await cursor.fetchone()
+            return self._row_to_message(row) if row else None
+    
+    async def get_messages(self, message_ids: List[str]) -> Dict[str, Message]:
+        """複数のメッセージをまとめて取得"""
+        messages: Dict[str, Message] = {}
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            for chunk in _chunks(list(dict.fromkeys(message_ids))):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = await db.execute(MESSAGE_SELECT + f"""
+                    WHERE m.id IN ({placeholders})
+                """, chunk)
+                for row in await cursor.fetchall():
+                    message = self._row_to_message(row)
+                    messages[message.id] = message
+        return messages
     
     async def get_channel_messages(self, channel_id: str, limit: int = 100) -> List[Message]:
         """チャンネルのメッセージを取得"""
         async with aiosqlite.connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             
-            cursor = await db.execute("""
-                SELECT m.*, u.username, u.display_name, u.roles
-                FROM messages m
-                JOIN users u ON m.user_id = u.id
+            cursor = await db.execute(MESSAGE_SELECT + """
                 WHERE m.channel_id = ?
+                AND m.deleted_at IS NULL
                 ORDER BY m.timestamp DESC
                 LIMIT ?
             """, (channel_id, limit))
@@ -118,45 +492,206 @@ class SQLiteMessageRepository(MessageRepository):
             rows = await cursor.fetchall()
             return [self._row_to_message(row) for row in rows]
     
+    async def get_messages_page(
+        self,
+        channel_id: Optional[str] = None,
+        thread_id: Optional[str] = None,
+        after: Optional[MessageCursor] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 500
+    ) -> List[Message]:
+        """(時刻, ID) 順で after より後のメッセージを取得（OFFSET を使わないので深いページも一定の速さ）"""
+        conditions = ["m.deleted_at IS NULL"]
+        params: list = []
+        if channel_id is not None:
+            conditions.append("m.channel_id = ?")
+            params.append(channel_id)
+        if thread_id is not None:
+            conditions.append("m.thread_id = ?")
+            params.append(thread_id)
+        if since is not None:
+            conditions.append("m.timestamp >= ?")
+            params.append(clock.to_db_timestamp(since))
+        if until is not None:
+            conditions.append("m.timestamp < ?")
+            params.append(clock.to_db_timestamp(until))
+        if after is not None:
+            # 時刻は保存時と同じ文字列表現で比較する
+            conditions.append("(m.timestamp, m.id) > (?, ?)")
+            params.extend([str(after.timestamp), after.message_id])
+        params.append(limit)
+        
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(
+                MESSAGE_SELECT + " WHERE " + " AND ".join(conditions) +
+                " ORDER BY m.timestamp ASC, m.id ASC LIMIT ?",
+                params
+            )
+            rows = await cursor.fetchall()
+            return [self._row_to_message(row) for row in rows]
+    
     async def get_recent_messages(self, channel_id: str, hours: int = 24) -> List[Message]:
         """最近のメッセージを取得"""
         async with aiosqlite.connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
             
-            cursor = await db.execute("""
-                SELECT m.*, u.username, u.display_name, u.roles
-                FROM messages m
-                JOIN users u ON m.user_id = u.id
+            cursor = await db.execute(MESSAGE_SELECT + """
                 WHERE m.channel_id = ? 
-                AND m.timestamp > datetime('now', '-{} hours')
+                AND m.timestamp > ?
+                AND m.deleted_at IS NULL
+                ORDER BY m.timestamp ASC
+            """, (channel_id, clock.to_db_timestamp(clock.hours_ago(hours))))
+            
+            rows = await cursor.fetchall()
+            return [self._row_to_message(row) for row in rows]
+    
+    async def get_recent_messages_for_channels(
+        self, channel_ids: List[str], hours: int = 24
+    ) -> Dict[str, List[Message]]:
+        """複数チャンネルの最近のメッセージをまとめて取得（1接続・IN 句を分割したクエリ）"""
+        since = clock.to_db_timestamp(clock.hours_ago(hours))
+        grouped: Dict[str, List[Message]] = {channel_id: [] for channel_id in channel_ids}
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            for chunk in _chunks(list(grouped)):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = await db.execute(MESSAGE_SELECT + f"""
+                    WHERE m.channel_id IN ({placeholders})
+                    AND m.timestamp > ?
+                    AND m.deleted_at IS NULL
+                    ORDER BY m.channel_id, m.timestamp ASC
+                """, (*chunk, since))
+                for row in await cursor.fetchall():
+                    grouped[row['channel_id']].append(self._row_to_message(row))
+        return grouped
+    
+    async def get_messages_before_for_channels(
+        self, channel_ids: List[str], before: datetime, limit: int
+    ) -> Dict[str, List[Message]]:
+        """複数チャンネルの指定時刻以前の直近 limit 件をまとめて取得（1接続・チャンネルごとにインデックスで末尾から読む）"""
+        until = clock.to_db_timestamp(before)
+        grouped: Dict[str, List[Message]] = {}
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            for channel_id in channel_ids:
+                cursor = await db.execute(MESSAGE_SELECT + """
+                    WHERE m.channel_id = ?
+                    AND m.timestamp <= ?
+                    AND m.deleted_at IS NULL
+                    ORDER BY m.timestamp DESC, m.id DESC
+                    LIMIT ?
+                """, (channel_id, until, limit))
+                rows = await cursor.fetchall()
+                grouped[channel_id] = [self._row_to_message(row) for row in reversed(rows)]
+        return grouped
+    
+    async def get_thread_messages(self, thread_id: str, limit: int = 100) -> List[Message]:
+        """スレッドのメッセージを取得"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            
+            cursor = await db.execute(MESSAGE_SELECT + """
+                WHERE m.thread_id = ?
+                AND m.deleted_at IS NULL
+                ORDER BY m.timestamp DESC
+                LIMIT ?
+            """, (thread_id, limit))
+            
+            rows = await cursor.fetchall()
+            return [self._row_to_message(row) for row in rows]
+    
+    async def get_recent_thread_messages(self, thread_id: str, hours: int = 24) -> List[Message]:
+        """スレッドの最近のメッセージを取得"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            
+            cursor = await db.execute(MESSAGE_SELECT + """
+                WHERE m.thread_id = ?
+                AND m.timestamp > ?
+                AND m.deleted_at IS NULL
                 ORDER BY m.timestamp ASC
-            """.format(hours), (channel_id,))
+            """, (thread_id, clock.to_db_timestamp(clock.hours_ago(hours))))
             
             rows = await cursor.fetchall()
             return [self._row_to_message(row) for row in rows]
     
+    async def get_session_messages(self, session: Session) -> List[Message]:
+        """セッションに含まれるメッセージを取得"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            
+            # 保存形式の違いによる取りこぼしを防ぐため範囲を1秒広げ、Python側で絞り込む
+            cursor = await db.execute(MESSAGE_SELECT + """
+                WHERE m.channel_id = ?
+                AND m.thread_id IS ?
+                AND m.timestamp >= ? AND m.timestamp <= ?
+                AND m.deleted_at IS NULL
+                ORDER BY m.timestamp ASC
+            """, (
+                session.channel_id,
+                session.thread_id,
+                clock.to_db_timestamp(session.started_at - timedelta(seconds=1)),
+                clock.to_db_timestamp(session.ended_at + timedelta(seconds=1))
+            ))
+            
+            rows = await cursor.fetchall()
+            messages = [self._row_to_message(row) for row in rows]
+            return [
+                message for message in messages
+                if session.started_at <= clock.as_utc(message.timestamp) <= session.ended_at
+            ]
+    
+    async def update_message_content(
+        self, channel_id: str, message_id: str, content: str, features: MessageFeatures, edited_at: datetime
+    ) -> bool:
+        """メッセージ本文を更新"""
+        cursor = await SQLiteWriter.for_path(self.db_path).execute(f"""
+            UPDATE messages SET content = ?, is_question = ?, edited_at = ?, {FEATURE_ASSIGNMENTS}
+            WHERE id = ?
+        """, (content, features.is_question, edited_at, *_feature_values(features), message_id))
+        return cursor.rowcount > 0
+    
+    async def mark_message_deleted(self, channel_id: str, message_id: str, deleted_at: datetime) -> bool:
+        """メッセージを削除済みにする"""
+        cursor = await SQLiteWriter.for_path(self.db_path).execute("""
+            UPDATE messages SET deleted_at = ?
+            WHERE id = ? AND deleted_at IS NULL
+        """, (deleted_at, message_id))
+        return cursor.rowcount > 0
+    
+    async def add_reaction(
+        self, channel_id: str, message_id: str, user_id: str, emoji: str, is_staff: bool
+    ) -> bool:
+        """リアクションを追加"""
+        # 保存対象外のメッセージへのリアクションは記録しない
+        cursor = await SQLiteWriter.for_path(self.db_path).execute("""
+            INSERT OR IGNORE INTO message_reactions (message_id, user_id, emoji, is_staff)
+            SELECT ?, ?, ?, ?
+            WHERE EXISTS (SELECT 1 FROM messages WHERE id = ?)
+        """, (message_id, user_id, emoji, is_staff, message_id))
+        return cursor.rowcount > 0
+    
+    async def remove_reaction(self, channel_id: str, message_id: str, user_id: str, emoji: str) -> bool:
+        """リアクションを削除"""
+        cursor = await SQLiteWriter.for_path(self.db_path).execute("""
+            DELETE FROM message_reactions
+            WHERE message_id = ? AND user_id = ? AND emoji = ?
+        """, (message_id, user_id, emoji))
+        return cursor.rowcount > 0
+    
     def _row_to_message(self, row) -> Message:
         """データベース行をMessageエンティティに変換"""
-        # ユーザーロールをパース
-        roles_json = row['roles']
-        try:
-            role_names = json.loads(roles_json)
-            roles = [UserRole(role) for role in role_names if role in [r.value for r in UserRole]]
-        except (json.JSONDecodeError, ValueError):
-            roles = [UserRole.STUDENT]
-        
         user = User(
             id=row['user_id'],
             username=row['username'],
             display_name=row['display_name'],
-            roles=roles
+            roles=list(_parse_roles(row['roles']))
         )
         
-        # リアクションをパース
-        try:
-            reactions = json.loads(row['reactions']) if row['reactions'] else []
-        except json.JSONDecodeError:
-            reactions = []
+        # リアクションをパース（正規化テーブルになければ旧来のJSON列を参照）
+        reactions = _parse_json_list(row['reaction_list']) or _parse_json_list(row['reactions'])
         
         return Message(
             id=row['id'],
@@ -167,8 +702,41 @@ class SQLiteMessageRepository(MessageRepository):
             timestamp=datetime.fromisoformat(row['timestamp']),
             reactions=reactions,
             is_question=bool(row['is_question']),
-            thread_id=row['thread_id']
+            thread_id=row['thread_id'],
+            edited_at=datetime.fromisoformat(row['edited_at']) if row['edited_at'] else None,
+            acknowledged=bool(row['acknowledged']),
+            features=_row_to_features(row)
         )
+    
+    async def backfill_features(self, extractor: FeatureExtractor, batch_size: int = 2000) -> int:
+        """特徴が未計算・古い版の行を batch_size 件ずつ埋め直す（更新した件数を返す）
+        
+        本文の読み込みは別の接続で、特徴の計算はスレッドで行い、書き込み用の接続は更新の間だけ使う。
+        """
+        writer = SQLiteWriter.for_path(self.db_path)
+        updated = 0
+        last_rowid = 0
+        while True:
+            async with aiosqlite.connect(self.db_path) as db:
+                cursor = await db.execute("""
+                    SELECT rowid, content FROM messages
+                    WHERE rowid > ? AND features_version IS NOT ?
+                    ORDER BY rowid LIMIT ?
+                """, (last_rowid, extractor.version, batch_size))
+                rows = await cursor.fetchall()
+            if not rows:
+                return updated
+            last_rowid = rows[-1][0]
+            
+            features = await asyncio.to_thread(extractor.extract_many, [row[1] for row in rows])
+            parameters = [
+                (item.is_question, *_feature_values(item, extractor.version), row[0])
+                for row, item in zip(rows, features)
+            ]
+            await writer.run(lambda conn: conn.executemany(
+                f"UPDATE messages SET is_question = ?, {FEATURE_ASSIGNMENTS} WHERE rowid = ?", parameters
+            ))
+            updated += len(parameters)
 
 
 class SQLiteUserRepository(UserRepository):
@@ -206,19 +774,42 @@ class SQLiteUserRepository(UserRepository):
     
     async def save_user(self, user: User) -> None:
         """ユーザー情報を保存"""
+        await self.save_users([user])
+    
+    async def save_users(self, users: List[User]) -> int:
+        """ユーザーをまとめて保存（1トランザクション、ロールと名前が変わったユーザーだけ書き込み、その件数を返す）"""
+        if not users:
+            return 0
+        rows = [
+            (user.id, user.username, user.display_name, json.dumps([role.value for role in user.roles]),
+             user.role_hash())
+            for user in users
+        ]
+        
+        def upsert(db: sqlite3.Connection) -> int:
+            # 既存の行は作成日時を残したまま更新する（INSERT OR REPLACE は行を作り直してしまう）
+            cursor = db.executemany("""
+                INSERT INTO users (id, username, display_name, roles, role_hash)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    username = excluded.username,
+                    display_name = excluded.display_name,
+                    roles = excluded.roles,
+                    role_hash = excluded.role_hash
+                WHERE users.role_hash IS NOT excluded.role_hash
+            """, rows)
+            return cursor.rowcount
+        
+        return await SQLiteWriter.for_path(self.db_path).run(upsert)
+    
+    async def get_users(self) -> List[User]:
+        """登録済みのユーザーをすべて取得"""
         async with aiosqlite.connect(self.db_path) as db:
-            roles_json = json.dumps([role.value for role in user.roles])
-            
-            await db.execute("""
-                INSERT OR REPLACE INTO users (id, username, display_name, roles)
-                VALUES (?, ?, ?, ?)
-            """, (
-                user.id,
-                user.username,
-                user.display_name,
-                roles_json
-            ))
-            await db.commit()
+            cursor = await db.execute("SELECT id, username, display_name, roles FROM users")
+            return [
+                User(id=row[0], username=row[1], display_name=row[2], roles=list(_parse_roles(row[3])))
+                for row in await cursor.fetchall()
+            ]
 
 
 class SQLiteAlertRepository(AlertRepository):
@@ -227,22 +818,450 @@ class SQLiteAlertRepository(AlertRepository):
     def __init__(self, db_path: str = "lesson_logs.db"):
         self.db_path = db_path
     
-    async def save_alert(self, alert: Alert) -> None:
-        """アラートを保存"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO alerts (channel_id, message_id, alert_type, description, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                alert.channel.id,
-                alert.message.id,
-                alert.alert_type,
-                alert.description,
-                alert.created_at
-            ))
-            await db.commit()
+    async def save_alert(self, alert: Alert) -> bool:
+        """アラートを保存（同じメッセージ・種別のアラートが既にあれば False）"""
+        cursor = await SQLiteWriter.for_path(self.db_path).execute("""
+            INSERT OR IGNORE INTO alerts (channel_id, message_id, alert_type, description, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (
+            alert.channel.id,
+            alert.message.id,
+            alert.alert_type,
+            alert.description,
+            alert.created_at
+        ))
+        return cursor.rowcount > 0
+    
+    async def save_alerts(self, alerts: List[Alert]) -> List[Alert]:
+        """アラートをまとめて保存（1トランザクション、新規に保存されたものだけを返す）"""
+        if not alerts:
+            return []
+        
+        def insert(db: sqlite3.Connection) -> List[Alert]:
+            saved = []
+            for alert in alerts:
+                cursor = db.execute("""
+                    INSERT OR IGNORE INTO alerts (channel_id, message_id, alert_type, description, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (
+                    alert.channel.id,
+                    alert.message.id,
+                    alert.alert_type,
+                    alert.description,
+                    alert.created_at
+                ))
+                if cursor.rowcount > 0:
+                    saved.append(alert)
+            return saved
+        
+        return await SQLiteWriter.for_path(self.db_path).run(insert)
     
     async def get_unresolved_alerts(self) -> List[Alert]:
         """未解決のアラートを取得"""
         # 簡略化実装
-        return []
\ No newline at end of file
+        return []
+    
+    async def resolve_alerts(self, message_id: str, alert_type: str) -> int:
+        """メッセージに対するアラートを解決済みにする"""
+        cursor = await SQLiteWriter.for_path(self.db_path).execute("""
+            UPDATE alerts SET resolved = TRUE
+            WHERE message_id = ? AND alert_type = ? AND NOT resolved
+        """, (message_id, alert_type))
+        return cursor.rowcount
+
+
+class SQLiteSessionRepository(SessionRepository):
+    """SQLite 会話セッションリポジトリ実装"""
+    
+    def __init__(self, db_path: str = "lesson_logs.db"):
+        self.db_path = db_path
+    
+    async def get_active_session(
+        self, channel_id: str, thread_id: Optional[str], timestamp: datetime, gap: timedelta
+    ) -> Optional[Session]:
+        """指定時刻の前後 gap 以内に続いているセッションを取得"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            
+            cursor = await db.execute("""
+                SELECT * FROM sessions
+                WHERE channel_id = ? AND thread_id IS ?
+                AND ended_at >= ? AND started_at <= ?
+                ORDER BY ended_at DESC
+                LIMIT 1
+            """, (
+                channel_id,
+                thread_id,
+                clock.to_db_timestamp(timestamp - gap),
+                clock.to_db_timestamp(timestamp + gap)
+            ))
+            
+            row = await cursor.fetchone()
+            return self._row_to_session(row) if row else None
+    
+    async def save_session(self, session: Session) -> Session:
+        """セッションを保存"""
+        values = (
+            session.channel_id,
+            session.thread_id,
+            session.started_at,
+            session.ended_at,
+            session.message_count,
+            json.dumps(session.participant_ids),
+            session.turns,
+            session.last_speaker_side,
+            session.last_message_id,
+            session.first_student_message_id,
+            session.first_student_at,
+            session.first_staff_reply_id,
+            session.first_staff_reply_at,
+            session.first_staff_reply_user_id,
+            session.pending_question_id,
+            session.pending_question_at
+        )
+        
+        writer = SQLiteWriter.for_path(self.db_path)
+        if session.id is None:
+            cursor = await writer.execute("""
+                INSERT INTO sessions
+                (channel_id, thread_id, started_at, ended_at, message_count, participants, turns,
+                 last_speaker_side, last_message_id, first_student_message_id, first_student_at,
+                 first_staff_reply_id, first_staff_reply_at, first_staff_reply_user_id,
+                 pending_question_id, pending_question_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, values)
+            session.id = cursor.lastrowid
+        else:
+            await writer.execute("""
+                UPDATE sessions SET
+                    channel_id = ?, thread_id = ?, started_at = ?, ended_at = ?, message_count = ?,
+                    participants = ?, turns = ?, last_speaker_side = ?, last_message_id = ?,
+                    first_student_message_id = ?, first_student_at = ?, first_staff_reply_id = ?,
+                    first_staff_reply_at = ?, first_staff_reply_user_id = ?,
+                    pending_question_id = ?, pending_question_at = ?
+                WHERE id = ?
+            """, values + (session.id,))
+        
+        return session
+    
+    async def get_recent_sessions(self, channel_id: str, hours: int = 24) -> List[Session]:
+        """最近のセッションを取得"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            
+            cursor = await db.execute("""
+                SELECT * FROM sessions
+                WHERE channel_id = ? AND ended_at > ?
+                ORDER BY started_at ASC
+            """, (channel_id, clock.to_db_timestamp(clock.hours_ago(hours))))
+            
+            rows = await cursor.fetchall()
+            return [self._row_to_session(row) for row in rows]
+    
+    async def get_pending_sessions(self, channel_id: str, asked_before: datetime) -> List[Session]:
+        """指定時刻より前の質問が未回答のままのセッションを取得"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            
+            cursor = await db.execute("""
+                SELECT * FROM sessions
+                WHERE channel_id = ? AND pending_question_id IS NOT NULL
+                AND pending_question_at < ?
+                ORDER BY pending_question_at ASC
+            """, (channel_id, clock.to_db_timestamp(asked_before)))
+            
+            rows = await cursor.fetchall()
+            return [self._row_to_session(row) for row in rows]
+    
+    async def get_pending_sessions_for_channels(
+        self, channel_ids: List[str], asked_before: datetime
+    ) -> Dict[str, List[Session]]:
+        """複数チャンネルの未回答のセッションをまとめて取得"""
+        grouped: Dict[str, List[Session]] = {channel_id: [] for channel_id in channel_ids}
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            for chunk in _chunks(list(grouped)):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = await db.execute(f"""
+                    SELECT * FROM sessions
+                    WHERE channel_id IN ({placeholders}) AND pending_question_id IS NOT NULL
+                    AND pending_question_at < ?
+                    ORDER BY pending_question_at ASC
+                """, (*chunk, clock.to_db_timestamp(asked_before)))
+                for row in await cursor.fetchall():
+                    grouped[row['channel_id']].append(self._row_to_session(row))
+        return grouped
+    
+    async def delete_sessions(self, channel_id: str, since: Optional[datetime] = None) -> int:
+        """チャンネルのセッションを削除"""
+        query = "DELETE FROM sessions WHERE channel_id = ?"
+        params = [channel_id]
+        if since is not None:
+            query += " AND started_at >= ?"
+            params.append(clock.to_db_timestamp(since))
+        
+        cursor = await SQLiteWriter.for_path(self.db_path).execute(query, tuple(params))
+        return cursor.rowcount
+    
+    async def acknowledge_question(self, message_id: str) -> None:
+        """質問を確認済みとして未回答状態を解除"""
+        await SQLiteWriter.for_path(self.db_path).execute("""
+            UPDATE sessions SET pending_question_id = NULL, pending_question_at = NULL
+            WHERE pending_question_id = ?
+        """, (message_id,))
+    
+    async def resolve_pending_questions(
+        self, channel_id: str, thread_id: Optional[str], answered_at: datetime, exclude_session_id: Optional[int] = None
+    ) -> int:
+        """運営側の返信より前の未回答の質問を、同じ会話の以前のセッションも含めて解除"""
+        cursor = await SQLiteWriter.for_path(self.db_path).execute("""
+            UPDATE sessions SET pending_question_id = NULL, pending_question_at = NULL
+            WHERE channel_id = ? AND thread_id IS ? AND pending_question_id IS NOT NULL
+            AND pending_question_at <= ? AND id IS NOT ?
+        """, (channel_id, thread_id, clock.to_db_timestamp(answered_at), exclude_session_id))
+        return cursor.rowcount
+    
+    def _row_to_session(self, row) -> Session:
+        """データベース行をSessionエンティティに変換"""
+        def parse(value) -> Optional[datetime]:
+            return clock.as_utc(datetime.fromisoformat(value)) if value else None
+        
+        return Session(
+            id=row['id'],
+            channel_id=row['channel_id'],
+            thread_id=row['thread_id'],
+            started_at=parse(row['started_at']),
+            ended_at=parse(row['ended_at']),
+            message_count=row['message_count'],
+            participant_ids=json.loads(row['participants']),
+            turns=row['turns'],
+            last_speaker_side=row['last_speaker_side'],
+            last_message_id=row['last_message_id'],
+            first_student_message_id=row['first_student_message_id'],
+            first_student_at=parse(row['first_student_at']),
+            first_staff_reply_id=row['first_staff_reply_id'],
+            first_staff_reply_at=parse(row['first_staff_reply_at']),
+            first_staff_reply_user_id=row['first_staff_reply_user_id'],
+            pending_question_id=row['pending_question_id'],
+            pending_question_at=parse(row['pending_question_at'])
+        )
+
+
+class SQLiteRollupRepository(RollupRepository):
+    """SQLite 活動集計リポジトリ実装"""
+    
+    def __init__(self, db_path: str = "lesson_logs.db"):
+        self.db_path = db_path
+    
+    async def record_message(
+        self, channel_id: str, timestamp: datetime, side: str, is_question: bool, answered_questions: int = 0
+    ) -> None:
+        """メッセージ1件分を時間枠の集計に加算"""
+        await SQLiteWriter.for_path(self.db_path).execute("""
+            INSERT INTO activity_rollups
+            (granularity, bucket_start, channel_id, side, message_count, question_count, answered_count)
+            VALUES ('hour', ?, ?, ?, 1, ?, ?)
+            ON CONFLICT (granularity, bucket_start, channel_id, side) DO UPDATE SET
+                message_count = message_count + 1,
+                question_count = question_count + excluded.question_count,
+                answered_count = answered_count + excluded.answered_count
+        """, (
+            self._hour_bucket(timestamp),
+            channel_id,
+            side,
+            int(is_question),
+            answered_questions
+        ))
+    
+    async def get_activity(
+        self, since: datetime, until: datetime, channel_id: Optional[str] = None, granularity: str = "hour"
+    ) -> List[ActivityBucket]:
+        """期間内の集計を取得"""
+        # 日単位では、まだまとめていない時間単位の行も日ごとに合算する
+        bucket_expr = "bucket_start" if granularity == "hour" else "substr(bucket_start, 1, 10) || ' 00:00:00'"
+        query = f"""
+            SELECT {bucket_expr} AS bucket, channel_id, side,
+                   SUM(message_count) AS message_count,
+                   SUM(question_count) AS question_count,
+                   SUM(answered_count) AS answered_count
+            FROM activity_rollups
+            WHERE bucket_start >= ? AND bucket_start < ?
+        """
+        params = [self._hour_bucket(since), clock.to_db_timestamp(until)]
+        if granularity == "hour":
+            query += " AND granularity = 'hour'"
+        if channel_id:
+            query += " AND channel_id = ?"
+            params.append(channel_id)
+        query += " GROUP BY bucket, channel_id, side ORDER BY bucket, channel_id, side"
+        
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(query, params)
+            rows = await cursor.fetchall()
+        
+        return [
+            ActivityBucket(
+                channel_id=row['channel_id'],
+                bucket_start=clock.as_utc(datetime.fromisoformat(row['bucket'])),
+                granularity=granularity,
+                side=row['side'],
+                message_count=row['message_count'],
+                question_count=row['question_count'],
+                answered_count=row['answered_count']
+            )
+            for row in rows
+        ]
+    
+    async def compact(self, before: datetime) -> int:
+        """指定日より前の時間単位の集計を日単位にまとめる"""
+        # 日の途中で区切らないよう、日付の境界に切り下げる
+        cutoff = clock.as_utc(before).strftime('%Y-%m-%d 00:00:00')
+        
+        def merge(db: sqlite3.Connection) -> int:
+            # 日単位への加算と時間単位の削除は同じトランザクションで行う（途中で記録された分を二重に数えない）
+            db.execute("""
+                INSERT INTO activity_rollups
+                (granularity, bucket_start, channel_id, side, message_count, question_count, answered_count)
+                SELECT 'day', substr(bucket_start, 1, 10) || ' 00:00:00', channel_id, side,
+                       SUM(message_count), SUM(question_count), SUM(answered_count)
+                FROM activity_rollups
+                WHERE granularity = 'hour' AND bucket_start < ?
+                GROUP BY substr(bucket_start, 1, 10), channel_id, side
+                ON CONFLICT (granularity, bucket_start, channel_id, side) DO UPDATE SET
+                    message_count = message_count + excluded.message_count,
+                    question_count = question_count + excluded.question_count,
+                    answered_count = answered_count + excluded.answered_count
+            """, (cutoff,))
+            cursor = db.execute("""
+                DELETE FROM activity_rollups
+                WHERE granularity = 'hour' AND bucket_start < ?
+            """, (cutoff,))
+            return cursor.rowcount
+        
+        return await SQLiteWriter.for_path(self.db_path).run(merge)
+    
+    @staticmethod
+    def _hour_bucket(timestamp: datetime) -> str:
+        """時間枠の開始時刻（UTC）"""
+        return clock.as_utc(timestamp).strftime('%Y-%m-%d %H:00:00')
+
+
+class SQLiteStudentActivityRepository(StudentActivityRepository):
+    """SQLite 生徒ごとの活動リポジトリ実装"""
+    
+    COLUMNS = (
+        "user_id", "channel_id", "last_post_at", "last_message_id", "message_count", "open_questions",
+        "last_staff_reply_at"
+    )
+    
+    def __init__(self, db_path: str = "lesson_logs.db"):
+        self.db_path = db_path
+    
+    async def record_student_message(self, user_id: str, channel_id: str, message_id: str,
+                                     timestamp: datetime, is_question: bool) -> None:
+        """生徒側の発言1件分を反映（古いメッセージが後から届いても最後の発言は新しい方のまま）"""
+        # SET の右辺はすべて更新前の値を参照する
+        await SQLiteWriter.for_path(self.db_path).execute("""
+            INSERT INTO student_activity
+            (user_id, channel_id, last_post_at, last_message_id, message_count, open_questions)
+            VALUES (?, ?, ?, ?, 1, ?)
+            ON CONFLICT (user_id, channel_id) DO UPDATE SET
+                message_count = message_count + 1,
+                open_questions = open_questions + CASE
+                    WHEN last_staff_reply_at IS NULL OR excluded.last_post_at > last_staff_reply_at
+                    THEN excluded.open_questions ELSE 0 END,
+                last_message_id = CASE
+                    WHEN excluded.last_post_at >= last_post_at THEN excluded.last_message_id
+                    ELSE last_message_id END,
+                last_post_at = MAX(last_post_at, excluded.last_post_at)
+        """, (user_id, channel_id, clock.to_db_timestamp(timestamp), message_id, int(is_question)))
+    
+    async def record_staff_reply(self, channel_id: str, timestamp: datetime) -> None:
+        """運営側の発言を、それより前に発言したチャンネルの生徒への返信として反映（未回答の質問は解消する）"""
+        moment = clock.to_db_timestamp(timestamp)
+        await SQLiteWriter.for_path(self.db_path).execute("""
+            UPDATE student_activity
+            SET last_staff_reply_at = ?, open_questions = 0
+            WHERE channel_id = ? AND last_post_at <= ?
+              AND (last_staff_reply_at IS NULL OR last_staff_reply_at < ?)
+        """, (moment, channel_id, moment, moment))
+    
+    async def get_student_activity(
+        self, channel_id: Optional[str] = None, user_id: Optional[str] = None
+    ) -> List[StudentActivity]:
+        """チャンネル・ユーザーで絞り込んだ活動を、最後の発言の新しい順に取得"""
+        conditions, params = [], []
+        if channel_id:
+            conditions.append("channel_id = ?")
+            params.append(channel_id)
+        if user_id:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self._fetch(
+            f"SELECT {', '.join(self.COLUMNS)} FROM student_activity {where} ORDER BY last_post_at DESC", params
+        )
+        return [self._row_to_activity(row) for row in rows]
+    
+    async def get_inactive_students(
+        self, before: datetime, since: Optional[datetime] = None, channel_ids: Optional[List[str]] = None
+    ) -> List[StudentActivity]:
+        """最後の発言が before より前（since 以降）の生徒を、最後の発言の古い順に取得"""
+        query = f"SELECT {', '.join(self.COLUMNS)} FROM student_activity WHERE last_post_at < ?"
+        params: List[Any] = [clock.to_db_timestamp(before)]
+        if since:
+            query += " AND last_post_at >= ?"
+            params.append(clock.to_db_timestamp(since))
+        
+        if channel_ids is None:
+            rows = await self._fetch(query, params)
+        else:
+            rows = []
+            for chunk in _chunks(channel_ids):
+                rows.extend(await self._fetch(
+                    f"{query} AND channel_id IN ({', '.join('?' * len(chunk))})", [*params, *chunk]
+                ))
+        activities = [self._row_to_activity(row) for row in rows]
+        return sorted(activities, key=lambda activity: activity.last_post_at)
+    
+    async def replace_channel(self, channel_id: str, activities: List[StudentActivity]) -> None:
+        """チャンネルの活動を作り直した内容で置き換える"""
+        rows = [
+            (
+                activity.user_id, activity.channel_id, clock.to_db_timestamp(activity.last_post_at),
+                activity.last_message_id, activity.message_count, activity.open_questions,
+                clock.to_db_timestamp(activity.last_staff_reply_at) if activity.last_staff_reply_at else None
+            )
+            for activity in activities
+        ]
+        
+        def replace(db: sqlite3.Connection) -> None:
+            db.execute("DELETE FROM student_activity WHERE channel_id = ?", (channel_id,))
+            db.executemany(f"""
+                INSERT INTO student_activity ({', '.join(self.COLUMNS)})
+                VALUES ({', '.join('?' * len(self.COLUMNS))})
+            """, rows)
+        
+        await SQLiteWriter.for_path(self.db_path).run(replace)
+    
+    async def _fetch(self, query: str, params: List[Any]) -> List[aiosqlite.Row]:
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(query, params)
+            return await cursor.fetchall()
+    
+    @staticmethod
+    def _row_to_activity(row) -> StudentActivity:
+        return StudentActivity(
+            user_id=row['user_id'],
+            channel_id=row['channel_id'],
+            last_post_at=clock.as_utc(datetime.fromisoformat(row['last_post_at'])),
+            last_message_id=row['last_message_id'],
+            message_count=row['message_count'],
+            open_questions=row['open_questions'],
+            last_staff_reply_at=(
+                clock.as_utc(datetime.fromisoformat(row['last_staff_reply_at']))
+                if row['last_staff_reply_at'] else None
+            )
+        )
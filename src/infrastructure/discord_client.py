@@ -8,14 +8,18 @@ from datetime import datetime
 import asyncio
 import logging
 
+from config.settings import Settings
+from ..domain import clock
 from ..domain.entities import Channel, Message, User, UserRole
 from ..domain.repositories import MessageRepository, ChannelRepository, UserRepository
+from .gateway import CHANNELS_EVENT
+from .memory_monitor import format_bytes
 
 
 class DiscordClient(commands.Bot):
     """Discord クライアント"""
     
-    def __init__(self, log_collection_service, **kwargs):
+    def __init__(self, log_collection_service, ingest_queue=None, startup_timer=None, **kwargs):
         intents = discord.Intents.default()
         intents.message_content = True
         intents.guilds = True
@@ -23,16 +27,66 @@ class DiscordClient(commands.Bot):
         
         super().__init__(command_prefix='!', intents=intents, **kwargs)
         self.log_collection_service = log_collection_service
+        self.ingest_queue = ingest_queue
+        self.startup_timer = startup_timer
         self.logger = logging.getLogger(__name__)
     
+    async def close(self):
+        """終了時に取り込みキューを処理しきってから切断"""
+        if self.ingest_queue:
+            await self.ingest_queue.drain(timeout=Settings.INGEST_DRAIN_TIMEOUT)
+        await super().close()
+    
     async def on_ready(self):
         """Bot準備完了時"""
-        self.logger.info(f'{self.user} がログインしました')
-        print(f'{self.user} がログインしました')
+        self.logger.info("%s がログインしました", self.user)
+        if self.startup_timer and 'ready' not in self.startup_timer.marks:
+            self.startup_timer.mark('ready')
+            self.logger.info("起動時間: %s", self.startup_timer.summary())
         
-        # 起動時に既存メッセージを収集
+        if self.log_collection_service:
+            # 直近のメッセージをキャッシュに読み込んでから既存メッセージを収集
+            await self.log_collection_service.warm_up()
+        else:
+            # ゲートウェイプロセスでは保存プロセスにチャンネル一覧を送る
+            await self._dispatch_event(CHANNELS_EVENT, {
+                'shard_id': self.shard_id, 'channels': self.lesson_channel_summaries()
+            })
+        # 既存メッセージの収集より先に名簿を登録し、投稿者をメッセージの処理で作成しなくて済むようにする
+        if Settings.ROSTER_SYNC_ENABLED:
+            await self.sync_roster()
         await self.collect_existing_messages()
     
+    async def sync_roster(self) -> int:
+        """全ギルドのメンバーを ROSTER_SYNC_BATCH_SIZE 人ずつまとめて登録（送ったメンバー数を返す）"""
+        total = 0
+        for guild in self.guilds:
+            if not guild.chunked:
+                await guild.chunk()
+            members = list(guild.members)
+            for start in range(0, len(members), Settings.ROSTER_SYNC_BATCH_SIZE):
+                batch = members[start:start + Settings.ROSTER_SYNC_BATCH_SIZE]
+                await self._dispatch_event('members', {
+                    'guild_id': str(guild.id), 'members': [self._author_data(member) for member in batch]
+                })
+            total += len(members)
+        self.logger.info("名簿を同期しました: %d ギルド %d 人", len(self.guilds), total)
+        return total
+    
+    async def on_member_join(self, member: discord.Member):
+        """メンバー参加時"""
+        await self._dispatch_member(member)
+    
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        """メンバーのロール・ニックネーム変更時"""
+        if before.roles != after.roles or before.display_name != after.display_name or before.name != after.name:
+            await self._dispatch_member(after)
+    
+    async def _dispatch_member(self, member: discord.Member):
+        await self._dispatch_event('members', {
+            'guild_id': str(member.guild.id), 'members': [self._author_data(member)]
+        })
+    
     async def on_message(self, message: discord.Message):
         """新しいメッセージ受信時"""
         # Bot自身のメッセージは無視
@@ -47,11 +101,77 @@ class DiscordClient(commands.Bot):
         message_data = await self._prepare_message_data(message)
         
         # アプリケーションサービスに処理を委譲
-        await self.log_collection_service.process_new_message(message_data)
+        await self._dispatch_event('message', message_data)
         
         # コマンド処理
         await self.process_commands(message)
     
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        """メッセージ編集時（キャッシュ外のメッセージも対象）"""
+        # 埋め込み展開などの本文を含まない更新は無視
+        if 'content' not in payload.data or not self._is_tracked_channel_id(payload.channel_id):
+            return
+        
+        await self._dispatch_event('message_edit', {
+            'id': str(payload.message_id),
+            **self._resolve_channel_ids(payload.channel_id),
+            'content': payload.data['content'],
+            'edited_at': payload.data.get('edited_timestamp')
+        })
+    
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """メッセージ削除時"""
+        if not self._is_tracked_channel_id(payload.channel_id):
+            return
+        
+        await self._dispatch_event('message_delete', {
+            'id': str(payload.message_id),
+            **self._resolve_channel_ids(payload.channel_id),
+            'deleted_at': clock.now().isoformat()
+        })
+    
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        """メッセージ一括削除時"""
+        if not self._is_tracked_channel_id(payload.channel_id):
+            return
+        
+        channel_ids = self._resolve_channel_ids(payload.channel_id)
+        deleted_at = clock.now().isoformat()
+        for message_id in payload.message_ids:
+            await self._dispatch_event('message_delete', {
+                'id': str(message_id),
+                **channel_ids,
+                'deleted_at': deleted_at
+            })
+    
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        """リアクション追加時"""
+        await self._dispatch_reaction('reaction_add', payload)
+    
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        """リアクション削除時"""
+        await self._dispatch_reaction('reaction_remove', payload)
+    
+    async def _dispatch_reaction(self, event_type: str, payload: discord.RawReactionActionEvent):
+        """リアクションイベントを渡す（追加時はメンバー情報からロールも渡す）"""
+        if self.user and payload.user_id == self.user.id:
+            return
+        if not self._is_tracked_channel_id(payload.channel_id):
+            return
+        
+        roles = None
+        if payload.member is not None:
+            roles = [role.name for role in payload.member.roles if role.name != '@everyone']
+        
+        await self._dispatch_event(event_type, {
+            'message_id': str(payload.message_id),
+            **self._resolve_channel_ids(payload.channel_id),
+            'user_id': str(payload.user_id),
+            'emoji': str(payload.emoji),
+            'roles': roles,
+            'timestamp': clock.now().isoformat()
+        })
+    
     async def collect_existing_messages(self):
         """既存メッセージを収集"""
         self.logger.info("既存メッセージの収集を開始します")
@@ -60,27 +180,70 @@ class DiscordClient(commands.Bot):
             lesson_channels = [ch for ch in guild.channels 
                              if isinstance(ch, discord.TextChannel) and self._is_lesson_channel(ch)]
             
+            # アクティブなスレッドも収集対象
+            for channel in list(lesson_channels):
+                lesson_channels.extend(channel.threads)
+            
             for channel in lesson_channels:
                 try:
-                    self.logger.info(f"チャンネル {channel.name} からメッセージを収集中...")
+                    self.logger.info("チャンネル %s からメッセージを収集中...", channel.name)
                     
-                    async for message in channel.history(limit=100):
+                    # 会話セッションを時系列で組み立てるため古い順に処理
+                    history = [message async for message in channel.history(limit=100)]
+                    for message in reversed(history):
                         if message.author == self.user:
                             continue
                         
                         message_data = await self._prepare_message_data(message)
-                        await self.log_collection_service.process_new_message(message_data)
+                        await self._dispatch_event('message', message_data)
                     
                     # レート制限を考慮
                     await asyncio.sleep(1)
                     
                 except Exception as e:
-                    self.logger.error(f"チャンネル {channel.name} の処理中にエラー: {e}")
+                    self.logger.error("チャンネル %s の処理中にエラー: %s", channel.name, e)
         
         self.logger.info("既存メッセージの収集が完了しました")
     
+    async def _dispatch_event(self, event_type: str, data: Dict[str, Any]) -> None:
+        """取り込みキュー経由（未設定なら直接）でサービスにイベントを渡す"""
+        if self.ingest_queue:
+            await self.ingest_queue.submit(event_type, data)
+        else:
+            await self.log_collection_service.handle_event(event_type, data)
+    
+    def _resolve_channel_ids(self, channel_id: int) -> Dict[str, Optional[str]]:
+        """生イベントのチャンネルIDを（親チャンネルID, スレッドID）に変換"""
+        channel = self.get_channel(channel_id)
+        if isinstance(channel, discord.Thread):
+            return {'channel_id': str(channel.parent_id), 'thread_id': str(channel.id)}
+        return {'channel_id': str(channel_id), 'thread_id': None}
+    
+    def _is_tracked_channel_id(self, channel_id: int) -> bool:
+        """生イベントのチャンネルが記録対象か（キャッシュにない場合は対象とみなす）"""
+        channel = self.get_channel(channel_id)
+        return channel is None or self._is_lesson_channel(channel)
+    
+    def guild_id_for_channel(self, channel_id: str) -> Optional[str]:
+        """キャッシュ済みのチャンネル（スレッドを含む）からギルドIDを取得"""
+        channel = self.get_channel(int(channel_id)) if channel_id.isdigit() else None
+        guild = getattr(channel, 'guild', None)
+        return str(guild.id) if guild else None
+    
+    def lesson_channel_summaries(self) -> List[Dict[str, Any]]:
+        """接続中のギルドのレッスンチャンネル一覧（プロセス間で送れる形）"""
+        return [
+            {'id': str(channel.id), 'name': channel.name, 'is_lesson_channel': True, 'guild_id': str(guild.id)}
+            for guild in self.guilds
+            for channel in guild.channels
+            if isinstance(channel, discord.TextChannel) and self._is_lesson_channel(channel)
+        ]
+    
     def _is_lesson_channel(self, channel) -> bool:
-        """レッスンチャンネルかどうかを判定"""
+        """レッスンチャンネルかどうかを判定（レッスンチャンネル配下のスレッドも含む）"""
+        if isinstance(channel, discord.Thread):
+            channel = channel.parent
+        
         if not isinstance(channel, discord.TextChannel):
             return False
         
@@ -88,26 +251,37 @@ class DiscordClient(commands.Bot):
         lesson_keywords = ["lesson", "レッスン", "授業", "class"]
         return any(keyword in channel.name.lower() for keyword in lesson_keywords)
     
+    @staticmethod
+    def _author_data(author) -> Dict[str, Any]:
+        """投稿者・メンバーの情報（ロールはメンバーの場合のみ）"""
+        roles = []
+        if hasattr(author, 'roles'):
+            roles = [role.name for role in author.roles if role.name != '@everyone']
+        return {
+            'id': str(author.id),
+            'username': author.name,
+            'display_name': author.display_name,
+            'roles': roles
+        }
+    
     async def _prepare_message_data(self, message: discord.Message) -> Dict[str, Any]:
         """メッセージデータを準備"""
-        # ユーザーのロール情報を取得
-        roles = []
-        if hasattr(message.author, 'roles'):
-            roles = [role.name for role in message.author.roles if role.name != '@everyone']
+        # スレッドの投稿は親チャンネルに紐づけ、スレッドIDを別に持つ
+        channel = message.channel
+        thread_id = None
+        if isinstance(channel, discord.Thread):
+            thread_id = str(channel.id)
+            channel = channel.parent
         
         return {
             'id': str(message.id),
-            'channel_id': str(message.channel.id),
-            'channel_name': message.channel.name,
+            'channel_id': str(channel.id),
+            'channel_name': channel.name,
+            'thread_id': thread_id,
             'content': message.content,
             'timestamp': message.created_at.isoformat(),
             'reactions': [str(reaction.emoji) for reaction in message.reactions],
-            'author': {
-                'id': str(message.author.id),
-                'username': message.author.name,
-                'display_name': message.author.display_name,
-                'roles': roles
-            }
+            'author': self._author_data(message.author)
         }
 
 
@@ -150,9 +324,16 @@ class DiscordChannelRepository(ChannelRepository):
 class DiscordCommands(commands.Cog):
     """Discord コマンド"""
     
-    def __init__(self, bot: DiscordClient, log_collection_service):
+    def __init__(
+        self, bot: DiscordClient, log_collection_service, loop_monitor=None, analytics=None, maintenance=None,
+        memory_monitor=None
+    ):
         self.bot = bot
         self.log_collection_service = log_collection_service
+        self.loop_monitor = loop_monitor
+        self.analytics = analytics
+        self.maintenance = maintenance
+        self.memory_monitor = memory_monitor
     
     @commands.command(name='export_logs')
     @commands.has_permissions(administrator=True)
@@ -166,6 +347,34 @@ class DiscordCommands(commands.Cog):
         except Exception as e:
             await ctx.send(f"エクスポート中にエラーが発生しました: {e}")
     
+    @commands.command(name='export_thread')
+    @commands.has_permissions(administrator=True)
+    async def export_thread(self, ctx, thread_id: str = None):
+        """スレッドのログをエクスポート（省略時は実行したスレッド）"""
+        if thread_id is None:
+            if not isinstance(ctx.channel, discord.Thread):
+                await ctx.send("スレッド内で実行するか、スレッドIDを指定してください")
+                return
+            thread_id = str(ctx.channel.id)
+        
+        try:
+            file_path = await self.log_collection_service.export_thread_logs(thread_id)
+            await ctx.send(f"スレッドのログをエクスポートしました: {file_path}")
+        except Exception as e:
+            await ctx.send(f"エクスポート中にエラーが発生しました: {e}")
+    
+    @commands.command(name='export_sessions')
+    @commands.has_permissions(administrator=True)
+    async def export_sessions(self, ctx, channel_id: str = None, days: int = 30):
+        """会話セッション一覧をエクスポート"""
+        target_channel_id = channel_id or str(ctx.channel.id)
+        
+        try:
+            file_path = await self.log_collection_service.export_channel_sessions(target_channel_id, days)
+            await ctx.send(f"セッション一覧をエクスポートしました: {file_path}")
+        except Exception as e:
+            await ctx.send(f"エクスポート中にエラーが発生しました: {e}")
+    
     @commands.command(name='analyze_now')
     @commands.has_permissions(administrator=True)
     async def analyze_now(self, ctx):
@@ -174,4 +383,216 @@ class DiscordCommands(commands.Cog):
             await self.log_collection_service.collect_and_analyze_messages()
             await ctx.send("分析が完了しました")
         except Exception as e:
-            await ctx.send(f"分析中にエラーが発生しました: {e}")
\ No newline at end of file
+            await ctx.send(f"分析中にエラーが発生しました: {e}")
+    
+    @commands.command(name='stats')
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx, days: int = 30, action: str = None):
+        """運営側の返信時間の統計を表示（`!stats 30 export` で表として出力）"""
+        if not self.analytics:
+            await ctx.send("統計機能が有効になっていません")
+            return
+        
+        try:
+            report = await self.analytics.compute(days=days)
+            
+            if action == 'export':
+                file_path = await self.log_collection_service.export_report('response_times', report.to_tables())
+                await ctx.send(f"返信時間レポートをエクスポートしました: {file_path}")
+                return
+            
+            overall = report.overall
+            lines = [
+                f"直近 {days} 日の返信時間: p50 {overall['p50(分)']}分 / p90 {overall['p90(分)']}分 "
+                f"（質問 {overall['質問数']} 件、未返信 {overall['未返信']} 件）",
+                "**チャンネル別（p90が長い順）**"
+            ]
+            for row in report.by_channel.head(5).to_dict('records'):
+                lines.append(f"- #{row['channel_name']}: p50 {row['p50(分)']}分 / p90 {row['p90(分)']}分 ({row['質問数']}件)")
+            lines.append("**メンター別（p90が長い順）**")
+            for row in report.by_mentor.head(5).to_dict('records'):
+                lines.append(f"- {row['mentor_name']}: p50 {row['p50(分)']}分 / p90 {row['p90(分)']}分 ({row['質問数']}件)")
+            await ctx.send("\n".join(lines))
+        except Exception as e:
+            await ctx.send(f"統計の集計中にエラーが発生しました: {e}")
+    
+    @commands.command(name='activity')
+    @commands.has_permissions(administrator=True)
+    async def activity(self, ctx, hours: int = 24):
+        """直近の発言数・質問数・回答済み数を表示（活動集計から取得）"""
+        try:
+            summary = await self.log_collection_service.get_activity_summary(clock.hours_ago(hours))
+            await ctx.send(
+                f"直近 {hours} 時間: 生徒側 {summary['student_messages']} 件 / 運営側 {summary['staff_messages']} 件、"
+                f"質問 {summary['questions']} 件のうち回答済み {summary['answered']} 件"
+            )
+        except Exception as e:
+            await ctx.send(f"活動集計の取得中にエラーが発生しました: {e}")
+    
+    @commands.command(name='export_activity')
+    @commands.has_permissions(administrator=True)
+    async def export_activity(self, ctx, days: int = 30):
+        """直近 days 日の活動をチャンネル別・日別・時間帯別に集計して出力（REPORTING_BACKEND=duckdb のとき）"""
+        try:
+            file_path = await self.log_collection_service.export_activity(days)
+            if not file_path:
+                await ctx.send("活動の集計出力は REPORTING_BACKEND=duckdb のときだけ使えます")
+                return
+            await ctx.send(f"活動の集計をエクスポートしました: {file_path}")
+        except Exception as e:
+            await ctx.send(f"エクスポート中にエラーが発生しました: {e}")
+    
+    @commands.command(name='inactive')
+    @commands.has_permissions(administrator=True)
+    async def inactive(self, ctx, days: float = 7):
+        """最後の発言から days 日以上経っている生徒を表示（生徒の活動の表から取得）"""
+        try:
+            activities = await self.log_collection_service.get_inactive_students(days)
+        except Exception as e:
+            await ctx.send(f"生徒の活動の取得中にエラーが発生しました: {e}")
+            return
+        if not activities:
+            await ctx.send(f"{days:g} 日以上発言していない生徒はいません")
+            return
+        
+        lines = [f"{days:g} 日以上発言していない生徒: {len(activities)} 人（古い順）"]
+        for activity in activities[:20]:
+            staff_reply = (
+                activity.last_staff_reply_at.strftime('%m/%d') if activity.last_staff_reply_at else "なし"
+            )
+            lines.append(
+                f"- <@{activity.user_id}> <#{activity.channel_id}>: 最後の発言 "
+                f"{activity.last_post_at.strftime('%m/%d')}、運営側の返信 {staff_reply}、"
+                f"発言 {activity.message_count} 件、未回答の質問 {activity.open_questions} 件"
+            )
+        await ctx.send("\n".join(lines)[:1990])
+    
+    @commands.command(name='maintenance')
+    @commands.has_permissions(administrator=True)
+    async def maintenance_status(self, ctx, job: str = None):
+        """DBメンテナンスの実行状況を表示（`!maintenance backup` のように処理名を指定すると今すぐ実行）"""
+        if not self.maintenance:
+            await ctx.send("DBメンテナンスが有効になっていません")
+            return
+        
+        if job:
+            if job not in self.maintenance.jobs:
+                await ctx.send(f"未対応の処理です（{', '.join(self.maintenance.jobs)}）")
+                return
+            try:
+                result = await self.maintenance.run_job(job)
+                await ctx.send(f"{job} が完了しました: {result}")
+            except Exception as e:
+                await ctx.send(f"{job} の実行中にエラーが発生しました: {e}")
+            return
+        
+        lines = ["DBメンテナンス"]
+        for status in self.maintenance.stats():
+            last_run = status['last_run'].strftime('%m/%d %H:%M') if status['last_run'] else '未実行'
+            line = f"- {status['name']}: 前回 {last_run} ({status['last_seconds']:.1f}秒, {status['runs']} 回)"
+            if status['running']:
+                line += " 実行中"
+            if status['last_error']:
+                line += f" エラー: {status['last_error']}"
+            lines.append(line)
+        await ctx.send("\n".join(lines))
+    
+    @commands.command(name='perf')
+    @commands.has_permissions(administrator=True)
+    async def perf(self, ctx, action: str = None):
+        """イベントループの遅延統計を表示（`!perf profile` でプロファイラを切替、`!perf detectors` で検出器の処理時間、`!perf cache` でキャッシュのヒット率、`!perf memory` でメモリ使用量）"""
+        if action == 'memory':
+            if not self.memory_monitor:
+                await ctx.send("メモリ監視が有効になっていません")
+                return
+            stats = self.memory_monitor.stats()
+            rss = format_bytes(stats['rss']) if stats['rss'] is not None else "不明"
+            max_rss = format_bytes(stats['max_rss']) if stats['max_rss'] is not None else "-"
+            lines = [f"RSS: {rss}（最大 {max_rss}、通知 {stats['alerts_sent']} 回）", "サブシステムごとの概算"]
+            for usage in self.memory_monitor.accounting():
+                if usage.error:
+                    lines.append(f"- {usage.name}: 取得できません ({usage.error})")
+                else:
+                    lines.append(f"- {usage.name}: {usage.items} 件 / 約 {format_bytes(usage.bytes)}")
+            await ctx.send("\n".join(lines))
+            return
+        
+        if action == 'cache':
+            cache_stats = getattr(self.log_collection_service.message_repo, 'stats', None)
+            if not cache_stats:
+                await ctx.send("メッセージキャッシュが有効になっていません")
+                return
+            stats = cache_stats()
+            await ctx.send(
+                f"メッセージキャッシュ: ヒット率 {stats['hit_ratio']:.1%} "
+                f"(ヒット {stats['hits']} / ミス {stats['misses']})、"
+                f"{stats['channels']} チャンネル / {stats['messages']}/{stats['max_messages']} 件、"
+                f"追い出し {stats['evicted_channels']} チャンネル"
+            )
+            return
+        
+        if action == 'detectors':
+            pipeline = self.log_collection_service.detector_pipeline
+            if not pipeline:
+                await ctx.send("検出器が登録されていません")
+                return
+            lines = ["検出器の処理時間（累計）"]
+            for name, timing in pipeline.stats().items():
+                lines.append(
+                    f"- {name}: {timing.seconds * 1000:.1f}ms / {timing.messages} 件 "
+                    f"({timing.microseconds_per_message:.1f}µs/件, アラート {timing.alerts} 件, {timing.runs} 回)"
+                )
+            await ctx.send("\n".join(lines))
+            return
+        
+        if not self.loop_monitor:
+            await ctx.send("ループ監視が有効になっていません")
+            return
+        
+        if action == 'profile':
+            file_path = self.loop_monitor.toggle_profiler()
+            if file_path:
+                await ctx.send(f"プロファイルを出力しました: {file_path}")
+            else:
+                await ctx.send("サンプリングプロファイラを開始しました。もう一度 `!perf profile` で停止します")
+            return
+        
+        stats = self.loop_monitor.stats()
+        lines = [
+            f"ループ遅延: 直近 {stats['last_ms']:.1f}ms / p50 {stats['p50_ms']:.1f}ms / "
+            f"p99 {stats['p99_ms']:.1f}ms / 最大 {stats['max_ms']:.1f}ms",
+            f"閾値超過: {stats['stalls']} 回"
+        ]
+        for stall in self.loop_monitor.slowest_callbacks()[:5]:
+            lines.append(
+                f"- {stall.duration_ms:.0f}ms ({stall.started_at.strftime('%H:%M:%S')}) {stall.summary()}"
+            )
+        await ctx.send("\n".join(lines))
+    
+    @commands.command(name='memsnap')
+    @commands.has_permissions(administrator=True)
+    async def memsnap(self, ctx, action: str = None):
+        """tracemalloc のスナップショットを取り、前回からの増加分を表示（`!memsnap stop` で追跡を終了）"""
+        if not self.memory_monitor:
+            await ctx.send("メモリ監視が有効になっていません")
+            return
+        
+        if action == 'stop':
+            if self.memory_monitor.stop_tracing():
+                await ctx.send("メモリの追跡を終了しました")
+            else:
+                await ctx.send("メモリを追跡していません")
+            return
+        
+        snapshot = await self.memory_monitor.snapshot()
+        header = f"追跡中のメモリ: {format_bytes(snapshot.traced_bytes)}（最大 {format_bytes(snapshot.peak_bytes)}）"
+        if snapshot.baseline:
+            await ctx.send(
+                f"メモリの追跡を開始し、基準のスナップショットを取りました。{header}\n"
+                "もう一度 `!memsnap` で増加分を表示します（追跡中は処理が遅くなるので `!memsnap stop` で終了してください）"
+            )
+            return
+        lines = [header, "前回からの増加（上位）"]
+        lines.extend(f"`{line[:160]}`" for line in snapshot.lines)
+        lines.append(f"詳細: {snapshot.filepath}")
+        await ctx.send("\n".join(lines)[:1990])
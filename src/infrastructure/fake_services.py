@@ -0,0 +1,486 @@
+"""
+負荷試験・動作確認用のローカルの Discord・Slack・OpenAI（本物の API には接続しない）
+
+FakeDiscordServer は discord.py がそのまま接続できる REST API とゲートウェイ（WebSocket）を提供し、
+指定したレートで複数チャンネルに MESSAGE_CREATE を送る。FakeSlackServer は Slack Web API のうち
+使っているメソッド（auth.test / chat.postMessage）を受け付けて投稿を記録する。
+メッセージの本文に [load:番号] を埋め込み、送信時刻と Slack への投稿時刻から遅延を求める。
+どちらも /_control/... で外部（別プロセスのハーネス）から操作できる。
+FakeOpenAIServer は Batch API で使うファイル・バッチのエンドポイントを提供し、一定時間後にバッチを完了させる。
+"""
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from aiohttp import WSMsgType, web
+
+# Discord のスノーフレークIDの基準時刻（ミリ秒）
+DISCORD_EPOCH_MS = 1420070400000
+# アラートの本文から送信時の番号を取り出す
+LOAD_TAG = re.compile(r"\[load:(\d+)\]")
+
+# 偽の OpenAI が振り返り以外の話題とみなす語（本物のモデルの代わり）
+OFF_TOPIC_WORDS = ("ゲーム", "アニメ", "テレビ", "週末", "カラオケ", "部活")
+# 分析のリクエスト本文の1行から (id:メッセージID) と本文を取り出す
+ANALYSIS_LINE = re.compile(r"\(id:([^)]+)\) [^:]*: (.*)")
+
+# ゲートウェイのオペコード
+OP_DISPATCH, OP_HEARTBEAT, OP_IDENTIFY, OP_REQUEST_MEMBERS, OP_HELLO, OP_HEARTBEAT_ACK = 0, 1, 2, 8, 10, 11
+
+
+def snowflake(moment: datetime, low_bits: int = 0) -> int:
+    return ((int(moment.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22) | (low_bits & 0x3FFFFF)
+
+
+def use_fake_discord(base_url: str) -> None:
+    """discord.py の接続先をローカルの FakeDiscordServer に向ける（負荷試験用）"""
+    import yarl
+    from discord import http
+    from discord.gateway import DiscordWebSocket
+
+    http.Route.BASE = f"{base_url}/api/v10"
+    DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(f"{base_url.replace('http', 'ws', 1)}/gateway")
+
+
+def discord_json(data: Any) -> web.Response:
+    """discord.py は Content-Type が application/json ちょうどのときだけ JSON として読むので charset を付けない"""
+    return web.Response(body=json.dumps(data, ensure_ascii=False).encode('utf-8'), content_type='application/json')
+
+
+class FakeDiscordServer:
+    """discord.py が接続できるローカルの Discord
+
+    レッスンチャンネル（lesson-N）を持つギルドを1つ用意し、生徒（student ロール）とメンター（mentor ロール）が
+    発言する。同じチャンネルのメッセージは SESSION_GAP_MINUTES より間隔を空けた過去の時刻にするので、
+    生徒の質問はそれぞれ新しい会話セッションの未回答の質問になり、すぐに未回答アラートの対象になる。
+    """
+
+    def __init__(
+        self,
+        channels: int = 8,
+        students: int = 50,
+        mentors: int = 5,
+        question_ratio: float = 0.2,
+        message_interval_minutes: int = 31,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = 0
+    ):
+        self.host = host
+        self.port = port
+        self.question_ratio = question_ratio
+        self.rng = random.Random(seed)
+        self.logger = logging.getLogger(__name__)
+
+        started = datetime.now(timezone.utc)
+        self.guild_id = snowflake(started - timedelta(days=365), 1)
+        self.bot_id = snowflake(started - timedelta(days=365), 2)
+        self.student_role_id = snowflake(started - timedelta(days=365), 3)
+        self.mentor_role_id = snowflake(started - timedelta(days=365), 4)
+        self.channel_ids = [snowflake(started - timedelta(days=364), 100 + index) for index in range(channels)]
+        self.students = [str(snowflake(started - timedelta(days=363), 1000 + index)) for index in range(students)]
+        self.mentors = [str(snowflake(started - timedelta(days=363), 5000 + index)) for index in range(mentors)]
+
+        # チャンネルごとのメッセージ時刻（2時間以上前に収まるよう十分過去から始める）
+        self.interval = timedelta(minutes=message_interval_minutes)
+        self.history_start = started - timedelta(hours=3) - self.interval * 100_000
+        self._channel_sequence = [0] * channels
+        self._sequence = 0
+
+        self.sent_at: Dict[int, float] = {}
+        self.counters = {'messages': 0, 'questions': 0, 'identifies': 0}
+        self._sockets: List[web.WebSocketResponse] = []
+        self._gateway_sequence = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get('/api/v10/users/@me', self._user)
+        app.router.add_get('/api/v10/oauth2/applications/@me', self._application)
+        app.router.add_get('/api/v10/gateway', self._gateway_url)
+        app.router.add_get('/api/v10/gateway/bot', self._gateway_url)
+        app.router.add_get('/api/v10/channels/{channel_id}/messages', self._history)
+        app.router.add_post('/api/v10/channels/{channel_id}/messages', self._create_message)
+        app.router.add_get('/gateway', self._gateway)
+        app.router.add_post('/_control/burst', self._control_burst)
+        app.router.add_get('/_control/stats', self._control_stats)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.base_url
+
+    async def stop(self) -> None:
+        for socket in list(self._sockets):
+            await socket.close()
+        if self._runner:
+            await self._runner.cleanup()
+
+    # --- 負荷の生成 ---
+
+    async def emit(self, rate: float, seconds: float) -> Dict[str, Any]:
+        """rate 件/秒で seconds 秒間、ランダムなチャンネルにメッセージを送る"""
+        if not self._sockets:
+            raise RuntimeError("ゲートウェイに接続しているクライアントがありません")
+        sent = questions = 0
+        started = time.perf_counter()
+        total = int(rate * seconds)
+        while sent < total:
+            # 送るべき件数に追いつくまでまとめて送る（10ms 単位で送信ペースを調整）
+            due = min(total, int((time.perf_counter() - started) * rate) + 1)
+            while sent < due:
+                questions += await self._send_message()
+                sent += 1
+            await asyncio.sleep(0.01)
+        return {'sent': sent, 'questions': questions, 'seconds': time.perf_counter() - started}
+
+    async def _send_message(self) -> int:
+        index = self.rng.randrange(len(self.channel_ids))
+        moment = self.history_start + self.interval * self._channel_sequence[index]
+        self._channel_sequence[index] += 1
+        self._sequence += 1
+        sequence = self._sequence
+
+        is_mentor = self.rng.random() < 0.2
+        is_question = not is_mentor and self.rng.random() < self.question_ratio
+        author_id = self.rng.choice(self.mentors if is_mentor else self.students)
+        content = f"[load:{sequence}] これはどうすればいいですか？" if is_question else "了解です"
+        payload = {
+            'id': str(snowflake(moment, index)),
+            'channel_id': str(self.channel_ids[index]),
+            'guild_id': str(self.guild_id),
+            'content': content,
+            'timestamp': moment.isoformat(),
+            'edited_timestamp': None,
+            'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [],
+            'attachments': [], 'embeds': [], 'pinned': False, 'type': 0, 'flags': 0,
+            'author': self._user_payload(author_id),
+            'member': self._member_payload(None, self.mentor_role_id if is_mentor else self.student_role_id)
+        }
+        if is_question:
+            self.sent_at[sequence] = time.time()
+            self.counters['questions'] += 1
+        self.counters['messages'] += 1
+        await self._dispatch('MESSAGE_CREATE', payload)
+        return int(is_question)
+
+    # --- ゲートウェイ ---
+
+    async def _gateway(self, request: web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        self._sockets.append(socket)
+        await socket.send_json({'op': OP_HELLO, 'd': {'heartbeat_interval': 41250}})
+        try:
+            async for frame in socket:
+                if frame.type != WSMsgType.TEXT:
+                    continue
+                message = json.loads(frame.data)
+                op = message.get('op')
+                if op == OP_HEARTBEAT:
+                    await socket.send_json({'op': OP_HEARTBEAT_ACK})
+                elif op == OP_IDENTIFY:
+                    self.counters['identifies'] += 1
+                    await self._ready(socket)
+                elif op == OP_REQUEST_MEMBERS:
+                    data = message['d']
+                    await self._dispatch('GUILD_MEMBERS_CHUNK', {
+                        'guild_id': data['guild_id'], 'members': [], 'chunk_index': 0, 'chunk_count': 1,
+                        'nonce': data.get('nonce')
+                    }, socket)
+        finally:
+            self._sockets.remove(socket)
+        return socket
+
+    async def _ready(self, socket: web.WebSocketResponse) -> None:
+        await self._dispatch('READY', {
+            'v': 10,
+            'user': self._user_payload(str(self.bot_id), bot=True),
+            'guilds': [{'id': str(self.guild_id), 'unavailable': True}],
+            'session_id': 'fake-session',
+            'resume_gateway_url': f"ws://{self.host}:{self.port}/gateway",
+            'application': {'id': str(self.bot_id), 'flags': 0},
+            'shard': [0, 1]
+        }, socket)
+        everyone = {'id': str(self.guild_id), 'name': '@everyone', 'permissions': '68608', 'position': 0,
+                    'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}
+        roles = [everyone] + [
+            {**everyone, 'id': str(role_id), 'name': name, 'position': position, 'permissions': '0'}
+            for position, (role_id, name) in enumerate(
+                [(self.student_role_id, 'student'), (self.mentor_role_id, 'mentor')], start=1
+            )
+        ]
+        # メンバーは全員 GUILD_CREATE に含める（件数が一致していれば discord.py は追加の取得をしない）
+        members = [
+            self._member_payload(user_id, role_id)
+            for user_ids, role_id in [(self.students, self.student_role_id), (self.mentors, self.mentor_role_id)]
+            for user_id in user_ids
+        ]
+        await self._dispatch('GUILD_CREATE', {
+            'id': str(self.guild_id),
+            'name': 'Fake Lessons',
+            'owner_id': str(self.bot_id),
+            'roles': roles,
+            'emojis': [], 'stickers': [], 'features': [],
+            'channels': [
+                {'id': str(channel_id), 'type': 0, 'name': f"lesson-{index}", 'position': index,
+                 'permission_overwrites': [], 'nsfw': False, 'parent_id': None, 'guild_id': str(self.guild_id)}
+                for index, channel_id in enumerate(self.channel_ids)
+            ],
+            'threads': [], 'members': members, 'voice_states': [], 'presences': [],
+            'member_count': len(members), 'large': False, 'unavailable': False,
+            'joined_at': self.history_start.isoformat()
+        }, socket)
+
+    async def _dispatch(self, event: str, data: dict, socket: Optional[web.WebSocketResponse] = None) -> None:
+        self._gateway_sequence += 1
+        payload = {'op': OP_DISPATCH, 't': event, 's': self._gateway_sequence, 'd': data}
+        for target in [socket] if socket else list(self._sockets):
+            await target.send_str(json.dumps(payload, ensure_ascii=False))
+
+    # --- REST API ---
+
+    def _user_payload(self, user_id: str, bot: bool = False) -> dict:
+        return {'id': user_id, 'username': f"user{user_id[-6:]}", 'global_name': None,
+                'discriminator': '0', 'avatar': None, 'bot': bot}
+
+    def _member_payload(self, user_id: Optional[str], role_id: int) -> dict:
+        payload = {'roles': [str(role_id)], 'nick': None, 'joined_at': self.history_start.isoformat(),
+                   'deaf': False, 'mute': False, 'flags': 0}
+        if user_id is not None:
+            payload['user'] = self._user_payload(user_id)
+        return payload
+
+    async def _user(self, request: web.Request) -> web.Response:
+        return discord_json(self._user_payload(str(self.bot_id), bot=True))
+
+    async def _application(self, request: web.Request) -> web.Response:
+        return discord_json({
+            'id': str(self.bot_id), 'name': 'fake-bot', 'description': '', 'icon': None,
+            'bot_public': False, 'bot_require_code_grant': False, 'verify_key': '0' * 64,
+            'owner': self._user_payload(str(self.bot_id)), 'flags': 0
+        })
+
+    async def _gateway_url(self, request: web.Request) -> web.Response:
+        return discord_json({
+            'url': f"ws://{self.host}:{self.port}/gateway", 'shards': 1,
+            'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': 1}
+        })
+
+    async def _history(self, request: web.Request) -> web.Response:
+        return discord_json([])
+
+    async def _create_message(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        moment = datetime.now(timezone.utc)
+        return discord_json({
+            'id': str(snowflake(moment)), 'channel_id': request.match_info['channel_id'],
+            'content': body.get('content', ''), 'timestamp': moment.isoformat(), 'edited_timestamp': None,
+            'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [],
+            'embeds': [], 'pinned': False, 'type': 0, 'author': self._user_payload(str(self.bot_id), bot=True)
+        })
+
+    # --- 外部からの操作 ---
+
+    async def _control_burst(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        return discord_json(await self.emit(float(body['rate']), float(body['seconds'])))
+
+    async def _control_stats(self, request: web.Request) -> web.Response:
+        return discord_json({**self.counters, 'sent_at': self.sent_at, 'clients': len(self._sockets)})
+
+
+class FakeSlackServer:
+    """Slack Web API の代わり（auth.test と chat.postMessage を受け付けて記録する）"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay_ms: float = 0):
+        self.host = host
+        self.port = port
+        # 本物の API の応答時間を模す
+        self.delay = delay_ms / 1000
+        self.posts: List[Dict[str, Any]] = []
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def api_url(self) -> str:
+        return f"http://{self.host}:{self.port}/api/"
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post('/api/auth.test', self._auth_test)
+        app.router.add_post('/api/chat.postMessage', self._post_message)
+        app.router.add_get('/_control/posts', self._control_posts)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.api_url
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    def received_tags(self) -> Dict[int, float]:
+        """本文の [load:番号] ごとの受信時刻"""
+        received = {}
+        for post in self.posts:
+            for tag in LOAD_TAG.findall(post['body']):
+                received.setdefault(int(tag), post['received_at'])
+        return received
+
+    async def _auth_test(self, request: web.Request) -> web.Response:
+        return web.json_response({'ok': True, 'user': 'fake-bot', 'team': 'fake', 'user_id': 'U0'})
+
+    async def _post_message(self, request: web.Request) -> web.Response:
+        received_at = time.time()
+        body = await request.text()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.posts.append({'received_at': received_at, 'body': body})
+        return web.json_response({'ok': True, 'channel': 'C0', 'ts': f"{received_at:.6f}"})
+
+    async def _control_posts(self, request: web.Request) -> web.Response:
+        return web.json_response({'posts': len(self.posts), 'received_at': self.received_tags()})
+
+
+class FakeOpenAIServer:
+    """OpenAI の Files・Batches API の代わり
+
+    アップロードされた入力ファイル（JSONL）の各リクエストについて、OFF_TOPIC_WORDS を含む発言を
+    detect_off_topic の結果として返す出力ファイルを作り、登録から complete_after 秒後にバッチを完了させる。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, complete_after: float = 1.0):
+        self.host = host
+        self.port = port
+        self.complete_after = complete_after
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self) -> str:
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.router.add_post('/v1/files', self._upload_file)
+        app.router.add_get('/v1/files/{file_id}/content', self._file_content)
+        app.router.add_post('/v1/batches', self._create_batch)
+        app.router.add_get('/v1/batches', self._list_batches)
+        app.router.add_get('/v1/batches/{batch_id}', self._retrieve_batch)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _store_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = {
+            'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+            'filename': filename, 'purpose': purpose, 'status': 'processed', 'content': content
+        }
+        return self.files[file_id]
+
+    def _batch_view(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        """経過時間に応じて状態を進めてから返す"""
+        if batch['status'] == 'in_progress' and time.time() - batch['created_at'] >= self.complete_after:
+            output = b"".join(
+                json.dumps(self._answer(json.loads(line)), ensure_ascii=False).encode() + b"\n"
+                for line in self.files[batch['input_file_id']]['content'].splitlines() if line.strip()
+            )
+            batch['output_file_id'] = self._store_file(output, f"{batch['id']}_output.jsonl", 'batch_output')['id']
+            batch['status'] = 'completed'
+            batch['completed_at'] = int(time.time())
+            batch['request_counts']['completed'] = batch['request_counts']['total']
+        return batch
+
+    @staticmethod
+    def _answer(request: Dict[str, Any]) -> Dict[str, Any]:
+        """リクエスト1件分の結果（detect_off_topic の呼び出し）"""
+        conversation = request['body']['messages'][-1]['content']
+        off_topic = [
+            {'message_id': match.group(1), 'reason': "レッスンと関係のない話題", 'topic_type': "雑談",
+             'severity': "low"}
+            for match in map(ANALYSIS_LINE.search, conversation.splitlines())
+            if match and any(word in match.group(2) for word in OFF_TOPIC_WORDS)
+        ]
+        message = {'role': 'assistant', 'content': None, 'function_call': {
+            'name': 'detect_off_topic', 'arguments': json.dumps({'off_topic_messages': off_topic}, ensure_ascii=False)
+        }}
+        return {
+            'id': f"batch_req_{request['custom_id']}", 'custom_id': request['custom_id'], 'error': None,
+            'response': {'status_code': 200, 'request_id': request['custom_id'], 'body': {
+                'object': 'chat.completion', 'model': request['body']['model'],
+                'choices': [{'index': 0, 'message': message, 'finish_reason': 'function_call'}]
+            }}
+        }
+
+    async def _upload_file(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        upload = form['file']
+        stored = self._store_file(upload.file.read(), upload.filename, form.get('purpose', 'batch'))
+        return web.json_response({key: value for key, value in stored.items() if key != 'content'})
+
+    async def _file_content(self, request: web.Request) -> web.Response:
+        stored = self.files.get(request.match_info['file_id'])
+        if stored is None:
+            return web.json_response({'error': {'message': "No such File object"}}, status=404)
+        return web.Response(body=stored['content'], content_type='application/octet-stream')
+
+    async def _create_batch(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body['input_file_id'] not in self.files:
+            return web.json_response({'error': {'message': "No such File object"}}, status=400)
+        total = sum(1 for line in self.files[body['input_file_id']]['content'].splitlines() if line.strip())
+        batch_id = f"batch_{len(self.batches) + 1}"
+        self.batches[batch_id] = {
+            'id': batch_id, 'object': 'batch', 'endpoint': body['endpoint'],
+            'completion_window': body['completion_window'], 'input_file_id': body['input_file_id'],
+            'status': 'in_progress', 'created_at': int(time.time()), 'output_file_id': None, 'error_file_id': None,
+            'completed_at': None, 'metadata': body.get('metadata'),
+            'request_counts': {'total': total, 'completed': 0, 'failed': 0}
+        }
+        return web.json_response(self.batches[batch_id])
+
+    async def _list_batches(self, request: web.Request) -> web.Response:
+        # 新しい順
+        data = [self._batch_view(batch) for batch in reversed(list(self.batches.values()))]
+        return web.json_response({
+            'object': 'list', 'data': data, 'has_more': False,
+            'first_id': data[0]['id'] if data else None, 'last_id': data[-1]['id'] if data else None
+        })
+
+    async def _retrieve_batch(self, request: web.Request) -> web.Response:
+        batch = self.batches.get(request.match_info['batch_id'])
+        if batch is None:
+            return web.json_response({'error': {'message': "No such Batch object"}}, status=404)
+        return web.json_response(self._batch_view(batch))
+
+
+def run_fake_services(port_queue, channels: int, question_ratio: float, slack_delay_ms: float, seed: int = 0) -> None:
+    """FakeDiscordServer と FakeSlackServer を（ハーネスとは別のプロセスで）起動し、ポートを port_queue に返す"""
+    async def serve():
+        discord_server = FakeDiscordServer(channels=channels, question_ratio=question_ratio, seed=seed)
+        slack_server = FakeSlackServer(delay_ms=slack_delay_ms)
+        port_queue.put((await discord_server.start(), await slack_server.start()))
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
@@ -0,0 +1,417 @@
+"""
+ゲートウェイのマルチプロセス化: Discord のシャードごとにプロセスを分ける
+
+ゲートウェイプロセスは Discord からのイベントの受信と正規化（取り込みキューに渡すのと同じ辞書への変換）だけを行い、
+イベントをまとめてプロセス間キューに送る。SQLite を扱うのは保存プロセス（main.py）だけで、
+受け取ったイベントを従来どおり取り込みキューに渡す。
+チャンネル一覧は制御イベント（CHANNELS_EVENT）で送り、保存プロセスの ForwardedChannelRepository に反映する。
+Discord に接続しない run_fake_gateway_shard で、同じ経路を試験・計測できる。
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import queue as queue_module
+import random
+import signal
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config.settings import Settings, LOG_FORMAT
+from ..domain.entities import Channel
+from ..domain.repositories import ChannelRepository
+from .log_pipeline import LogPipeline
+
+
+# チャンネル一覧を送る制御イベント（取り込みキューには渡さない）
+CHANNELS_EVENT = 'channels'
+
+# Discord のスノーフレークIDの基準時刻（ミリ秒）
+DISCORD_EPOCH_MS = 1420070400000
+
+Event = Tuple[str, dict]
+
+
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    """ギルドを担当するシャード（Discord の割り当て規則）"""
+    return (guild_id >> 22) % shard_count
+
+
+class EventForwarder:
+    """ゲートウェイプロセス側で IngestQueue の代わりに使い、イベントをまとめてプロセス間キューに送る
+
+    submit / drain / stats は IngestQueue と同じなので DiscordClient はそのまま使える。
+    batch_size 件たまるか flush_interval 秒たつと送る（1件ずつ送るとプロセス間通信の費用が大きい）。
+    """
+
+    def __init__(self, event_queue, shard_id: int, batch_size: int = 200, flush_interval: float = 0.05):
+        self.event_queue = event_queue
+        self.shard_id = shard_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger(__name__)
+        self._buffer: List[Event] = []
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {'submitted': 0, 'batches': 0}
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_periodically(), name=f"gateway-forwarder-{self.shard_id}")
+
+    async def submit(self, event_type: str, data: dict) -> bool:
+        self._buffer.append((event_type, data))
+        self.counters['submitted'] += 1
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+        return True
+
+    async def flush(self) -> None:
+        """たまったイベントを送る（キューが満杯なら空くまで待つ）"""
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        await asyncio.to_thread(self.event_queue.put, batch)
+        self.counters['batches'] += 1
+
+    async def drain(self, timeout: float = 30.0) -> None:
+        """残りを送って停止"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.wait_for(self.flush(), timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, 'buffered': len(self._buffer)}
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+class ForwardedChannelRepository(ChannelRepository):
+    """ゲートウェイプロセスから送られたチャンネル一覧を保持するリポジトリ"""
+
+    def __init__(self):
+        self.channels: Dict[str, Channel] = {}
+        self.guilds: Dict[str, str] = {}
+
+    def update(self, data: dict) -> None:
+        """CHANNELS_EVENT の内容を反映"""
+        for item in data.get('channels', []):
+            self.channels[item['id']] = Channel(
+                id=item['id'], name=item['name'], is_lesson_channel=item['is_lesson_channel']
+            )
+            if item.get('guild_id'):
+                self.guilds[item['id']] = item['guild_id']
+
+    def guild_id_for_channel(self, channel_id: str) -> Optional[str]:
+        return self.guilds.get(channel_id)
+
+    async def get_lesson_channels(self) -> List[Channel]:
+        return [channel for channel in self.channels.values() if channel.is_lesson_channel]
+
+    async def get_channel(self, channel_id: str) -> Optional[Channel]:
+        return self.channels.get(channel_id)
+
+
+class GatewayEventReceiver:
+    """保存プロセス側でプロセス間キューからイベントを受け取り、取り込みキューに渡す"""
+
+    def __init__(
+        self,
+        event_queue,
+        ingest_queue,
+        channel_repo: ForwardedChannelRepository,
+        on_channels: Optional[Callable[[], Awaitable[None]]] = None
+    ):
+        self.event_queue = event_queue
+        self.ingest_queue = ingest_queue
+        self.channel_repo = channel_repo
+        self.on_channels = on_channels
+        self.logger = logging.getLogger(__name__)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.counters = {'received': 0, 'batches': 0}
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._receive(), name="gateway-receiver")
+
+    async def stop(self) -> None:
+        """キューが空になるまで受け取ってから止める（ゲートウェイプロセスを止めた後に呼ぶ）"""
+        if self._task:
+            # 取り出し中のバッチを捨てないよう、キャンセルせずに受信ループを終わらせる
+            self._stopping = True
+            try:
+                await self._task
+            finally:
+                self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters)
+
+    async def _receive(self) -> None:
+        while True:
+            batch = await asyncio.to_thread(self._get)
+            if batch is None:
+                if self._stopping:
+                    return
+                continue
+            self.counters['batches'] += 1
+            for event_type, data in batch:
+                if event_type == CHANNELS_EVENT:
+                    self.channel_repo.update(data)
+                    if self.on_channels:
+                        await self.on_channels()
+                    continue
+                self.counters['received'] += 1
+                await self.ingest_queue.submit(event_type, data)
+
+    def _get(self) -> Optional[List[Event]]:
+        # 停止できるようにタイムアウト付きで待つ
+        try:
+            return self.event_queue.get(timeout=0.5)
+        except queue_module.Empty:
+            return None
+
+
+class GatewaySupervisor:
+    """ゲートウェイプロセスを起動し、異常終了したら再起動する"""
+
+    def __init__(
+        self,
+        target: Callable[..., None],
+        shard_count: int,
+        event_queue,
+        kwargs: Optional[Dict[str, Any]] = None,
+        restart_delay: float = 5.0,
+        context=None
+    ):
+        self.target = target
+        self.shard_count = shard_count
+        self.event_queue = event_queue
+        self.kwargs = kwargs or {}
+        self.restart_delay = restart_delay
+        self.context = context or multiprocessing.get_context('spawn')
+        self.logger = logging.getLogger(__name__)
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.restarts = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        for shard_id in range(self.shard_count):
+            self._spawn(shard_id)
+        self._task = asyncio.create_task(self._monitor(), name="gateway-supervisor")
+        self.logger.info("ゲートウェイプロセスを %d 個起動しました", self.shard_count)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # SIGTERM を受けたゲートウェイプロセスは、たまっているイベントを送ってから終わる
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for shard_id, process in self.processes.items():
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                self.logger.warning("ゲートウェイプロセス %d が終了しないため強制終了します", shard_id)
+                process.kill()
+                await asyncio.to_thread(process.join)
+
+    async def wait(self) -> None:
+        """監視を続ける（停止されるまで戻らない）"""
+        if self._task:
+            await self._task
+
+    async def join(self) -> None:
+        """全プロセスの終了を待つ（正常終了したプロセスは再起動しない）"""
+        for process in list(self.processes.values()):
+            await asyncio.to_thread(process.join)
+
+    def _spawn(self, shard_id: int) -> None:
+        process = self.context.Process(
+            target=self.target,
+            args=(shard_id, self.shard_count, self.event_queue),
+            kwargs=self.kwargs,
+            name=f"gateway-shard-{shard_id}",
+            daemon=True
+        )
+        process.start()
+        self.processes[shard_id] = process
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            for shard_id, process in list(self.processes.items()):
+                if process.is_alive() or process.exitcode == 0:
+                    continue
+                self.logger.error(
+                    "ゲートウェイプロセス %d が終了しました（終了コード %s）。%.0f 秒後に再起動します",
+                    shard_id, process.exitcode, self.restart_delay
+                )
+                await asyncio.sleep(self.restart_delay)
+                self.restarts += 1
+                self._spawn(shard_id)
+
+
+# --- ゲートウェイプロセスの本体 ---
+
+def _cancel_on_terminate() -> None:
+    """SIGTERM で現在のタスクをキャンセルする（finally でイベントを送ってから終われるように）"""
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, RuntimeError):
+        # Windows ではシグナルハンドラを登録できない
+        pass
+
+
+def run_gateway_shard(shard_id: int, shard_count: int, event_queue, token: str) -> None:
+    """Discord に接続するゲートウェイプロセス"""
+    # ファイルへの出力は保存プロセスだけが行う（複数プロセスで同じファイルをローテーションしない）
+    LogPipeline(
+        level=Settings.LOG_LEVEL,
+        text_format=LOG_FORMAT,
+        json_console=Settings.LOG_JSON,
+        sample_per_second=Settings.LOG_SAMPLE_PER_SECOND,
+        sample_burst=Settings.LOG_SAMPLE_BURST
+    ).start()
+    asyncio.run(_run_gateway_shard(shard_id, shard_count, event_queue, token))
+
+
+async def _run_gateway_shard(shard_id: int, shard_count: int, event_queue, token: str) -> None:
+    # discord.py はゲートウェイプロセスでだけ読み込む
+    from .discord_client import DiscordClient
+
+    _cancel_on_terminate()
+    forwarder = EventForwarder(event_queue, shard_id)
+    await forwarder.start()
+    client = DiscordClient(
+        log_collection_service=None, ingest_queue=forwarder, shard_id=shard_id, shard_count=shard_count
+    )
+    try:
+        async with client:
+            await client.start(token)
+    except asyncio.CancelledError:
+        # 停止の指示
+        pass
+    finally:
+        await forwarder.drain()
+
+
+def run_fake_gateway_shard(
+    shard_id: int,
+    shard_count: int,
+    event_queue,
+    guilds: int = 8,
+    channels_per_guild: int = 4,
+    messages_per_channel: int = 100,
+    seed: int = 0
+) -> None:
+    """Discord に接続せず、このシャードが担当するギルドの合成イベントを送るゲートウェイプロセス
+
+    MESSAGE_CREATE 相当の JSON を作ってから解析・正規化するので、実際のゲートウェイプロセスと同程度の負荷になる。
+    """
+    async def emit() -> None:
+        _cancel_on_terminate()
+        try:
+            await emit_fake_gateway_events(
+                shard_id, shard_count, event_queue, guilds, channels_per_guild, messages_per_channel, seed
+            )
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(emit())
+
+
+async def emit_fake_gateway_events(
+    shard_id: int, shard_count: int, event_queue, guilds: int = 8, channels_per_guild: int = 4,
+    messages_per_channel: int = 100, seed: int = 0
+) -> None:
+    """合成イベントを event_queue に送る（同じプロセス内で queue.Queue に送ってもよい）"""
+    forwarder = EventForwarder(event_queue, shard_id)
+    await forwarder.start()
+    try:
+        await _emit_fake_events(
+            forwarder, shard_id, shard_count, guilds, channels_per_guild, messages_per_channel, seed
+        )
+    finally:
+        await forwarder.drain()
+
+
+async def _emit_fake_events(
+    forwarder: EventForwarder, shard_id: int, shard_count: int, guilds: int, channels_per_guild: int,
+    messages_per_channel: int, seed: int
+) -> None:
+
+    rng = random.Random(seed * 1000 + shard_id)
+    started = datetime.now(timezone.utc) - timedelta(hours=1)
+    guild_ids = [fake_snowflake(started + timedelta(milliseconds=index), 0) for index in range(guilds)]
+    mine = [guild_id for guild_id in guild_ids if shard_for_guild(guild_id, shard_count) == shard_id]
+
+    channels = [
+        {'id': str(guild_id + 1 + index), 'name': f"lesson-{guild_id % 1000}-{index}",
+         'is_lesson_channel': True, 'guild_id': str(guild_id)}
+        for guild_id in mine for index in range(channels_per_guild)
+    ]
+    await forwarder.submit(CHANNELS_EVENT, {'shard_id': shard_id, 'channels': channels})
+
+    for sequence in range(messages_per_channel):
+        for position, channel in enumerate(channels):
+            # ID は時刻・シャード番号・チャンネルの位置から一意に決める
+            moment = started + timedelta(seconds=sequence)
+            message_id = fake_snowflake(moment, position) + (shard_id % 32 << 17)
+            raw = json.dumps(fake_message_payload(rng, channel, moment, message_id))
+            await forwarder.submit('message', normalize_message_payload(json.loads(raw), channel['name']))
+
+
+def fake_snowflake(moment: datetime, sequence: int) -> int:
+    return ((int(moment.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22) + sequence % 4096
+
+
+def fake_message_payload(rng: random.Random, channel: dict, moment: datetime, message_id: int) -> dict:
+    """ゲートウェイの MESSAGE_CREATE と同じ形の合成データ"""
+    staff = rng.random() < 0.3
+    user_id = str(rng.randrange(10_000, 10_200) if not staff else rng.randrange(20_000, 20_020))
+    return {
+        'id': str(message_id),
+        'channel_id': channel['id'],
+        'guild_id': channel['guild_id'],
+        'content': "これはどうすればいいですか？" if rng.random() < 0.2 else "了解です",
+        'timestamp': moment.isoformat(),
+        'author': {'id': user_id, 'username': f"user{user_id}", 'global_name': f"ユーザー{user_id}"},
+        'member': {'roles': ['mentor'] if staff else ['student'], 'nick': None},
+        'reactions': [],
+        'attachments': [], 'embeds': [], 'mentions': [], 'mention_roles': [],
+        'pinned': False, 'tts': False, 'type': 0, 'flags': 0
+    }
+
+
+def normalize_message_payload(payload: dict, channel_name: str) -> dict:
+    """MESSAGE_CREATE を取り込みキューに渡す辞書に変換（DiscordClient._prepare_message_data と同じ形）"""
+    author = payload['author']
+    return {
+        'id': payload['id'],
+        'channel_id': payload['channel_id'],
+        'channel_name': channel_name,
+        'thread_id': None,
+        'content': payload['content'],
+        'timestamp': payload['timestamp'],
+        'reactions': [reaction['emoji']['name'] for reaction in payload.get('reactions', [])],
+        'author': {
+            'id': author['id'],
+            'username': author['username'],
+            'display_name': (payload.get('member') or {}).get('nick') or author.get('global_name') or author['username'],
+            'roles': (payload.get('member') or {}).get('roles', [])
+        }
+    }
@@ -0,0 +1,171 @@
+"""
+ログ出力基盤: イベントループを止めないログの書き出し・JSON 形式・間引き
+
+ログの呼び出し側（イベントループ）ではメッセージの埋め込みと相関IDの付与だけを行い、キューに積む。
+時刻の書式化・JSON 化・ファイルへの書き込み・ローテーションは QueueListener の書き込みスレッドで行う。
+同じ呼び出し箇所から大量に出る INFO 以下のログは SamplingFilter で間引き、間引いた件数を次のログに付ける。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from ..application.log_context import current_log_context
+
+
+class ContextFilter(logging.Filter):
+    """ログを出した時点の相関ID（メッセージID・チャンネルなど）を付ける
+
+    書き込みスレッドでは呼び出し側のコンテキストが取れないので、キューに積む前に付ける。
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = current_log_context()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """呼び出し箇所（ファイルと行）ごとに、level 以下のログを1秒あたり rate 件（最大 burst 件まで連続可）に間引く
+
+    間引いた件数は、その呼び出し箇所から次に出力されるログに suppressed として付ける。
+    複数のスレッドから呼ばれても止まらないようロックは使わない（件数は概数になることがある）。
+    """
+
+    def __init__(self, rate_per_second: float = 20, burst: int = 100, level: int = logging.INFO):
+        super().__init__()
+        self.rate = rate_per_second
+        self.burst = burst
+        self.level = level
+        self._buckets: Dict[Tuple[str, int], Tuple[float, float]] = {}
+        self._suppressed: Dict[Tuple[str, int], int] = {}
+        self.suppressed_total = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno > self.level:
+            return True
+
+        key = (record.pathname, record.lineno)
+        tokens, last = self._buckets.get(key, (self.burst, record.created))
+        tokens = min(self.burst, tokens + (record.created - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, record.created)
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            self.suppressed_total += 1
+            return False
+
+        self._buckets[key] = (tokens - 1, record.created)
+        suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class LoopQueueHandler(logging.handlers.QueueHandler):
+    """キューに積むだけのハンドラ（整形は書き込みスレッドで行う）"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 引数は後から変更されうるので埋め込みだけここで行う（標準の prepare は例外の整形までここで行う）
+        # ルートロガーのハンドラは最後に呼ばれるので、複製せずにそのまま書き換える
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1件の JSON 形式"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **getattr(record, 'context', {})
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextTextFormatter(logging.Formatter):
+    """従来のテキスト形式の末尾に相関IDと間引いた件数を付ける"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        extras = [f"{key}={value}" for key, value in getattr(record, 'context', {}).items()]
+        if getattr(record, 'suppressed', 0):
+            extras.append(f"suppressed={record.suppressed}")
+        return f"{text} [{' '.join(extras)}]" if extras else text
+
+
+class LogPipeline:
+    """ルートロガーに LoopQueueHandler を付け、書き込みスレッドで各出力先に書き出す"""
+
+    def __init__(
+        self,
+        level: str = "INFO",
+        text_format: str = logging.BASIC_FORMAT,
+        json_console: bool = False,
+        log_file: Optional[str] = None,
+        max_bytes: int = 10_000_000,
+        backup_count: int = 5,
+        sample_per_second: float = 20,
+        sample_burst: int = 100,
+        console: bool = True
+    ):
+        self.handlers: List[logging.Handler] = []
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(JsonFormatter() if json_console else ContextTextFormatter(text_format))
+            self.handlers.append(console_handler)
+        if log_file:
+            os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+            )
+            file_handler.setFormatter(JsonFormatter())
+            self.handlers.append(file_handler)
+
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.sampling = SamplingFilter(sample_per_second, sample_burst)
+        self.handler = LoopQueueHandler(self.queue)
+        # 間引かれるログには相関IDを付ける手間もかけない
+        self.handler.addFilter(self.sampling)
+        self.handler.addFilter(ContextFilter())
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.level = level
+        self._started = False
+
+    def start(self) -> 'LogPipeline':
+        """ルートロガーの出力先を置き換えて書き込みスレッドを開始"""
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(getattr(logging, self.level))
+        self.listener.start()
+        self._started = True
+        # stop() を呼ばずに終了しても残りを書き出す
+        atexit.register(self.stop)
+        return self
+
+    def stop(self) -> None:
+        """残りのログを書き出して書き込みスレッドを止める"""
+        if not self._started:
+            return
+        self._started = False
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {'queued': self.queue.qsize(), 'suppressed': self.sampling.suppressed_total}
@@ -0,0 +1,232 @@
+"""
+イベントループ監視: ループ遅延ウォッチドッグとサンプリングプロファイラ
+"""
+import asyncio
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass(order=True)
+class LoopStall:
+    """イベントループが停止していた区間の記録"""
+    duration_ms: float
+    started_at: datetime = field(compare=False)
+    stack: List[str] = field(compare=False, default_factory=list)
+
+    def summary(self) -> str:
+        """最も内側のフレームを要約"""
+        if not self.stack:
+            return "(スタック取得なし)"
+        return self.stack[-1].strip().splitlines()[0]
+
+
+class SamplingProfiler:
+    """ループスレッドのスタックを定期的に採取するサンプリングプロファイラ"""
+
+    def __init__(self, thread_id: int, interval_ms: float = 5.0, output_dir: str = "output"):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.output_dir = output_dir
+        self.samples: Counter = Counter()
+        self.started_at: Optional[datetime] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """サンプリングを開始"""
+        if self.is_running:
+            return
+        self.samples.clear()
+        self.started_at = datetime.now()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="loop-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        """サンプリングを停止し、collapsed stack 形式のファイルを書き出す"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = (self.started_at or datetime.now()).strftime('%Y%m%d_%H%M%S')
+        filepath = os.path.join(self.output_dir, f"profile_{timestamp}.folded")
+        with open(filepath, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return filepath
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        """フレームを root;...;leaf 形式の1行に変換"""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+
+class LoopLagWatchdog:
+    """イベントループの遅延を計測し、閾値超過時に原因のスタックを記録する"""
+
+    def __init__(
+        self,
+        threshold_ms: float = 250.0,
+        interval_ms: float = 100.0,
+        max_records: int = 10,
+        profiler_interval_ms: float = 5.0,
+        output_dir: str = "output"
+    ):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.max_records = max_records
+        self.profiler_interval_ms = profiler_interval_ms
+        self.output_dir = output_dir
+        self.logger = logging.getLogger(__name__)
+
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._pending_stall: Optional[Tuple[datetime, List[str]]] = None
+        self._lock = threading.Lock()
+        self._lags = deque(maxlen=1000)
+        self._max_lag = 0.0
+        self._stall_count = 0
+        self._slowest: List[LoopStall] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._monitor_thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self.profiler: Optional[SamplingProfiler] = None
+
+    async def start(self) -> None:
+        """ウォッチドッグを開始（イベントループ上で呼び出すこと）"""
+        if self._heartbeat_task:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop_event.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._monitor_thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._monitor_thread.start()
+        self.logger.info("ループ遅延ウォッチドッグを開始しました（閾値 %.0fms）", self.threshold * 1000)
+
+    async def stop(self) -> None:
+        """ウォッチドッグを停止"""
+        self._stop_event.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+        if self._monitor_thread:
+            # 監視スレッドは interval / 2 ごとに停止を確認するので、すぐに終わる
+            await asyncio.to_thread(self._monitor_thread.join)
+            self._monitor_thread = None
+        if self.profiler and self.profiler.is_running:
+            self.profiler.stop()
+
+    async def _heartbeat(self) -> None:
+        """一定間隔でスリープし、予定時刻とのずれを遅延として記録"""
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+
+            with self._lock:
+                self._last_beat = now
+                pending = self._pending_stall
+                self._pending_stall = None
+                self._lags.append(lag)
+                self._max_lag = max(self._max_lag, lag)
+
+            if lag >= self.threshold:
+                self._record_stall(lag, pending)
+
+    def _monitor(self) -> None:
+        """別スレッドからループの停止を検知し、停止中のスタックを採取"""
+        while not self._stop_event.wait(self.interval / 2):
+            with self._lock:
+                stalled_for = time.monotonic() - self._last_beat - self.interval
+                if stalled_for < self.threshold or self._pending_stall is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = traceback.format_stack(frame) if frame else []
+                self._pending_stall = (datetime.now(), stack)
+
+    def _record_stall(self, lag: float, pending: Optional[Tuple[datetime, List[str]]]) -> None:
+        """停止区間を記録し、遅い順に上位のみ保持"""
+        started_at, stack = pending if pending else (datetime.now(), [])
+        stall = LoopStall(duration_ms=lag * 1000, started_at=started_at, stack=stack)
+
+        with self._lock:
+            self._stall_count += 1
+            if len(self._slowest) < self.max_records:
+                heapq.heappush(self._slowest, stall)
+            else:
+                heapq.heappushpop(self._slowest, stall)
+
+        self.logger.warning(
+            "イベントループが %.0fms 停止しました: %s\n%s", stall.duration_ms, stall.summary(), "".join(stack[-8:])
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """遅延統計を取得"""
+        with self._lock:
+            lags = sorted(self._lags)
+        if not lags:
+            return {'samples': 0, 'last_ms': 0.0, 'p50_ms': 0.0, 'p99_ms': 0.0,
+                    'max_ms': 0.0, 'stalls': self._stall_count}
+
+        return {
+            'samples': len(lags),
+            'last_ms': self._lags[-1] * 1000,
+            'p50_ms': lags[len(lags) // 2] * 1000,
+            'p99_ms': lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+            'max_ms': self._max_lag * 1000,
+            'stalls': self._stall_count
+        }
+
+    def slowest_callbacks(self) -> List[LoopStall]:
+        """記録した停止区間を遅い順に取得"""
+        with self._lock:
+            return sorted(self._slowest, reverse=True)
+
+    def toggle_profiler(self) -> Optional[str]:
+        """プロファイラを切り替え。停止した場合は出力ファイルのパスを返す"""
+        if self.profiler and self.profiler.is_running:
+            filepath = self.profiler.stop()
+            self.logger.info("プロファイルを出力しました: %s", filepath)
+            return filepath
+
+        self.profiler = SamplingProfiler(
+            thread_id=self._loop_thread_id or threading.get_ident(),
+            interval_ms=self.profiler_interval_ms,
+            output_dir=self.output_dir
+        )
+        self.profiler.start()
+        self.logger.info("サンプリングプロファイラを開始しました")
+        return None
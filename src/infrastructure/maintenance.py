@@ -0,0 +1,312 @@
+"""
+データベースの定期メンテナンス: オンラインバックアップ・統計の更新・空き領域の解放
+
+どの処理も小さな単位に分けてスレッドで実行し、単位の間で書き込みロックを手放すので、
+メンテナンス中もメッセージの取り込みは待たされない（WAL モードが前提）。
+"""
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from ..domain import clock
+
+
+@dataclass
+class MaintenanceJob:
+    """定期実行する処理"""
+    name: str
+    interval: timedelta
+    func: Callable[[], Awaitable[object]]
+    quiet_hours_only: bool = False
+    next_run: Optional[datetime] = None
+    last_run: Optional[datetime] = None
+    last_seconds: float = 0.0
+    last_result: object = None
+    last_error: Optional[str] = None
+    runs: int = 0
+
+
+@dataclass
+class BackupResult:
+    """バックアップの結果"""
+    path: str
+    pages: int = 0
+    steps: int = 0
+    restarts: int = 0
+    single_step: bool = False
+    seconds: float = 0.0
+
+
+class _BackupRestarted(Exception):
+    """バックアップのやり直しが続いた"""
+
+
+@dataclass
+class VacuumResult:
+    """空き領域の解放の結果"""
+    freed_pages: int = 0
+    remaining_pages: int = 0
+    steps: int = 0
+    skipped: Optional[str] = None
+
+
+def parse_quiet_hours(value: str) -> Tuple[int, int]:
+    """"2-5" 形式の時間帯をパース（終了時刻は含まない。"22-4" のように日をまたいでもよい）"""
+    start, end = (int(part) for part in value.split('-', 1))
+    if not (0 <= start < 24 and 0 <= end <= 24):
+        raise ValueError(f"時間帯の指定が不正です: {value}")
+    return start, end
+
+
+class MaintenanceScheduler:
+    """SQLite ファイルの定期メンテナンス
+
+    - バックアップ: sqlite3 のバックアップ API で pages_per_step ページずつコピーする
+    - 統計の更新: PRAGMA optimize（必要なテーブルだけ ANALYZE される）
+    - 空き領域の解放: 静かな時間帯に PRAGMA incremental_vacuum を少しずつ実行する
+    ほかの定期処理（集計のまとめ・アーカイブなど）も add_job で同じスケジューラに載せられる。
+    処理は同時に1つずつ実行する。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        backup_dir: str = "backups",
+        backup_interval_hours: float = 24,
+        backup_keep: int = 7,
+        optimize_interval_hours: float = 6,
+        vacuum_interval_hours: float = 24,
+        quiet_hours: str = "2-5",
+        timezone: str = "Asia/Tokyo",
+        pages_per_step: int = 256,
+        step_sleep_ms: float = 20,
+        check_interval_seconds: float = 60,
+        max_backup_restarts: int = 3,
+        db_paths: Optional[List[str]] = None
+    ):
+        self.db_path = db_path
+        # シャーディング時は全シャードのファイルを順に処理する
+        self.db_paths = list(db_paths or [db_path])
+        self.backup_dir = backup_dir
+        self.backup_keep = backup_keep
+        self.quiet_hours = parse_quiet_hours(quiet_hours)
+        self.timezone = ZoneInfo(timezone)
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep_ms / 1000
+        self.check_interval = check_interval_seconds
+        self.max_backup_restarts = max_backup_restarts
+        self.logger = logging.getLogger(__name__)
+
+        self.jobs: Dict[str, MaintenanceJob] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._running: Optional[str] = None
+        self._lock = asyncio.Lock()
+
+        if backup_interval_hours > 0:
+            self.add_job("backup", timedelta(hours=backup_interval_hours), self.backup)
+        if optimize_interval_hours > 0:
+            self.add_job("optimize", timedelta(hours=optimize_interval_hours), self.optimize)
+        if vacuum_interval_hours > 0:
+            self.add_job("incremental_vacuum", timedelta(hours=vacuum_interval_hours),
+                         self.incremental_vacuum, quiet_hours_only=True)
+
+    def add_job(
+        self,
+        name: str,
+        interval: timedelta,
+        func: Callable[[], Awaitable[object]],
+        quiet_hours_only: bool = False
+    ) -> None:
+        """定期処理を登録（初回は次の確認時に実行される）"""
+        if name in self.jobs:
+            raise ValueError(f"メンテナンス処理が重複しています: {name}")
+        self.jobs[name] = MaintenanceJob(name=name, interval=interval, func=func, quiet_hours_only=quiet_hours_only)
+
+    async def start(self) -> None:
+        """スケジューラを開始"""
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._run(), name="db-maintenance")
+        self.logger.info("DBメンテナンスを開始しました（%s）", ', '.join(self.jobs))
+
+    async def stop(self) -> None:
+        """スケジューラを停止"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_quiet_hours(self, moment: Optional[datetime] = None) -> bool:
+        """静かな時間帯かどうか"""
+        hour = (moment or clock.now()).astimezone(self.timezone).hour
+        start, end = self.quiet_hours
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def stats(self) -> List[Dict[str, object]]:
+        """処理ごとの実行状況"""
+        return [
+            {
+                'name': job.name,
+                'runs': job.runs,
+                'last_run': job.last_run,
+                'next_run': job.next_run,
+                'last_seconds': job.last_seconds,
+                'last_result': job.last_result,
+                'last_error': job.last_error,
+                'running': job.name == self._running
+            }
+            for job in self.jobs.values()
+        ]
+
+    async def run_job(self, name: str) -> object:
+        """処理を今すぐ実行（他の処理の実行中はその完了を待つ）"""
+        job = self.jobs[name]
+        async with self._lock:
+            self._running = name
+            started = time.perf_counter()
+            try:
+                job.last_result = await job.func()
+                job.last_error = None
+                return job.last_result
+            except Exception as e:
+                job.last_error = str(e)
+                raise
+            finally:
+                self._running = None
+                job.runs += 1
+                job.last_run = clock.now()
+                job.last_seconds = time.perf_counter() - started
+                job.next_run = job.last_run + job.interval
+
+    async def _run(self) -> None:
+        while True:
+            for job in list(self.jobs.values()):
+                now = clock.now()
+                if job.next_run is not None and job.next_run > now:
+                    continue
+                if job.quiet_hours_only and not self.is_quiet_hours(now):
+                    continue
+                try:
+                    result = await self.run_job(job.name)
+                    self.logger.info("DBメンテナンス %s が完了しました（%.1f 秒）: %s", job.name, job.last_seconds, result)
+                except Exception as e:
+                    self.logger.error("DBメンテナンス %s でエラー: %s", job.name, e)
+            await asyncio.sleep(self.check_interval)
+
+    # --- バックアップ ---
+
+    async def backup(self) -> List[BackupResult]:
+        """オンラインバックアップを作成し、古いものを削除"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        results = []
+        for db_path in self.db_paths:
+            stem = os.path.splitext(os.path.basename(db_path))[0]
+            path = os.path.join(self.backup_dir, f"{stem}_{clock.now().strftime('%Y%m%d_%H%M%S')}.db")
+            results.append(await asyncio.to_thread(self._backup, db_path, path))
+            self._prune_backups(stem)
+        return results
+
+    def _backup(self, db_path: str, path: str) -> BackupResult:
+        result = BackupResult(path=path)
+        started = time.perf_counter()
+        previous = {'remaining': None}
+
+        def progress(status, remaining, total):
+            result.steps += 1
+            result.pages = total
+            # 他の接続から書き込まれるとコピーは最初からやり直しになる
+            if previous['remaining'] is not None and remaining > previous['remaining']:
+                result.restarts += 1
+                if result.restarts >= self.max_backup_restarts:
+                    raise _BackupRestarted()
+            previous['remaining'] = remaining
+
+        # 書き終えてから名前を変える（途中のファイルをバックアップと取り違えない）
+        temporary = path + '.tmp'
+        source = sqlite3.connect(db_path)
+        target = sqlite3.connect(temporary)
+        try:
+            try:
+                # ステップの間は元のDBのロックを手放して sleep 秒待つ
+                source.backup(target, pages=self.pages_per_step, progress=progress, sleep=self.step_sleep)
+            except _BackupRestarted:
+                # 書き込みが続いて終わらない場合は1回でコピーする
+                # （WAL では読み込みのスナップショットを取るだけなので書き込みは待たされない）
+                source.backup(target)
+                result.single_step = True
+        finally:
+            target.close()
+            source.close()
+        os.replace(temporary, path)
+
+        result.seconds = time.perf_counter() - started
+        return result
+
+    def _prune_backups(self, stem: str) -> None:
+        backups = sorted(glob.glob(os.path.join(self.backup_dir, f"{stem}_*.db")))
+        for path in backups[:-self.backup_keep] if self.backup_keep > 0 else []:
+            os.remove(path)
+
+    # --- 統計の更新 ---
+
+    async def optimize(self) -> str:
+        """クエリプランナーの統計を更新（変化の大きいテーブルだけ ANALYZE される）"""
+        results = [await asyncio.to_thread(self._optimize, db_path) for db_path in self.db_paths]
+        return " / ".join(results)
+
+    def _optimize(self, db_path: str) -> str:
+        with sqlite3.connect(db_path, timeout=30) as conn:
+            # 大きなテーブルでも短時間で終わるよう、サンプリングする行数を制限する
+            conn.execute("PRAGMA analysis_limit = 1000")
+            conn.execute("PRAGMA optimize")
+            checkpoint = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        return f"WAL {checkpoint[2]}/{checkpoint[1]} ページをチェックポイント"
+
+    # --- 空き領域の解放 ---
+
+    async def incremental_vacuum(self) -> List[VacuumResult]:
+        """静かな時間帯のあいだ、空きページを少しずつ解放する"""
+        return [await self._incremental_vacuum(db_path) for db_path in self.db_paths]
+
+    async def _incremental_vacuum(self, db_path: str) -> VacuumResult:
+        result = VacuumResult()
+        mode = await asyncio.to_thread(self._pragma, db_path, "auto_vacuum")
+        if mode != 2:
+            # auto_vacuum は VACUUM しないと切り替わらない（tools_db_maintenance.py enable-incremental-vacuum）
+            result.skipped = "auto_vacuum が INCREMENTAL ではありません"
+            return result
+
+        while self.is_quiet_hours():
+            freed, remaining = await asyncio.to_thread(self._vacuum_step, db_path)
+            result.steps += 1
+            result.freed_pages += freed
+            result.remaining_pages = remaining
+            if remaining == 0 or freed == 0:
+                break
+            # 取り込みの書き込みを先に通す
+            await asyncio.sleep(self.step_sleep)
+        return result
+
+    def _vacuum_step(self, db_path: str) -> Tuple[int, int]:
+        with sqlite3.connect(db_path, timeout=30) as conn:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute() だと1ステップ（1ページ）しか進まないので、最後まで実行される executescript() を使う
+            conn.executescript(f"PRAGMA incremental_vacuum({int(self.pages_per_step)});")
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return before - after, after
+
+    def _pragma(self, db_path: str, name: str) -> int:
+        with sqlite3.connect(db_path, timeout=30) as conn:
+            return conn.execute(f"PRAGMA {name}").fetchone()[0]
@@ -0,0 +1,272 @@
+"""
+メモリ監視: サブシステムごとの使用量の概算・RSS の定期採取・tracemalloc のスナップショット比較
+
+サブシステム（キャッシュ・キュー・discord.py のメッセージキャッシュなど）は件数と要素を返す関数として登録し、
+要素の一部だけを辿って1件あたりの大きさを求め、件数を掛けて概算する（全件を辿らない）。
+RSS は一定間隔で採取し、閾値を超えたら NotificationService で通知する（再通知までの間隔を空ける）。
+"""
+import asyncio
+import enum
+import itertools
+import logging
+import os
+import sys
+import tracemalloc
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from types import FunctionType, MethodType, ModuleType
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from ..domain import clock
+from ..domain.repositories import NotificationService
+
+# 件数と要素（大きさの見積もりに使う）を返す関数
+MemoryProvider = Callable[[], Tuple[int, Iterable[Any]]]
+
+# 辿らない（共有されていて要素ごとの大きさに含めない）型
+_SHARED_TYPES = (type, ModuleType, FunctionType, MethodType, enum.Enum)
+
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    """オブジェクトが参照するものを含めたおおよその大きさ（バイト）"""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _SHARED_TYPES) or current is None:
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, (str, bytes, bytearray, int, float, bool)):
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+        else:
+            attributes = getattr(current, '__dict__', None)
+            if attributes is not None:
+                stack.append(attributes)
+            for slot in getattr(type(current), '__slots__', ()):
+                stack.append(getattr(current, slot, None))
+    return size
+
+
+def estimate_bytes(count: int, items: Iterable[Any], sample: int = 64) -> int:
+    """先頭の sample 件の平均の大きさに件数を掛けた概算"""
+    if count <= 0:
+        return 0
+    seen: set = set()
+    sizes = [deep_sizeof(item, seen) for item in itertools.islice(items, sample)]
+    if not sizes:
+        return 0
+    return int(sum(sizes) / len(sizes) * count)
+
+
+def current_rss() -> Optional[int]:
+    """プロセスの RSS（バイト）。取得できない環境では最大 RSS、それもなければ None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@dataclass
+class MemoryUsage:
+    """サブシステム1つ分の使用量"""
+    name: str
+    items: int
+    bytes: int
+    error: Optional[str] = None
+
+
+@dataclass
+class MemorySnapshot:
+    """tracemalloc のスナップショットを前回と比較した結果"""
+    taken_at: datetime
+    traced_bytes: int
+    peak_bytes: int
+    lines: List[str]
+    filepath: Optional[str] = None
+    baseline: bool = False
+
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+class MemoryMonitor:
+    """サブシステムごとのメモリ使用量の概算と RSS の監視"""
+
+    def __init__(
+        self,
+        notification_service: Optional[NotificationService] = None,
+        interval_seconds: float = 60.0,
+        rss_alert_mb: float = 0.0,
+        alert_cooldown_minutes: float = 60.0,
+        history: int = 1440,
+        output_dir: str = "output",
+        trace_frames: int = 10
+    ):
+        self.notification_service = notification_service
+        self.interval = interval_seconds
+        # 0 なら通知しない
+        self.rss_alert_bytes = int(rss_alert_mb * 1024 * 1024)
+        self.alert_cooldown = timedelta(minutes=alert_cooldown_minutes)
+        self.output_dir = output_dir
+        self.trace_frames = trace_frames
+        self.providers: Dict[str, MemoryProvider] = {}
+        self.samples: Deque[Tuple[datetime, int]] = deque(maxlen=history)
+        self.alerts_sent = 0
+        self.logger = logging.getLogger(__name__)
+        self._last_alert: Optional[datetime] = None
+        self._previous_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # --- サブシステム ---
+
+    def register(self, name: str, provider: MemoryProvider) -> None:
+        """サブシステムを登録（provider は件数と要素を返す）"""
+        if name in self.providers:
+            raise ValueError(f"サブシステムが重複しています: {name}")
+        self.providers[name] = provider
+
+    def accounting(self) -> List[MemoryUsage]:
+        """サブシステムごとの使用量（大きい順）"""
+        usages = []
+        for name, provider in self.providers.items():
+            try:
+                count, items = provider()
+                usages.append(MemoryUsage(name=name, items=count, bytes=estimate_bytes(count, items)))
+            except Exception as e:
+                usages.append(MemoryUsage(name=name, items=0, bytes=0, error=str(e)))
+        return sorted(usages, key=lambda usage: usage.bytes, reverse=True)
+
+    # --- RSS の定期採取 ---
+
+    async def start(self) -> None:
+        """RSS の定期採取を開始"""
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._run(), name="memory-monitor")
+
+    async def stop(self) -> None:
+        """定期採取を停止（tracemalloc を使っていれば止める）"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.stop_tracing()
+
+    def stats(self) -> Dict[str, Any]:
+        """RSS の現在値・最大値と採取数"""
+        rss = [value for _, value in self.samples]
+        return {
+            'rss': rss[-1] if rss else current_rss(),
+            'max_rss': max(rss) if rss else None,
+            'samples': len(rss),
+            'alert_bytes': self.rss_alert_bytes,
+            'alerts_sent': self.alerts_sent,
+            'tracing': tracemalloc.is_tracing()
+        }
+
+    async def sample(self) -> Optional[int]:
+        """RSS を1回採取し、閾値を超えていれば通知する"""
+        rss = current_rss()
+        if rss is None:
+            return None
+        now = clock.now()
+        self.samples.append((now, rss))
+        if self.rss_alert_bytes and rss >= self.rss_alert_bytes:
+            if self._last_alert is None or now - self._last_alert >= self.alert_cooldown:
+                self._last_alert = now
+                await self._send_alert(rss)
+        return rss
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sample()
+            except Exception as e:
+                self.logger.error("メモリ使用量の採取でエラー: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def _send_alert(self, rss: int) -> None:
+        lines = [f"RSS が {format_bytes(rss)} になりました（閾値 {format_bytes(self.rss_alert_bytes)}）"]
+        for usage in self.accounting()[:5]:
+            lines.append(f"- {usage.name}: {usage.items} 件 / 約 {format_bytes(usage.bytes)}")
+        self.logger.warning("\n".join(lines))
+        if not self.notification_service:
+            return
+        try:
+            await self.notification_service.send_system_alert("memory", "\n".join(lines))
+            self.alerts_sent += 1
+        except Exception as e:
+            self.logger.error("メモリ使用量の通知に失敗しました: %s", e)
+
+    # --- tracemalloc ---
+
+    async def snapshot(self, top: int = 10) -> MemorySnapshot:
+        """スナップショットを取り、前回との差分（初回は追跡を開始して基準にする）を返す"""
+        return await asyncio.to_thread(self._snapshot, top)
+
+    def _snapshot(self, top: int) -> MemorySnapshot:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+            self._previous_snapshot = None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        traced, peak = tracemalloc.get_traced_memory()
+        taken_at = datetime.now()
+        previous, self._previous_snapshot = self._previous_snapshot, snapshot
+        if previous is None:
+            return MemorySnapshot(taken_at=taken_at, traced_bytes=traced, peak_bytes=peak, lines=[], baseline=True)
+
+        differences = snapshot.compare_to(previous, 'lineno')
+        lines = [
+            f"{format_bytes(diff.size_diff):>9} ({diff.count_diff:+d}) 計 {format_bytes(diff.size)} "
+            f"{diff.traceback.format()[0].strip()}"
+            for diff in differences[:top]
+        ]
+
+        # 全体の差分は呼び出し元のスタック付きでファイルに残す
+        os.makedirs(self.output_dir, exist_ok=True)
+        filepath = os.path.join(self.output_dir, f"memsnap_{taken_at.strftime('%Y%m%d_%H%M%S')}.txt")
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(f"traced {format_bytes(traced)} / peak {format_bytes(peak)}\n\n")
+            for diff in snapshot.compare_to(previous, 'traceback')[:100]:
+                f.write(f"{format_bytes(diff.size_diff)} ({diff.count_diff:+d}) 計 {format_bytes(diff.size)}\n")
+                for line in diff.traceback.format():
+                    f.write(f"    {line}\n")
+                f.write("\n")
+        return MemorySnapshot(taken_at=taken_at, traced_bytes=traced, peak_bytes=peak, lines=lines, filepath=filepath)
+
+    def stop_tracing(self) -> bool:
+        """tracemalloc を止める（追跡中だったかどうかを返す）"""
+        self._previous_snapshot = None
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        return True
@@ -0,0 +1,330 @@
+"""
+メッセージキャッシュ: チャンネルごとの直近メッセージをメモリに保持
+"""
+import bisect
+import logging
+import itertools
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from ..domain import clock
+from ..domain.entities import Message, MessageFeatures
+from ..domain.repositories import MessageRepository, DelegatingMessageRepository
+
+
+@dataclass
+class _ChannelBuffer:
+    """1チャンネル分の直近メッセージ（時刻順）
+
+    complete_since 以降のメッセージはすべて保持している（None はまだ読み込んでいない）。
+    """
+    messages: Deque[Message]
+    complete_since: Optional[datetime] = None
+
+    def covers(self, since: datetime) -> bool:
+        return self.complete_since is not None and self.complete_since <= since
+
+    def insert(self, message: Message) -> None:
+        """時刻順を保って追加（ほとんどは末尾への追加）"""
+        timestamp = clock.as_utc(message.timestamp)
+        if not self.messages or clock.as_utc(self.messages[-1].timestamp) <= timestamp:
+            self.messages.append(message)
+            return
+        keys = [clock.as_utc(m.timestamp) for m in self.messages]
+        self.messages.insert(bisect.bisect_right(keys, timestamp), message)
+
+    def since(self, since: datetime) -> List[Message]:
+        """指定時刻より後のメッセージ"""
+        result = []
+        for message in reversed(self.messages):
+            if clock.as_utc(message.timestamp) <= since:
+                break
+            result.append(message)
+        result.reverse()
+        return result
+
+    def find(self, message_id: str) -> Optional[int]:
+        for index in range(len(self.messages) - 1, -1, -1):
+            if self.messages[index].id == message_id:
+                return index
+        return None
+
+    def trim(self, cutoff: datetime) -> int:
+        """保持期間より古いメッセージを捨てる"""
+        removed = 0
+        while self.messages and clock.as_utc(self.messages[0].timestamp) < cutoff:
+            self.messages.popleft()
+            removed += 1
+        if self.complete_since is not None and self.complete_since < cutoff:
+            self.complete_since = cutoff
+        return removed
+
+
+class CachedMessageRepository(DelegatingMessageRepository):
+    """直近のメッセージをチャンネルごとにメモリに持つ MessageRepository
+
+    書き込みは下位のリポジトリに保存してからキャッシュに反映する。
+    直近 window_hours 以内の読み込みはキャッシュから返し、
+    未読み込みのチャンネルや保持期間より古い範囲は下位のリポジトリに問い合わせる。
+    全チャンネル合計で max_messages 件を超えたら、最も長く使われていないチャンネルから捨てる。
+    """
+
+    def __init__(self, backend: MessageRepository, window_hours: int = 24, max_messages: int = 200_000):
+        super().__init__(backend)
+        self.window = timedelta(hours=window_hours)
+        self.max_messages = max_messages
+        self._channels: "OrderedDict[str, _ChannelBuffer]" = OrderedDict()
+        self._thread_channels: Dict[str, str] = {}
+        # 読み込み中のチャンネルに保存されたメッセージ（読み込み結果に合わせる）と、そのチャンネルの読み込み数
+        self._pending: Dict[str, List[Message]] = {}
+        self._pending_loads: Dict[str, int] = {}
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted_channels = 0
+        self.logger = logging.getLogger(__name__)
+
+    # --- 読み込み ---
+
+    async def get_recent_messages(self, channel_id: str, hours: int = 24) -> List[Message]:
+        """最近のメッセージを取得（保持期間内ならキャッシュから返す）"""
+        # 保持期間の切り詰めより後に範囲を決める（同じ24時間の読み込みが常に外れないように）
+        buffer = self._touch(channel_id)
+        since = clock.hours_ago(hours)
+        if buffer and buffer.covers(since):
+            self.hits += 1
+            return buffer.since(since)
+
+        self.misses += 1
+        # 保持期間に収まるかは時間数で判定する（時刻を取り直すと同じ24時間の読み込みがわずかにはみ出す）
+        cacheable = timedelta(hours=hours) <= self.window
+        self._begin_load([channel_id])
+        try:
+            messages = await self.backend.get_recent_messages(channel_id, hours)
+            if cacheable:
+                self._load(channel_id, messages, since)
+        finally:
+            self._end_load([channel_id])
+        return messages
+
+    async def get_recent_messages_for_channels(
+        self, channel_ids: List[str], hours: int = 24
+    ) -> Dict[str, List[Message]]:
+        """キャッシュにないチャンネルだけを下位のリポジトリからまとめて取得"""
+        buffers = {channel_id: self._touch(channel_id) for channel_id in channel_ids}
+        since = clock.hours_ago(hours)
+        result: Dict[str, List[Message]] = {}
+        missing = []
+        for channel_id, buffer in buffers.items():
+            if buffer and buffer.covers(since):
+                self.hits += 1
+                result[channel_id] = buffer.since(since)
+            else:
+                self.misses += 1
+                missing.append(channel_id)
+
+        if missing:
+            cacheable = timedelta(hours=hours) <= self.window
+            self._begin_load(missing)
+            try:
+                fetched = await self.backend.get_recent_messages_for_channels(missing, hours)
+                for channel_id in missing:
+                    messages = fetched.get(channel_id, [])
+                    result[channel_id] = messages
+                    if cacheable:
+                        self._load(channel_id, messages, since)
+            finally:
+                self._end_load(missing)
+        return result
+
+    async def get_recent_thread_messages(self, thread_id: str, hours: int = 24) -> List[Message]:
+        """スレッドの最近のメッセージを取得（親チャンネルがキャッシュにあればそこから絞り込む）"""
+        channel_id = self._thread_channels.get(thread_id)
+        buffer = self._touch(channel_id) if channel_id else None
+        since = clock.hours_ago(hours)
+        if buffer and buffer.covers(since):
+            self.hits += 1
+            return [message for message in buffer.since(since) if message.thread_id == thread_id]
+
+        self.misses += 1
+        return await self.backend.get_recent_thread_messages(thread_id, hours)
+
+    # --- 書き込み ---
+
+    async def save_message(self, message: Message) -> bool:
+        """保存してからキャッシュに反映"""
+        inserted = await self.backend.save_message(message)
+        buffer = self._channels.get(message.channel_id)
+        if buffer is None:
+            # 読み込み中なら読み込み結果に合わせる（読み込みより後に保存されたものは結果に含まれないことがある）
+            pending = self._pending.get(message.channel_id)
+            if pending is not None and inserted:
+                pending.append(message)
+            # 読み込み前のチャンネルは、次の読み込みでまとめて取得する
+            return inserted
+
+        if message.thread_id:
+            self._thread_channels[message.thread_id] = message.channel_id
+        cached = None if inserted else self._cached(message.channel_id, message.id)
+        if cached is not None:
+            # 既存の行は本文とリアクションの一覧だけが更新される（確認済みかどうかは変わらない）
+            cached.content = message.content
+            cached.is_question = message.is_question
+            cached.features = message.features
+            cached.reactions.extend(emoji for emoji in message.reactions if emoji not in cached.reactions)
+        elif inserted and clock.as_utc(message.timestamp) >= clock.now() - self.window:
+            buffer.insert(message)
+            self._size += 1
+            self._trim(message.channel_id, buffer)
+            self._evict()
+        return inserted
+
+    async def update_message_content(
+        self, channel_id: str, message_id: str, content: str, features: MessageFeatures, edited_at: datetime
+    ) -> bool:
+        updated = await self.backend.update_message_content(channel_id, message_id, content, features, edited_at)
+        message = self._cached(channel_id, message_id)
+        if updated and message:
+            message.content = content
+            message.is_question = features.is_question
+            message.features = features
+            message.edited_at = edited_at
+        return updated
+
+    async def mark_message_deleted(self, channel_id: str, message_id: str, deleted_at: datetime) -> bool:
+        deleted = await self.backend.mark_message_deleted(channel_id, message_id, deleted_at)
+        buffer = self._channels.get(channel_id)
+        index = buffer.find(message_id) if buffer else None
+        if index is not None:
+            del buffer.messages[index]
+            self._size -= 1
+        return deleted
+
+    async def add_reaction(
+        self, channel_id: str, message_id: str, user_id: str, emoji: str, is_staff: bool
+    ) -> bool:
+        added = await self.backend.add_reaction(channel_id, message_id, user_id, emoji, is_staff)
+        message = self._cached(channel_id, message_id)
+        if added and message:
+            if emoji not in message.reactions:
+                message.reactions.append(emoji)
+            message.acknowledged = message.acknowledged or is_staff
+        return added
+
+    async def remove_reaction(self, channel_id: str, message_id: str, user_id: str, emoji: str) -> bool:
+        removed = await self.backend.remove_reaction(channel_id, message_id, user_id, emoji)
+        if removed and self._cached(channel_id, message_id):
+            # 他のユーザーのリアクションが残っているかはDBでないと分からないので読み直す
+            await self._refresh(channel_id, message_id)
+        return removed
+
+    # --- キャッシュ管理 ---
+
+    async def warm(self, channel_ids: List[str], hours: Optional[int] = None) -> None:
+        """起動時に直近のメッセージを読み込む"""
+        hours = hours or int(self.window.total_seconds() // 3600)
+        missing = [channel_id for channel_id in channel_ids if channel_id not in self._channels]
+        if not missing:
+            return
+        self._begin_load(missing)
+        try:
+            fetched = await self.backend.get_recent_messages_for_channels(missing, hours)
+            since = clock.hours_ago(hours)
+            for channel_id in missing:
+                self._load(channel_id, fetched.get(channel_id, []), since)
+        finally:
+            self._end_load(missing)
+        self.logger.info("メッセージキャッシュを読み込みました: %d チャンネル / %d 件", len(missing), self._size)
+
+    def stats(self) -> Dict[str, float]:
+        """キャッシュの統計"""
+        total = self.hits + self.misses
+        return {
+            'channels': len(self._channels),
+            'messages': self._size,
+            'max_messages': self.max_messages,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'evicted_channels': self.evicted_channels
+        }
+
+    def memory_items(self) -> Tuple[int, Iterator[Message]]:
+        """保持しているメッセージ数と、その要素（メモリ使用量の概算用）"""
+        return self._size, itertools.chain.from_iterable(buffer.messages for buffer in self._channels.values())
+
+    def _touch(self, channel_id: str) -> Optional[_ChannelBuffer]:
+        """チャンネルを最近使ったものとして取得"""
+        buffer = self._channels.get(channel_id)
+        if buffer is not None:
+            self._channels.move_to_end(channel_id)
+            self._trim(channel_id, buffer)
+        return buffer
+
+    def _begin_load(self, channel_ids: List[str]) -> None:
+        """下位のリポジトリからの読み込みを始める（終わるまでに保存されたメッセージを集める）"""
+        for channel_id in channel_ids:
+            self._pending.setdefault(channel_id, [])
+            self._pending_loads[channel_id] = self._pending_loads.get(channel_id, 0) + 1
+
+    def _end_load(self, channel_ids: List[str]) -> None:
+        for channel_id in channel_ids:
+            self._pending_loads[channel_id] -= 1
+            if not self._pending_loads[channel_id]:
+                del self._pending_loads[channel_id]
+                self._pending.pop(channel_id, None)
+
+    def _load(self, channel_id: str, messages: List[Message], since: datetime) -> None:
+        """下位のリポジトリから読み込んだ範囲でキャッシュを置き換える"""
+        buffer = self._channels.get(channel_id)
+        seen_ids = {message.id for message in messages}
+        merged: Deque[Message] = deque(messages)
+        # 読み込み中に保存されたメッセージを取りこぼさないよう合わせる
+        saved = list(self._pending.get(channel_id, []))
+        if buffer is not None:
+            self._size -= len(buffer.messages)
+            saved.extend(buffer.messages)
+        newer = []
+        for message in saved:
+            if message.id not in seen_ids and clock.as_utc(message.timestamp) > since:
+                seen_ids.add(message.id)
+                newer.append(message)
+
+        buffer = _ChannelBuffer(messages=merged, complete_since=clock.as_utc(since))
+        for message in newer:
+            buffer.insert(message)
+        for message in buffer.messages:
+            if message.thread_id:
+                self._thread_channels[message.thread_id] = channel_id
+
+        self._channels[channel_id] = buffer
+        self._channels.move_to_end(channel_id)
+        self._size += len(buffer.messages)
+        self._evict()
+
+    def _trim(self, channel_id: str, buffer: _ChannelBuffer) -> None:
+        self._size -= buffer.trim(clock.now() - self.window)
+
+    def _evict(self) -> None:
+        """上限を超えたら最も長く使われていないチャンネルから捨てる"""
+        while self._size > self.max_messages and len(self._channels) > 1:
+            channel_id, buffer = self._channels.popitem(last=False)
+            self._size -= len(buffer.messages)
+            self.evicted_channels += 1
+            for thread_id in {m.thread_id for m in buffer.messages if m.thread_id}:
+                if self._thread_channels.get(thread_id) == channel_id:
+                    del self._thread_channels[thread_id]
+
+    def _cached(self, channel_id: str, message_id: str) -> Optional[Message]:
+        buffer = self._channels.get(channel_id)
+        index = buffer.find(message_id) if buffer else None
+        return buffer.messages[index] if index is not None else None
+
+    async def _refresh(self, channel_id: str, message_id: str) -> None:
+        message = await self.backend.get_message(message_id)
+        buffer = self._channels.get(channel_id)
+        index = buffer.find(message_id) if buffer else None
+        if message and index is not None:
+            buffer.messages[index] = message
@@ -0,0 +1,300 @@
+"""
+OpenAI Batch API による振り返り以外の話題の一括分析
+
+その場での分析はチャンネルごとに API を呼ぶため費用とレート制限の負担が大きい。翌朝までに分かればよい分析は、
+1日分の会話のまとまり（セッション）ごとのリクエストを1行にした JSONL を作って Batch API に登録し、
+完了したら出力ファイルを1行ずつ読みながらアラートにする。
+
+ジョブの進み具合は analysis_batches テーブルに記録し、どの段階で中断しても続きから再開できる。
+    pending（入力ファイル作成済み）→ uploaded → submitted → completed（結果の取り込み中）→ done
+                                                          └→ failed（期限切れ・失敗で出力がない）
+アラートは (message_id, alert_type) で一意なので、結果を取り込み直しても同じアラートは通知されない。
+"""
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import aiosqlite
+
+from ..domain import clock
+from ..domain.entities import Alert, Message
+from ..domain.repositories import AlertRepository, ChannelRepository, MessageRepository, NotificationService
+from ..domain.services import Sessionizer
+from .openai_client import OpenAIAnalyzer
+
+# ジョブが終わった（これ以上進めない）状態
+FINISHED_STATUSES = ("done", "failed")
+# Batch API のバッチがこれ以上進まない状態
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+@dataclass
+class BatchJob:
+    """1日分の一括分析のジョブ"""
+    job_key: str
+    day: str
+    status: str
+    request_count: int = 0
+    input_path: Optional[str] = None
+    input_file_id: Optional[str] = None
+    batch_id: Optional[str] = None
+    output_file_id: Optional[str] = None
+    processed_lines: int = 0
+    alert_count: int = 0
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+
+class BatchJobStore:
+    """analysis_batches テーブルの読み書き"""
+
+    COLUMNS = (
+        "job_key", "day", "status", "request_count", "input_path", "input_file_id", "batch_id",
+        "output_file_id", "processed_lines", "alert_count", "error"
+    )
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    async def get(self, job_key: str) -> Optional[BatchJob]:
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM analysis_batches WHERE job_key = ?", (job_key,)
+            )
+            row = await cursor.fetchone()
+        return BatchJob(*row) if row else None
+
+    async def unfinished(self) -> List[BatchJob]:
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM analysis_batches WHERE status NOT IN (?, ?) ORDER BY day",
+                FINISHED_STATUSES
+            )
+            rows = await cursor.fetchall()
+        return [BatchJob(*row) for row in rows]
+
+    async def save(self, job: BatchJob) -> None:
+        now = clock.now().isoformat()
+        values = [getattr(job, column) for column in self.COLUMNS]
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(f"""
+                INSERT INTO analysis_batches ({', '.join(self.COLUMNS)}, created_at, updated_at)
+                VALUES ({', '.join('?' * len(self.COLUMNS))}, ?, ?)
+                ON CONFLICT (job_key) DO UPDATE SET
+                    {', '.join(f'{column} = excluded.{column}' for column in self.COLUMNS[1:])},
+                    updated_at = excluded.updated_at
+            """, (*values, now, now))
+            await db.commit()
+
+
+class OffTopicBatchRunner:
+    """1日分の会話を Batch API でまとめて分析し、結果をアラートにする"""
+
+    JOB_PREFIX = "off_topic"
+
+    def __init__(
+        self,
+        analyzer: OpenAIAnalyzer,
+        message_repo: MessageRepository,
+        alert_repo: AlertRepository,
+        notification_service: NotificationService,
+        channel_repo: ChannelRepository,
+        db_path: str,
+        work_dir: str = "batches",
+        sessionizer: Optional[Sessionizer] = None,
+        timezone: str = "Asia/Tokyo",
+        min_messages: int = 2,
+        max_window_messages: int = 80,
+        result_chunk_lines: int = 200
+    ):
+        self.analyzer = analyzer
+        self.message_repo = message_repo
+        self.alert_repo = alert_repo
+        self.notification_service = notification_service
+        self.channel_repo = channel_repo
+        self.store = BatchJobStore(db_path)
+        self.work_dir = work_dir
+        self.sessionizer = sessionizer or Sessionizer()
+        self.timezone = ZoneInfo(timezone)
+        self.min_messages = min_messages
+        self.max_window_messages = max_window_messages
+        self.result_chunk_lines = result_chunk_lines
+        self.logger = logging.getLogger(__name__)
+
+    def job_key(self, day: date) -> str:
+        return f"{self.JOB_PREFIX}:{day.isoformat()}"
+
+    # --- 実行 ---
+
+    async def run_pending(self) -> Dict[str, str]:
+        """前日分のジョブがなければ作成し、未完了のジョブを進められるところまで進める（定期実行用）"""
+        yesterday = (clock.now().astimezone(self.timezone) - timedelta(days=1)).date()
+        if await self.store.get(self.job_key(yesterday)) is None:
+            channels = await self.channel_repo.get_lesson_channels()
+            # 起動直後でチャンネル一覧がまだ届いていなければ、空のジョブで済ませずに次の回に作る
+            if channels:
+                await self.prepare(yesterday, [channel.id for channel in channels])
+
+        results = {}
+        for job in await self.store.unfinished():
+            job = await self.advance(job)
+            results[job.job_key] = job.status
+        return results
+
+    async def run(
+        self, day: date, channel_ids: List[str], wait: bool = False, poll_interval: float = 60
+    ) -> BatchJob:
+        """指定日のジョブを作成（済みなら再開）して進める。wait なら完了まで待つ"""
+        job = await self.store.get(self.job_key(day)) or await self.prepare(day, channel_ids)
+        job = await self.advance(job)
+        while wait and not job.finished:
+            await asyncio.sleep(poll_interval)
+            job = await self.advance(job)
+        return job
+
+    async def advance(self, job: BatchJob) -> BatchJob:
+        """ジョブを進められるところまで進める（バッチの処理待ちになったら戻る）"""
+        try:
+            if job.status == "pending":
+                job.input_file_id = await self.analyzer.upload_batch_file(job.input_path)
+                job.status = "uploaded"
+                await self.store.save(job)
+                self.logger.info("一括分析の入力をアップロードしました: %s (%d 件)", job.job_key, job.request_count)
+
+            if job.status == "uploaded":
+                batch = await self.analyzer.find_batch(job.input_file_id) or await self.analyzer.create_batch(
+                    job.input_file_id, {'job_key': job.job_key}
+                )
+                job.batch_id = batch.id
+                job.status = "submitted"
+                await self.store.save(job)
+                self.logger.info("一括分析を登録しました: %s -> %s", job.job_key, batch.id)
+
+            if job.status == "submitted":
+                batch = await self.analyzer.get_batch(job.batch_id)
+                if batch.status not in BATCH_FINAL_STATUSES:
+                    return job
+                if batch.output_file_id:
+                    # 期限切れでも処理済みの分は出力される
+                    job.output_file_id = batch.output_file_id
+                    job.status = "completed"
+                else:
+                    job.status = "failed"
+                    job.error = f"バッチが {batch.status} になり、出力がありません"
+                await self.store.save(job)
+
+            if job.status == "completed":
+                await self._import_results(job)
+                job.status = "done"
+                job.error = None
+                await self.store.save(job)
+                self.logger.info("一括分析の結果を取り込みました: %s (アラート %d 件)", job.job_key, job.alert_count)
+        except Exception as e:
+            # 状態は最後に進んだ段階のまま残るので、次の実行で続きから再開する
+            job.error = str(e)
+            await self.store.save(job)
+            self.logger.error("一括分析 %s でエラー（%s の段階から再開します）: %s", job.job_key, job.status, e)
+        return job
+
+    # --- 入力の作成 ---
+
+    async def prepare(self, day: date, channel_ids: List[str]) -> BatchJob:
+        """指定日の会話のまとまりごとにリクエストを作り、入力ファイルとジョブを保存する"""
+        job_key = self.job_key(day)
+        os.makedirs(self.work_dir, exist_ok=True)
+        input_path = os.path.join(self.work_dir, f"{job_key.replace(':', '_')}.jsonl")
+
+        windows = await self._collect_windows(day, channel_ids)
+        # 入力ファイルと、結果を突き合わせるための各リクエストのメッセージIDを書き出す（作り直しても同じ内容）
+        await asyncio.to_thread(self._write_input, input_path, windows)
+
+        job = BatchJob(job_key=job_key, day=day.isoformat(), status="pending", request_count=len(windows),
+                       input_path=input_path)
+        if not windows:
+            job.status = "done"
+        await self.store.save(job)
+        return job
+
+    async def _collect_windows(self, day: date, channel_ids: List[str]) -> List[Tuple[str, List[Message]]]:
+        """その日の会話をチャンネル・スレッドごとのセッションに分け、(custom_id, メッセージ) の一覧にする"""
+        since = datetime.combine(day, dt_time.min, self.timezone)
+        until = since + timedelta(days=1)
+        windows: List[Tuple[str, List[Message]]] = []
+
+        def close(messages: List[Message]) -> None:
+            if len(messages) >= self.min_messages:
+                first = messages[0]
+                windows.append((f"{first.channel_id}:{first.thread_id or '-'}:{first.id}", messages))
+
+        for channel_id in channel_ids:
+            open_windows: Dict[Optional[str], Tuple[object, List[Message]]] = {}
+            async for message in self.message_repo.iter_channel_messages(channel_id, since=since, until=until):
+                session, messages = open_windows.get(message.thread_id, (None, []))
+                applied = self.sessionizer.apply(session, message)
+                if applied is not session or len(messages) >= self.max_window_messages:
+                    close(messages)
+                    messages = []
+                messages.append(message)
+                open_windows[message.thread_id] = (applied, messages)
+            for _, messages in open_windows.values():
+                close(messages)
+        return windows
+
+    def _write_input(self, input_path: str, windows: List[Tuple[str, List[Message]]]) -> None:
+        with open(input_path + ".tmp", "w", encoding="utf-8") as f:
+            for custom_id, messages in windows:
+                f.write(json.dumps(self.analyzer.batch_request(custom_id, messages), ensure_ascii=False) + "\n")
+        with open(self._windows_path(input_path) + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({custom_id: [message.id for message in messages] for custom_id, messages in windows}, f)
+        os.replace(input_path + ".tmp", input_path)
+        os.replace(self._windows_path(input_path) + ".tmp", self._windows_path(input_path))
+
+    @staticmethod
+    def _windows_path(input_path: str) -> str:
+        return input_path[:-len(".jsonl")] + ".windows.json"
+
+    # --- 結果の取り込み ---
+
+    async def _import_results(self, job: BatchJob) -> None:
+        """出力ファイルを1行ずつ読み、result_chunk_lines 行ごとにアラートを保存・通知して進み具合を記録する"""
+        with open(self._windows_path(job.input_path), encoding="utf-8") as f:
+            windows: Dict[str, List[str]] = json.load(f)
+
+        chunk: List[dict] = []
+        line_number = 0
+        async for line in self.analyzer.iter_file_lines(job.output_file_id):
+            line_number += 1
+            if line_number <= job.processed_lines:
+                # 前回までに取り込んだ行
+                continue
+            chunk.append(json.loads(line))
+            if len(chunk) >= self.result_chunk_lines:
+                await self._import_chunk(job, chunk, windows)
+                chunk = []
+        if chunk:
+            await self._import_chunk(job, chunk, windows)
+
+    async def _import_chunk(self, job: BatchJob, results: List[dict], windows: Dict[str, List[str]]) -> None:
+        message_ids = [message_id for result in results for message_id in windows.get(result.get("custom_id"), [])]
+        messages = await self.message_repo.get_messages(message_ids)
+
+        alerts: List[Alert] = []
+        for result in results:
+            window = [messages[message_id] for message_id in windows.get(result.get("custom_id"), [])
+                      if message_id in messages]
+            alerts.extend(self.analyzer.alerts_from_batch_result(result, window))
+
+        new_alerts = await self.alert_repo.save_alerts(alerts)
+        if new_alerts:
+            await self.notification_service.send_alerts(new_alerts)
+        job.processed_lines += len(results)
+        job.alert_count += len(new_alerts)
+        await self.store.save(job)
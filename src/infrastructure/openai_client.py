@@ -2,18 +2,24 @@
 OpenAI API クライアント実装
 """
 from openai import AsyncOpenAI
-from typing import List, Dict, Any
+from typing import Any, AsyncIterator, Dict, List, Optional
 import logging
 import json
 
-from ..domain.entities import Message, Alert
+from ..domain.entities import Message, Alert, Channel, Session
+from ..domain.repositories import MessageRepository
 
 
 class OpenAIAnalyzer:
     """OpenAI API を使用したメッセージ分析"""
     
-    def __init__(self, api_key: str):
-        self.client = AsyncOpenAI(api_key=api_key)
+    # Batch API で実行するエンドポイント
+    BATCH_ENDPOINT = "/v1/chat/completions"
+    
+    def __init__(self, api_key: str, base_url: Optional[str] = None, model: str = "gpt-4o-mini"):
+        # base_url を指定するとローカルの代替サーバーなどに接続する（省略時は https://api.openai.com/v1）
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        self.model = model
         self.logger = logging.getLogger(__name__)
     
     async def analyze_off_topic_conversation(self, messages: List[Message]) -> List[Alert]:
@@ -22,65 +28,77 @@ class OpenAIAnalyzer:
             return []
         
         try:
-            # メッセージを分析用のテキストに変換
-            conversation_text = self._format_messages_for_analysis(messages)
-            
             # GPT-4.1 で分析
-            response = await self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self._get_analysis_system_prompt()
-                    },
-                    {
-                        "role": "user",
-                        "content": f"以下の会話を分析してください：\n\n{conversation_text}"
-                    }
-                ],
-                functions=[
-                    {
-                        "name": "detect_off_topic",
-                        "description": "振り返り以外の話題を検出する",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "off_topic_messages": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "object",
-                                        "properties": {
-                                            "message_id": {"type": "string"},
-                                            "reason": {"type": "string"},
-                                            "topic_type": {"type": "string"},
-                                            "severity": {"type": "string", "enum": ["low", "medium", "high"]}
-                                        },
-                                        "required": ["message_id", "reason", "topic_type", "severity"]
-                                    }
-                                }
-                            },
-                            "required": ["off_topic_messages"]
-                        }
-                    }
-                ],
-                function_call="auto"
-            )
+            response = await self.client.chat.completions.create(**self._chat_request(messages))
             
             # 結果を解析してアラートを生成
             return self._process_analysis_result(response, messages)
             
         except Exception as e:
-            self.logger.error(f"OpenAI分析エラー: {e}")
+            self.logger.error("OpenAI分析エラー: %s", e)
             return []
     
+    def _chat_request(self, messages: List[Message]) -> Dict[str, Any]:
+        """分析のリクエスト本文（その場で呼ぶ場合と Batch API の1行で共通）"""
+        # メッセージを分析用のテキストに変換
+        conversation_text = self._format_messages_for_analysis(messages)
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": self._get_analysis_system_prompt()
+                },
+                {
+                    "role": "user",
+                    "content": f"以下の会話を分析してください：\n\n{conversation_text}"
+                }
+            ],
+            "functions": [
+                {
+                    "name": "detect_off_topic",
+                    "description": "振り返り以外の話題を検出する",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "off_topic_messages": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "message_id": {"type": "string"},
+                                        "reason": {"type": "string"},
+                                        "topic_type": {"type": "string"},
+                                        "severity": {"type": "string", "enum": ["low", "medium", "high"]}
+                                    },
+                                    "required": ["message_id", "reason", "topic_type", "severity"]
+                                }
+                            }
+                        },
+                        "required": ["off_topic_messages"]
+                    }
+                }
+            ],
+            "function_call": "auto"
+        }
+    
+    async def analyze_sessions(self, sessions: List[Session], message_repo: MessageRepository) -> List[Alert]:
+        """会話セッションを1つの分析単位として振り返り以外の話題を検出"""
+        alerts = []
+        for session in sessions:
+            messages = await message_repo.get_session_messages(session)
+            alerts.extend(await self.analyze_off_topic_conversation(messages))
+        return alerts
+    
     def _format_messages_for_analysis(self, messages: List[Message]) -> str:
         """メッセージを分析用テキストに変換"""
         formatted_messages = []
         
         for msg in messages:
             user_type = "運営" if not msg.user.is_student_side() else "生徒"
+            # 結果の message_id と突き合わせられるようにIDも渡す
             formatted_messages.append(
-                f"[{msg.timestamp.strftime('%H:%M')}] {msg.user.display_name}({user_type}): {msg.content}"
+                f"[{msg.timestamp.strftime('%H:%M')}] (id:{msg.id}) {msg.user.display_name}({user_type}): {msg.content}"
             )
         
         return "\n".join(formatted_messages)
@@ -111,25 +129,25 @@ Discord上の会話を分析し、振り返り以外の話題を検出してく
     
     def _process_analysis_result(self, response, messages: List[Message]) -> List[Alert]:
         """分析結果を処理してアラートを生成"""
+        function_call = response.choices[0].message.function_call
+        if not function_call:
+            return []
+        return self._alerts_from_arguments(function_call.arguments, messages)
+    
+    def _alerts_from_arguments(self, arguments: str, messages: List[Message]) -> List[Alert]:
+        """detect_off_topic の引数（JSON）からアラートを生成"""
         alerts = []
         
-        if not response.choices[0].message.function_call:
-            return alerts
-        
         try:
-            function_args = json.loads(response.choices[0].message.function_call.arguments)
+            function_args = json.loads(arguments)
             off_topic_messages = function_args.get("off_topic_messages", [])
             
+            # メッセージIDに対応するメッセージを検索
+            by_id = {msg.id: msg for msg in messages}
             for off_topic_msg in off_topic_messages:
-                # メッセージIDに対応するメッセージを検索
-                target_message = None
-                for msg in messages:
-                    if msg.id == off_topic_msg["message_id"]:
-                        target_message = msg
-                        break
+                target_message = by_id.get(str(off_topic_msg.get("message_id")))
                 
                 if target_message:
-                    from ..domain.entities import Channel  # 遅延インポートで循環依存を回避
                     alert = Alert(
                         channel=Channel(
                             id=target_message.channel_id,
@@ -143,11 +161,67 @@ Discord上の会話を分析し、振り返り以外の話題を検出してく
                     )
                     alerts.append(alert)
         
-        except json.JSONDecodeError as e:
-            self.logger.error(f"OpenAI応答の解析エラー: {e}")
+        except (json.JSONDecodeError, KeyError, AttributeError) as e:
+            self.logger.error("OpenAI応答の解析エラー: %s", e)
         
         return alerts
     
+    # --- Batch API ---
+    
+    def batch_request(self, custom_id: str, messages: List[Message]) -> Dict[str, Any]:
+        """Batch API の入力ファイル（JSONL）の1行"""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": self.BATCH_ENDPOINT,
+            "body": self._chat_request(messages)
+        }
+    
+    def alerts_from_batch_result(self, result: Dict[str, Any], messages: List[Message]) -> List[Alert]:
+        """Batch API の出力ファイルの1行からアラートを生成（失敗したリクエストは空）"""
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            self.logger.warning("バッチのリクエストが失敗しました: %s %s", result.get("custom_id"), result.get("error"))
+            return []
+        
+        choices = response.get("body", {}).get("choices") or [{}]
+        function_call = choices[0].get("message", {}).get("function_call")
+        if not function_call:
+            return []
+        return self._alerts_from_arguments(function_call.get("arguments", "{}"), messages)
+    
+    async def upload_batch_file(self, path: str) -> str:
+        """入力ファイルをアップロードしてファイルIDを返す"""
+        with open(path, "rb") as f:
+            uploaded = await self.client.files.create(file=f, purpose="batch")
+        return uploaded.id
+    
+    async def create_batch(self, input_file_id: str, metadata: Dict[str, str]):
+        """バッチを登録（24時間以内に処理される）"""
+        return await self.client.batches.create(
+            input_file_id=input_file_id,
+            endpoint=self.BATCH_ENDPOINT,
+            completion_window="24h",
+            metadata=metadata
+        )
+    
+    async def find_batch(self, input_file_id: str):
+        """同じ入力ファイルで登録済みのバッチ（登録した直後に中断した場合の二重登録を防ぐ）"""
+        async for batch in self.client.batches.list(limit=100):
+            if batch.input_file_id == input_file_id:
+                return batch
+        return None
+    
+    async def get_batch(self, batch_id: str):
+        return await self.client.batches.retrieve(batch_id)
+    
+    async def iter_file_lines(self, file_id: str) -> AsyncIterator[str]:
+        """出力ファイルを1行ずつ読む（ファイル全体をメモリに載せない）"""
+        async with self.client.files.with_streaming_response.content(file_id) as response:
+            async for line in response.iter_lines():
+                if line:
+                    yield line
+    
     async def test_connection(self) -> bool:
         """OpenAI接続テスト"""
         try:
@@ -159,5 +233,5 @@ Discord上の会話を分析し、振り返り以外の話題を検出してく
             self.logger.info("OpenAI接続成功")
             return True
         except Exception as e:
-            self.logger.error(f"OpenAI接続失敗: {e}")
+            self.logger.error("OpenAI接続失敗: %s", e)
             return False
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""
+リプレイ用のインフラ実装（Discord/Slack に接続しない）
+"""
+import logging
+from typing import Dict, List, Optional
+
+from config.settings import LESSON_CHANNEL_KEYWORDS
+from ..domain.entities import Alert, Channel
+from ..domain.repositories import ChannelRepository, NotificationService
+
+
+class ReplayChannelRepository(ChannelRepository):
+    """リプレイしたイベントからチャンネル情報を組み立てるリポジトリ"""
+
+    def __init__(self):
+        self.channels: Dict[str, Channel] = {}
+
+    def observe(self, event) -> None:
+        """イベントに含まれるチャンネルを登録"""
+        channel_id = event.data.get('channel_id')
+        if not channel_id or channel_id in self.channels:
+            return
+
+        name = event.data.get('channel_name', '')
+        self.channels[channel_id] = Channel(
+            id=channel_id,
+            name=name,
+            is_lesson_channel=any(keyword in name.lower() for keyword in LESSON_CHANNEL_KEYWORDS)
+        )
+
+    async def get_lesson_channels(self) -> List[Channel]:
+        """レッスンチャンネル一覧を取得"""
+        return [channel for channel in self.channels.values() if channel.is_lesson_channel]
+
+    async def get_channel(self, channel_id: str) -> Optional[Channel]:
+        """チャンネル情報を取得"""
+        return self.channels.get(channel_id)
+
+
+class LoggingNotificationService(NotificationService):
+    """アラートをログに出力するだけの通知サービス"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.sent_alerts = 0
+
+    async def send_alert(self, alert: Alert) -> None:
+        """アラートをログに出力"""
+        self.sent_alerts += 1
+        self.logger.info(
+            "[%s] #%s %s: %s", alert.alert_type, alert.channel.name, alert.message.id, alert.description
+        )
+
+    async def send_system_alert(self, title: str, description: str) -> None:
+        """運用上の通知をログに出力"""
+        self.sent_alerts += 1
+        self.logger.warning("[%s] %s", title, description)
@@ -0,0 +1,271 @@
+"""
+集計・出力用の分析エンジン（DuckDB）
+
+長期間の集計や件数の多い出力を、SQLite のファイルとアーカイブ（圧縮 JSONL）を DuckDB から
+読み取り専用で参照して列単位で実行する。結果はデータフレームのまま返し、Message への変換は行わない。
+SQLite は WAL モードなので、読み込み中も取り込み側の書き込みは止まらない。
+
+duckdb は任意の依存で、REPORTING_BACKEND=duckdb のときだけ読み込む（なければ従来の集計を使う）。
+"""
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+from ..domain import clock
+from ..domain.entities import STAFF_ROLES
+from ..domain.repositories import LOG_TABLE_COLUMNS, LogTableSource
+from .analytics import ResponseTimeAnalytics
+
+if TYPE_CHECKING:
+    import duckdb
+    import pandas as pd
+
+
+STAFF_ROLE_LIST = "[{}]".format(", ".join(f"'{role.value}'" for role in sorted(STAFF_ROLES, key=lambda r: r.value)))
+
+# シャードのDBから読む列（sqlite_all_varchar で文字列として読み、型は MESSAGES_VIEW でそろえる）
+SHARD_SELECT = """
+    SELECT m.id, m.channel_id, m.channel_name, m.user_id, u.username, u.display_name, u.roles, m.content,
+           m.timestamp, m.is_question, m.thread_id,
+           COALESCE(r.emojis, CASE WHEN json_valid(m.reactions) THEN from_json(m.reactions, '["VARCHAR"]') END)
+               AS reactions,
+           m.question_score, m.has_code_block, m.mention_count, m.url_count, m.content_length
+    FROM {db}.messages m
+    JOIN {db}.users u ON m.user_id = u.id
+    LEFT JOIN (
+        SELECT message_id, list(DISTINCT emoji ORDER BY emoji) AS emojis
+        FROM {db}.message_reactions GROUP BY message_id
+    ) r ON r.message_id = m.id
+    WHERE m.deleted_at IS NULL
+"""
+
+# アーカイブのレコード（MessageArchiver._row_to_record）の列と型
+ARCHIVE_COLUMNS = {
+    'id': 'VARCHAR', 'channel_id': 'VARCHAR', 'channel_name': 'VARCHAR', 'user_id': 'VARCHAR',
+    'username': 'VARCHAR', 'display_name': 'VARCHAR', 'roles': 'VARCHAR', 'content': 'VARCHAR',
+    'timestamp': 'VARCHAR', 'is_question': 'VARCHAR', 'thread_id': 'VARCHAR', 'reactions': 'VARCHAR[]',
+    'question_score': 'VARCHAR', 'has_code_block': 'VARCHAR', 'mention_count': 'VARCHAR', 'url_count': 'VARCHAR',
+    'content_length': 'VARCHAR', 'deleted_at': 'VARCHAR'
+}
+ARCHIVE_SELECT = """
+    SELECT id, channel_id, channel_name, user_id, username, display_name, roles, content,
+           timestamp, is_question, thread_id, reactions,
+           question_score, has_code_block, mention_count, url_count, content_length
+    FROM read_json({files}, format = 'newline_delimited', columns = {columns})
+    WHERE deleted_at IS NULL
+"""
+
+# DB とアーカイブのメッセージを同じ型にそろえたビュー（ts_key は SQLite と同じ文字列の時刻で、範囲の絞り込みに使う）
+MESSAGES_VIEW = """
+    CREATE OR REPLACE TEMP VIEW messages_all AS
+    WITH raw AS ({sources}),
+    typed AS (
+        SELECT id, channel_id, channel_name, user_id, username, display_name, content,
+               timestamp AS ts_key,
+               CAST(timestamp AS TIMESTAMPTZ) AS ts,
+               CASE WHEN json_valid(roles) THEN from_json(roles, '["VARCHAR"]') ELSE ['student'] END AS roles,
+               is_question IN ('1', 'true', 'True') AS is_question,
+               thread_id,
+               COALESCE(reactions, []) AS reactions,
+               TRY_CAST(question_score AS DOUBLE) AS question_score,
+               has_code_block IN ('1', 'true', 'True') AS has_code_block,
+               TRY_CAST(mention_count AS INTEGER) AS mention_count,
+               TRY_CAST(url_count AS INTEGER) AS url_count,
+               TRY_CAST(content_length AS INTEGER) AS content_length
+        FROM raw
+    )
+    SELECT *, list_has_any(roles, {staff_roles}) AS is_staff FROM typed
+"""
+
+
+def duckdb_available() -> bool:
+    """duckdb がインストールされているか（読み込みはしない）"""
+    return importlib.util.find_spec("duckdb") is not None
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+class DuckDBReporting(ResponseTimeAnalytics, LogTableSource):
+    """DuckDB で SQLite のDB（全シャード）とアーカイブをまとめて集計する
+
+    返信時間の集計は ResponseTimeAnalytics と同じ結果をウィンドウ関数で求める（アーカイブ済みの期間も含む）。
+    """
+
+    def __init__(
+        self,
+        db_paths: Sequence[str],
+        archive_dir: Optional[str] = None,
+        timezone: str = "Asia/Tokyo",
+        threads: Optional[int] = None,
+        memory_limit: Optional[str] = None
+    ):
+        super().__init__(db_path=db_paths[0], timezone=timezone, db_paths=db_paths)
+        self.archive_dir = archive_dir
+        self.threads = threads
+        self.memory_limit = memory_limit
+
+    # --- 接続 ---
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        """集計1回分の接続（DB は読み取り専用で添付し、アーカイブの一覧は呼び出しのたびに読み直す）"""
+        import duckdb
+
+        conn = duckdb.connect(":memory:")
+        conn.execute("SET TimeZone = 'UTC'")
+        if self.threads:
+            conn.execute(f"SET threads = {int(self.threads)}")
+        if self.memory_limit:
+            conn.execute(f"SET memory_limit = {_quote(self.memory_limit)}")
+
+        sources = []
+        for index, path in enumerate(self.db_paths):
+            self._attach(conn, f"s{index}", path)
+            sources.append(SHARD_SELECT.format(db=f"s{index}"))
+        archive_files = self._archive_files()
+        if archive_files:
+            sources.append(ARCHIVE_SELECT.format(
+                files="[" + ", ".join(_quote(path) for path in archive_files) + "]",
+                columns="{" + ", ".join(f"{_quote(name)}: {_quote(kind)}" for name, kind in ARCHIVE_COLUMNS.items()) + "}"
+            ))
+        conn.execute(MESSAGES_VIEW.format(sources=" UNION ALL ".join(sources), staff_roles=STAFF_ROLE_LIST))
+        return conn
+
+    @staticmethod
+    def _attach(conn: duckdb.DuckDBPyConnection, name: str, path: str) -> None:
+        """SQLite のDBを読み取り専用で添付（sqlite 拡張は初回だけ取得される。列は文字列として読む）"""
+        conn.execute("INSTALL sqlite")
+        conn.execute("LOAD sqlite")
+        conn.execute("SET sqlite_all_varchar = true")
+        conn.execute(f"ATTACH {_quote(os.path.abspath(path))} AS {name} (TYPE sqlite, READ_ONLY)")
+
+    def _archive_files(self) -> List[str]:
+        """マニフェストに記録されたアーカイブファイル（アーカイブを使っていなければ空）"""
+        if not self.archive_dir:
+            return []
+        files = []
+        for path in self.db_paths:
+            with sqlite3.connect(path) as conn:
+                rows = conn.execute("SELECT path FROM archive_manifest ORDER BY channel_id, month").fetchall()
+            files.extend(os.path.abspath(os.path.join(self.archive_dir, row[0])) for row in rows)
+        return [path for path in files if os.path.exists(path)]
+
+    def _query(self, sql: str, params: Sequence[Any] = ()) -> pd.DataFrame:
+        conn = self._connect()
+        try:
+            return conn.execute(sql, list(params)).df()
+        finally:
+            conn.close()
+
+    # --- メッセージログ ---
+
+    async def channel_log_table(self, channel_id: str, since: Optional[datetime] = None) -> pd.DataFrame:
+        """チャンネルのメッセージログを古い順に表として読み込む"""
+        return await asyncio.to_thread(self._channel_log_table, channel_id, since)
+
+    def _channel_log_table(self, channel_id: str, since: Optional[datetime]) -> pd.DataFrame:
+        query = """
+            SELECT id AS message_id, channel_name, display_name, username, is_staff,
+                   array_to_string(roles, ', ') AS roles, content, ts AS timestamp, is_question,
+                   array_to_string(reactions, ', ') AS reactions, thread_id,
+                   COALESCE(question_score, 0.0) AS question_score,
+                   COALESCE(has_code_block, false) AS has_code_block,
+                   COALESCE(mention_count, 0) AS mention_count,
+                   COALESCE(url_count, 0) AS url_count,
+                   COALESCE(content_length, length(content)) AS length
+            FROM messages_all
+            WHERE channel_id = ?
+        """
+        params: List[Any] = [channel_id]
+        if since is not None:
+            query += " AND ts_key >= ?"
+            params.append(clock.to_db_timestamp(since))
+        query += " ORDER BY ts_key, id"
+        frame = self._query(query, params)
+        return frame[list(LOG_TABLE_COLUMNS)]
+
+    # --- 活動の集計 ---
+
+    async def activity_tables(self, days: int = 30) -> Dict[str, pd.DataFrame]:
+        """直近 days 日の活動をチャンネル別・日別・時間帯別に集計"""
+        return await asyncio.to_thread(self._activity_tables, days)
+
+    def _activity_tables(self, days: int) -> Dict[str, pd.DataFrame]:
+        since = clock.to_db_timestamp(clock.now() - timedelta(days=days))
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TEMP TABLE recent AS
+                SELECT channel_id, channel_name, user_id, is_staff, is_question, has_code_block, url_count,
+                       question_score, timezone(?, ts) AS local_ts
+                FROM messages_all WHERE ts_key >= ?
+            """, [self.timezone, since])
+            by_channel = conn.execute("""
+                SELECT channel_id, MAX(channel_name) AS channel_name,
+                       COUNT(*) AS "メッセージ数",
+                       COUNT(*) FILTER (WHERE NOT is_staff) AS "生徒側の発言",
+                       COUNT(*) FILTER (WHERE is_staff) AS "運営側の発言",
+                       COUNT(*) FILTER (WHERE is_question) AS "質問数",
+                       COUNT(DISTINCT user_id) FILTER (WHERE NOT is_staff) AS "発言した生徒数",
+                       COUNT(*) FILTER (WHERE has_code_block) AS "コードブロック",
+                       COALESCE(SUM(url_count), 0) AS "URL数",
+                       ROUND(AVG(question_score), 3) AS "質問らしさ(平均)"
+                FROM recent GROUP BY channel_id ORDER BY "メッセージ数" DESC
+            """).df()
+            by_day = conn.execute("""
+                SELECT CAST(local_ts AS DATE) AS "日付",
+                       COUNT(*) AS "メッセージ数",
+                       COUNT(*) FILTER (WHERE is_question) AS "質問数",
+                       COUNT(DISTINCT user_id) FILTER (WHERE NOT is_staff) AS "発言した生徒数",
+                       COUNT(DISTINCT channel_id) AS "チャンネル数"
+                FROM recent GROUP BY 1 ORDER BY 1
+            """).df()
+            by_hour = conn.execute("""
+                SELECT hour(local_ts) AS "時",
+                       COUNT(*) AS "メッセージ数",
+                       COUNT(*) FILTER (WHERE is_question) AS "質問数",
+                       COUNT(*) FILTER (WHERE is_staff) AS "運営側の発言"
+                FROM recent GROUP BY 1 ORDER BY 1
+            """).df()
+        finally:
+            conn.close()
+        return {'チャンネル別': by_channel, '日別': by_day, '時間帯別': by_hour}
+
+    # --- 返信時間（ResponseTimeAnalytics の _starts を置き換える） ---
+
+    def _starts(self, days: int, channel_id: Optional[str]) -> pd.DataFrame:
+        """生徒側の連続した発言の最初の1件ごとに、会話内で次の運営側の発言までの分数を求める"""
+        query = """
+            WITH base AS (
+                SELECT id, channel_id, MAX(channel_name) OVER (PARTITION BY channel_id) AS channel_name,
+                       COALESCE(thread_id, '') AS thread_id, user_id, display_name, is_staff, ts, ts_key
+                FROM messages_all
+                WHERE ts_key >= ? {channel_filter}
+            ),
+            ordered AS (
+                SELECT *,
+                       lag(is_staff) OVER conversation AS previous_is_staff,
+                       first_value(CASE WHEN is_staff THEN ts END IGNORE NULLS) OVER following AS reply_ts,
+                       first_value(CASE WHEN is_staff THEN user_id END IGNORE NULLS) OVER following AS mentor_id,
+                       first_value(CASE WHEN is_staff THEN display_name END IGNORE NULLS) OVER following AS mentor_name
+                FROM base
+                WINDOW conversation AS (PARTITION BY channel_id, thread_id ORDER BY ts, ts_key, id),
+                       following AS (PARTITION BY channel_id, thread_id ORDER BY ts, ts_key, id
+                                     ROWS BETWEEN CURRENT ROW AND UNBOUNDED FOLLOWING)
+            )
+            SELECT channel_id, channel_name, hour(timezone(?, ts)) AS hour, mentor_id, mentor_name,
+                   epoch(reply_ts - ts) / 60.0 AS minutes
+            FROM ordered
+            WHERE NOT is_staff AND (previous_is_staff IS NULL OR previous_is_staff)
+        """
+        params: List[Any] = [clock.to_db_timestamp(clock.now() - timedelta(days=days))]
+        if channel_id:
+            params.append(channel_id)
+        params.append(self.timezone)
+        return self._query(query.format(channel_filter="AND channel_id = ?" if channel_id else ""), params)
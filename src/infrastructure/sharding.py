@@ -0,0 +1,452 @@
+"""
+ストレージのシャーディング: ギルド（またはチャンネル）ごとに SQLite ファイルを分ける
+
+書き込みロックはファイル単位なので、ファイルを分けると別々のギルドの取り込みが互いを待たなくなる。
+チャンネルの割り当ては最初に見たときに決めて shard_directory（シャード0のファイル）に記録し、以後は動かさない。
+チャンネル単位の読み書きは担当のシャードだけに送り、ID検索や全体の集計は全シャードに問い合わせて結果を合わせる。
+シャード数が1のときは従来どおり DATABASE_PATH だけを使う。
+"""
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, TypeVar
+
+from ..domain.entities import ActivityBucket, Alert, Message, MessageFeatures, Session, StudentActivity, User
+from ..domain.repositories import (
+    AlertRepository, MessageCursor, MessageRepository, RollupRepository, SessionRepository,
+    StudentActivityRepository, UserRepository
+)
+from .database import SQLiteWriter
+
+
+T = TypeVar('T')
+
+GuildResolver = Callable[[str], Optional[str]]
+
+
+def shard_paths(db_path: str, count: int) -> List[str]:
+    """シャードのファイルパス（シャード0は db_path そのもの）"""
+    stem, extension = os.path.splitext(db_path)
+    return [db_path] + [f"{stem}.shard{index}{extension or '.db'}" for index in range(1, count)]
+
+
+def parse_guild_shards(value: str) -> Dict[str, int]:
+    """"ギルドID:シャード番号,..." 形式の固定割り当てをパース"""
+    result = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        guild_id, shard = item.split(':', 1)
+        result[guild_id.strip()] = int(shard)
+    return result
+
+
+def sync_users(db_paths: Sequence[str]) -> None:
+    """シャード0のユーザーを他のシャードに複製（シャーディング前から登録済みのユーザー用）"""
+    for path in db_paths[1:]:
+        with sqlite3.connect(path) as conn:
+            conn.execute("ATTACH DATABASE ? AS primary_db", (db_paths[0],))
+            conn.execute("""
+                INSERT OR IGNORE INTO users (id, username, display_name, roles, role_hash, created_at)
+                SELECT id, username, display_name, roles, role_hash, created_at FROM primary_db.users
+            """)
+            conn.commit()
+            conn.execute("DETACH DATABASE primary_db")
+
+
+def _stable_hash(key: str) -> int:
+    return zlib.crc32(key.encode('utf-8'))
+
+
+class ShardDirectory:
+    """チャンネル・スレッドとシャードの対応表
+
+    mode が guild のときは guild_resolver でチャンネルのギルドを調べ、ギルド単位でシャードを決める
+    （guild_shards にあればその番号、なければギルドIDのハッシュ）。
+    ギルドが分からないとき、または mode が channel のときはチャンネルIDのハッシュで決める。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        shard_count: int,
+        mode: str = "guild",
+        guild_shards: Optional[Dict[str, int]] = None,
+        guild_resolver: Optional[GuildResolver] = None
+    ):
+        if mode not in ("guild", "channel"):
+            raise ValueError(f"未対応のシャーディング方式です: {mode}")
+        invalid = {guild: shard for guild, shard in (guild_shards or {}).items() if not 0 <= shard < shard_count}
+        if invalid:
+            raise ValueError(f"シャード番号が範囲外です: {invalid}")
+
+        self.db_path = db_path
+        self.shard_count = shard_count
+        self.mode = mode
+        self.guild_shards = guild_shards or {}
+        self.guild_resolver = guild_resolver
+        self._shards: Dict[str, int] = {}
+        self.logger = logging.getLogger(__name__)
+
+    def load(self) -> None:
+        """対応表を読み込む（初回は既存のチャンネルをすべてシャード0に割り当てる）"""
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute("SELECT key, shard FROM shard_directory").fetchall()
+            if not rows:
+                # シャーディング前のデータはシャード0のファイルにあるので、そのままそこを使う
+                conn.execute("""
+                    INSERT OR IGNORE INTO shard_directory (key, shard)
+                    SELECT DISTINCT channel_id, 0 FROM messages
+                    UNION SELECT DISTINCT thread_id, 0 FROM messages WHERE thread_id IS NOT NULL
+                """)
+                rows = conn.execute("SELECT key, shard FROM shard_directory").fetchall()
+
+        out_of_range = [key for key, shard in rows if shard >= self.shard_count]
+        if out_of_range:
+            raise ValueError(
+                f"シャード数 {self.shard_count} では割り当て済みのチャンネルを扱えません: {out_of_range[:5]}"
+            )
+        self._shards = dict(rows)
+
+    def shard_of(self, channel_id: str) -> int:
+        """チャンネルのシャード（未割り当てなら割り当て予定のシャード）"""
+        shard = self._shards.get(channel_id)
+        return shard if shard is not None else self._choose(channel_id)[0]
+
+    def known(self, key: str) -> Optional[int]:
+        """割り当て済みのシャード（スレッドIDも可）"""
+        return self._shards.get(key)
+
+    async def assign(self, channel_id: str, thread_id: Optional[str] = None) -> int:
+        """チャンネル（とスレッド）のシャードを確定して返す"""
+        shard = self._shards.get(channel_id)
+        new_rows = []
+        if shard is None:
+            shard, guild_id = self._choose(channel_id)
+            new_rows.append((channel_id, shard, guild_id))
+        if thread_id and thread_id not in self._shards:
+            new_rows.append((thread_id, shard, None))
+        if new_rows:
+            for key, row_shard, _ in new_rows:
+                self._shards[key] = row_shard
+            await SQLiteWriter.for_path(self.db_path).run(lambda conn: conn.executemany(
+                "INSERT OR IGNORE INTO shard_directory (key, shard, guild_id) VALUES (?, ?, ?)", new_rows
+            ))
+        return shard
+
+    def stats(self) -> Dict[int, int]:
+        """シャードごとの割り当て数"""
+        counts = defaultdict(int)
+        for shard in self._shards.values():
+            counts[shard] += 1
+        return dict(counts)
+
+    def _choose(self, channel_id: str):
+        guild_id = None
+        if self.mode == "guild" and self.guild_resolver:
+            guild_id = self.guild_resolver(channel_id)
+        if guild_id is None:
+            return _stable_hash(channel_id) % self.shard_count, None
+        if guild_id in self.guild_shards:
+            return self.guild_shards[guild_id], guild_id
+        return _stable_hash(guild_id) % self.shard_count, guild_id
+
+
+class _ShardRouter:
+    """シャードのリポジトリを選ぶ共通処理"""
+
+    def __init__(self, shards: Sequence, directory: ShardDirectory):
+        if len(shards) != directory.shard_count:
+            raise ValueError("シャードの数と対応表のシャード数が一致しません")
+        self.shards = list(shards)
+        self.directory = directory
+
+    def _for_channel(self, channel_id: str):
+        """読み込み先のシャード（割り当ては確定しない）"""
+        return self.shards[self.directory.shard_of(channel_id)]
+
+    async def _for_write(self, channel_id: str):
+        """書き込み先のシャード（割り当てを確定する）"""
+        return self.shards[await self.directory.assign(channel_id)]
+
+    def _group(self, channel_ids: List[str]) -> Dict[int, List[str]]:
+        groups: Dict[int, List[str]] = defaultdict(list)
+        for channel_id in channel_ids:
+            groups[self.directory.shard_of(channel_id)].append(channel_id)
+        return groups
+
+    async def _fan_out(self, call: Callable[[object], object]) -> List:
+        """全シャードに同じ問い合わせをして結果を並べて返す"""
+        return await asyncio.gather(*(call(shard) for shard in self.shards))
+
+
+def _first(results: List[Optional[T]]) -> Optional[T]:
+    return next((result for result in results if result), None)
+
+
+def _page_key(message: Message):
+    return str(message.timestamp), message.id
+
+
+class ShardedMessageRepository(_ShardRouter, MessageRepository):
+    """メッセージを担当のシャードに振り分ける MessageRepository"""
+
+    async def save_message(self, message: Message) -> bool:
+        shard = await self.directory.assign(message.channel_id, message.thread_id)
+        return await self.shards[shard].save_message(message)
+
+    async def get_message(self, message_id: str) -> Optional[Message]:
+        return _first(await self._fan_out(lambda shard: shard.get_message(message_id)))
+
+    async def get_messages(self, message_ids: List[str]) -> Dict[str, Message]:
+        merged: Dict[str, Message] = {}
+        for found in await self._fan_out(lambda shard: shard.get_messages(message_ids)):
+            merged.update(found)
+        return merged
+
+    async def get_channel_messages(self, channel_id: str, limit: int = 100) -> List[Message]:
+        return await self._for_channel(channel_id).get_channel_messages(channel_id, limit)
+
+    async def get_messages_page(
+        self,
+        channel_id: Optional[str] = None,
+        thread_id: Optional[str] = None,
+        after: Optional[MessageCursor] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 500
+    ) -> List[Message]:
+        shard = self.directory.known(channel_id or thread_id) if (channel_id or thread_id) else None
+        if shard is not None:
+            return await self.shards[shard].get_messages_page(channel_id, thread_id, after, since, until, limit)
+
+        # 全体のページは各シャードのページを (時刻, ID) 順に合わせる
+        pages = await self._fan_out(
+            lambda repo: repo.get_messages_page(channel_id, thread_id, after, since, until, limit)
+        )
+        return [message for _, message in zip(range(limit), heapq.merge(*pages, key=_page_key))]
+
+    async def get_recent_messages(self, channel_id: str, hours: int = 24) -> List[Message]:
+        return await self._for_channel(channel_id).get_recent_messages(channel_id, hours)
+
+    async def get_recent_messages_for_channels(
+        self, channel_ids: List[str], hours: int = 24
+    ) -> Dict[str, List[Message]]:
+        groups = self._group(channel_ids)
+        results = await asyncio.gather(*(
+            self.shards[shard].get_recent_messages_for_channels(ids, hours) for shard, ids in groups.items()
+        ))
+        merged: Dict[str, List[Message]] = {}
+        for result in results:
+            merged.update(result)
+        return merged
+
+    async def get_messages_before_for_channels(
+        self, channel_ids: List[str], before: datetime, limit: int
+    ) -> Dict[str, List[Message]]:
+        groups = self._group(channel_ids)
+        results = await asyncio.gather(*(
+            self.shards[shard].get_messages_before_for_channels(ids, before, limit) for shard, ids in groups.items()
+        ))
+        merged: Dict[str, List[Message]] = {}
+        for result in results:
+            merged.update(result)
+        return merged
+
+    async def get_thread_messages(self, thread_id: str, limit: int = 100) -> List[Message]:
+        shard = self.directory.known(thread_id)
+        if shard is not None:
+            return await self.shards[shard].get_thread_messages(thread_id, limit)
+        return _first(await self._fan_out(lambda repo: repo.get_thread_messages(thread_id, limit))) or []
+
+    async def get_recent_thread_messages(self, thread_id: str, hours: int = 24) -> List[Message]:
+        shard = self.directory.known(thread_id)
+        if shard is not None:
+            return await self.shards[shard].get_recent_thread_messages(thread_id, hours)
+        return _first(await self._fan_out(lambda repo: repo.get_recent_thread_messages(thread_id, hours))) or []
+
+    async def get_session_messages(self, session: Session) -> List[Message]:
+        return await self._for_channel(session.channel_id).get_session_messages(session)
+
+    async def update_message_content(
+        self, channel_id: str, message_id: str, content: str, features: MessageFeatures, edited_at: datetime
+    ) -> bool:
+        repo = await self._for_write(channel_id)
+        return await repo.update_message_content(channel_id, message_id, content, features, edited_at)
+
+    async def mark_message_deleted(self, channel_id: str, message_id: str, deleted_at: datetime) -> bool:
+        return await (await self._for_write(channel_id)).mark_message_deleted(channel_id, message_id, deleted_at)
+
+    async def add_reaction(
+        self, channel_id: str, message_id: str, user_id: str, emoji: str, is_staff: bool
+    ) -> bool:
+        repo = await self._for_write(channel_id)
+        return await repo.add_reaction(channel_id, message_id, user_id, emoji, is_staff)
+
+    async def remove_reaction(self, channel_id: str, message_id: str, user_id: str, emoji: str) -> bool:
+        return await (await self._for_write(channel_id)).remove_reaction(channel_id, message_id, user_id, emoji)
+
+    async def warm(self, channel_ids: List[str], hours: Optional[int] = None) -> None:
+        await asyncio.gather(*(
+            self.shards[shard].warm(ids, hours) for shard, ids in self._group(channel_ids).items()
+        ))
+
+
+class ShardedSessionRepository(_ShardRouter, SessionRepository):
+    """会話セッションをチャンネルのシャードに振り分ける SessionRepository
+
+    セッションIDはシャードごとの採番なので、チャンネルと組み合わせて扱うこと。
+    """
+
+    async def get_active_session(
+        self, channel_id: str, thread_id: Optional[str], timestamp: datetime, gap: timedelta
+    ) -> Optional[Session]:
+        repo = self._for_channel(channel_id)
+        return await repo.get_active_session(channel_id, thread_id, timestamp, gap)
+
+    async def save_session(self, session: Session) -> Session:
+        return await (await self._for_write(session.channel_id)).save_session(session)
+
+    async def get_recent_sessions(self, channel_id: str, hours: int = 24) -> List[Session]:
+        return await self._for_channel(channel_id).get_recent_sessions(channel_id, hours)
+
+    async def get_pending_sessions(self, channel_id: str, asked_before: datetime) -> List[Session]:
+        return await self._for_channel(channel_id).get_pending_sessions(channel_id, asked_before)
+
+    async def get_pending_sessions_for_channels(
+        self, channel_ids: List[str], asked_before: datetime
+    ) -> Dict[str, List[Session]]:
+        results = await asyncio.gather(*(
+            self.shards[shard].get_pending_sessions_for_channels(ids, asked_before)
+            for shard, ids in self._group(channel_ids).items()
+        ))
+        merged: Dict[str, List[Session]] = {}
+        for result in results:
+            merged.update(result)
+        return merged
+
+    async def delete_sessions(self, channel_id: str, since: Optional[datetime] = None) -> int:
+        return await (await self._for_write(channel_id)).delete_sessions(channel_id, since)
+
+    async def acknowledge_question(self, message_id: str) -> None:
+        await self._fan_out(lambda repo: repo.acknowledge_question(message_id))
+
+    async def resolve_pending_questions(
+        self, channel_id: str, thread_id: Optional[str], answered_at: datetime, exclude_session_id: Optional[int] = None
+    ) -> int:
+        repo = self._for_channel(channel_id)
+        return await repo.resolve_pending_questions(channel_id, thread_id, answered_at, exclude_session_id)
+
+
+class ShardedAlertRepository(_ShardRouter, AlertRepository):
+    """アラートを対象メッセージのシャードに振り分ける AlertRepository"""
+
+    async def save_alert(self, alert: Alert) -> bool:
+        return await (await self._for_write(alert.message.channel_id)).save_alert(alert)
+
+    async def save_alerts(self, alerts: List[Alert]) -> List[Alert]:
+        groups: Dict[int, List[Alert]] = defaultdict(list)
+        for alert in alerts:
+            groups[await self.directory.assign(alert.message.channel_id)].append(alert)
+        results = await asyncio.gather(*(self.shards[shard].save_alerts(group) for shard, group in groups.items()))
+        return [alert for result in results for alert in result]
+
+    async def get_unresolved_alerts(self) -> List[Alert]:
+        results = await self._fan_out(lambda repo: repo.get_unresolved_alerts())
+        return sorted((alert for result in results for alert in result), key=lambda alert: alert.created_at)
+
+    async def resolve_alerts(self, message_id: str, alert_type: str) -> int:
+        return sum(await self._fan_out(lambda repo: repo.resolve_alerts(message_id, alert_type)))
+
+
+class ShardedRollupRepository(_ShardRouter, RollupRepository):
+    """活動集計をチャンネルのシャードに振り分ける RollupRepository"""
+
+    async def record_message(
+        self, channel_id: str, timestamp: datetime, side: str, is_question: bool, answered_questions: int = 0
+    ) -> None:
+        repo = await self._for_write(channel_id)
+        await repo.record_message(channel_id, timestamp, side, is_question, answered_questions)
+
+    async def get_activity(
+        self, since: datetime, until: datetime, channel_id: Optional[str] = None, granularity: str = "hour"
+    ) -> List[ActivityBucket]:
+        if channel_id:
+            return await self._for_channel(channel_id).get_activity(since, until, channel_id, granularity)
+        # チャンネルはどれか1つのシャードにしかないので、並べ直すだけでよい
+        results = await self._fan_out(lambda repo: repo.get_activity(since, until, None, granularity))
+        return sorted(
+            (bucket for result in results for bucket in result),
+            key=lambda bucket: (bucket.bucket_start, bucket.channel_id, bucket.side)
+        )
+
+    async def compact(self, before: datetime) -> int:
+        return sum(await self._fan_out(lambda repo: repo.compact(before)))
+
+
+class ShardedStudentActivityRepository(_ShardRouter, StudentActivityRepository):
+    """生徒ごとの活動をチャンネルのシャードに振り分ける StudentActivityRepository"""
+
+    async def record_student_message(self, user_id: str, channel_id: str, message_id: str,
+                                     timestamp: datetime, is_question: bool) -> None:
+        repo = await self._for_write(channel_id)
+        await repo.record_student_message(user_id, channel_id, message_id, timestamp, is_question)
+
+    async def record_staff_reply(self, channel_id: str, timestamp: datetime) -> None:
+        repo = await self._for_write(channel_id)
+        await repo.record_staff_reply(channel_id, timestamp)
+
+    async def get_student_activity(
+        self, channel_id: Optional[str] = None, user_id: Optional[str] = None
+    ) -> List[StudentActivity]:
+        if channel_id:
+            return await self._for_channel(channel_id).get_student_activity(channel_id, user_id)
+        results = await self._fan_out(lambda repo: repo.get_student_activity(None, user_id))
+        return sorted(
+            (activity for result in results for activity in result),
+            key=lambda activity: activity.last_post_at, reverse=True
+        )
+
+    async def get_inactive_students(
+        self, before: datetime, since: Optional[datetime] = None, channel_ids: Optional[List[str]] = None
+    ) -> List[StudentActivity]:
+        if channel_ids is None:
+            results = await self._fan_out(lambda repo: repo.get_inactive_students(before, since))
+        else:
+            results = await asyncio.gather(*(
+                self.shards[shard].get_inactive_students(before, since, ids)
+                for shard, ids in self._group(channel_ids).items()
+            ))
+        return sorted(
+            (activity for result in results for activity in result), key=lambda activity: activity.last_post_at
+        )
+
+    async def replace_channel(self, channel_id: str, activities: List[StudentActivity]) -> None:
+        repo = await self._for_write(channel_id)
+        await repo.replace_channel(channel_id, activities)
+
+
+class ReplicatedUserRepository(UserRepository):
+    """ユーザーを全シャードに保存する UserRepository
+
+    メッセージの読み込みは同じファイルの users と結合するため、ユーザーは全シャードに複製する（件数は少ない）。
+    """
+
+    def __init__(self, shards: Sequence[UserRepository]):
+        self.shards = list(shards)
+
+    async def get_user(self, user_id: str) -> Optional[User]:
+        return await self.shards[0].get_user(user_id)
+
+    async def save_user(self, user: User) -> None:
+        await asyncio.gather(*(shard.save_user(user) for shard in self.shards))
+
+    async def save_users(self, users: List[User]) -> int:
+        # どのシャードも同じ内容なので、変更件数は最初のシャードのものを返す
+        return (await asyncio.gather(*(shard.save_users(users) for shard in self.shards)))[0]
+
+    async def get_users(self) -> List[User]:
+        return await self.shards[0].get_users()
@@ -2,9 +2,7 @@
 Slack API クライアント実装
 """
 import asyncio
-from slack_sdk.web.async_client import AsyncWebClient
-from slack_sdk.errors import SlackApiError
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 import logging
 
 from ..domain.entities import Alert
@@ -14,13 +12,32 @@ from ..domain.repositories import NotificationService
 class SlackNotificationService(NotificationService):
     """Slack 通知サービス実装"""
     
-    def __init__(self, token: str, channel: str):
-        self.client = AsyncWebClient(token=token)
+    # これより多いアラートはまとめて1件の投稿にする
+    DIGEST_THRESHOLD = 3
+    # まとめ投稿1件あたりのアラート数（Slack のブロック数上限 50 を超えないようにする）
+    DIGEST_CHUNK_SIZE = 20
+    
+    def __init__(self, token: str, channel: str, base_url: Optional[str] = None):
+        self.token = token
         self.channel = channel
+        # 負荷試験ではローカルの FakeSlackServer に向ける
+        self.base_url = base_url
         self.logger = logging.getLogger(__name__)
+        self._client = None
+    
+    @property
+    def client(self):
+        """Slack クライアント（slack_sdk の読み込みは起動を遅くするので最初に使うときに行う）"""
+        if self._client is None:
+            from slack_sdk.web.async_client import AsyncWebClient
+            options = {'base_url': self.base_url} if self.base_url else {}
+            self._client = AsyncWebClient(token=self.token, **options)
+        return self._client
     
     async def send_alert(self, alert: Alert) -> None:
         """アラートをSlackに送信"""
+        from slack_sdk.errors import SlackApiError
+        
         try:
             message = self._format_alert_message(alert)
             
@@ -29,15 +46,75 @@ class SlackNotificationService(NotificationService):
                 **message
             )
             
-            self.logger.info(f"Slackにアラート送信完了: {response['ts']}")
+            self.logger.info("Slackにアラート送信完了: %s", response['ts'])
             
         except SlackApiError as e:
-            self.logger.error(f"Slack送信エラー: {e.response['error']}")
+            self.logger.error("Slack送信エラー: %s", e.response['error'])
             raise
         except Exception as e:
-            self.logger.error(f"予期しないエラー: {e}")
+            self.logger.error("予期しないエラー: %s", e)
             raise
     
+    async def send_alerts(self, alerts: List[Alert]) -> None:
+        """複数のアラートを送信（件数が多い場合はまとめ投稿にする）"""
+        from slack_sdk.errors import SlackApiError
+        
+        if len(alerts) <= self.DIGEST_THRESHOLD:
+            for alert in alerts:
+                await self.send_alert(alert)
+            return
+        
+        for start in range(0, len(alerts), self.DIGEST_CHUNK_SIZE):
+            chunk = alerts[start:start + self.DIGEST_CHUNK_SIZE]
+            try:
+                response = await self.client.chat_postMessage(
+                    channel=self.channel,
+                    **self._format_digest_message(chunk, start, len(alerts))
+                )
+                self.logger.info("Slackにアラートをまとめて送信完了: %d 件 (%s)", len(chunk), response['ts'])
+            except SlackApiError as e:
+                self.logger.error("Slack送信エラー: %s", e.response['error'])
+                raise
+    
+    async def send_system_alert(self, title: str, description: str) -> None:
+        """運用上の通知をSlackに送信"""
+        from slack_sdk.errors import SlackApiError
+
+        try:
+            response = await self.client.chat_postMessage(
+                channel=self.channel,
+                text=f"⚠️ {title}",
+                blocks=[
+                    {"type": "header", "text": {"type": "plain_text", "text": f"⚠️ {title}"}},
+                    {"type": "section", "text": {"type": "mrkdwn", "text": description}}
+                ]
+            )
+            self.logger.info("Slackに運用通知を送信完了: %s", response['ts'])
+        except SlackApiError as e:
+            self.logger.error("Slack送信エラー: %s", e.response['error'])
+            raise
+    
+    def _format_digest_message(self, alerts: List[Alert], offset: int, total: int) -> Dict[str, Any]:
+        """まとめ投稿をフォーマット"""
+        title = f"🚨 アラート {total} 件"
+        if total > len(alerts):
+            title += f"（{offset + 1}〜{offset + len(alerts)} 件目）"
+        
+        blocks = [{"type": "header", "text": {"type": "plain_text", "text": title}}]
+        for alert in alerts:
+            link = f"https://discord.com/channels/{alert.message.channel_id}/{alert.message.id}"
+            blocks.append({
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": (
+                        f"*{alert.alert_type}* #{alert.channel.name} - {alert.message.user.display_name}\n"
+                        f"{alert.description}\n<{link}|Discordで確認>"
+                    )
+                }
+            })
+        return {"text": title, "blocks": blocks}
+    
     def _format_alert_message(self, alert: Alert) -> Dict[str, Any]:
         """アラートメッセージをフォーマット"""
         
@@ -176,9 +253,11 @@ class SlackNotificationService(NotificationService):
     async def test_connection(self) -> bool:
         """Slack接続テスト"""
         try:
-            response = await self.client.auth_test()
-            self.logger.info(f"Slack接続成功: {response['user']}")
+            # 起動と並行して実行されるので、slack_sdk の読み込みでイベントループを止めないようスレッドで行う
+            client = await asyncio.to_thread(lambda: self.client)
+            response = await client.auth_test()
+            self.logger.info("Slack接続成功: %s", response['user'])
             return True
         except Exception as e:
-            self.logger.error(f"Slack接続失敗: {e}")
+            self.logger.error("Slack接続失敗: %s", e)
             return False
\ No newline at end of file
@@ -1,15 +1,28 @@
 """
 スプレッドシート出力サービス実装
 """
-import pandas as pd
-from typing import List
+import asyncio
+import csv
+from typing import Any, AsyncIterable, Dict, List
 import os
 from datetime import datetime
 
-from ..domain.entities import Message
+from ..domain.entities import Message, MessageFeatures, Session
 from ..domain.repositories import SpreadsheetService
 
 
+EXCEL_LOG_COLUMNS = [
+    'メッセージID', 'チャンネル名', '投稿者名', 'ユーザー名', 'ユーザータイプ', 'ロール',
+    'メッセージ内容', '投稿日時', '質問フラグ', 'リアクション', 'スレッドID',
+    '質問らしさ', 'コードブロック', 'メンション数', 'URL数', '文字数'
+]
+CSV_LOG_COLUMNS = [
+    'message_id', 'channel_name', 'display_name', 'username', 'user_type', 'roles',
+    'content', 'timestamp', 'is_question', 'reactions', 'thread_id',
+    'question_score', 'has_code_block', 'mention_count', 'url_count', 'length'
+]
+
+
 class ExcelSpreadsheetService(SpreadsheetService):
     """Excel スプレッドシートサービス実装"""
     
@@ -17,74 +30,191 @@ class ExcelSpreadsheetService(SpreadsheetService):
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
     
-    async def export_channel_logs(self, channel_id: str, messages: List[Message]) -> str:
+    async def export_channel_logs(self, channel_id: str, messages: AsyncIterable[Message]) -> str:
         """チャンネルログをスプレッドシートに出力"""
-        if not messages:
+        return await self._write_logs(messages, "logs")
+    
+    async def export_thread_logs(self, thread_id: str, messages: AsyncIterable[Message]) -> str:
+        """スレッドのログをスプレッドシートに出力"""
+        return await self._write_logs(messages, f"thread_{thread_id}_logs")
+    
+    async def export_channel_sessions(self, channel_id: str, sessions: List[Session]) -> str:
+        """チャンネルの会話セッション一覧をExcelに出力"""
+        import pandas as pd
+        
+        if not sessions:
             return ""
         
-        # データフレーム用のデータを準備
-        data = []
-        for msg in messages:
-            data.append({
-                'メッセージID': msg.id,
-                'チャンネル名': msg.channel_name,
-                '投稿者名': msg.user.display_name,
-                'ユーザー名': msg.user.username,
-                'ユーザータイプ': '運営' if not msg.user.is_student_side() else '生徒',
-                'ロール': ', '.join([role.value for role in msg.user.roles]),
-                'メッセージ内容': msg.content,
-                '投稿日時': msg.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                '質問フラグ': '質問' if msg.is_question else '',
-                'リアクション': ', '.join(msg.reactions),
-                'スレッドID': msg.thread_id or ''
-            })
-        
-        # データフレームを作成
-        df = pd.DataFrame(data)
-        
-        # ファイル名を生成
-        channel_name = messages[0].channel_name if messages else 'unknown'
+        df = pd.DataFrame(_session_rows(sessions))
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{channel_name}_logs_{timestamp}.xlsx"
-        filepath = os.path.join(self.output_dir, filename)
+        filepath = os.path.join(self.output_dir, f"{channel_id}_sessions_{timestamp}.xlsx")
         
-        # Excelファイルとして保存
         with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='メッセージログ', index=False)
-            
-            # ワークシートを取得してフォーマット
-            worksheet = writer.sheets['メッセージログ']
-            
-            # 列幅を調整
-            column_widths = {
-                'A': 15,  # メッセージID
-                'B': 20,  # チャンネル名
-                'C': 15,  # 投稿者名
-                'D': 15,  # ユーザー名
-                'E': 10,  # ユーザータイプ
-                'F': 20,  # ロール
-                'G': 50,  # メッセージ内容
-                'H': 20,  # 投稿日時
-                'I': 10,  # 質問フラグ
-                'J': 15,  # リアクション
-                'K': 15   # スレッドID
-            }
-            
-            for col, width in column_widths.items():
-                worksheet.column_dimensions[col].width = width
-            
-            # ヘッダーの書式設定
-            from openpyxl.styles import Font, PatternFill
-            header_font = Font(bold=True, color="FFFFFF")
-            header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+            df.to_excel(writer, sheet_name='セッション', index=False)
+        
+        return filepath
+    
+    async def export_report(self, name: str, tables: Dict[str, Any]) -> str:
+        """集計表を1つのExcelファイルにシートごとに出力"""
+        import pandas as pd
+        
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filepath = os.path.join(self.output_dir, f"{name}_{timestamp}.xlsx")
+        
+        with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
+            for sheet_name, table in tables.items():
+                pd.DataFrame(table).to_excel(writer, sheet_name=sheet_name[:31], index=False)
+        
+        return filepath
+    
+    async def export_log_table(self, channel_id: str, table: Any) -> str:
+        """表のまま読み込んだチャンネルログをExcelに出力（Message への変換を行わない）"""
+        if table is None or len(table) == 0:
+            return ""
+        
+        frame = _log_table_frame(table, staff='運営', student='生徒', question='質問', iso_timestamp=False)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filepath = os.path.join(self.output_dir, f"{table['channel_name'].iat[0]}_logs_{timestamp}.xlsx")
+        await asyncio.to_thread(self._save_table, filepath, frame)
+        return filepath
+    
+    def _save_table(self, filepath: str, frame) -> None:
+        workbook, worksheet = self._create_log_workbook()
+        for row in frame.itertuples(index=False, name=None):
+            worksheet.append(row)
+        workbook.save(filepath)
+    
+    @staticmethod
+    def _create_log_workbook():
+        """ログ出力用のブック（書き込み専用）と、列幅・ヘッダーを設定したシート"""
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, PatternFill
+        
+        # 書き込み専用モードは行を一時ファイルに流すため、件数が多くてもメモリを使わない
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet('メッセージログ')
+        
+        # 列幅を調整
+        column_widths = {
+            'A': 15,  # メッセージID
+            'B': 20,  # チャンネル名
+            'C': 15,  # 投稿者名
+            'D': 15,  # ユーザー名
+            'E': 10,  # ユーザータイプ
+            'F': 20,  # ロール
+            'G': 50,  # メッセージ内容
+            'H': 20,  # 投稿日時
+            'I': 10,  # 質問フラグ
+            'J': 15,  # リアクション
+            'K': 15   # スレッドID
+        }
+        for col, width in column_widths.items():
+            worksheet.column_dimensions[col].width = width
+        
+        # ヘッダーの書式設定
+        header_font = Font(bold=True, color="FFFFFF")
+        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+        header = []
+        for title in EXCEL_LOG_COLUMNS:
+            cell = WriteOnlyCell(worksheet, value=title)
+            cell.font = header_font
+            cell.fill = header_fill
+            header.append(cell)
+        worksheet.append(header)
+        return workbook, worksheet
+    
+    async def _write_logs(self, messages: AsyncIterable[Message], file_suffix: str) -> str:
+        """メッセージを1件ずつExcelファイルに書き出す（ファイル名は最初のメッセージのチャンネル名から作る）"""
+        workbook = worksheet = filepath = None
+        async for msg in messages:
+            if worksheet is None:
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                filepath = os.path.join(self.output_dir, f"{msg.channel_name}_{file_suffix}_{timestamp}.xlsx")
+                workbook, worksheet = self._create_log_workbook()
             
-            for cell in worksheet[1]:
-                cell.font = header_font
-                cell.fill = header_fill
+            worksheet.append([
+                msg.id,
+                msg.channel_name,
+                msg.user.display_name,
+                msg.user.username,
+                '運営' if not msg.user.is_student_side() else '生徒',
+                ', '.join([role.value for role in msg.user.roles]),
+                msg.content,
+                msg.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                '質問' if msg.is_question else '',
+                ', '.join(msg.reactions),
+                msg.thread_id or '',
+                *_feature_cells(msg)
+            ])
+        
+        if workbook is None:
+            return ""
         
+        await asyncio.to_thread(workbook.save, filepath)
         return filepath
 
 
+def _feature_cells(msg: Message) -> list:
+    """取り込み時に保存した本文の特徴（出力のたびに本文を解析し直さない）"""
+    features = msg.features or MessageFeatures(length=len(msg.content))
+    return [
+        round(features.question_score, 2), features.has_code_block, features.mention_count,
+        features.url_count, features.length
+    ]
+
+
+def _log_table_frame(table, staff: str, student: str, question: str, iso_timestamp: bool):
+    """LogTableSource の表を出力用の列に列単位で変換（_write_logs の1行分の変換と同じ内容）"""
+    import pandas as pd
+    
+    timestamps = pd.to_datetime(table['timestamp'], utc=True)
+    if iso_timestamp:
+        formatted = timestamps.dt.strftime('%Y-%m-%dT%H:%M:%S') + '+00:00'
+    else:
+        formatted = timestamps.dt.strftime('%Y-%m-%d %H:%M:%S')
+    is_question = table['is_question'].astype(bool)
+    return pd.DataFrame({
+        'message_id': table['message_id'],
+        'channel_name': table['channel_name'],
+        'display_name': table['display_name'],
+        'username': table['username'],
+        'user_type': table['is_staff'].astype(bool).map({True: staff, False: student}),
+        'roles': table['roles'],
+        'content': table['content'],
+        'timestamp': formatted,
+        'is_question': is_question.map({True: question, False: ''}) if question else is_question,
+        'reactions': table['reactions'],
+        'thread_id': table['thread_id'].fillna(''),
+        'question_score': table['question_score'].round(2),
+        'has_code_block': table['has_code_block'].astype(bool),
+        'mention_count': table['mention_count'],
+        'url_count': table['url_count'],
+        'length': table['length']
+    })
+
+
+def _session_rows(sessions: List[Session]) -> List[dict]:
+    """セッション一覧を出力用の行に変換"""
+    rows = []
+    for session in sessions:
+        response_time = session.response_time_seconds()
+        rows.append({
+            'セッションID': session.id,
+            'スレッドID': session.thread_id or '',
+            '開始日時': session.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            '終了日時': session.ended_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'メッセージ数': session.message_count,
+            '参加者数': len(session.participant_ids),
+            '発言交代回数': session.turns,
+            '最初の生徒発言ID': session.first_student_message_id or '',
+            '最初の運営返信ID': session.first_staff_reply_id or '',
+            '返信までの分数': round(response_time / 60, 1) if response_time is not None else '',
+            '未回答の質問ID': session.pending_question_id or ''
+        })
+    return rows
+
+
 class CSVSpreadsheetService(SpreadsheetService):
     """CSV スプレッドシートサービス実装"""
     
@@ -92,38 +222,85 @@ class CSVSpreadsheetService(SpreadsheetService):
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
     
-    async def export_channel_logs(self, channel_id: str, messages: List[Message]) -> str:
+    async def export_channel_logs(self, channel_id: str, messages: AsyncIterable[Message]) -> str:
         """チャンネルログをCSVに出力"""
-        if not messages:
+        return await self._write_logs(messages, "logs")
+    
+    async def export_thread_logs(self, thread_id: str, messages: AsyncIterable[Message]) -> str:
+        """スレッドのログをCSVに出力"""
+        return await self._write_logs(messages, f"thread_{thread_id}_logs")
+    
+    async def export_channel_sessions(self, channel_id: str, sessions: List[Session]) -> str:
+        """チャンネルの会話セッション一覧をCSVに出力"""
+        import pandas as pd
+        
+        if not sessions:
             return ""
         
-        # データフレーム用のデータを準備
-        data = []
-        for msg in messages:
-            data.append({
-                'message_id': msg.id,
-                'channel_name': msg.channel_name,
-                'display_name': msg.user.display_name,
-                'username': msg.user.username,
-                'user_type': 'staff' if not msg.user.is_student_side() else 'student',
-                'roles': ', '.join([role.value for role in msg.user.roles]),
-                'content': msg.content,
-                'timestamp': msg.timestamp.isoformat(),
-                'is_question': msg.is_question,
-                'reactions': ', '.join(msg.reactions),
-                'thread_id': msg.thread_id or ''
-            })
-        
-        # データフレームを作成
-        df = pd.DataFrame(data)
-        
-        # ファイル名を生成
-        channel_name = messages[0].channel_name if messages else 'unknown'
+        df = pd.DataFrame(_session_rows(sessions))
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{channel_name}_logs_{timestamp}.csv"
-        filepath = os.path.join(self.output_dir, filename)
-        
-        # CSVファイルとして保存（UTF-8 BOM付き）
+        filepath = os.path.join(self.output_dir, f"{channel_id}_sessions_{timestamp}.csv")
         df.to_csv(filepath, index=False, encoding='utf-8-sig')
         
-        return filepath
\ No newline at end of file
+        return filepath
+    
+    async def export_report(self, name: str, tables: Dict[str, Any]) -> str:
+        """集計表を表ごとのCSVに出力（パスをカンマ区切りで返す）"""
+        import pandas as pd
+        
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filepaths = []
+        
+        for table_name, table in tables.items():
+            filepath = os.path.join(self.output_dir, f"{name}_{table_name}_{timestamp}.csv")
+            pd.DataFrame(table).to_csv(filepath, index=False, encoding='utf-8-sig')
+            filepaths.append(filepath)
+        
+        return ', '.join(filepaths)
+    
+    async def export_log_table(self, channel_id: str, table: Any) -> str:
+        """表のまま読み込んだチャンネルログをCSVに出力（Message への変換を行わない）"""
+        if table is None or len(table) == 0:
+            return ""
+        
+        frame = _log_table_frame(table, staff='staff', student='student', question='', iso_timestamp=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filepath = os.path.join(self.output_dir, f"{table['channel_name'].iat[0]}_logs_{timestamp}.csv")
+        # UTF-8 BOM付き
+        await asyncio.to_thread(
+            frame.to_csv, filepath, index=False, header=CSV_LOG_COLUMNS, encoding='utf-8-sig'
+        )
+        return filepath
+    
+    async def _write_logs(self, messages: AsyncIterable[Message], file_suffix: str) -> str:
+        """メッセージを1件ずつCSVファイルに書き出す（ファイル名は最初のメッセージのチャンネル名から作る）"""
+        file = writer = filepath = None
+        try:
+            async for msg in messages:
+                if writer is None:
+                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                    filepath = os.path.join(self.output_dir, f"{msg.channel_name}_{file_suffix}_{timestamp}.csv")
+                    # UTF-8 BOM付き
+                    file = open(filepath, 'w', encoding='utf-8-sig', newline='')
+                    writer = csv.writer(file)
+                    writer.writerow(CSV_LOG_COLUMNS)
+                
+                writer.writerow([
+                    msg.id,
+                    msg.channel_name,
+                    msg.user.display_name,
+                    msg.user.username,
+                    'staff' if not msg.user.is_student_side() else 'student',
+                    ', '.join([role.value for role in msg.user.roles]),
+                    msg.content,
+                    msg.timestamp.isoformat(),
+                    msg.is_question,
+                    ', '.join(msg.reactions),
+                    msg.thread_id or '',
+                    *_feature_cells(msg)
+                ])
+        finally:
+            if file is not None:
+                file.close()
+        
+        return filepath or ""
@@ -0,0 +1,48 @@
+"""
+起動時間の計測: 起動の段階ごとの所要時間を記録する
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, Iterator, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class StartupTimer:
+    """起動の段階ごとの所要時間と、起動開始からの経過時間（マーク）を記録
+
+    並行して実行する段階は timed() で囲むと、それぞれの所要時間が記録される。
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        # プロセスの起動直後（重いモジュールを読み込む前）の perf_counter を渡すと import の時間も含められる
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.marks: Dict[str, float] = {}
+        self.logger = logging.getLogger(__name__)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    async def timed(self, name: str, awaitable: Awaitable[T]) -> T:
+        with self.phase(name):
+            return await awaitable
+
+    def mark(self, name: str) -> float:
+        """起動開始からの経過時間を記録"""
+        self.marks[name] = time.perf_counter() - self.started
+        return self.marks[name]
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        marks = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.marks.items())
+        return f"{marks}（{phases}）"
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        return {'phases': dict(self.phases), 'marks': dict(self.marks)}
@@ -0,0 +1,40 @@
+"""
+返信時間の集計: ちょうど HH:00:00 の発言がその時間帯に入ること
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from src.domain import clock
+from src.domain.entities import Message, User, UserRole
+from src.infrastructure.analytics import ResponseTimeAnalytics
+from src.infrastructure.database import DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository
+
+# 2026-09-01 19:00:00 (Asia/Tokyo)
+QUESTION_AT = datetime(2026, 9, 1, 10, 0, tzinfo=timezone.utc)
+
+
+async def report_on_the_hour(db_path: str):
+    await DatabaseManager(db_path).initialize_database()
+    student = User(id="u1", username="student", display_name="student", roles=[UserRole.STUDENT])
+    mentor = User(id="u2", username="mentor", display_name="mentor", roles=[UserRole.MENTOR])
+    await SQLiteUserRepository(db_path).save_users([student, mentor])
+
+    message_repo = SQLiteMessageRepository(db_path)
+    for message_id, user, minutes in (("q1", student, 0), ("r1", mentor, 7)):
+        await message_repo.save_message(Message(
+            id=message_id, channel_id="c1", channel_name="lesson", user=user, content=message_id,
+            timestamp=QUESTION_AT + timedelta(minutes=minutes), reactions=[]
+        ))
+
+    clock.set_clock(clock.ReplayClock(QUESTION_AT + timedelta(hours=1)))
+    try:
+        return await ResponseTimeAnalytics(db_path, timezone="Asia/Tokyo").compute(days=1)
+    finally:
+        clock.set_clock(clock.Clock())
+
+
+def test_message_on_the_hour_is_bucketed_in_that_hour(tmp_path):
+    report = asyncio.run(report_on_the_hour(str(tmp_path / "analytics.db")))
+    assert report.by_hour['hour'].tolist() == [19]
+    assert report.overall['返信あり'] == 1
+    assert report.by_hour['p50(分)'].tolist() == [7.0]
@@ -0,0 +1,56 @@
+"""
+検出器: 分析の範囲が生徒側の連続の途中から始まっても、同じ連続に別のアラートを出さないこと
+"""
+from datetime import datetime, timedelta, timezone
+
+from src.domain.detectors import DetectorPipeline, StudentOnlyRunDetector
+from src.domain.entities import Channel, Message, User, UserRole
+
+START = datetime(2026, 9, 1, 10, 0, tzinfo=timezone.utc)
+CHANNEL = Channel(id="c1", name="lesson", is_lesson_channel=True)
+STUDENT = User(id="u1", username="student", display_name="student", roles=[UserRole.STUDENT])
+MENTOR = User(id="u2", username="mentor", display_name="mentor", roles=[UserRole.MENTOR])
+
+
+def conversation() -> list:
+    """運営側の発言のあとに生徒側の発言が 8 件続く"""
+    messages = [Message(id="s0", channel_id="c1", channel_name="lesson", user=MENTOR, content="どうぞ",
+                        timestamp=START, reactions=[])]
+    for number in range(1, 9):
+        messages.append(Message(
+            id=f"m{number}", channel_id="c1", channel_name="lesson", user=STUDENT, content=f"発言 {number}",
+            timestamp=START + timedelta(minutes=number), reactions=[]
+        ))
+    return messages
+
+
+def scan(messages: list, window_start: int) -> list:
+    """window_start 件目からを分析の範囲とし、その直前を context として渡す"""
+    pipeline = DetectorPipeline([StudentOnlyRunDetector(max_run=3)])
+    context = messages[:window_start][-pipeline.context_messages:]
+    return [alert.message.id for alert in pipeline.run(CHANNEL, messages[window_start:], context)]
+
+
+def test_alert_is_anchored_to_first_message_of_run():
+    assert scan(conversation(), 0) == ["m1"]
+
+
+def test_sliding_window_keeps_same_alert_message():
+    messages = conversation()
+    # 連続の始まりが範囲の外に出ても、同じ発言へのアラート（保存時に重複として除かれる）か、出し済みとして出さない
+    assert scan(messages, 2) == ["m1"]
+    assert scan(messages, 3) == ["m1"]
+    assert scan(messages, 4) == []
+    assert scan(messages, 6) == []
+
+
+def test_staff_reply_starts_new_run():
+    messages = conversation()
+    reply = Message(id="s1", channel_id="c1", channel_name="lesson", user=MENTOR, content="確認します",
+                    timestamp=START + timedelta(minutes=9), reactions=[])
+    later = [
+        Message(id=f"n{number}", channel_id="c1", channel_name="lesson", user=STUDENT, content=f"追加 {number}",
+                timestamp=START + timedelta(minutes=9 + number), reactions=[])
+        for number in range(1, 4)
+    ]
+    assert scan(messages + [reply] + later, 6) == ["n1"]
@@ -0,0 +1,57 @@
+"""
+ゲートウェイ: 合成イベントがプロセス間キュー（ここでは queue.Queue）を経て取り込みキューまで届くこと
+"""
+import asyncio
+import queue
+
+from src.application.ingest import IngestQueue
+from src.infrastructure.gateway import ForwardedChannelRepository, GatewayEventReceiver, emit_fake_gateway_events
+
+GUILDS = 2
+CHANNELS_PER_GUILD = 2
+MESSAGES_PER_CHANNEL = 5
+
+
+async def forward_events(tmp_path, start_receiver_first: bool):
+    handled = []
+
+    async def handler(event_type, data):
+        handled.append((event_type, data['id']))
+
+    ingest_queue = IngestQueue(handler, workers=2, spill_dir=str(tmp_path / "spill"))
+    await ingest_queue.start()
+    channel_repo = ForwardedChannelRepository()
+    receiver = GatewayEventReceiver(queue.Queue(), ingest_queue, channel_repo)
+
+    async def emit():
+        await emit_fake_gateway_events(
+            0, 1, receiver.event_queue, guilds=GUILDS, channels_per_guild=CHANNELS_PER_GUILD,
+            messages_per_channel=MESSAGES_PER_CHANNEL
+        )
+
+    if start_receiver_first:
+        await receiver.start()
+        await emit()
+    else:
+        # 停止の時点でキューに残っているバッチも取り込む
+        await emit()
+        await receiver.start()
+    await receiver.stop()
+    await ingest_queue.drain()
+    return handled, channel_repo, receiver.stats()
+
+
+def test_events_reach_ingest_queue(tmp_path):
+    handled, channel_repo, stats = asyncio.run(forward_events(tmp_path, start_receiver_first=True))
+    total = GUILDS * CHANNELS_PER_GUILD * MESSAGES_PER_CHANNEL
+    assert len(channel_repo.channels) == GUILDS * CHANNELS_PER_GUILD
+    assert stats['received'] == total
+    assert len({message_id for _, message_id in handled}) == total
+    assert {event_type for event_type, _ in handled} == {'message'}
+
+
+def test_stop_reads_queue_until_empty(tmp_path):
+    handled, _, stats = asyncio.run(forward_events(tmp_path, start_receiver_first=False))
+    total = GUILDS * CHANNELS_PER_GUILD * MESSAGES_PER_CHANNEL
+    assert stats['received'] == total
+    assert len(handled) == total
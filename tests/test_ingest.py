@@ -0,0 +1,42 @@
+"""
+取り込みキュー: 停止がタイムアウトしても残りのイベントを退避し、次回の起動時に順序どおり処理すること
+"""
+import asyncio
+
+from src.application.ingest import IngestQueue
+
+
+async def stop_with_stuck_handler(spill_dir: str, count: int, max_size: int, overflow_policy: str) -> list:
+    stuck = asyncio.Event()
+
+    async def blocking_handler(event_type, data):
+        await stuck.wait()
+
+    first = IngestQueue(blocking_handler, workers=1, max_size=max_size, overflow_policy=overflow_policy,
+                        spill_dir=spill_dir)
+    await first.start()
+    for number in range(count):
+        await first.submit('message', {'id': f"m{number}", 'channel_id': "c1"})
+        await asyncio.sleep(0)
+    await first.drain(timeout=0.1)
+
+    handled = []
+
+    async def handler(event_type, data):
+        handled.append(data['id'])
+
+    second = IngestQueue(handler, workers=1, spill_dir=spill_dir)
+    await second.start()
+    await second.drain()
+    return handled
+
+
+def test_drain_timeout_spills_queued_events(tmp_path):
+    handled = asyncio.run(stop_with_stuck_handler(str(tmp_path), count=5, max_size=10, overflow_policy='block'))
+    assert handled == [f"m{number}" for number in range(5)]
+
+
+def test_drain_timeout_keeps_order_with_spilled_events(tmp_path):
+    # キューに入らなかった分は既に退避ファイルにある（キューの残りはその前に処理する）
+    handled = asyncio.run(stop_with_stuck_handler(str(tmp_path), count=6, max_size=2, overflow_policy='spill'))
+    assert handled == [f"m{number}" for number in range(6)]
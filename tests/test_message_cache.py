@@ -0,0 +1,77 @@
+"""
+メッセージキャッシュ: チャンネルの読み込み中に保存されたメッセージを取りこぼさないこと
+"""
+import asyncio
+from datetime import timedelta
+
+from src.domain import clock
+from src.domain.entities import Message, User, UserRole
+from src.infrastructure.database import DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository
+from src.infrastructure.message_cache import CachedMessageRepository
+
+
+class SlowMessageRepository(SQLiteMessageRepository):
+    """読み込みの結果を返す前に、テスト側の合図を待つ"""
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.fetched = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def _hold(self, result):
+        self.fetched.set()
+        await self.release.wait()
+        return result
+
+    async def get_recent_messages(self, channel_id, hours=24):
+        return await self._hold(await super().get_recent_messages(channel_id, hours))
+
+    async def get_recent_messages_for_channels(self, channel_ids, hours=24):
+        return await self._hold(await super().get_recent_messages_for_channels(channel_ids, hours))
+
+
+def make_message(message_id: str, user: User, minutes_ago: int) -> Message:
+    return Message(
+        id=message_id,
+        channel_id="c1",
+        channel_name="lesson",
+        user=user,
+        content=f"message {message_id}",
+        timestamp=clock.now() - timedelta(minutes=minutes_ago),
+        reactions=[]
+    )
+
+
+async def interleave_save_with_load(db_path: str, load) -> list:
+    await DatabaseManager(db_path).initialize_database()
+    user = User(id="u1", username="student", display_name="student", roles=[UserRole.STUDENT])
+    await SQLiteUserRepository(db_path).save_user(user)
+
+    backend = SlowMessageRepository(db_path)
+    cache = CachedMessageRepository(backend, window_hours=24)
+    await cache.save_message(make_message("m1", user, minutes_ago=30))
+
+    # 読み込みが結果を取得した後・キャッシュに反映する前にメッセージを保存する
+    loading = asyncio.create_task(load(cache))
+    await backend.fetched.wait()
+    await cache.save_message(make_message("m2", user, minutes_ago=1))
+    backend.release.set()
+    await loading
+
+    messages = await cache.get_recent_messages("c1", hours=6)
+    assert cache.stats()['hits'] >= 1
+    return [message.id for message in messages]
+
+
+def test_save_during_cold_miss_is_cached(tmp_path):
+    ids = asyncio.run(interleave_save_with_load(
+        str(tmp_path / "cache.db"), lambda cache: cache.get_recent_messages("c1", hours=24)
+    ))
+    assert ids == ["m1", "m2"]
+
+
+def test_save_during_warm_is_cached(tmp_path):
+    ids = asyncio.run(interleave_save_with_load(
+        str(tmp_path / "cache.db"), lambda cache: cache.warm(["c1"], hours=24)
+    ))
+    assert ids == ["m1", "m2"]
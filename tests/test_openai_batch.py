@@ -0,0 +1,108 @@
+"""
+一括分析: 偽の OpenAI に対して最後まで進むこと・中断した段階から再開しても二重に登録・通知しないこと
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from src.domain.entities import Message, User, UserRole
+from src.infrastructure.database import (
+    DatabaseManager, SQLiteAlertRepository, SQLiteMessageRepository, SQLiteUserRepository
+)
+from src.infrastructure.fake_services import FakeOpenAIServer
+from src.infrastructure.openai_batch import OffTopicBatchRunner
+from src.infrastructure.openai_client import OpenAIAnalyzer
+from src.infrastructure.replay import LoggingNotificationService, ReplayChannelRepository
+
+DAY = date(2026, 9, 1)
+# 2026-09-01 10:00 (Asia/Tokyo)
+START = datetime(2026, 9, 1, 1, 0, tzinfo=timezone.utc)
+CONTENTS = ["課題の進め方を教えてください", "週末はゲームをしていました", "今日の振り返りを書きました"]
+
+
+async def make_runner(tmp_path, server: FakeOpenAIServer):
+    db_path = str(tmp_path / "batch.db")
+    await DatabaseManager(db_path).initialize_database()
+    user = User(id="u1", username="student", display_name="student", roles=[UserRole.STUDENT])
+    await SQLiteUserRepository(db_path).save_user(user)
+    message_repo = SQLiteMessageRepository(db_path)
+    for number, content in enumerate(CONTENTS, start=1):
+        await message_repo.save_message(Message(
+            id=f"m{number}", channel_id="c1", channel_name="lesson", user=user, content=content,
+            timestamp=START + timedelta(minutes=number), reactions=[]
+        ))
+
+    notifier = LoggingNotificationService()
+    runner = OffTopicBatchRunner(
+        analyzer=OpenAIAnalyzer("fake-key", base_url=await server.start()),
+        message_repo=message_repo,
+        alert_repo=SQLiteAlertRepository(db_path),
+        notification_service=notifier,
+        channel_repo=ReplayChannelRepository(),
+        db_path=db_path,
+        work_dir=str(tmp_path / "batches")
+    )
+    return runner, notifier
+
+
+def run_with_server(tmp_path, scenario, complete_after: float = 0):
+    async def main():
+        server = FakeOpenAIServer(complete_after=complete_after)
+        try:
+            runner, notifier = await make_runner(tmp_path, server)
+            return await scenario(runner, notifier, server)
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def test_run_to_done(tmp_path):
+    async def scenario(runner, notifier, server):
+        job = await runner.run(DAY, ["c1"], wait=True, poll_interval=0)
+        return job, notifier.sent_alerts, len(server.batches)
+
+    job, sent, batches = run_with_server(tmp_path, scenario)
+    assert (job.status, job.request_count, job.processed_lines, job.alert_count) == ("done", 1, 1, 1)
+    assert (sent, batches) == (1, 1)
+
+
+@pytest.mark.parametrize("interrupted_at", ["uploaded", "submitted"])
+def test_resume_does_not_create_second_batch(tmp_path, interrupted_at):
+    async def scenario(runner, notifier, server):
+        job = await runner.run(DAY, ["c1"])
+        assert job.status == "submitted"
+
+        # バッチを登録した後・状態を保存する前に中断した場合も、同じ入力ファイルのバッチを見つけて続ける
+        job.status = interrupted_at
+        if interrupted_at == "uploaded":
+            job.batch_id = None
+        await runner.store.save(job)
+
+        server.complete_after = 0
+        job = await runner.run(DAY, ["c1"], wait=True, poll_interval=0)
+        return job, notifier.sent_alerts, len(server.batches)
+
+    job, sent, batches = run_with_server(tmp_path, scenario, complete_after=3600)
+    assert (job.status, job.alert_count) == ("done", 1)
+    assert (sent, batches) == (1, 1)
+
+
+@pytest.mark.parametrize("processed_lines", [0, 1])
+def test_reimport_does_not_notify_again(tmp_path, processed_lines):
+    async def scenario(runner, notifier, server):
+        job = await runner.run(DAY, ["c1"], wait=True, poll_interval=0)
+
+        # 結果の取り込み中に中断した場合は、processed_lines 行目の次から取り込み直す
+        job.status = "completed"
+        job.processed_lines = processed_lines
+        job.alert_count = 0
+        await runner.store.save(job)
+
+        job = await runner.run(DAY, ["c1"], wait=True, poll_interval=0)
+        return job, notifier.sent_alerts, len(server.batches)
+
+    job, sent, batches = run_with_server(tmp_path, scenario)
+    assert (job.status, job.processed_lines, job.alert_count) == ("done", 1, 0)
+    assert (sent, batches) == (1, 1)
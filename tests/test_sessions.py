@@ -0,0 +1,85 @@
+"""
+会話セッション: 間隔を空けた運営側の返信で、以前のセッションの質問も回答済みになること
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from src.application.services import LogCollectionService
+from src.domain import clock
+from src.domain.entities import Channel
+from src.infrastructure.database import (
+    DatabaseManager, SQLiteAlertRepository, SQLiteMessageRepository, SQLiteRollupRepository,
+    SQLiteSessionRepository, SQLiteUserRepository
+)
+from src.infrastructure.replay import LoggingNotificationService, ReplayChannelRepository
+
+START = datetime(2026, 9, 1, 10, 0, tzinfo=timezone.utc)
+
+
+def message_event(message_id: str, author: dict, content: str, minutes: int) -> dict:
+    return {
+        'id': message_id,
+        'channel_id': "c1",
+        'channel_name': "lesson",
+        'author': author,
+        'content': content,
+        'timestamp': (START + timedelta(minutes=minutes)).isoformat(),
+        'reactions': []
+    }
+
+
+async def reply_after_gap(db_path: str, reply_minutes: int, rebuild: bool = False):
+    await DatabaseManager(db_path).initialize_database()
+    replay_clock = clock.ReplayClock(START)
+    clock.set_clock(replay_clock)
+    channels = ReplayChannelRepository()
+    channels.channels["c1"] = Channel(id="c1", name="lesson", is_lesson_channel=True)
+    notifier = LoggingNotificationService()
+    session_repo = SQLiteSessionRepository(db_path)
+    rollup_repo = SQLiteRollupRepository(db_path)
+    service = LogCollectionService(
+        message_repo=SQLiteMessageRepository(db_path),
+        channel_repo=channels,
+        user_repo=SQLiteUserRepository(db_path),
+        alert_repo=SQLiteAlertRepository(db_path),
+        notification_service=notifier,
+        spreadsheet_service=None,
+        session_repo=session_repo,
+        rollup_repo=rollup_repo
+    )
+
+    student = {'id': "u1", 'username': "student", 'roles': []}
+    mentor = {'id': "u2", 'username': "mentor", 'roles': ["mentor"]}
+    await service.process_new_message(message_event("q1", student, "この課題はどうやって提出しますか？", 0))
+    replay_clock.advance_to(START + timedelta(minutes=reply_minutes))
+    await service.process_new_message(message_event("r1", mentor, "提出フォームから送ってください", reply_minutes))
+    if rebuild:
+        await service.rebuild_sessions("c1")
+
+    replay_clock.advance_to(START + timedelta(hours=3))
+    await service.collect_and_analyze_messages()
+    pending = await session_repo.get_pending_sessions_for_channels(["c1"], asked_before=clock.now())
+    summary = await service.get_activity_summary(START - timedelta(hours=1), channel_id="c1")
+    return notifier.sent_alerts, pending.get("c1", []), summary['answered']
+
+
+def run(coro):
+    try:
+        return asyncio.run(coro)
+    finally:
+        clock.set_clock(clock.Clock())
+
+
+def test_reply_within_session_answers_question(tmp_path):
+    alerts, pending, answered = run(reply_after_gap(str(tmp_path / "sessions.db"), reply_minutes=10))
+    assert (alerts, pending, answered) == (0, [], 1)
+
+
+def test_reply_after_gap_answers_question_of_previous_session(tmp_path):
+    alerts, pending, answered = run(reply_after_gap(str(tmp_path / "sessions.db"), reply_minutes=60))
+    assert (alerts, pending, answered) == (0, [], 1)
+
+
+def test_rebuild_keeps_question_answered_after_gap(tmp_path):
+    alerts, pending, _ = run(reply_after_gap(str(tmp_path / "sessions.db"), reply_minutes=60, rebuild=True))
+    assert (alerts, pending) == (0, [])
@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from config.settings import Settings, LOG_FORMAT
+from src.infrastructure.archive import ArchiveStore, MessageArchiver
+from src.infrastructure.database import DatabaseManager
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="古いメッセージをチャンネル・月ごとの圧縮ファイルに移します")
+    parser.add_argument("--older-than-days", type=int, default=Settings.ARCHIVE_AFTER_DAYS,
+                        help="この日数より古いメッセージをアーカイブする")
+    parser.add_argument("--db", default=Settings.DATABASE_PATH, help="対象のDBファイル")
+    parser.add_argument("--archive-dir", default=Settings.ARCHIVE_DIR, help="アーカイブの保存先")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=Settings.ARCHIVE_COMPRESSION,
+                        help="圧縮形式（zstd は zstandard パッケージが必要）")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, Settings.LOG_LEVEL), format=LOG_FORMAT)
+    if args.older_than_days <= 0:
+        raise SystemExit("--older-than-days には 1 以上を指定してください")
+
+    await DatabaseManager(args.db).initialize_database()
+    store = ArchiveStore(args.db, args.archive_dir, compression=args.compression)
+    size_before = os.path.getsize(args.db)
+    result = await MessageArchiver(store).archive_older_than(args.older_than_days)
+
+    print(f"{result.messages} 件を {result.files} ファイルにアーカイブしました ({result.seconds:.1f} 秒)")
+    print(f"DBファイル: {size_before / 1e6:.1f} MB（空き領域は VACUUM で解放されます）")
+    for entry in store.entries():
+        print(f"  {entry.channel_id} {entry.month}: {entry.message_count} 件 -> {entry.path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
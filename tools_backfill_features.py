@@ -0,0 +1,38 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from config.settings import Settings, LOG_FORMAT
+from src.domain.features import FeatureExtractor
+from src.infrastructure.database import DatabaseManager, SQLiteMessageRepository
+from src.infrastructure.sharding import shard_paths
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="保存済みのメッセージの特徴（質問らしさ・コードブロック・メンション・URL・文字数）を埋め直します"
+    )
+    parser.add_argument("--db", default=Settings.DATABASE_PATH, help="対象のDBファイル（シャード0）")
+    parser.add_argument("--shards", type=int, default=Settings.SHARD_COUNT, help="シャード数")
+    parser.add_argument("--batch-size", type=int, default=2000, help="1トランザクションで更新する件数")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, Settings.LOG_LEVEL), format=LOG_FORMAT)
+
+    extractor = FeatureExtractor()
+    for path in shard_paths(args.db, args.shards):
+        await DatabaseManager(path).initialize_database()
+        started = time.perf_counter()
+        updated = await SQLiteMessageRepository(path).backfill_features(extractor, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - started
+        print(f"{path}: {updated} 件 ({elapsed:.1f} 秒, {updated / elapsed if elapsed else 0:.0f} 件/秒)")
+
+    print("質問の判定が変わったメッセージの会話セッションは tools_backfill_sessions.py で作り直せます")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from config.settings import Settings, LOG_FORMAT
+from src.application.services import LogCollectionService
+from src.domain import clock
+from src.domain.services import Sessionizer
+from src.infrastructure.database import (
+    DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository, SQLiteAlertRepository,
+    SQLiteSessionRepository
+)
+from src.infrastructure.replay import ReplayChannelRepository, LoggingNotificationService
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="保存済みのメッセージから会話セッションを作り直します")
+    parser.add_argument("channel_ids", nargs="+", help="対象のチャンネルID")
+    parser.add_argument("--days", type=int, default=None, help="直近N日分だけ作り直す（省略時は全期間）")
+    parser.add_argument("--db", default=Settings.DATABASE_PATH, help="対象のDBファイル")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, Settings.LOG_LEVEL), format=LOG_FORMAT)
+
+    db_manager = DatabaseManager(args.db)
+    await db_manager.initialize_database()
+
+    log_service = LogCollectionService(
+        message_repo=SQLiteMessageRepository(args.db),
+        channel_repo=ReplayChannelRepository(),
+        user_repo=SQLiteUserRepository(args.db),
+        alert_repo=SQLiteAlertRepository(args.db),
+        notification_service=LoggingNotificationService(),
+        spreadsheet_service=None,
+        session_repo=SQLiteSessionRepository(args.db),
+        sessionizer=Sessionizer(Settings.SESSION_GAP_MINUTES, Settings.SESSION_RESOLVED_GAP_MINUTES)
+    )
+
+    since = clock.now() - timedelta(days=args.days) if args.days else None
+    for channel_id in args.channel_ids:
+        started = time.perf_counter()
+        created = await log_service.rebuild_sessions(channel_id, since=since)
+        print(f"{channel_id}: {created} セッション ({time.perf_counter() - started:.1f} 秒)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
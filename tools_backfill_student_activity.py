@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import logging
+import sqlite3
+import time
+
+from config.settings import Settings, LOG_FORMAT
+from src.application.services import LogCollectionService
+from src.infrastructure.archive import ArchiveAwareMessageRepository, ArchiveStore
+from src.infrastructure.database import (
+    DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository, SQLiteAlertRepository,
+    SQLiteStudentActivityRepository
+)
+from src.infrastructure.replay import ReplayChannelRepository, LoggingNotificationService
+from src.infrastructure.sharding import shard_paths
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="保存済みのメッセージから生徒ごとの活動（最後の発言・運営側の返信・発言数・未回答の質問数）を作り直します"
+    )
+    parser.add_argument("channel_ids", nargs="*", help="対象のチャンネルID（省略時はDBにメッセージがあるすべてのチャンネル）")
+    parser.add_argument("--db", default=Settings.DATABASE_PATH, help="対象のDBファイル（シャード0）")
+    parser.add_argument("--shards", type=int, default=Settings.SHARD_COUNT, help="シャード数")
+    return parser.parse_args()
+
+
+def stored_channel_ids(db_path: str):
+    with sqlite3.connect(db_path) as conn:
+        return [row[0] for row in conn.execute("SELECT DISTINCT channel_id FROM messages ORDER BY channel_id")]
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, Settings.LOG_LEVEL), format=LOG_FORMAT)
+
+    # チャンネルはどれか1つのシャードにしかないので、シャードごとにそのファイルのチャンネルを作り直す
+    for path in shard_paths(args.db, args.shards):
+        await DatabaseManager(path).initialize_database()
+        log_service = LogCollectionService(
+            # アーカイブ済みのメッセージも発言数に含める
+            message_repo=ArchiveAwareMessageRepository(
+                SQLiteMessageRepository(path),
+                ArchiveStore(db_path=path, archive_dir=Settings.ARCHIVE_DIR, compression=Settings.ARCHIVE_COMPRESSION)
+            ),
+            channel_repo=ReplayChannelRepository(),
+            user_repo=SQLiteUserRepository(path),
+            alert_repo=SQLiteAlertRepository(path),
+            notification_service=LoggingNotificationService(),
+            spreadsheet_service=None,
+            student_activity_repo=SQLiteStudentActivityRepository(path)
+        )
+
+        stored = await asyncio.to_thread(stored_channel_ids, path)
+        if args.channel_ids:
+            stored = [channel_id for channel_id in args.channel_ids if channel_id in stored]
+        for channel_id in stored:
+            started = time.perf_counter()
+            students = await log_service.rebuild_student_activity(channel_id)
+            print(f"{path} {channel_id}: {students} 人 ({time.perf_counter() - started:.1f} 秒)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,644 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import json
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from config.settings import Settings, LOG_FORMAT
+from src.application.services import LogCollectionService
+from src.domain import clock
+from src.domain.detectors import DetectorPipeline
+from src.domain.entities import Channel, Message, User, UserRole
+from src.infrastructure.database import (
+    DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository, SQLiteAlertRepository,
+    SQLiteSessionRepository
+)
+from src.infrastructure.message_cache import CachedMessageRepository
+from src.infrastructure.maintenance import MaintenanceScheduler
+from src.infrastructure.sharding import ShardDirectory, ShardedMessageRepository, shard_paths
+from src.infrastructure.archive import (
+    ArchiveStore, ArchiveAwareMessageRepository, MessageArchiver, DISCORD_EPOCH_MS
+)
+from src.infrastructure.replay import ReplayChannelRepository, LoggingNotificationService
+from src.infrastructure.gateway import (
+    ForwardedChannelRepository, GatewayEventReceiver, GatewaySupervisor, run_fake_gateway_shard
+)
+from src.application.ingest import IngestQueue
+from src.application.log_context import bind_log_context
+from src.infrastructure.log_pipeline import LogPipeline
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="処理時間のベンチマーク")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    analysis = subparsers.add_parser("analysis", help="全レッスンチャンネルの定期分析")
+    analysis.add_argument("--channels", type=int, default=500, help="チャンネル数")
+    analysis.add_argument("--messages", type=int, default=40, help="チャンネルあたりの直近24時間のメッセージ数")
+    analysis.add_argument("--db", default=None, help="使用するDBファイル（省略時は一時ファイルに生成）")
+
+    cache = subparsers.add_parser("cache", help="直近メッセージの読み込み（SQLite とキャッシュの比較）")
+    cache.add_argument("--channels", type=int, default=50, help="チャンネル数")
+    cache.add_argument("--messages", type=int, default=200, help="チャンネルあたりの直近24時間のメッセージ数")
+    cache.add_argument("--reads", type=int, default=2000, help="読み込み回数")
+
+    archive = subparsers.add_parser("archive", help="アーカイブ前後の直近メッセージの読み込み")
+    archive.add_argument("--channels", type=int, default=50, help="チャンネル数")
+    archive.add_argument("--days", type=int, default=365, help="生成する期間（日）")
+    archive.add_argument("--messages-per-day", type=int, default=40, help="チャンネルあたりの1日のメッセージ数")
+    archive.add_argument("--archive-after-days", type=int, default=90, help="この日数より古いメッセージをアーカイブ")
+    archive.add_argument("--reads", type=int, default=500, help="読み込み回数")
+
+    maintenance = subparsers.add_parser("maintenance", help="DBメンテナンス中の書き込みの待ち時間")
+    maintenance.add_argument("--channels", type=int, default=50, help="チャンネル数")
+    maintenance.add_argument("--days", type=int, default=120, help="生成する期間（日）")
+    maintenance.add_argument("--messages-per-day", type=int, default=40, help="チャンネルあたりの1日のメッセージ数")
+
+    shards = subparsers.add_parser("shards", help="シャード数ごとの書き込みスループット")
+    shards.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4], help="比較するシャード数")
+    shards.add_argument("--channels", type=int, default=16, help="同時に書き込むチャンネル数")
+    shards.add_argument("--messages", type=int, default=200, help="チャンネルあたりのメッセージ数")
+
+    gateway = subparsers.add_parser("gateway", help="ゲートウェイプロセス数ごとの取り込みスループット（合成イベント）")
+    gateway.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4], help="比較するゲートウェイプロセス数")
+    gateway.add_argument("--guilds", type=int, default=8, help="ギルド数")
+    gateway.add_argument("--channels-per-guild", type=int, default=4, help="ギルドあたりのチャンネル数")
+    gateway.add_argument("--messages", type=int, default=250, help="チャンネルあたりのメッセージ数")
+
+    startup = subparsers.add_parser("startup", help="起動時間（import の内訳とスタブのゲートウェイで準備完了まで）")
+    startup.add_argument("--runs", type=int, default=3, help="起動の回数")
+    startup.add_argument("--db", default=None, help="使用するDBファイル（省略時は空の一時ファイル）")
+    startup.add_argument("--top", type=int, default=12, help="表示する import の件数")
+
+    log = subparsers.add_parser("logging", help="ログ出力1件あたりのイベントループ上の時間")
+    log.add_argument("--records", type=int, default=50000, help="出力するログの件数")
+
+    reporting = subparsers.add_parser("reporting", help="集計・出力（従来の方法と DuckDB）")
+    reporting.add_argument("--channels", type=int, default=20, help="チャンネル数")
+    reporting.add_argument("--days", type=int, default=365, help="生成する期間（日）")
+    reporting.add_argument("--messages-per-day", type=int, default=100, help="チャンネルあたりの1日のメッセージ数")
+    reporting.add_argument("--archive-after-days", type=int, default=90,
+                           help="この日数より古いメッセージをアーカイブ（0 でアーカイブしない）")
+    reporting.add_argument("--report-days", type=int, default=180, help="集計する期間（日）")
+    return parser.parse_args()
+
+
+class Timer:
+    """区間ごとの経過時間を表示"""
+
+    def __init__(self, label: str):
+        self.label = label
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        print(f"{self.label:<40} {self.seconds * 1000:9.1f} ms")
+
+
+def seed_analysis_db(db_path: str, channels: int, messages_per_channel: int) -> None:
+    """分析用のテストデータを生成（直近24時間に散らばったメッセージと未回答のセッション）"""
+    rng = random.Random(0)
+    now = clock.now()
+    students = [(f"s{i}", f"student{i}", f"生徒{i}", '["student"]') for i in range(200)]
+    mentors = [(f"m{i}", f"mentor{i}", f"メンター{i}", '["mentor"]') for i in range(20)]
+
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT OR IGNORE INTO users (id, username, display_name, roles) VALUES (?, ?, ?, ?)",
+                         students + mentors)
+        message_rows = []
+        session_rows = []
+        for c in range(channels):
+            channel_id = f"c{c}"
+            offsets = sorted(rng.uniform(0, 24 * 3600) for _ in range(messages_per_channel))
+            for m, offset in enumerate(offsets):
+                author = rng.choice(mentors if rng.random() < 0.3 else students)
+                content = "これはどうすればいいですか？" if rng.random() < 0.2 else "了解です"
+                timestamp = now - timedelta(seconds=offset)
+                message_rows.append((
+                    f"{channel_id}-{m}", channel_id, f"lesson-{c}", author[0], content,
+                    str(timestamp), "[]", content.endswith("？")
+                ))
+            if c % 5 == 0:
+                asked = now - timedelta(hours=3)
+                session_rows.append((
+                    channel_id, str(asked), str(asked), 1, f"{channel_id}-0", str(asked)
+                ))
+        conn.executemany("""
+            INSERT OR IGNORE INTO messages (id, channel_id, channel_name, user_id, content, timestamp, reactions, is_question)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, message_rows)
+        conn.executemany("""
+            INSERT INTO sessions (channel_id, started_at, ended_at, message_count, pending_question_id, pending_question_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, session_rows)
+
+
+async def benchmark_analysis(args):
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+    await DatabaseManager(db_path).initialize_database()
+    if not args.db:
+        with Timer(f"テストデータ生成 ({args.channels} ch x {args.messages} 件)"):
+            seed_analysis_db(db_path, args.channels, args.messages)
+
+    channel_repo = ReplayChannelRepository()
+    for c in range(args.channels):
+        channel_repo.channels[f"c{c}"] = Channel(id=f"c{c}", name=f"lesson-{c}", is_lesson_channel=True)
+    channel_ids = list(channel_repo.channels)
+
+    message_repo = SQLiteMessageRepository(db_path)
+    session_repo = SQLiteSessionRepository(db_path)
+
+    with Timer("DB: チャンネルごとに取得（従来）"):
+        for channel_id in channel_ids:
+            await message_repo.get_recent_messages(channel_id, hours=24)
+            await session_repo.get_pending_sessions(channel_id, asked_before=clock.hours_ago(2))
+
+    with Timer("DB: まとめて取得"):
+        grouped = await message_repo.get_recent_messages_for_channels(channel_ids, hours=24)
+        pending = await session_repo.get_pending_sessions_for_channels(channel_ids, asked_before=clock.hours_ago(2))
+        await message_repo.get_messages([
+            session.pending_question_id for sessions in pending.values() for session in sessions
+        ])
+    print(f"  メッセージ {sum(len(messages) for messages in grouped.values())} 件 / "
+          f"未回答セッション {sum(len(sessions) for sessions in pending.values())} 件")
+
+    notification_service = LoggingNotificationService()
+    log_service = LogCollectionService(
+        message_repo=message_repo,
+        channel_repo=channel_repo,
+        user_repo=SQLiteUserRepository(db_path),
+        alert_repo=SQLiteAlertRepository(db_path),
+        notification_service=notification_service,
+        spreadsheet_service=None,
+        session_repo=session_repo,
+        detector_pipeline=DetectorPipeline.from_config(Settings.DETECTORS, Settings.DETECTOR_CONFIG),
+        analysis_concurrency=Settings.ANALYSIS_CONCURRENCY
+    )
+    with Timer("collect_and_analyze_messages（1回目）"):
+        await log_service.collect_and_analyze_messages()
+    with Timer("collect_and_analyze_messages（2回目・通知なし）"):
+        await log_service.collect_and_analyze_messages()
+    print(f"  通知したアラート {notification_service.sent_alerts} 件")
+    for name, timing in log_service.detector_pipeline.stats().items():
+        print(f"  {name:<24} {timing.seconds * 1000:8.1f} ms ({timing.microseconds_per_message:.2f} µs/件)")
+
+
+async def benchmark_cache(args):
+    db_path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+    await DatabaseManager(db_path).initialize_database()
+    seed_analysis_db(db_path, args.channels, args.messages)
+
+    rng = random.Random(0)
+    reads = [(f"c{rng.randrange(args.channels)}", rng.choice([6, 24])) for _ in range(args.reads)]
+    backend = SQLiteMessageRepository(db_path)
+    cached = CachedMessageRepository(backend, window_hours=24)
+
+    with Timer(f"SQLite: get_recent_messages x {args.reads}"):
+        for channel_id, hours in reads:
+            await backend.get_recent_messages(channel_id, hours)
+    with Timer("キャッシュの事前読み込み"):
+        await cached.warm([f"c{c}" for c in range(args.channels)])
+    with Timer(f"キャッシュ: get_recent_messages x {args.reads}"):
+        for channel_id, hours in reads:
+            await cached.get_recent_messages(channel_id, hours)
+    stats = cached.stats()
+    print(f"  ヒット率 {stats['hit_ratio']:.1%} ({stats['messages']} 件保持)")
+
+
+def seed_history_db(db_path: str, channels: int, days: int, messages_per_day: int) -> int:
+    """長期間のテストデータを生成（IDは Discord と同じく作成時刻を含むスノーフレーク）"""
+    rng = random.Random(0)
+    now = clock.now()
+    users = [(f"s{i}", f"student{i}", f"生徒{i}", '["student"]') for i in range(200)]
+    users += [(f"m{i}", f"mentor{i}", f"メンター{i}", '["mentor"]') for i in range(20)]
+
+    total = 0
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT OR IGNORE INTO users (id, username, display_name, roles) VALUES (?, ?, ?, ?)", users)
+        for c in range(channels):
+            rows = []
+            for sequence, offset in enumerate(sorted(rng.uniform(0, days * 86400)
+                                                     for _ in range(days * messages_per_day))):
+                timestamp = now - timedelta(seconds=offset)
+                snowflake = ((int(timestamp.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22) + c * 4096 + sequence % 4096
+                content = "これはどうすればいいですか？" if rng.random() < 0.2 else "了解です。ありがとうございます"
+                rows.append((
+                    str(snowflake), f"c{c}", f"lesson-{c}", rng.choice(users)[0], content,
+                    str(timestamp), "[]", content.endswith("？")
+                ))
+            conn.executemany("""
+                INSERT OR IGNORE INTO messages (id, channel_id, channel_name, user_id, content, timestamp, reactions, is_question)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            total += len(rows)
+    return total
+
+
+async def measure_hot_reads(repo, reads, label: str) -> None:
+    """直近のメッセージの読み込みを計測"""
+    with Timer(f"{label}: get_recent_messages x {len(reads)}"):
+        for channel_id in reads:
+            await repo.get_recent_messages(channel_id, hours=24)
+    with Timer(f"{label}: get_channel_messages x {len(reads)}"):
+        for channel_id in reads:
+            await repo.get_channel_messages(channel_id, limit=100)
+    with Timer(f"{label}: 直近7日の全件走査 x {len(reads) // 10}"):
+        for channel_id in reads[:len(reads) // 10]:
+            async for _ in repo.iter_channel_messages(channel_id, since=clock.now() - timedelta(days=7)):
+                pass
+
+
+async def benchmark_archive(args):
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    db_path = os.path.join(workdir, "bench.db")
+    await DatabaseManager(db_path).initialize_database()
+    with Timer(f"テストデータ生成 ({args.channels} ch x {args.days} 日)"):
+        total = seed_history_db(db_path, args.channels, args.days, args.messages_per_day)
+    print(f"  メッセージ {total} 件 / DB {os.path.getsize(db_path) / 1e6:.1f} MB")
+
+    rng = random.Random(0)
+    reads = [f"c{rng.randrange(args.channels)}" for _ in range(args.reads)]
+    await measure_hot_reads(SQLiteMessageRepository(db_path), reads, "アーカイブ前")
+
+    store = ArchiveStore(db_path, os.path.join(workdir, "archive"))
+    with Timer(f"アーカイブ（{args.archive_after_days} 日より古いもの）"):
+        result = await MessageArchiver(store).archive_older_than(args.archive_after_days)
+    with Timer("VACUUM"):
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("VACUUM")
+    archive_bytes = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(store.archive_dir) for name in names
+    )
+    print(f"  {result.messages} 件 / {result.files} ファイル ({archive_bytes / 1e6:.1f} MB) / "
+          f"DB {os.path.getsize(db_path) / 1e6:.1f} MB")
+
+    repo = ArchiveAwareMessageRepository(SQLiteMessageRepository(db_path), store)
+    await measure_hot_reads(repo, reads, "アーカイブ後")
+
+    old = clock.now() - timedelta(days=args.days - 30)
+    with Timer("アーカイブ後: 古い範囲のページ x 10（初回）"):
+        for channel_id in reads[:10]:
+            await repo.get_messages_page(channel_id=channel_id, since=old, limit=500)
+    with Timer("アーカイブ後: 古い範囲のページ x 10（2回目）"):
+        for channel_id in reads[:10]:
+            await repo.get_messages_page(channel_id=channel_id, since=old, limit=500)
+    with Timer(f"アーカイブ後: {reads[0]} の全期間を走査"):
+        count = sum([1 async for _ in repo.iter_channel_messages(reads[0])])
+    print(f"  {count} 件（期待値 {args.days * args.messages_per_day} 件）")
+
+
+async def measure_writes(repo, job, label: str) -> None:
+    """処理を実行しながら10ミリ秒ごとにメッセージを保存し、保存にかかった時間を計測"""
+    latencies = []
+    task = asyncio.create_task(job())
+    sequence = 0
+    while not task.done():
+        message = Message(
+            id=f"w-{label}-{sequence}", channel_id="c0", channel_name="lesson-0",
+            user=User(id="s0", username="student0", display_name="生徒0", roles=[UserRole.STUDENT]),
+            content="書き込みの計測", timestamp=clock.now(), reactions=[]
+        )
+        started = time.perf_counter()
+        await repo.save_message(message)
+        latencies.append(time.perf_counter() - started)
+        sequence += 1
+        await asyncio.sleep(0.01)
+    result = await task
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+    print(f"  {label:<20} 書き込み {len(latencies)} 件: p50 {latencies[len(latencies) // 2] * 1000 if latencies else 0:.1f} ms / "
+          f"p99 {p99 * 1000:.1f} ms / 最大 {(latencies[-1] if latencies else 0) * 1000:.1f} ms")
+    print(f"  {'':<20} {result}")
+
+
+async def benchmark_maintenance(args):
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    db_path = os.path.join(workdir, "bench.db")
+    await DatabaseManager(db_path).initialize_database()
+    with Timer(f"テストデータ生成 ({args.channels} ch x {args.days} 日)"):
+        seed_history_db(db_path, args.channels, args.days, args.messages_per_day)
+    # 空きページを作る
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM messages WHERE channel_id IN ('c1', 'c2', 'c3', 'c4', 'c5')")
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    print(f"  DB {os.path.getsize(db_path) / 1e6:.1f} MB / 空きページ {free}")
+
+    repo = SQLiteMessageRepository(db_path)
+    await SQLiteUserRepository(db_path).save_user(
+        User(id="s0", username="student0", display_name="生徒0", roles=[UserRole.STUDENT])
+    )
+    maintenance = MaintenanceScheduler(db_path, backup_dir=os.path.join(workdir, "backups"), quiet_hours="0-24")
+
+    async def idle():
+        await asyncio.sleep(2)
+        return "なし"
+
+    await measure_writes(repo, idle, "メンテナンスなし")
+    await measure_writes(repo, maintenance.backup, "バックアップ")
+    await measure_writes(repo, maintenance.optimize, "optimize")
+    await measure_writes(repo, maintenance.incremental_vacuum, "incremental_vacuum")
+
+
+async def benchmark_shards(args):
+    author = User(id="s0", username="student0", display_name="生徒0", roles=[UserRole.STUDENT])
+    for count in args.shards:
+        workdir = tempfile.mkdtemp(prefix="bench_")
+        paths = shard_paths(os.path.join(workdir, "bench.db"), count)
+        for path in paths:
+            await DatabaseManager(path).initialize_database()
+            await SQLiteUserRepository(path).save_user(author)
+        directory = ShardDirectory(paths[0], count, mode="channel")
+        directory.load()
+        repo = ShardedMessageRepository([SQLiteMessageRepository(path) for path in paths], directory)
+
+        # 取り込みキューと同じく、チャンネルごとに1つのワーカーが順に保存する
+        async def write_channel(channel_id: str):
+            for sequence in range(args.messages):
+                await repo.save_message(Message(
+                    id=f"{channel_id}-{sequence}", channel_id=channel_id, channel_name=channel_id, user=author,
+                    content="書き込みの計測", timestamp=clock.now(), reactions=[]
+                ))
+
+        channel_ids = [f"c{c}" for c in range(args.channels)]
+        started = time.perf_counter()
+        await asyncio.gather(*(write_channel(channel_id) for channel_id in channel_ids))
+        seconds = time.perf_counter() - started
+        total = args.channels * args.messages
+        print(f"{count} シャード: {total} 件 / {seconds:.2f} 秒 ({total / seconds:,.0f} 件/秒) "
+              f"割り当て {dict(sorted(directory.stats().items()))}")
+
+
+async def benchmark_gateway(args):
+    total = args.guilds * args.channels_per_guild * args.messages
+    print(f"CPU コア数: {os.cpu_count()}")
+    for count in args.processes:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+        await DatabaseManager(db_path).initialize_database()
+        channel_repo = ForwardedChannelRepository()
+        log_service = LogCollectionService(
+            message_repo=SQLiteMessageRepository(db_path),
+            channel_repo=channel_repo,
+            user_repo=SQLiteUserRepository(db_path),
+            alert_repo=SQLiteAlertRepository(db_path),
+            notification_service=LoggingNotificationService(),
+            spreadsheet_service=None,
+            session_repo=SQLiteSessionRepository(db_path)
+        )
+        ingest_queue = IngestQueue(handler=log_service.handle_event, workers=Settings.INGEST_WORKERS)
+        await ingest_queue.start()
+
+        event_queue = multiprocessing.get_context("spawn").Queue(maxsize=Settings.GATEWAY_QUEUE_SIZE)
+        receiver = GatewayEventReceiver(event_queue, ingest_queue, channel_repo)
+        supervisor = GatewaySupervisor(run_fake_gateway_shard, count, event_queue, kwargs={
+            'guilds': args.guilds, 'channels_per_guild': args.channels_per_guild, 'messages_per_channel': args.messages
+        })
+        started = time.perf_counter()
+        await receiver.start()
+        await supervisor.start()
+        await supervisor.join()
+        while receiver.counters['received'] < total:
+            await asyncio.sleep(0.01)
+        await ingest_queue.drain()
+        seconds = time.perf_counter() - started
+        await receiver.stop()
+        await supervisor.stop()
+
+        with sqlite3.connect(db_path) as conn:
+            saved = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        print(f"{count} プロセス: {saved}/{total} 件 / {seconds:.2f} 秒 ({saved / seconds:,.0f} 件/秒) "
+              f"チャンネル {len(channel_repo.channels)} / バッチ {receiver.counters['batches']}")
+
+
+# 子プロセスで main.py と同じ手順で起動し、スタブのゲートウェイ（合成イベント）がチャンネル一覧を送って
+# 直近メッセージの読み込みが終わった時点を準備完了とする
+STARTUP_CHILD = '''
+import asyncio, json, queue
+import main
+from src.infrastructure.gateway import GatewayEventReceiver, emit_fake_gateway_events
+
+async def run():
+    timer = main.StartupTimer(started=main.PROCESS_STARTED)
+    timer.mark('imports')
+    app = await main.start_application(timer)
+    ready = asyncio.Event()
+
+    async def on_channels():
+        await app.log_service.warm_up()
+        timer.mark('ready')
+        ready.set()
+
+    event_queue = queue.Queue()
+    receiver = GatewayEventReceiver(event_queue, app.ingest_queue, app.log_service.channel_repo, on_channels=on_channels)
+    await receiver.start()
+    gateway = asyncio.create_task(emit_fake_gateway_events(0, 1, event_queue, messages_per_channel=1))
+    await ready.wait()
+    await gateway
+    await receiver.stop()
+    await main.stop_application(app)
+    await app.loop_monitor.stop()
+    print(json.dumps(timer.to_dict()))
+
+asyncio.run(run())
+'''
+
+
+def summarize_importtime(stderr: str, top: int):
+    """-X importtime の出力から直接 import したモジュールの累積時間（ms）を集計"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # 入れ子の import は名前の前の空白が2つ以上になる
+        if name.startswith("  "):
+            continue
+        modules.append((int(cumulative_us) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:top], sum(ms for ms, _ in modules)
+
+
+def benchmark_startup(args):
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    env = {
+        **os.environ,
+        "DATABASE_PATH": args.db or os.path.join(workdir, "bench.db"),
+        "OUTPUT_DIR": os.path.join(workdir, "output"),
+        "GATEWAY_PROCESSES": "1",
+        "MAINTENANCE_ENABLED": "false",
+        "ARCHIVE_AFTER_DAYS": "0",
+        "LOG_LEVEL": "WARNING"
+    }
+    for run in range(args.runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_CHILD],
+            env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        wall = time.perf_counter() - started
+        if result.returncode != 0:
+            raise SystemExit(result.stderr[-2000:])
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        marks = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings['marks'].items())
+        phases = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings['phases'].items())
+        print(f"{run + 1} 回目: 準備完了 {timings['marks']['ready'] * 1000:.0f} ms "
+              f"/ プロセス終了まで {wall * 1000:.0f} ms（起動時の Slack 接続テストの完了を待つ）")
+        print(f"  経過: {marks}")
+        print(f"  段階: {phases}")
+
+    modules, total = summarize_importtime(result.stderr, args.top)
+    print(f"import の内訳（最後の回, 合計 {total:.0f} ms）")
+    for ms, name in modules:
+        print(f"  {name:<48} {ms:8.1f} ms")
+
+    # 使うときまで読み込まない依存の import 時間
+    for module in ["pandas", "openpyxl", "slack_sdk.web.async_client", "discord", "openai"]:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"  （遅延） {module:<38} 未インストール")
+            continue
+        modules, total = summarize_importtime(result.stderr, 1)
+        print(f"  （遅延） {module:<38} {total:8.1f} ms")
+
+
+async def measure_logging(records: int, label: str, use_format: bool) -> None:
+    """アラート送信のログと同じ呼び出しを繰り返し、ループ上の時間を計測"""
+    logger = logging.getLogger("bench.hot_path")
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    for sequence in range(records):
+        with bind_log_context(event="message", message_id=str(sequence), channel_id="c1"):
+            if use_format:
+                logger.info(f"Slackにアラート送信完了: {sequence}.000100")
+            else:
+                logger.info("Slackにアラート送信完了: %s.000100", sequence)
+        if sequence % 100 == 0:
+            await asyncio.sleep(0)
+    seconds, cpu_seconds = time.perf_counter() - started, time.thread_time() - cpu_started
+    # 1コアでは書き込みスレッドの処理も経過時間に入るので、ループのスレッドの CPU 時間も表示する
+    print(f"{label:<36} 経過 {seconds / records * 1e6:7.2f} µs/件 / ループのCPU {cpu_seconds / records * 1e6:7.2f} µs/件",
+          end="")
+
+
+async def benchmark_logging(args):
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    root = logging.getLogger()
+    previous_handlers, previous_level = list(root.handlers), root.level
+    for handler in previous_handlers:
+        root.removeHandler(handler)
+
+    # 従来: ループ上で整形してファイルに書き込む
+    handler = logging.FileHandler(os.path.join(workdir, "sync.log"), encoding="utf-8")
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    await measure_logging(args.records, "同期ハンドラ（f-string）", use_format=True)
+    root.removeHandler(handler)
+    handler.close()
+    print()
+
+    for label, per_second, use_format in [
+        ("キュー（間引きなし）", 0, False),
+        ("キュー + 間引き（f-string）", Settings.LOG_SAMPLE_PER_SECOND, True),
+        ("キュー + 間引き（%-style）", Settings.LOG_SAMPLE_PER_SECOND, False),
+    ]:
+        path = os.path.join(workdir, f"pipeline_{per_second}_{use_format}.log")
+        pipeline = LogPipeline(
+            level="INFO", log_file=path, console=False, max_bytes=1 << 40,
+            sample_per_second=per_second, sample_burst=Settings.LOG_SAMPLE_BURST
+        ).start()
+        await measure_logging(args.records, label, use_format)
+        started = time.perf_counter()
+        suppressed = pipeline.stats()['suppressed']
+        pipeline.stop()
+        with open(path, encoding="utf-8") as file:
+            written = sum(1 for _ in file)
+        print(f"  書き出し {written} 件 / 間引き {suppressed} 件 / 残りの書き出し {time.perf_counter() - started:.2f} 秒")
+
+    for handler in previous_handlers:
+        root.addHandler(handler)
+    root.setLevel(previous_level)
+
+
+async def benchmark_reporting(args):
+    from src.infrastructure.analytics import ResponseTimeAnalytics
+    from src.infrastructure.reporting import DuckDBReporting, duckdb_available
+    from src.infrastructure.spreadsheet import CSVSpreadsheetService
+
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    db_path = os.path.join(workdir, "bench.db")
+    archive_dir = os.path.join(workdir, "archive")
+    await DatabaseManager(db_path).initialize_database()
+    with Timer(f"テストデータ生成 ({args.channels} ch x {args.days} 日)"):
+        total = seed_history_db(db_path, args.channels, args.days, args.messages_per_day)
+    store = ArchiveStore(db_path, archive_dir)
+    if args.archive_after_days:
+        with Timer(f"アーカイブ（{args.archive_after_days} 日より古いもの）"):
+            archived = await MessageArchiver(store).archive_older_than(args.archive_after_days)
+        print(f"  メッセージ {total} 件のうち {archived.messages} 件をアーカイブ")
+
+    spreadsheet = CSVSpreadsheetService(os.path.join(workdir, "output"))
+    repo = ArchiveAwareMessageRepository(SQLiteMessageRepository(db_path), store)
+    since = clock.now() - timedelta(days=args.report_days)
+
+    with Timer(f"従来: c0 の直近 {args.report_days} 日を CSV 出力"):
+        path = await spreadsheet.export_channel_logs("c0", repo.iter_channel_messages("c0", since=since))
+    with open(path, encoding="utf-8-sig") as f:
+        print(f"  {sum(1 for _ in f) - 1} 行")
+    with Timer(f"従来: 返信時間の集計（{args.report_days} 日、DB のみ）"):
+        legacy = await ResponseTimeAnalytics(db_path).compute(days=args.report_days)
+    print(f"  質問 {legacy.overall['質問数']} 件 / p50 {legacy.overall['p50(分)']} 分")
+
+    if not duckdb_available():
+        print("duckdb がインストールされていないため、DuckDB の計測は行いません（pip install duckdb）")
+        return
+
+    reporting = DuckDBReporting([db_path], archive_dir=archive_dir)
+    with Timer(f"DuckDB: c0 の直近 {args.report_days} 日を CSV 出力"):
+        table = await reporting.channel_log_table("c0", since=since)
+        await spreadsheet.export_log_table("c0", table)
+    print(f"  {len(table)} 行")
+    with Timer(f"DuckDB: 返信時間の集計（{args.report_days} 日、アーカイブを含む）"):
+        report = await reporting.compute(days=args.report_days)
+    print(f"  質問 {report.overall['質問数']} 件 / p50 {report.overall['p50(分)']} 分")
+    with Timer(f"DuckDB: 活動の集計（{args.report_days} 日、アーカイブを含む）"):
+        tables = await reporting.activity_tables(days=args.report_days)
+    print(f"  チャンネル {len(tables['チャンネル別'])} 件 / 日 {len(tables['日別'])} 件")
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format=LOG_FORMAT)
+
+    if args.command == "analysis":
+        await benchmark_analysis(args)
+    elif args.command == "cache":
+        await benchmark_cache(args)
+    elif args.command == "archive":
+        await benchmark_archive(args)
+    elif args.command == "maintenance":
+        await benchmark_maintenance(args)
+    elif args.command == "shards":
+        await benchmark_shards(args)
+    elif args.command == "gateway":
+        await benchmark_gateway(args)
+    elif args.command == "startup":
+        benchmark_startup(args)
+    elif args.command == "logging":
+        await benchmark_logging(args)
+    elif args.command == "reporting":
+        await benchmark_reporting(args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
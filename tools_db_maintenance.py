@@ -0,0 +1,50 @@
+import argparse
+import asyncio
+import logging
+import sqlite3
+import time
+
+from config.settings import Settings, LOG_FORMAT
+from src.infrastructure.maintenance import MaintenanceScheduler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="DBメンテナンスを手動で実行します")
+    parser.add_argument("action", choices=["backup", "optimize", "vacuum", "enable-incremental-vacuum"],
+                        help="enable-incremental-vacuum は既存のDBを VACUUM して空き領域を少しずつ解放できるようにする"
+                             "（書き込みを止めてから実行すること）")
+    parser.add_argument("--db", default=Settings.DATABASE_PATH, help="対象のDBファイル")
+    parser.add_argument("--backup-dir", default=Settings.BACKUP_DIR, help="バックアップの保存先")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, Settings.LOG_LEVEL), format=LOG_FORMAT)
+
+    if args.action == "enable-incremental-vacuum":
+        started = time.perf_counter()
+        with sqlite3.connect(args.db) as conn:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        print(f"auto_vacuum = {mode} ({time.perf_counter() - started:.1f} 秒)")
+        return
+
+    # 手動実行では時間帯を問わず空き領域を解放する
+    maintenance = MaintenanceScheduler(
+        db_path=args.db,
+        backup_dir=args.backup_dir,
+        backup_keep=Settings.BACKUP_KEEP,
+        quiet_hours="0-24",
+        timezone=Settings.REPORT_TIMEZONE,
+        pages_per_step=Settings.MAINTENANCE_PAGES_PER_STEP,
+        step_sleep_ms=Settings.MAINTENANCE_STEP_SLEEP_MS
+    )
+    job = {"backup": "backup", "optimize": "optimize", "vacuum": "incremental_vacuum"}[args.action]
+    result = await maintenance.run_job(job)
+    print(f"{job}: {result} ({maintenance.jobs[job].last_seconds:.1f} 秒)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="ローカルの Discord・Slack を相手に、on_message から Slack 投稿までの遅延と処理できるレートを計測します"
+    )
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 100, 200, 400, 800],
+                        help="試すメッセージのレート（件/秒）。低い順に試し、処理しきれなくなったら止める")
+    parser.add_argument("--seconds", type=float, default=10, help="レートごとの送信時間（秒）")
+    parser.add_argument("--channels", type=int, default=16, help="チャンネル数")
+    parser.add_argument("--question-ratio", type=float, default=0.1, help="生徒の発言のうち質問（アラートになる）の割合")
+    parser.add_argument("--max-latency", type=float, default=2.0,
+                        help="この秒数を p99 が超えたら処理しきれていないとみなす")
+    parser.add_argument("--slack-delay-ms", type=float, default=50, help="Slack の応答時間（模擬）")
+    parser.add_argument("--db", default=None, help="使用するDBファイル（省略時は一時ファイル）")
+    return parser.parse_args()
+
+
+def percentile(values, ratio: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(ratio * len(ordered)))]
+
+
+async def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="load_")
+
+    # 偽の Discord・Slack は別プロセスで動かす（計測対象のイベントループと CPU を取り合わないように）
+    context = multiprocessing.get_context("spawn")
+    port_queue = context.Queue()
+    from src.infrastructure.fake_services import run_fake_services
+    server = context.Process(
+        target=run_fake_services, args=(port_queue, args.channels, args.question_ratio, args.slack_delay_ms),
+        daemon=True
+    )
+    server.start()
+    discord_url, slack_url = await asyncio.to_thread(port_queue.get, True, 30)
+
+    # 設定は読み込み時に環境変数から決まるので、アプリケーションを読み込む前に設定する
+    os.environ.update({
+        "DATABASE_PATH": args.db or os.path.join(workdir, "load.db"),
+        "OUTPUT_DIR": os.path.join(workdir, "output"),
+        "SLACK_BOT_TOKEN": "xoxb-load-test",
+        "SLACK_API_URL": slack_url,
+        "MAINTENANCE_ENABLED": "false",
+        "ARCHIVE_AFTER_DAYS": "0",
+        "GATEWAY_PROCESSES": "0",
+        "SHARD_COUNT": "1",
+        "INGEST_OVERFLOW_POLICY": "block"
+    })
+    logging.basicConfig(level=logging.WARNING)
+
+    import aiohttp
+    import main as app_main
+    from src.infrastructure.discord_client import DiscordClient
+    from src.infrastructure.fake_services import use_fake_discord
+
+    use_fake_discord(discord_url)
+    timer = app_main.StartupTimer()
+    app = await app_main.start_application(timer)
+    client = DiscordClient(
+        log_collection_service=app.log_service, ingest_queue=app.ingest_queue, startup_timer=timer,
+        guild_ready_timeout=0.1
+    )
+    app.log_service.channel_repo.client = client
+    connection = asyncio.create_task(client.start("load-test-token"))
+    ready = asyncio.create_task(client.wait_until_ready())
+    await asyncio.wait([ready, connection], timeout=30, return_when=asyncio.FIRST_COMPLETED)
+    if not ready.done():
+        ready.cancel()
+        # 接続に失敗した場合はその例外を出す
+        if connection.done():
+            connection.result()
+        raise TimeoutError("ローカルの Discord に接続できませんでした")
+    print(f"接続完了: {timer.marks['ready']:.2f} 秒 / レッスンチャンネル "
+          f"{len(await app.log_service.channel_repo.get_lesson_channels())} 件")
+
+    sustainable = None
+    measured = set()
+    async with aiohttp.ClientSession() as session:
+        for rate in args.rates:
+            processed_before = app.ingest_queue.counters['processed']
+            started = time.perf_counter()
+            async with session.post(f"{discord_url}/_control/burst",
+                                    json={'rate': rate, 'seconds': args.seconds}) as response:
+                burst = await response.json()
+
+            # 送信したメッセージをすべて処理し終えるまで待つ（最大で送信時間と同じだけ）
+            deadline = time.perf_counter() + max(args.seconds, args.max_latency)
+            while time.perf_counter() < deadline:
+                if app.ingest_queue.counters['processed'] - processed_before >= burst['sent']:
+                    break
+                await asyncio.sleep(0.05)
+            processed = app.ingest_queue.counters['processed'] - processed_before
+            elapsed = time.perf_counter() - started
+            await asyncio.sleep(args.max_latency)
+
+            async with session.get(f"{discord_url}/_control/stats") as response:
+                sent_at = {int(tag): at for tag, at in (await response.json())['sent_at'].items()}
+            async with session.get(f"{slack_url.rstrip('/').rsplit('/', 1)[0]}/_control/posts") as response:
+                received_at = {int(tag): at for tag, at in (await response.json())['received_at'].items()}
+            # このレートで送った質問だけを対象にする
+            tags = [tag for tag in sent_at if tag not in measured]
+            measured.update(tags)
+            phase = [received_at[tag] - sent_at[tag] for tag in tags if tag in received_at]
+
+            p50, p99 = percentile(phase, 0.5), percentile(phase, 0.99)
+            keeps_up = processed >= burst['sent'] and len(phase) >= burst['questions'] and p99 <= args.max_latency
+            print(
+                f"{rate:7.0f} 件/秒: 送信 {burst['sent']} 件（{burst['sent'] / burst['seconds']:.0f} 件/秒）"
+                f" 処理 {processed} 件（{processed / elapsed:.0f} 件/秒） "
+                f"アラート {len(phase)}/{burst['questions']} 件 p50 {p50 * 1000:.0f}ms p99 {p99 * 1000:.0f}ms"
+                f" 待ち {app.ingest_queue.stats()['max_depth']} 件 {'OK' if keeps_up else '処理しきれない'}"
+            )
+            if not keeps_up:
+                break
+            sustainable = rate
+
+    print(f"処理できた最大のレート: {sustainable if sustainable is not None else '-'} 件/秒"
+          f"（p99 {args.max_latency:.1f} 秒以内）")
+    print(json.dumps({'startup': timer.to_dict()}, ensure_ascii=False))
+
+    await client.close()
+    connection.cancel()
+    await app_main.stop_application(app)
+    await app.loop_monitor.stop()
+    server.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import logging
+import sqlite3
+import tempfile
+from datetime import date, timedelta
+from zoneinfo import ZoneInfo
+
+from config.settings import Settings, LOG_FORMAT
+from src.domain import clock
+from src.domain.services import Sessionizer
+from src.infrastructure.database import DatabaseManager, SQLiteAlertRepository, SQLiteMessageRepository
+from src.infrastructure.openai_batch import OffTopicBatchRunner
+from src.infrastructure.openai_client import OpenAIAnalyzer
+from src.infrastructure.replay import LoggingNotificationService, ReplayChannelRepository
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="指定日の会話を OpenAI Batch API でまとめて分析し、振り返り以外の話題をアラートにします"
+                    "（中断しても同じ日を指定すれば続きから再開します）"
+    )
+    parser.add_argument("--day", type=date.fromisoformat, default=None,
+                        help="分析する日（YYYY-MM-DD、REPORT_TIMEZONE の日付。省略時は前日）")
+    parser.add_argument("--db", default=None,
+                        help=f"対象のDBファイル（省略時は {Settings.DATABASE_PATH}。--fake では指定が必要）")
+    parser.add_argument("--channel-ids", nargs="+", default=None,
+                        help="対象のチャンネルID（省略時はDBにメッセージがあるすべてのチャンネル）")
+    parser.add_argument("--wait", action="store_true", help="バッチの完了を待って結果を取り込む")
+    parser.add_argument("--poll-interval", type=float, default=60, help="完了を確認する間隔（秒）")
+    parser.add_argument("--notify", action="store_true", help="アラートをSlackに送信する")
+    parser.add_argument("--fake", action="store_true",
+                        help="本物の API の代わりにローカルの偽の OpenAI を使う（動作確認用。完了まで待つ）")
+    args = parser.parse_args()
+    # 偽の結果でアラートや進み具合を本番のDBに書き込まないよう、--fake では DB を明示させる
+    if args.db is None:
+        if args.fake:
+            parser.error("--fake では --db で動作確認用のDBファイルを指定してください")
+        args.db = Settings.DATABASE_PATH
+    return args
+
+
+def stored_channel_ids(db_path: str):
+    with sqlite3.connect(db_path) as conn:
+        return [row[0] for row in conn.execute("SELECT DISTINCT channel_id FROM messages ORDER BY channel_id")]
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, Settings.LOG_LEVEL), format=LOG_FORMAT)
+
+    await DatabaseManager(args.db).initialize_database()
+    day = args.day or (clock.now().astimezone(ZoneInfo(Settings.REPORT_TIMEZONE)) - timedelta(days=1)).date()
+    channel_ids = args.channel_ids or await asyncio.to_thread(stored_channel_ids, args.db)
+
+    fake_server = None
+    work_dir = Settings.OPENAI_BATCH_DIR
+    if args.fake:
+        # 入力ファイルも本番のジョブと同じ名前になるので、別のディレクトリに作る
+        work_dir = tempfile.mkdtemp(prefix="off_topic_batch_")
+        from src.infrastructure.fake_services import FakeOpenAIServer
+        fake_server = FakeOpenAIServer(complete_after=args.poll_interval)
+        analyzer = OpenAIAnalyzer("fake-key", base_url=await fake_server.start(), model=Settings.OPENAI_MODEL)
+    else:
+        analyzer = OpenAIAnalyzer(
+            Settings.OPENAI_API_KEY or "", base_url=Settings.OPENAI_BASE_URL, model=Settings.OPENAI_MODEL
+        )
+
+    if args.notify:
+        from src.infrastructure.slack_client import SlackNotificationService
+        notification_service = SlackNotificationService(
+            Settings.SLACK_BOT_TOKEN or "", Settings.SLACK_NOTIFICATION_CHANNEL, base_url=Settings.SLACK_API_URL
+        )
+    else:
+        notification_service = LoggingNotificationService()
+
+    runner = OffTopicBatchRunner(
+        analyzer=analyzer,
+        message_repo=SQLiteMessageRepository(args.db),
+        alert_repo=SQLiteAlertRepository(args.db),
+        notification_service=notification_service,
+        channel_repo=ReplayChannelRepository(),
+        db_path=args.db,
+        work_dir=work_dir,
+        sessionizer=Sessionizer(Settings.SESSION_GAP_MINUTES, Settings.SESSION_RESOLVED_GAP_MINUTES),
+        timezone=Settings.REPORT_TIMEZONE
+    )
+    try:
+        # 偽の OpenAI はこのプロセスの中だけにあるので、完了まで待つ
+        job = await runner.run(day, channel_ids, wait=args.wait or args.fake, poll_interval=args.poll_interval)
+    finally:
+        if fake_server:
+            await fake_server.stop()
+
+    print(f"{job.job_key}: {job.status} リクエスト {job.request_count} 件 / 取り込んだ結果 {job.processed_lines} 件"
+          f" / アラート {job.alert_count} 件 (バッチ {job.batch_id or '-'})")
+    if job.error:
+        print(f"エラー: {job.error}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
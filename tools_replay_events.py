@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import logging
+
+from config.settings import Settings, LOG_FORMAT
+from src.application.replay import ReplayEngine
+from src.application.services import LogCollectionService
+from src.domain.services import Sessionizer
+from src.domain.detectors import DetectorPipeline
+from src.infrastructure.database import (
+    DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository, SQLiteAlertRepository,
+    SQLiteSessionRepository, SQLiteRollupRepository, SQLiteStudentActivityRepository
+)
+from src.infrastructure.replay import ReplayChannelRepository, LoggingNotificationService
+from src.infrastructure.spreadsheet import ExcelSpreadsheetService
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="JSONL のDiscordイベントダンプをリプレイします")
+    parser.add_argument("path", help="イベントファイル（.jsonl / .jsonl.gz）")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="再生速度（1=実時間, N=N倍速, 0=待ち時間なし）")
+    parser.add_argument("--db", default=Settings.DATABASE_PATH, help="書き込み先のDBファイル")
+    parser.add_argument("--notify", action="store_true", help="アラートをSlackに送信する")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, Settings.LOG_LEVEL), format=LOG_FORMAT)
+
+    # DB init
+    db_manager = DatabaseManager(args.db)
+    await db_manager.initialize_database()
+
+    # services
+    if args.notify:
+        from src.infrastructure.slack_client import SlackNotificationService
+        notification_service = SlackNotificationService(
+            Settings.SLACK_BOT_TOKEN or "", Settings.SLACK_NOTIFICATION_CHANNEL
+        )
+    else:
+        notification_service = LoggingNotificationService()
+
+    channel_repo = ReplayChannelRepository()
+    log_service = LogCollectionService(
+        message_repo=SQLiteMessageRepository(args.db),
+        channel_repo=channel_repo,
+        user_repo=SQLiteUserRepository(args.db),
+        alert_repo=SQLiteAlertRepository(args.db),
+        notification_service=notification_service,
+        spreadsheet_service=ExcelSpreadsheetService(Settings.OUTPUT_DIR),
+        session_repo=SQLiteSessionRepository(args.db),
+        sessionizer=Sessionizer(Settings.SESSION_GAP_MINUTES, Settings.SESSION_RESOLVED_GAP_MINUTES),
+        rollup_repo=SQLiteRollupRepository(args.db),
+        detector_pipeline=DetectorPipeline.from_config(Settings.DETECTORS, Settings.DETECTOR_CONFIG),
+        student_activity_repo=SQLiteStudentActivityRepository(args.db)
+    )
+
+    engine = ReplayEngine(log_service, speed=args.speed, observers=[channel_repo.observe])
+    stats = await engine.replay(args.path)
+    print(stats.summary())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
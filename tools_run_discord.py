@@ -3,11 +3,14 @@ import asyncio
 from config.settings import Settings
 from src.infrastructure.discord_client import DiscordClient, DiscordCommands
 from src.infrastructure.database import (
-    DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository, SQLiteAlertRepository
+    DatabaseManager, SQLiteMessageRepository, SQLiteUserRepository, SQLiteAlertRepository,
+    SQLiteSessionRepository, SQLiteRollupRepository, SQLiteStudentActivityRepository
 )
 from src.infrastructure.slack_client import SlackNotificationService
 from src.infrastructure.spreadsheet import ExcelSpreadsheetService
 from src.application.services import LogCollectionService
+from src.domain.services import Sessionizer
+from src.domain.detectors import DetectorPipeline
 
 
 async def main():
@@ -19,6 +22,9 @@ async def main():
     message_repo = SQLiteMessageRepository(Settings.DATABASE_PATH)
     user_repo = SQLiteUserRepository(Settings.DATABASE_PATH)
     alert_repo = SQLiteAlertRepository(Settings.DATABASE_PATH)
+    session_repo = SQLiteSessionRepository(Settings.DATABASE_PATH)
+    rollup_repo = SQLiteRollupRepository(Settings.DATABASE_PATH)
+    student_activity_repo = SQLiteStudentActivityRepository(Settings.DATABASE_PATH)
     spreadsheet_service = ExcelSpreadsheetService()
     slack_service = SlackNotificationService(Settings.SLACK_BOT_TOKEN or "", Settings.SLACK_NOTIFICATION_CHANNEL)
 
@@ -28,11 +34,16 @@ async def main():
         user_repo=user_repo,
         alert_repo=alert_repo,
         notification_service=slack_service,
-        spreadsheet_service=spreadsheet_service
+        spreadsheet_service=spreadsheet_service,
+        session_repo=session_repo,
+        sessionizer=Sessionizer(Settings.SESSION_GAP_MINUTES, Settings.SESSION_RESOLVED_GAP_MINUTES),
+        rollup_repo=rollup_repo,
+        detector_pipeline=DetectorPipeline.from_config(Settings.DETECTORS, Settings.DETECTOR_CONFIG),
+        student_activity_repo=student_activity_repo
     )
 
     bot = DiscordClient(log_collection_service=log_service)
-    bot.add_cog(DiscordCommands(bot, log_service))
+    await bot.add_cog(DiscordCommands(bot, log_service))
 
     # inject channel repo after bot created
     from src.infrastructure.discord_client import DiscordChannelRepository